@@ -1,22 +1,36 @@
 #app.py
 from pydantic import BaseModel, Field
-from openai import OpenAI, AsyncOpenAI
 import os
 from dotenv import load_dotenv
 import logging
 import json
 import argparse
 import sys
-from typing import List, Optional, Union, Generator
+import time
+from typing import AsyncGenerator, Dict, List, Optional, Union, Generator
 from pathlib import Path
 import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
+from prompt_context import extract_prompt_context, tokenize
+from prompt_cache import prefix_cache, topic_fingerprint
+from audio_formats import AUDIO_FORMATS, DEFAULT_FORMAT, DEFAULT_SPEED
+from graph_layout import DEFAULT_HEIGHT, DEFAULT_WIDTH, compute_layout
+from graph_stream import DEFAULT_BATCH_SIZE, generate_synthetic_graph, iter_ndjson, parse_viewport
+from graph_store import TopicGraph, graph_store
+from visualization_state import record_doubt, state_key
+from session_context import SessionContext, session_contexts
+from resilience import chat_calls, tts_calls
+from load_shedding import degraded_answer, remember_answer, shed_reason
+from model_router import model_router
+from openai_clients import async_client, sync_client
+from cache_store import DOUBT_CACHE_TTL, cache_store, doubt_cache_key, normalize_doubt
+from openai_scheduler import (
+    AdmissionRejected, Priority, chat_scheduler, tts_scheduler, estimate_chat_tokens
+)
 
-# Load environment variables
-load_dotenv()
+logger = logging.getLogger(__name__)
 
 # Define data models
 class VisualizationNode(BaseModel):
@@ -43,13 +57,71 @@ class VisualizationData(BaseModel):
     topic: str
     narration: Optional[str] = None
     narration_timestamps: Optional[List[WordTiming]] = None
+    positions: Optional[Dict[str, Dict[str, float]]] = Field(
+        None, description="Precomputed node coordinates, keyed by node id"
+    )
 
 class DoubtResponse(BaseModel):
     narration: Optional[str] = None
     narration_timestamps: Optional[List[WordTiming]] = None
     highlights: Optional[List[str]] = None
+    patch: Optional[dict] = Field(
+        None, description="Visualization state patches since the client's version"
+    )
+    degraded: bool = Field(
+        False, description="Answered from the fast path while upstream was overloaded"
+    )
+    degraded_source: Optional[str] = None
+
+
+# Function definition for highlighting elements. Kept at module level so the
+# serialized tools are byte-identical across requests and stay in the cached prompt prefix.
+HIGHLIGHT_FUNCTIONS = [
+    {
+        "name": "highlight_elements",
+        "description": "Highlight specific elements in the visualization to explain concepts",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "element_ids": {
+                    "type": "array",
+                    "items": {
+                        "type": "string"
+                    },
+                    "description": "IDs of the elements to highlight in the visualization"
+                },
+                "explanation": {
+                    "type": "string",
+                    "description": (
+                        "Explanation of the highlighted elements and how they relate to the doubt"
+                    )
+                }
+            },
+            "required": ["element_ids", "explanation"]
+        }
+    }
+]
+
+# Largest synthetic benchmark topic (synthetic_<n>) that is built; larger sizes are
+# treated as ordinary unknown topics so a request cannot force unbounded graph work
+MAX_SYNTHETIC_NODES = int(os.getenv("MAX_SYNTHETIC_NODES", "10000"))
+
 
 # Helper functions
+def synthetic_size(topic: str) -> Optional[int]:
+    """Return n for a synthetic_<n> topic within MAX_SYNTHETIC_NODES, else None."""
+    digits = topic[len('synthetic_'):] if topic.startswith('synthetic_') else ''
+    # The length check comes first so huge digit strings are never converted
+    if not digits.isdigit() or len(digits) > len(str(MAX_SYNTHETIC_NODES)):
+        return None
+    size = int(digits)
+    return size if 0 < size <= MAX_SYNTHETIC_NODES else None
+
+
+def mentioned_elements(graph: TopicGraph, text: str) -> List[str]:
+    """Ids of the topic elements named in an answer, in order of first mention."""
+    return [graph.ids[node] for node in graph.mentioned_nodes(text)]
+
 def generate_word_timings(text: str) -> List[WordTiming]:
     """Generate simple word timings for narration."""
     words = text.split()
@@ -72,250 +144,293 @@ def generate_word_timings(text: str) -> List[WordTiming]:
     
     return timings
 
-def load_visualization_data(topic: str) -> VisualizationData:
-    """Load visualization data for a given topic."""
-    try:
-        # For the ER model, return a simple mock dataset
-        if topic == 'er':
-            # Create a simple ER diagram with entities and relationships
-            nodes = [
-                VisualizationNode(
-                    id="student",
-                    name="Student",
-                    type="entity",
-                    attributes=[
-                        {"name": "student_id", "isKey": True},
-                        {"name": "name", "isKey": False},
-                        {"name": "email", "isKey": False}
-                    ]
-                ),
-                VisualizationNode(
-                    id="course",
-                    name="Course",
-                    type="entity",
-                    attributes=[
-                        {"name": "course_id", "isKey": True},
-                        {"name": "title", "isKey": False},
-                        {"name": "credits", "isKey": False}
+
+def build_visualization_data(topic: str) -> VisualizationData:
+    """Build the visualization data of a topic (see topic_graph for the stored form)."""
+    # For the ER model, return a simple mock dataset
+    if topic == 'er':
+        # Create a simple ER diagram with entities and relationships
+        nodes = [
+            VisualizationNode(
+                id="student",
+                name="Student",
+                type="entity",
+                attributes=[
+                    {"name": "student_id", "isKey": True},
+                    {"name": "name", "isKey": False},
+                    {"name": "email", "isKey": False}
+                ]
+            ),
+            VisualizationNode(
+                id="course",
+                name="Course",
+                type="entity",
+                attributes=[
+                    {"name": "course_id", "isKey": True},
+                    {"name": "title", "isKey": False},
+                    {"name": "credits", "isKey": False}
+                ]
+            ),
+            VisualizationNode(
+                id="enrollment",
+                name="Enrolls",
+                type="relationship"
+            )
+        ]
+
+        edges = [
+            VisualizationEdge(
+                source="student",
+                target="enrollment",
+                type="participates"
+            ),
+            VisualizationEdge(
+                source="enrollment",
+                target="course",
+                type="participates"
+            )
+        ]
+
+        # Create a simple narration
+        narration = (
+            "This Entity-Relationship diagram shows a Student entity connected to a Course entity "
+            "through an Enrollment relationship. Each Student has attributes like student_id "
+            "(primary key), name, and email. Each Course has attributes like course_id (primary "
+            "key), title, and credits. The Enrollment relationship represents how students enroll "
+            "in courses."
+        )
+
+        # Generate simple word timings
+        narration_timestamps = generate_word_timings(narration)
+
+        return VisualizationData(
+            nodes=nodes,
+            edges=edges,
+            topic=topic,
+            narration=narration,
+            narration_timestamps=narration_timestamps
+        )
+
+    # For Document Database visualization
+    elif topic == 'document':
+        nodes = [
+            VisualizationNode(
+                id="user_collection",
+                name="Users Collection",
+                type="collection",
+                document={
+                    "_id": "user123",
+                    "name": "John Doe",
+                    "email": "john@example.com",
+                    "preferences": {
+                        "theme": "dark",
+                        "notifications": True
+                    },
+                    "posts": [
+                        {"id": "post1", "title": "First Post"},
+                        {"id": "post2", "title": "Second Post"}
                     ]
-                ),
-                VisualizationNode(
-                    id="enrollment",
-                    name="Enrolls",
-                    type="relationship"
-                )
-            ]
-            
-            edges = [
-                VisualizationEdge(
-                    source="student",
-                    target="enrollment",
-                    type="participates"
-                ),
-                VisualizationEdge(
-                    source="enrollment",
-                    target="course",
-                    type="participates"
-                )
-            ]
-            
-            # Create a simple narration
-            narration = "This Entity-Relationship diagram shows a Student entity connected to a Course entity through an Enrollment relationship. Each Student has attributes like student_id (primary key), name, and email. Each Course has attributes like course_id (primary key), title, and credits. The Enrollment relationship represents how students enroll in courses."
-            
-            # Generate simple word timings
-            narration_timestamps = generate_word_timings(narration)
-            
-            return VisualizationData(
-                nodes=nodes,
-                edges=edges,
-                topic=topic,
-                narration=narration,
-                narration_timestamps=narration_timestamps
+                }
+            ),
+            VisualizationNode(
+                id="post_collection",
+                name="Posts Collection",
+                type="collection",
+                document={
+                    "_id": "post1",
+                    "title": "First Post",
+                    "content": "This is the content of the first post",
+                    "author_id": "user123",
+                    "comments": [
+                        {"user_id": "user456", "text": "Great post!"},
+                        {"user_id": "user789", "text": "Thanks for sharing"}
+                    ],
+                    "tags": ["database", "nosql", "document"]
+                }
             )
+        ]
         
-        # For Document Database visualization
-        elif topic == 'document':
-            nodes = [
-                VisualizationNode(
-                    id="user_collection",
-                    name="Users Collection",
-                    type="collection",
-                    document={
-                        "_id": "user123",
-                        "name": "John Doe",
-                        "email": "john@example.com",
-                        "preferences": {
-                            "theme": "dark",
-                            "notifications": True
-                        },
-                        "posts": [
-                            {"id": "post1", "title": "First Post"},
-                            {"id": "post2", "title": "Second Post"}
-                        ]
-                    }
-                ),
-                VisualizationNode(
-                    id="post_collection",
-                    name="Posts Collection",
-                    type="collection",
-                    document={
-                        "_id": "post1",
-                        "title": "First Post",
-                        "content": "This is the content of the first post",
-                        "author_id": "user123",
-                        "comments": [
-                            {"user_id": "user456", "text": "Great post!"},
-                            {"user_id": "user789", "text": "Thanks for sharing"}
-                        ],
-                        "tags": ["database", "nosql", "document"]
-                    }
-                )
-            ]
-            
-            edges = [
-                VisualizationEdge(
-                    source="user_collection",
-                    target="post_collection",
-                    type="reference",
-                    description="User -> Posts"
-                )
-            ]
-            
-            narration = "This Document Database visualization shows two collections: Users and Posts. The Users collection contains documents with embedded arrays and nested objects, demonstrating the flexible schema of document databases. The Posts collection references users and contains embedded comments, showing how document databases can model relationships without formal joins."
-            
-            narration_timestamps = generate_word_timings(narration)
-            
-            return VisualizationData(
-                nodes=nodes,
-                edges=edges,
-                topic=topic,
-                narration=narration,
-                narration_timestamps=narration_timestamps
+        edges = [
+            VisualizationEdge(
+                source="user_collection",
+                target="post_collection",
+                type="reference",
+                description="User -> Posts"
             )
-            
-        # For Hierarchical Database visualization
-        elif topic == 'hierarchical':
-            nodes = [
-                VisualizationNode(
-                    id="root",
-                    name="University",
-                    type="root"
-                ),
-                VisualizationNode(
-                    id="department1",
-                    name="Computer Science",
-                    type="branch"
-                ),
-                VisualizationNode(
-                    id="department2",
-                    name="Mathematics",
-                    type="branch"
-                ),
-                VisualizationNode(
-                    id="course1",
-                    name="Database Systems",
-                    type="leaf"
-                ),
-                VisualizationNode(
-                    id="course2",
-                    name="Algorithms",
-                    type="leaf"
-                ),
-                VisualizationNode(
-                    id="course3",
-                    name="Calculus",
-                    type="leaf"
-                )
-            ]
-            
-            edges = [
-                VisualizationEdge(
-                    source="root",
-                    target="department1",
-                    type="parent-child"
-                ),
-                VisualizationEdge(
-                    source="root",
-                    target="department2",
-                    type="parent-child"
-                ),
-                VisualizationEdge(
-                    source="department1",
-                    target="course1",
-                    type="parent-child"
-                ),
-                VisualizationEdge(
-                    source="department1",
-                    target="course2",
-                    type="parent-child"
-                ),
-                VisualizationEdge(
-                    source="department2",
-                    target="course3",
-                    type="parent-child"
-                )
-            ]
-            
-            narration = "This Hierarchical Database visualization shows a university structure with departments and courses. The University is the root node, with Computer Science and Mathematics as branch nodes. Each department has courses as leaf nodes. This tree-like structure demonstrates how hierarchical databases organize data in parent-child relationships."
-            
-            narration_timestamps = generate_word_timings(narration)
-            
-            return VisualizationData(
-                nodes=nodes,
-                edges=edges,
-                topic=topic,
-                narration=narration,
-                narration_timestamps=narration_timestamps
+        ]
+
+        narration = (
+            "This Document Database visualization shows two collections: Users and Posts. The "
+            "Users collection contains documents with embedded arrays and nested objects, "
+            "demonstrating the flexible schema of document databases. The Posts collection "
+            "references users and contains embedded comments, showing how document databases can "
+            "model relationships without formal joins."
+        )
+
+        narration_timestamps = generate_word_timings(narration)
+
+        return VisualizationData(
+            nodes=nodes,
+            edges=edges,
+            topic=topic,
+            narration=narration,
+            narration_timestamps=narration_timestamps
+        )
+
+    # For Hierarchical Database visualization
+    elif topic == 'hierarchical':
+        nodes = [
+            VisualizationNode(
+                id="root",
+                name="University",
+                type="root"
+            ),
+            VisualizationNode(
+                id="department1",
+                name="Computer Science",
+                type="branch"
+            ),
+            VisualizationNode(
+                id="department2",
+                name="Mathematics",
+                type="branch"
+            ),
+            VisualizationNode(
+                id="course1",
+                name="Database Systems",
+                type="leaf"
+            ),
+            VisualizationNode(
+                id="course2",
+                name="Algorithms",
+                type="leaf"
+            ),
+            VisualizationNode(
+                id="course3",
+                name="Calculus",
+                type="leaf"
             )
-            
-        # For other topics, create a generic visualization with appropriate structure
-        else:
-            # Generic visualization with a few nodes and edges
-            nodes = [
-                VisualizationNode(
-                    id=f"{topic}_node1",
-                    name=f"{topic.capitalize()} Node 1",
-                    type="generic"
-                ),
-                VisualizationNode(
-                    id=f"{topic}_node2",
-                    name=f"{topic.capitalize()} Node 2",
-                    type="generic"
-                ),
-                VisualizationNode(
-                    id=f"{topic}_node3",
-                    name=f"{topic.capitalize()} Node 3",
-                    type="generic"
-                )
-            ]
-            
-            edges = [
-                VisualizationEdge(
-                    source=f"{topic}_node1",
-                    target=f"{topic}_node2",
-                    type="connection"
-                ),
-                VisualizationEdge(
-                    source=f"{topic}_node2",
-                    target=f"{topic}_node3",
-                    type="connection"
-                )
-            ]
-            
-            narration = f"This is a visualization of a {topic.replace('_', ' ')} database model. It shows three nodes connected in a simple structure. In a real implementation, this would contain more detailed information specific to the {topic.replace('_', ' ')} model."
-            
-            narration_timestamps = generate_word_timings(narration)
-            
-            return VisualizationData(
-                nodes=nodes,
-                edges=edges,
-                topic=topic,
-                narration=narration,
-                narration_timestamps=narration_timestamps
+        ]
+
+        edges = [
+            VisualizationEdge(
+                source="root",
+                target="department1",
+                type="parent-child"
+            ),
+            VisualizationEdge(
+                source="root",
+                target="department2",
+                type="parent-child"
+            ),
+            VisualizationEdge(
+                source="department1",
+                target="course1",
+                type="parent-child"
+            ),
+            VisualizationEdge(
+                source="department1",
+                target="course2",
+                type="parent-child"
+            ),
+            VisualizationEdge(
+                source="department2",
+                target="course3",
+                type="parent-child"
             )
-    
+        ]
+
+        narration = (
+            "This Hierarchical Database visualization shows a university structure with "
+            "departments and courses. The University is the root node, with Computer Science and "
+            "Mathematics as branch nodes. Each department has courses as leaf nodes. This "
+            "tree-like structure demonstrates how hierarchical databases organize data in "
+            "parent-child relationships."
+        )
+
+        narration_timestamps = generate_word_timings(narration)
+
+        return VisualizationData(
+            nodes=nodes,
+            edges=edges,
+            topic=topic,
+            narration=narration,
+            narration_timestamps=narration_timestamps
+        )
+
+    # Synthetic graphs of a given size (e.g. synthetic_10000), for benchmarking large topics
+    elif synthetic_size(topic):
+        nodes, edges = generate_synthetic_graph(synthetic_size(topic))
+
+        return VisualizationData(
+            nodes=nodes,
+            edges=edges,
+            topic=topic
+        )
+
+    # For other topics, create a generic visualization with appropriate structure
+    else:
+        # Generic visualization with a few nodes and edges
+        nodes = [
+            VisualizationNode(
+                id=f"{topic}_node1",
+                name=f"{topic.capitalize()} Node 1",
+                type="generic"
+            ),
+            VisualizationNode(
+                id=f"{topic}_node2",
+                name=f"{topic.capitalize()} Node 2",
+                type="generic"
+            ),
+            VisualizationNode(
+                id=f"{topic}_node3",
+                name=f"{topic.capitalize()} Node 3",
+                type="generic"
+            )
+        ]
+
+        edges = [
+            VisualizationEdge(
+                source=f"{topic}_node1",
+                target=f"{topic}_node2",
+                type="connection"
+            ),
+            VisualizationEdge(
+                source=f"{topic}_node2",
+                target=f"{topic}_node3",
+                type="connection"
+            )
+        ]
+
+        narration = (
+            f"This is a visualization of a {topic.replace('_', ' ')} database model. "
+            "It shows three nodes connected in a simple structure. "
+            "In a real implementation, this would contain more detailed information "
+            f"specific to the {topic.replace('_', ' ')} model."
+        )
+
+        narration_timestamps = generate_word_timings(narration)
+
+        return VisualizationData(
+            nodes=nodes,
+            edges=edges,
+            topic=topic,
+            narration=narration,
+            narration_timestamps=narration_timestamps
+        )
+
+
+def topic_graph(topic: str) -> TopicGraph:
+    """Return the compact graph of a topic, built once per process and shared by all requests."""
+    return graph_store.get(topic, lambda: TopicGraph.from_data(build_visualization_data(topic)))
+
+
+def load_visualization_data(topic: str) -> VisualizationData:
+    """Load visualization data for a given topic, materialized from its stored graph."""
+    try:
+        return VisualizationData(**topic_graph(topic).export())
     except Exception as e:
-        logger.error(f"Error loading visualization data for {topic}: {str(e)}")
+        logger.error("Error loading visualization data for %s: %s", topic, e)
         # Return a minimal valid response instead of raising an exception
         return VisualizationData(
             nodes=[VisualizationNode(id="error", name="Error", type="error")],
@@ -324,76 +439,176 @@ def load_visualization_data(topic: str) -> VisualizationData:
             narration=f"Error loading visualization: {str(e)}"
         )
 
-def process_doubt(topic: str, doubt: str, current_state=None, stream=False) -> Union[DoubtResponse, Generator]:
-    """Process a doubt about a visualization topic."""
+
+def compute_topic_layout(topic: str) -> dict:
+    """Compute (or fetch cached) node coordinates for a topic's visualization."""
+    # Topics with a static data file are laid out from it, using its canvas size if given
+    data_path = Path(__file__).parent / "static" / "data" / f"{topic}_visualization.json"
+    width, height = DEFAULT_WIDTH, DEFAULT_HEIGHT
+    if data_path.exists():
+        data = json.loads(data_path.read_text())
+        canvas = data.get("layout") or {}
+        width, height = canvas.get("width", width), canvas.get("height", height)
+        visualization_data = VisualizationData(
+            nodes=data.get("nodes", []), edges=data.get("edges", []), topic=topic
+        )
+    else:
+        visualization_data = topic_graph(topic)
+
+    return {
+        "topic": topic,
+        "width": width,
+        "height": height,
+        "positions": compute_layout(visualization_data, width, height)
+    }
+
+
+def state_patch(topic: str, session_id: Optional[str], since_version: Optional[int],
+                narration: str, highlights: List[str], narration_timestamps: List[dict],
+                doubt: str = "") -> Optional[dict]:
+    """Record an answer in the session's conversation and visualization state.
+
+    Returns the patches the client is missing.
+    """
+    if not session_id:
+        return None
+    session_contexts.record_turn(state_key(topic, session_id), doubt, narration)
+    return record_doubt(topic, session_id, narration, highlights, narration_timestamps,
+                        since_version)
+
+
+def degraded_response(topic: str, doubt: str, highlighted_elements: List[str],
+                      reason: str) -> DoubtResponse:
+    """Answer a doubt without the chat API (FAQ, script segment or busy notice)."""
+    answer = degraded_answer(topic, doubt, highlighted_elements, reason)
+    return DoubtResponse(
+        narration=answer.narration,
+        narration_timestamps=generate_word_timings(answer.narration),
+        highlights=answer.highlights,
+        degraded=True,
+        degraded_source=answer.source
+    )
+
+
+def degraded_stream(response: DoubtResponse, patch: Optional[dict] = None,
+                    retry_after: Optional[float] = None) -> Generator:
+    """Stream a degraded answer as a single final record."""
+    final = {"type": "final", **response.dict(exclude={"patch"}), "retry_after": retry_after}
+    yield json.dumps(final) + "\n"
+    if patch:
+        yield json.dumps({"type": "patch", **patch}) + "\n"
+
+
+def process_doubt(topic: str, doubt: str, current_state=None, stream=False,
+                  priority=Priority.INTERACTIVE, session_id: Optional[str] = None,
+                  since_version: Optional[int] = None) -> Union[DoubtResponse, Generator]:
+    """Process a doubt about a visualization topic.
+
+    With a session_id the answer is also recorded in the session's versioned
+    visualization state, and the response carries the patches since `since_version`.
+    """
     try:
-        # Load visualization data for context
-        visualization_data = load_visualization_data(topic)
-        
-        # Initialize OpenAI client
-        client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        # The topic's graph, built once per process
+        visualization_data = topic_graph(topic)
         
-        # Define the function for highlighting elements
-        functions = [
-            {
-                "name": "highlight_elements",
-                "description": "Highlight specific elements in the visualization to explain concepts",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "element_ids": {
-                            "type": "array",
-                            "items": {
-                                "type": "string"
-                            },
-                            "description": "IDs of the elements to highlight in the visualization"
-                        },
-                        "explanation": {
-                            "type": "string",
-                            "description": "Explanation of the highlighted elements and how they relate to the doubt"
-                        }
-                    },
-                    "required": ["element_ids", "explanation"]
-                }
-            }
-        ]
+        # Select the part of the graph relevant to this doubt
+        highlighted_elements = (current_state or {}).get("highlighted_elements", [])
+
+        # Earlier turns of the session, trimmed to a fixed token budget
+        if session_id:
+            conversation = session_contexts.context(state_key(topic, session_id))
+        else:
+            conversation = SessionContext()
+
+        # Answers are shared across doubt processes and bridge workers
+        # (follow-ups only within their conversation)
+        cache_key = doubt_cache_key(topic, doubt, topic_fingerprint(visualization_data),
+                                    highlighted_elements, *conversation.cache_context())
+        if not stream:
+            cached_response = cache_store.get("doubt_response", cache_key)
+            if cached_response is not None:
+                logger.info("Serving cached answer for doubt about %s", topic)
+                doubt_response = DoubtResponse(**cached_response)
+                timestamps = [t.dict() for t in doubt_response.narration_timestamps or []]
+                doubt_response.patch = state_patch(topic, session_id, since_version,
+                                                   doubt_response.narration,
+                                                   doubt_response.highlights or [],
+                                                   timestamps, doubt)
+                return doubt_response
+
+        # Under overload, answer from the fast path instead of queueing behind upstream
+        reason = shed_reason()
+        if reason:
+            doubt_response = degraded_response(topic, doubt, highlighted_elements, reason)
+            timestamps = [t.dict() for t in doubt_response.narration_timestamps]
+            doubt_response.patch = state_patch(topic, session_id, since_version,
+                                               doubt_response.narration, doubt_response.highlights,
+                                               timestamps, doubt)
+            if stream:
+                return degraded_stream(doubt_response, doubt_response.patch)
+            return doubt_response
+
+        # The OpenAI SDK is only imported once a doubt actually needs the API
+        client = sync_client()
         
-        # Prepare the messages for the API call
+        context = extract_prompt_context(visualization_data, doubt, highlighted_elements)
+        logger.info("Prompt context: %d/%d nodes, %d/%d edges, ~%d tokens",
+                    len(context.nodes), context.total_nodes,
+                    len(context.edges), context.total_edges, context.token_estimate)
+
+        # The static topic prefix comes first so it can be served from the provider's
+        # prompt cache; everything specific to this request is appended after it
+        prefix = prefix_cache.get(topic, visualization_data)
+        selection = " (the elements most relevant to the question)" if context.truncated else ""
+        request_context = (
+            f"Visualization data{selection}:\n"
+            f"- Nodes: {json.dumps(context.nodes)}\n"
+            f"- Edges: {json.dumps(context.edges)}"
+        )
+        if highlighted_elements:
+            request_context += (
+                f"\nThe student is currently looking at these highlighted elements: "
+                f"{highlighted_elements}"
+            )
+        if not conversation.empty:
+            logger.info("Session context: %d recent turns, ~%d tokens",
+                        len(conversation.turns), conversation.token_estimate)
+
         messages = [
-            {"role": "system", "content": f"""You are an AI assistant helping students understand database concepts through visualizations.
-            
-            The current visualization is about: {topic.replace('_', ' ').title()}
-            
-            You have access to the following visualization data:
-            - Nodes: {[{"id": node.id, "name": node.name, "type": node.type} for node in visualization_data.nodes]}
-            - Edges: {[{"source": edge.source, "target": edge.target, "type": edge.type} for edge in visualization_data.edges]}
-            
-            When answering questions, use the highlight_elements function to highlight relevant parts of the visualization.
-            Be specific about which elements should be highlighted to help the student understand the concept.
-            """},
+            {"role": "system", "content": prefix.text},
+            {"role": "system", "content": request_context},
+            *conversation.messages(),
             {"role": "user", "content": doubt}
         ]
         
-        # Add current state context if available
-        if current_state:
-            highlighted_elements = current_state.get("highlighted_elements", [])
-            if highlighted_elements:
-                messages.append({
-                    "role": "system", 
-                    "content": f"The student is currently looking at these highlighted elements: {highlighted_elements}"
-                })
-        
+        # Simple lookups go to the small, fast model; multi-step questions to the large one
+        # The route's answer budget is not applied: the answer is usually inside the
+        # highlight_elements arguments, and cut-off arguments are invalid JSON
+        route = model_router.route(topic, doubt, highlighted_elements).route
+
         # Make the API call with function calling
         if stream:
             def response_generator():
+                response_stream = None
                 try:
                     # Stream the response
-                    response_stream = client.chat.completions.create(
-                        model="gpt-4",
-                        messages=messages,
-                        functions=functions,
-                        function_call="auto",
-                        stream=True
+                    started = time.monotonic()
+                    response_stream = chat_calls.call_sync(
+                        lambda timeout: chat_scheduler.submit_sync(
+                            lambda: client.chat.completions.create(
+                                model=route.model,
+                                messages=messages,
+                                functions=HIGHLIGHT_FUNCTIONS,
+                                function_call="auto",
+                                stream=True,
+                                stream_options={"include_usage": True},
+                                timeout=timeout
+                            ),
+                            priority,
+                            tokens=estimate_chat_tokens(messages),
+                            # The admission is held until the stream is read to the end
+                            stream=True
+                        )
                     )
                     
                     # Variables to collect the streamed response
@@ -403,6 +618,11 @@ def process_doubt(topic: str, doubt: str, current_state=None, stream=False) -> U
                     
                     # Process the streamed response
                     for chunk in response_stream:
+                        if not chunk.choices:
+                            # The final chunk only carries token usage
+                            prefix_cache.record_usage(chunk.usage)
+                            model_router.record(route, time.monotonic() - started, chunk.usage)
+                            continue
                         if chunk.choices[0].delta.function_call:
                             # Handle function call
                             if function_name is None and chunk.choices[0].delta.function_call.name:
@@ -464,12 +684,18 @@ def process_doubt(topic: str, doubt: str, current_state=None, stream=False) -> U
                                     current_time += word_duration
                             
                             # Yield the final response with highlights
+                            timestamps = [t.dict() for t in narration_timestamps]
                             yield json.dumps({
                                 "type": "final",
                                 "narration": explanation,
                                 "highlights": highlights,
-                                "narration_timestamps": [t.dict() for t in narration_timestamps]
+                                "narration_timestamps": timestamps
                             }) + "\n"
+                            remember_answer(topic, doubt, explanation, highlights)
+                            patch = state_patch(topic, session_id, since_version, explanation,
+                                                highlights, timestamps, doubt)
+                            if patch:
+                                yield json.dumps({"type": "patch", **patch}) + "\n"
                         except json.JSONDecodeError:
                             # Handle invalid JSON in function arguments
                             yield json.dumps({
@@ -480,27 +706,54 @@ def process_doubt(topic: str, doubt: str, current_state=None, stream=False) -> U
                         # If no function call was made, use the collected messages
                         full_response = "".join(collected_messages)
                         narration_timestamps = generate_word_timings(full_response)
+                        timestamps = [t.dict() for t in narration_timestamps]
+                        # Without the function call, the elements the answer names are highlighted
+                        highlights = mentioned_elements(visualization_data, full_response)
                         
                         yield json.dumps({
                             "type": "final",
                             "narration": full_response,
-                            "highlights": [],
-                            "narration_timestamps": [t.dict() for t in narration_timestamps]
+                            "highlights": highlights,
+                            "narration_timestamps": timestamps
                         }) + "\n"
+                        remember_answer(topic, doubt, full_response, highlights)
+                        patch = state_patch(topic, session_id, since_version, full_response,
+                                            highlights, timestamps, doubt)
+                        if patch:
+                            yield json.dumps({"type": "patch", **patch}) + "\n"
                         
+                except AdmissionRejected as e:
+                    logger.warning("Doubt rejected by scheduler, answering from the fast path: %s",
+                                   e)
+                    doubt_response = degraded_response(topic, doubt, highlighted_elements, str(e))
+                    yield from degraded_stream(doubt_response, retry_after=e.retry_after)
                 except Exception as e:
-                    logger.error(f"Error in streaming response: {str(e)}")
+                    logger.error("Error in streaming response: %s", e)
                     yield json.dumps({"type": "error", "error": str(e)}) + "\n"
+                finally:
+                    # Frees the admission when the client stops reading early
+                    if response_stream is not None:
+                        response_stream.close()
             
             return response_generator()
         else:
             # Non-streaming response
-            response = client.chat.completions.create(
-                model="gpt-4",
-                messages=messages,
-                functions=functions,
-                function_call="auto"
+            started = time.monotonic()
+            response = chat_calls.call_sync(
+                lambda timeout: chat_scheduler.submit_sync(
+                    lambda: client.chat.completions.create(
+                        model=route.model,
+                        messages=messages,
+                        functions=HIGHLIGHT_FUNCTIONS,
+                        function_call="auto",
+                        timeout=timeout
+                    ),
+                    priority,
+                    tokens=estimate_chat_tokens(messages)
+                )
             )
+            prefix_cache.record_usage(response.usage)
+            model_router.record(route, time.monotonic() - started, response.usage)
             
             # Process the response
             message = response.choices[0].message
@@ -518,8 +771,10 @@ def process_doubt(topic: str, doubt: str, current_state=None, stream=False) -> U
                     # Handle invalid JSON
                     explanation = "I couldn't process the highlighting function. " + (message.content or "")
             else:
-                # Use the regular content if no function was called
+                # Use the regular content if no function was called, highlighting the
+                # elements it names
                 explanation = message.content
+                highlights = mentioned_elements(visualization_data, explanation or "")
             
             # Generate word timings with node_id for highlighting
             narration_timestamps = []
@@ -557,14 +812,27 @@ def process_doubt(topic: str, doubt: str, current_state=None, stream=False) -> U
                     current_time += word_duration
             
             # Return the response
-            return DoubtResponse(
+            doubt_response = DoubtResponse(
                 narration=explanation,
                 narration_timestamps=narration_timestamps,
                 highlights=highlights
             )
+            cache_store.set("doubt_response", cache_key, doubt_response.dict(), ttl=DOUBT_CACHE_TTL)
+            remember_answer(topic, doubt, explanation, highlights)
+            doubt_response.patch = state_patch(topic, session_id, since_version, explanation,
+                                               highlights, [t.dict() for t in narration_timestamps],
+                                               doubt)
+            return doubt_response
     
+    except AdmissionRejected as e:
+        logger.warning("Doubt rejected by scheduler, answering from the fast path: %s", e)
+        highlighted_elements = (current_state or {}).get("highlighted_elements", [])
+        doubt_response = degraded_response(topic, doubt, highlighted_elements, str(e))
+        if stream:
+            return degraded_stream(doubt_response, retry_after=e.retry_after)
+        return doubt_response
     except Exception as e:
-        logger.error(f"Error processing doubt: {str(e)}")
+        logger.error("Error processing doubt: %s", e)
         if stream:
             def error_generator():
                 yield json.dumps({"type": "error", "error": str(e)}) + "\n"
@@ -576,9 +844,99 @@ def process_doubt(topic: str, doubt: str, current_state=None, stream=False) -> U
                 highlights=[]
             )
 
-async def generate_streaming_audio(text, chunk_size=100):
+
+class DoubtBatchItem(BaseModel):
+    id: str
+    topic: str
+    doubt: str
+    current_state: Optional[dict] = None
+
+
+# Doubts whose word pairs overlap at least this much (Jaccard) are answered once
+DOUBT_DEDUPE_THRESHOLD = float(os.getenv("DOUBT_DEDUPE_THRESHOLD", "0.85"))
+# Upper bound on the doubts of a batch answered at the same time
+MAX_BATCH_CONCURRENCY = int(os.getenv("DOUBT_BATCH_MAX_CONCURRENCY", "8"))
+
+_batch_executor = None
+
+
+def batch_executor() -> ThreadPoolExecutor:
+    """Threads shared by all doubt batches, created on first use.
+
+    A batch doubt can block its thread while it waits for admission, so batches
+    get their own bounded pool instead of the default executor other requests use.
+    """
+    global _batch_executor
+    if _batch_executor is None:
+        _batch_executor = ThreadPoolExecutor(max_workers=MAX_BATCH_CONCURRENCY,
+                                             thread_name_prefix="doubt-batch")
+    return _batch_executor
+
+
+def doubt_bigrams(doubt: str) -> set:
+    """Return the adjacent word pairs of a normalized doubt, including its first and last word.
+
+    Pairs keep word order, so "is A a subset of B" and "is B a subset of A" differ.
+    """
+    words = ["", *tokenize(normalize_doubt(doubt)), ""]
+    return set(zip(words, words[1:])) if len(words) > 2 else set()
+
+
+def group_duplicate_doubts(items: List[DoubtBatchItem],
+                           threshold: float = DOUBT_DEDUPE_THRESHOLD) -> List[List[DoubtBatchItem]]:
+    """Group near-identical doubts asked about the same topic and highlighted elements."""
+    groups = []
+    for item in items:
+        state = item.current_state or {}
+        context = (item.topic, tuple(sorted(state.get("highlighted_elements", []))))
+        pairs = doubt_bigrams(item.doubt)
+        for group_context, group_pairs, group in groups:
+            if group_context != context:
+                continue
+            union = pairs | group_pairs
+            if union and len(pairs & group_pairs) / len(union) >= threshold:
+                group.append(item)
+                break
+        else:
+            groups.append((context, pairs, [item]))
+    return [group for _, _, group in groups]
+
+
+async def process_doubt_batch(items: List[DoubtBatchItem], concurrency: int = 4,
+                              priority=Priority.PREFETCH) -> AsyncGenerator[dict, None]:
+    """Answer many doubts concurrently, yielding results in completion order.
+
+    Near-identical doubts are answered once; the other items of a group are
+    reported with `duplicate_of` set to the id of the item that was answered.
+    """
+    semaphore = asyncio.Semaphore(min(max(1, concurrency), MAX_BATCH_CONCURRENCY))
+    groups = group_duplicate_doubts(items)
+    logger.info("Processing batch of %s doubts as %s unique doubts", len(items), len(groups))
+
+    async def answer(group):
+        leader = group[0]
+        async with semaphore:
+            response = await asyncio.get_running_loop().run_in_executor(
+                batch_executor(),
+                functools.partial(process_doubt, leader.topic, leader.doubt,
+                                  leader.current_state, False, priority)
+            )
+        return group, response
+
+    for finished in asyncio.as_completed([answer(group) for group in groups]):
+        group, response = await finished
+        for item in group:
+            yield {
+                "id": item.id,
+                "duplicate_of": None if item is group[0] else group[0].id,
+                "response": response.model_dump()
+            }
+
+
+async def generate_streaming_audio(text, chunk_size=100, audio_format=DEFAULT_FORMAT,
+                                   speed=DEFAULT_SPEED):
     """Generate audio in chunks for streaming."""
-    client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    client = async_client()
     
     # Split text into chunks for audio generation
     words = text.split()
@@ -602,21 +960,30 @@ async def generate_streaming_audio(text, chunk_size=100):
     # Generate audio for each chunk
     for chunk_text in chunks:
         try:
-            response = await client.audio.speech.create(
-                model="tts-1",
-                voice="alloy",  # You can make this configurable
-                input=chunk_text,
-                response_format="mp3"
+            response = await tts_calls.call(
+                lambda timeout: tts_scheduler.submit(
+                    lambda: client.audio.speech.create(
+                        model="tts-1",
+                        voice="alloy",  # You can make this configurable
+                        input=chunk_text,
+                        response_format=AUDIO_FORMATS[audio_format].response_format,
+                        speed=speed,
+                        timeout=timeout
+                    ),
+                    Priority.NARRATION
+                ),
+                hedge=len(chunk_text) <= tts_calls.policy.hedge_max_chars
             )
             
             # Return the audio data
             yield {
                 "type": "audio_chunk",
                 "audio_data": response.content.hex(),  # Convert binary to hex string for JSON
+                "content_type": AUDIO_FORMATS[audio_format].content_type,
                 "text": chunk_text
             }
         except Exception as e:
-            logger.error(f"Error generating audio: {str(e)}")
+            logger.error("Error generating audio: %s", e)
             yield {
                 "type": "error",
                 "content": f"Error generating audio: {str(e)}"
@@ -624,13 +991,45 @@ async def generate_streaming_audio(text, chunk_size=100):
 
 def main():
     """Main entry point for the application."""
+    # Configured here rather than at import, so importing this module has no side effects
+    logging.basicConfig(level=logging.INFO)
+    load_dotenv()
+
     parser = argparse.ArgumentParser(description='Generate visualization data')
     parser.add_argument('--topic', type=str, help='Visualization topic')
     parser.add_argument('--doubt', action='store_true', help='Process a doubt')
+    parser.add_argument('--batch', action='store_true',
+                        help='Process JSON lines of doubts from stdin')
+    parser.add_argument('--concurrency', type=int, default=4,
+                        help='Concurrent doubts in batch mode')
+    parser.add_argument('--stream', action='store_true',
+                        help='Stream the topic graph as NDJSON batches')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                        help='Nodes per batch in stream mode')
+    parser.add_argument('--viewport', type=str,
+                        help='Only stream nodes inside x0,y0,x1,y1 (layout coordinates)')
+    parser.add_argument('--focus', type=str,
+                        help='Only stream the neighborhood of these comma-separated node ids')
+    parser.add_argument('--hops', type=int, default=1,
+                        help='Neighborhood size around the focus nodes')
     args = parser.parse_args()
     
-    if args.doubt and args.topic:
+    if args.batch:
+        # Process a batch of doubts, one JSON item per line, printing results as they finish
+        async def run_batch():
+            items = [DoubtBatchItem(**json.loads(line)) for line in sys.stdin if line.strip()]
+            async for result in process_doubt_batch(items, args.concurrency):
+                print(json.dumps(result), flush=True)
+
+        try:
+            asyncio.run(run_batch())
+        except Exception as e:
+            logger.error("Error processing doubt batch: %s", e)
+            print(json.dumps({"error": str(e)}))
+    elif args.doubt and args.topic:
         # Process a doubt from stdin
+        # This process exits right after answering, before a background summary could finish
+        session_contexts.background_summaries = False
         try:
             # Read the doubt request from stdin
             doubt_request = json.loads(sys.stdin.read())
@@ -639,26 +1038,42 @@ def main():
             doubt = doubt_request.get('doubt', '')
             current_state = doubt_request.get('current_state', {})
             
-            # Process the doubt
-            response = process_doubt(args.topic, doubt, current_state)
+            # Process the doubt, returning state patches for clients that track a session
+            response = process_doubt(args.topic, doubt, current_state,
+                                     session_id=doubt_request.get('session_id'),
+                                     since_version=doubt_request.get('since_version'))
             
             # Print the response as JSON
             print(json.dumps(response.dict() if hasattr(response, 'dict') else response))
         except Exception as e:
-            logger.error(f"Error processing doubt from stdin: {str(e)}")
+            logger.error("Error processing doubt from stdin: %s", e)
             print(json.dumps({
                 "error": str(e),
                 "narration": f"Sorry, I encountered an error: {str(e)}",
                 "narration_timestamps": [],
                 "highlights": []
             }))
+    elif args.stream and args.topic:
+        # Stream the visualization graph in batches, one JSON record per line
+        try:
+            visualization_data = topic_graph(args.topic)
+            focus = [node_id for node_id in (args.focus or '').split(',') if node_id] or None
+            lines = iter_ndjson(visualization_data, batch_size=args.batch_size,
+                                viewport=parse_viewport(args.viewport), focus=focus, hops=args.hops)
+            for line in lines:
+                sys.stdout.write(line)
+                sys.stdout.flush()
+        except Exception as e:
+            logger.error("Error streaming visualization data: %s", e)
+            print(json.dumps({"type": "error", "error": str(e)}))
     elif args.topic:
         # Generate visualization data for the topic
         try:
             visualization_data = load_visualization_data(args.topic)
+            visualization_data.positions = compute_layout(visualization_data)
             print(visualization_data.json())
         except Exception as e:
-            logger.error(f"Error generating visualization data: {str(e)}")
+            logger.error("Error generating visualization data: %s", e)
             print(json.dumps({"error": str(e)}))
     else:
         parser.print_help()
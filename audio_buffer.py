@@ -0,0 +1,147 @@
+"""
+Bounded-memory buffers for synthesized audio.
+
+Audio is never held as one `bytes` object per session:
+
+- SpooledAudio collects audio as it arrives from the TTS API. It stays in
+  memory up to AUDIO_SPOOL_THRESHOLD bytes and then spills to an anonymous
+  temporary file.
+- MappedAudioFile serves an audio file (e.g. a cached narration) through a
+  read-only mmap, so its pages come from the OS page cache, are shared
+  between sessions and can be evicted under memory pressure.
+
+Both expose the audio as a memoryview and stream it as memoryview slices,
+so chunking never copies; what a session keeps resident is bounded by the
+chunks in flight rather than by the length of the narration.
+"""
+
+import logging
+import mmap
+import os
+import tempfile
+from pathlib import Path
+from typing import Iterator, Optional
+
+from audio_formats import AudioFormat, iter_chunks
+
+logger = logging.getLogger(__name__)
+
+AUDIO_SPOOL_THRESHOLD = int(os.getenv("AUDIO_SPOOL_THRESHOLD", str(256 * 1024)))
+
+# Block size for reading from the TTS API and copying buffers to disk
+BLOCK_SIZE = 64 * 1024
+
+
+def _close_mapping(mapping: Optional[mmap.mmap]):
+    if mapping is None:
+        return
+    try:
+        mapping.close()
+    except BufferError:
+        # Chunks are still referenced (e.g. queued for a slow client); the
+        # mapping is released once the last of them is dropped
+        pass
+
+
+class AudioBuffer:
+    """Audio that can be streamed as zero-copy memoryview chunks."""
+
+    size: int = 0
+    # Playing time, once measured (see realtime_audio.measured_duration_ms)
+    duration_ms: Optional[int] = None
+
+    def view(self) -> memoryview:
+        raise NotImplementedError
+
+    def chunks(self, audio_format: AudioFormat) -> Iterator[memoryview]:
+        """Split the audio following the format's chunking policy, without copying."""
+        return iter_chunks(self.view(), audio_format)
+
+    def blocks(self, block_size: int = BLOCK_SIZE) -> Iterator[memoryview]:
+        view = self.view()
+        for offset in range(0, self.size, block_size):
+            end = offset + block_size
+            yield view[offset:end]
+
+    def read(self) -> bytes:
+        """Return a copy of the whole audio."""
+        return bytes(self.view())
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class SpooledAudio(AudioBuffer):
+    """Append-only audio buffer that spills to a temporary file past a threshold."""
+
+    def __init__(
+        self, threshold: int = AUDIO_SPOOL_THRESHOLD, directory: Optional[str] = None
+    ):
+        self.threshold = threshold
+        self.directory = directory
+        self.size = 0
+        self._memory: Optional[bytearray] = bytearray()
+        self._file = None
+        self._mapping: Optional[mmap.mmap] = None
+
+    @property
+    def spilled(self) -> bool:
+        return self._file is not None
+
+    def write(self, data: bytes):
+        if self._mapping is not None:
+            raise ValueError("Cannot write to a buffer that is being read")
+        if self._file is None and self.size + len(data) > self.threshold:
+            self._file = tempfile.TemporaryFile(dir=self.directory, prefix="tts-spool-")
+            self._file.write(self._memory)
+            self._memory = None
+        if self._file is not None:
+            self._file.write(data)
+        else:
+            self._memory.extend(data)
+        self.size += len(data)
+
+    def view(self) -> memoryview:
+        if self._file is None:
+            return memoryview(self._memory)
+        if self._mapping is None:
+            self._file.flush()
+            self._mapping = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        return memoryview(self._mapping)
+
+    def close(self):
+        _close_mapping(self._mapping)
+        self._mapping = None
+        if self._file is not None:
+            self._file.close()
+        self._memory = None
+
+
+class MappedAudioFile(AudioBuffer):
+    """Read-only, memory-mapped view of an audio file."""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._file = open(self.path, "rb")
+        self.size = os.fstat(self._file.fileno()).st_size
+        self._mapping = (
+            mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            if self.size
+            else None
+        )
+
+    def view(self) -> memoryview:
+        return (
+            memoryview(self._mapping) if self._mapping is not None else memoryview(b"")
+        )
+
+    def close(self):
+        _close_mapping(self._mapping)
+        self._mapping = None
+        self._file.close()
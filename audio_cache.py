@@ -0,0 +1,254 @@
+"""
+On-disk cache for synthesized speech.
+
+Entries are content-addressed by the synthesis parameters (text, voice, model,
+format, speed), so identical narrations are only synthesized once. Each entry
+is an audio file plus a JSON metadata file that may also carry the word
+timings for the narration. Files are written to a temporary name and renamed
+into place, and the metadata file is written last, so readers never observe a
+partially written entry.
+
+MP3 entries can be indexed by frame (see mp3_index.py) for their exact
+duration and for seeking; indexes are kept for the most recently used
+entries, which never change once written.
+
+The audio files are held to a byte budget (TTS_CACHE_MAX_BYTES). Reading an
+entry refreshes its audio file's modification time, and once the files add
+up to more than the budget the least recently used entries are deleted.
+Recency lives in the file system, so eviction is shared by every process
+using the directory.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Iterable, Optional, Union
+
+from audio_buffer import AudioBuffer, MappedAudioFile
+from mp3_index import Mp3Index, index_mp3
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = os.getenv("TTS_CACHE_DIR", os.path.join(".cache", "tts"))
+
+# Frame indexes kept in memory
+INDEX_CACHE_SIZE = 64
+
+# Total size of the cached audio files (bytes); 0 means unlimited
+DEFAULT_MAX_BYTES = int(os.getenv("TTS_CACHE_MAX_BYTES", str(1024**3)))
+# How often a process recounts the directory, which other processes write to too
+SIZE_RESCAN_INTERVAL = 60.0
+
+
+def audio_cache_key(
+    text: str,
+    voice: str = "alloy",
+    model: str = "tts-1",
+    response_format: str = "mp3",
+    speed: float = 1.0,
+) -> str:
+    """Return the cache key for a synthesis request."""
+    payload = json.dumps([text, voice, model, response_format, speed])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:32]
+
+
+class AudioCache:
+    """Directory-backed store of synthesized audio and its metadata."""
+
+    def __init__(
+        self, directory: str = DEFAULT_CACHE_DIR, max_bytes: int = DEFAULT_MAX_BYTES
+    ):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self._indexes: "OrderedDict[str, Mp3Index]" = OrderedDict()
+        self._indexes_lock = threading.Lock()
+        # Running total of the audio files, recounted from the directory now and then
+        self._size: Optional[int] = None
+        self._size_counted_at = 0.0
+        self._size_lock = threading.Lock()
+        self.evictions = 0
+
+    def _audio_path(self, key: str) -> Path:
+        return self.directory / f"{key}.audio"
+
+    def _meta_path(self, key: str) -> Path:
+        return self.directory / f"{key}.json"
+
+    def _write_atomic(self, path: Path, data: Union[bytes, Iterable[bytes]]):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                # Large audio arrives as an iterable of blocks, so it is never held whole
+                for block in (
+                    [data] if isinstance(data, (bytes, bytearray, memoryview)) else data
+                ):
+                    f.write(block)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def _touch(self, path: Path):
+        # The modification time of an audio file is its entry's last use
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def contains(self, key: str) -> bool:
+        return self._meta_path(key).exists()
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Return the cached audio for a key, or None."""
+        if not self.contains(key):
+            return None
+        try:
+            audio = self._audio_path(key).read_bytes()
+        except OSError as e:
+            logger.warning("Could not read cached audio %s: %s", key, e)
+            return None
+        self._touch(self._audio_path(key))
+        return audio
+
+    def path(self, key: str) -> Optional[Path]:
+        """Return the path of the cached audio file for a key, or None."""
+        if not self.contains(key):
+            return None
+        path = self._audio_path(key)
+        if not path.exists():
+            return None
+        self._touch(path)
+        return path
+
+    def open(self, key: str) -> Optional[MappedAudioFile]:
+        """Return the cached audio as a memory-mapped buffer, or None."""
+        path = self.path(key)
+        if path is None:
+            return None
+        try:
+            return MappedAudioFile(path)
+        except OSError as e:
+            logger.warning("Could not open cached audio %s: %s", key, e)
+            return None
+
+    def index(self, key: str) -> Optional[Mp3Index]:
+        """Return the frame index of a cached MP3 entry, or None."""
+        with self._indexes_lock:
+            if key in self._indexes:
+                self._indexes.move_to_end(key)
+                return self._indexes[key]
+        meta = self.get_meta(key)
+        if meta is None or meta.get("response_format", "mp3") != "mp3":
+            return None
+        buffer = self.open(key)
+        if buffer is None:
+            return None
+        with buffer:
+            index = index_mp3(buffer.view())
+        if index is not None:
+            with self._indexes_lock:
+                self._indexes[key] = index
+                while len(self._indexes) > INDEX_CACHE_SIZE:
+                    self._indexes.popitem(last=False)
+        return index
+
+    def get_meta(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return the metadata of a cached entry, or None."""
+        try:
+            return json.loads(self._meta_path(key).read_text())
+        except (OSError, json.JSONDecodeError):
+            return None
+
+    def put(self, key: str, audio: bytes, **meta):
+        """Store audio and its metadata under a key."""
+        self._write_atomic(self._audio_path(key), audio)
+        meta.setdefault("size", len(audio))
+        meta.setdefault("created_at", time.time())
+        self._write_atomic(self._meta_path(key), json.dumps(meta).encode("utf-8"))
+        self._added(key, len(audio))
+
+    def put_buffer(self, key: str, buffer: AudioBuffer, **meta):
+        """Store audio from a buffer block by block, without copying it into memory."""
+        self._write_atomic(self._audio_path(key), buffer.blocks())
+        meta.setdefault("size", buffer.size)
+        meta.setdefault("created_at", time.time())
+        self._write_atomic(self._meta_path(key), json.dumps(meta).encode("utf-8"))
+        self._added(key, buffer.size)
+
+    def _added(self, key: str, size: int):
+        """Count a new entry and evict old ones once the budget is exceeded."""
+        if not self.max_bytes:
+            return
+        with self._size_lock:
+            now = time.monotonic()
+            if (
+                self._size is not None
+                and now - self._size_counted_at < SIZE_RESCAN_INTERVAL
+            ):
+                self._size += size
+                if self._size <= self.max_bytes:
+                    return
+            self._size = self.evict(keep=key)
+            self._size_counted_at = now
+
+    def evict(self, keep: Optional[str] = None) -> int:
+        """Delete least recently used entries until the audio fits the byte budget.
+
+        `keep` (usually the entry just written) is never deleted. Returns the
+        size of the audio files left.
+        """
+        entries = []
+        for path in self.directory.glob("*.audio"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue  # Evicted by another process meanwhile
+            entries.append((stat.st_mtime, stat.st_size, path.stem))
+        total = sum(size for _, size, _ in entries)
+        if not self.max_bytes:
+            return total
+        evicted = 0
+        for _, size, key in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            self._remove(key)
+            total -= size
+            evicted += 1
+        if evicted:
+            self.evictions += evicted
+            logger.info(
+                "Evicted %d cached audio entries, %d bytes left", evicted, total
+            )
+        return total
+
+    def _remove(self, key: str):
+        # Metadata first, so readers stop finding the entry before its audio goes
+        for path in (self._meta_path(key), self._audio_path(key)):
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning("Could not evict cached audio %s: %s", key, e)
+        with self._indexes_lock:
+            self._indexes.pop(key, None)
+
+    def update_meta(self, key: str, **fields):
+        """Merge fields into the metadata of an existing entry."""
+        meta = self.get_meta(key)
+        if meta is None:
+            raise KeyError(key)
+        meta.update(fields)
+        self._write_atomic(self._meta_path(key), json.dumps(meta).encode("utf-8"))
+
+
+audio_cache = AudioCache()
@@ -0,0 +1,151 @@
+"""
+Output formats for synthesized speech.
+
+Each format trades bandwidth against time-to-first-sample differently:
+
+- mp3: compatible with every client, moderate size.
+- opus: smallest payloads (Ogg/Opus), good for constrained networks.
+- wav / pcm: uncompressed 24 kHz 16-bit mono, largest payloads but no decoder
+  start-up delay, so playback can begin with the first small chunk.
+
+Every format has its own chunking policy: a small first chunk to get audio
+to the client quickly, then larger chunks for throughput. PCM chunks are
+aligned to whole samples. Deployments choose the enabled formats and the
+default with TTS_FORMATS and TTS_DEFAULT_FORMAT; clients pick one of the
+enabled formats per connection.
+"""
+
+import math
+import os
+from typing import Iterator, List, Optional, Union
+
+from pydantic import BaseModel
+
+# OpenAI TTS outputs 24 kHz, 16-bit, mono for the uncompressed formats
+PCM_SAMPLE_RATE = 24000
+PCM_SAMPLE_WIDTH = 2
+
+
+class AudioFormat(BaseModel):
+    """An output format and its chunking policy."""
+
+    name: str
+    response_format: str
+    content_type: str
+    first_chunk_size: int
+    chunk_size: int
+    sample_rate: Optional[int] = None
+
+
+AUDIO_FORMATS = {
+    "mp3": AudioFormat(
+        name="mp3",
+        response_format="mp3",
+        content_type="audio/mpeg",
+        first_chunk_size=8192,
+        chunk_size=8192,
+    ),
+    "opus": AudioFormat(
+        name="opus",
+        response_format="opus",
+        content_type="audio/ogg; codecs=opus",
+        first_chunk_size=2048,
+        chunk_size=4096,
+    ),
+    "wav": AudioFormat(
+        name="wav",
+        response_format="wav",
+        content_type="audio/wav",
+        # WAV header plus ~50 ms of audio
+        first_chunk_size=44 + PCM_SAMPLE_RATE * PCM_SAMPLE_WIDTH // 20,
+        chunk_size=PCM_SAMPLE_RATE * PCM_SAMPLE_WIDTH // 4,
+        sample_rate=PCM_SAMPLE_RATE,
+    ),
+    "pcm": AudioFormat(
+        name="pcm",
+        response_format="pcm",
+        content_type=f"audio/L16; rate={PCM_SAMPLE_RATE}; channels=1",
+        # ~50 ms first, then ~250 ms per chunk
+        first_chunk_size=PCM_SAMPLE_RATE * PCM_SAMPLE_WIDTH // 20,
+        chunk_size=PCM_SAMPLE_RATE * PCM_SAMPLE_WIDTH // 4,
+        sample_rate=PCM_SAMPLE_RATE,
+    ),
+}
+
+ENABLED_FORMATS = [
+    name.strip()
+    for name in os.getenv("TTS_FORMATS", "mp3,opus,wav,pcm").split(",")
+    if name.strip() in AUDIO_FORMATS
+]
+DEFAULT_FORMAT = os.getenv("TTS_DEFAULT_FORMAT", "mp3")
+if DEFAULT_FORMAT not in ENABLED_FORMATS:
+    DEFAULT_FORMAT = ENABLED_FORMATS[0] if ENABLED_FORMATS else "mp3"
+
+DEFAULT_SPEED = float(os.getenv("TTS_SPEED", "1.0"))
+
+
+def negotiate_format(requested: Optional[Union[str, List[str]]] = None) -> AudioFormat:
+    """Pick the first enabled format from a client's preference list."""
+    if isinstance(requested, str):
+        requested = [name.strip() for name in requested.split(",")]
+    elif not isinstance(requested, (list, tuple)):
+        requested = []
+    for name in requested:
+        if name in ENABLED_FORMATS:
+            return AUDIO_FORMATS[name]
+    return AUDIO_FORMATS[DEFAULT_FORMAT]
+
+
+def formats_from_accept(accept: Optional[str]) -> List[str]:
+    """Map an HTTP Accept header to format names, by q-value then the client's order.
+
+    Media ranges with q=0 are refused by the client and left out.
+    """
+    preferences = []
+    for position, media_range in enumerate((accept or "").split(",")):
+        media_type, *parameters = media_range.split(";")
+        media_type = media_type.strip().lower()
+        quality = 1.0
+        for parameter in parameters:
+            key, _, value = parameter.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if quality <= 0:
+            continue
+        for audio_format in AUDIO_FORMATS.values():
+            if audio_format.content_type.split(";")[0].lower() == media_type:
+                preferences.append((-quality, position, audio_format.name))
+    return [name for _, _, name in sorted(preferences)]
+
+
+def clamp_speed(speed: Optional[float]) -> float:
+    """Limit a requested speed to the range supported by the TTS API.
+
+    Missing or malformed speeds fall back to DEFAULT_SPEED.
+    """
+    try:
+        speed = float(speed)
+    except (TypeError, ValueError):
+        return DEFAULT_SPEED
+    if not math.isfinite(speed):
+        return DEFAULT_SPEED
+    return min(4.0, max(0.25, speed))
+
+
+def iter_chunks(audio_data: bytes, audio_format: AudioFormat) -> Iterator[memoryview]:
+    """Split audio into chunks following the format's chunking policy.
+
+    Chunks are memoryview slices of `audio_data` (any bytes-like object), so
+    no audio is copied.
+    """
+    view = memoryview(audio_data)
+    offset = 0
+    size = audio_format.first_chunk_size
+    while offset < len(view):
+        end = offset + size
+        yield view[offset:end]
+        offset = end
+        size = audio_format.chunk_size
@@ -0,0 +1,214 @@
+"""
+Cross-process cache store backed by SQLite in WAL mode.
+
+The bridge can run several worker processes (see `socket_bridge.py
+--workers`), and doubts are also answered by short-lived `app.py --doubt`
+processes. They all share cached state through one SQLite database: WAL
+journaling lets readers proceed while a writer commits, so every worker sees
+entries written by the others without re-warming its own cache. Synthesized
+audio itself lives in the shared audio cache directory (audio_cache.py); this
+store holds small values such as doubt answers, warm-up progress and leases.
+
+Values are JSON-serializable objects grouped by namespace, with an optional
+time-to-live.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DB_PATH = os.getenv("CACHE_DB_PATH", os.path.join(".cache", "bridge.sqlite3"))
+
+# How long doubt answers stay cached (seconds)
+DOUBT_CACHE_TTL = float(os.getenv("DOUBT_CACHE_TTL", str(24 * 3600)))
+# How often long-running processes delete expired entries (seconds)
+CACHE_PURGE_INTERVAL = float(os.getenv("CACHE_PURGE_INTERVAL", "600"))
+
+
+def normalize_doubt(doubt: str) -> str:
+    """Normalize case, whitespace and trailing punctuation of a doubt."""
+    return re.sub(r"\s+", " ", doubt.lower()).strip().rstrip("?!. ")
+
+
+def doubt_cache_key(topic: str, doubt: str, *context: Any) -> str:
+    """Return the cache key of a doubt asked about a topic in a given context."""
+    payload = json.dumps([topic, normalize_doubt(doubt), *context], sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class SQLiteCacheStore:
+    """Namespaced key-value store shared by every process using the same file."""
+
+    def __init__(self, path: str = DEFAULT_DB_PATH):
+        self.path = path
+        self._local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        # One connection per thread (and per process, since the thread-local
+        # is not shared with forked or spawned workers)
+        connection = getattr(self._local, "connection", None)
+        if connection is None or getattr(self._local, "pid", None) != os.getpid():
+            Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                " namespace TEXT NOT NULL,"
+                " key TEXT NOT NULL,"
+                " value TEXT NOT NULL,"
+                " expires_at REAL,"
+                " PRIMARY KEY (namespace, key))"
+            )
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def get(self, namespace: str, key: str) -> Optional[Any]:
+        """Return a cached value, or None if it is missing or expired."""
+        try:
+            row = (
+                self._connection()
+                .execute(
+                    "SELECT value, expires_at FROM cache WHERE namespace = ? AND key = ?",
+                    (namespace, key),
+                )
+                .fetchone()
+            )
+        except sqlite3.Error as e:
+            logger.warning("Cache store read failed: %s", e)
+            return None
+        if row is None or (row[1] is not None and row[1] < time.time()):
+            return None
+        return json.loads(row[0])
+
+    def set(self, namespace: str, key: str, value: Any, ttl: Optional[float] = None):
+        """Store a value, replacing any previous one."""
+        expires_at = time.time() + ttl if ttl else None
+        try:
+            self._connection().execute(
+                "INSERT OR REPLACE INTO cache (namespace, key, value, expires_at)"
+                " VALUES (?, ?, ?, ?)",
+                (namespace, key, json.dumps(value), expires_at),
+            )
+        except sqlite3.Error as e:
+            logger.warning("Cache store write failed: %s", e)
+
+    def update(
+        self,
+        namespace: str,
+        key: str,
+        change: Callable[[Optional[Any]], Any],
+        ttl: Optional[float] = None,
+    ) -> Any:
+        """Atomically replace a value with `change(current)` and return the new value.
+
+        The read and the write share one immediate transaction, so updates from
+        other workers and processes are serialized instead of overwriting each
+        other. `change` gets None for a missing or expired entry.
+        """
+        now = time.time()
+        connection = self._connection()
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            row = connection.execute(
+                "SELECT value, expires_at FROM cache WHERE namespace = ? AND key = ?",
+                (namespace, key),
+            ).fetchone()
+            expired = row is None or (row[1] is not None and row[1] < now)
+            value = change(None if expired else json.loads(row[0]))
+            connection.execute(
+                "INSERT OR REPLACE INTO cache (namespace, key, value, expires_at)"
+                " VALUES (?, ?, ?, ?)",
+                (namespace, key, json.dumps(value), now + ttl if ttl else None),
+            )
+            connection.execute("COMMIT")
+            return value
+        except BaseException as e:
+            if connection.in_transaction:
+                connection.execute("ROLLBACK")
+            if isinstance(e, sqlite3.Error):
+                logger.warning("Cache store update failed: %s", e)
+            raise
+
+    def delete(self, namespace: str, key: str):
+        self._connection().execute(
+            "DELETE FROM cache WHERE namespace = ? AND key = ?", (namespace, key)
+        )
+
+    def try_lease(self, name: str, owner: str, ttl: float) -> bool:
+        """Atomically take (or renew) a named lease; return whether `owner` holds it."""
+        now = time.time()
+        connection = self._connection()
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            row = connection.execute(
+                "SELECT value, expires_at FROM cache WHERE namespace = 'lease' AND key = ?",
+                (name,),
+            ).fetchone()
+            if row is None or row[1] < now or json.loads(row[0]) == owner:
+                connection.execute(
+                    "INSERT OR REPLACE INTO cache (namespace, key, value, expires_at)"
+                    " VALUES ('lease', ?, ?, ?)",
+                    (name, json.dumps(owner), now + ttl),
+                )
+                connection.execute("COMMIT")
+                return True
+            connection.execute("COMMIT")
+            return False
+        except sqlite3.Error as e:
+            if connection.in_transaction:
+                connection.execute("ROLLBACK")
+            logger.warning("Could not take lease %s: %s", name, e)
+            return False
+
+    def release_lease(self, name: str, owner: str):
+        """Give up a lease early, if `owner` still holds it."""
+        try:
+            self._connection().execute(
+                "DELETE FROM cache WHERE namespace = 'lease' AND key = ? AND value = ?",
+                (name, json.dumps(owner)),
+            )
+        except sqlite3.Error as e:
+            logger.warning("Could not release lease %s: %s", name, e)
+
+    def purge_expired(self) -> int:
+        """Delete expired entries and return how many were removed."""
+        cursor = self._connection().execute(
+            "DELETE FROM cache WHERE expires_at IS NOT NULL AND expires_at < ?",
+            (time.time(),),
+        )
+        return cursor.rowcount
+
+
+cache_store = SQLiteCacheStore()
+
+
+async def purge_expired_periodically(
+    store: Optional[SQLiteCacheStore] = None, interval: Optional[float] = None
+):
+    """Delete expired entries every `interval` seconds until cancelled.
+
+    Expired entries are never returned, but they stay in the file until
+    purged; the bridge runs this for as long as it serves requests.
+    """
+    store = store or cache_store
+    interval = CACHE_PURGE_INTERVAL if interval is None else interval
+    while True:
+        try:
+            removed = await asyncio.to_thread(store.purge_expired)
+            if removed:
+                logger.info("Purged %d expired cache entries", removed)
+        except sqlite3.Error as e:
+            logger.warning("Cache store purge failed: %s", e)
+        await asyncio.sleep(interval)
@@ -0,0 +1,136 @@
+"""
+Cancelling a request's in-flight work when its client goes away.
+
+A WebSocket handler only notices a closed tab when it next sends, which may
+be after the whole chat completion and TTS synthesis have been paid for.
+RequestScope watches the socket while the handler works: when the client
+disconnects, sends {"type": "cancel"}, or the request's deadline
+(REQUEST_DEADLINE seconds) passes, the running stage is cancelled right
+away. Requests sharing a multiplexed socket pass a `signal` future instead,
+resolved by the session with the reason. Cancellation propagates into the
+upstream calls, which close their HTTP streams and free their scheduler
+slots, and RequestCancelled is raised in the handler.
+
+Cancelled requests are counted by reason and by the stage they were in,
+together with the characters of answer text that were never synthesized.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Awaitable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+REQUEST_DEADLINE = float(os.getenv("REQUEST_DEADLINE", "120"))
+
+REASONS = ("disconnect", "cancel", "deadline")
+
+_counters: Dict[str, int] = {
+    **{reason: 0 for reason in REASONS},
+    "chat": 0,
+    "tts": 0,
+    "tts_chars_saved": 0,
+}
+_counters_lock = threading.Lock()
+
+
+class RequestCancelled(Exception):
+    """Raised in a handler whose request was cancelled."""
+
+    def __init__(self, reason: str, stage: str):
+        super().__init__(f"Request cancelled during {stage}: {reason}")
+        self.reason = reason
+        self.stage = stage
+
+
+def record_cancelled(reason: str, stage: str, tts_chars: int = 0):
+    with _counters_lock:
+        _counters[reason] += 1
+        _counters[stage] = _counters.get(stage, 0) + 1
+        _counters["tts_chars_saved"] += tts_chars
+
+
+def cancellation_metrics() -> Dict[str, int]:
+    """Return how many requests were cancelled, by reason and by stage."""
+    with _counters_lock:
+        return dict(_counters)
+
+
+async def watch_client(websocket) -> str:
+    """Return once the client disconnects or asks to cancel its request."""
+    while True:
+        message = await websocket.receive()
+        if message["type"] == "websocket.disconnect":
+            return "disconnect"
+        try:
+            if json.loads(message.get("text") or "{}").get("type") == "cancel":
+                return "cancel"
+        except (ValueError, AttributeError):
+            pass
+
+
+class RequestScope:
+    """Runs the stages of one WebSocket request until the client leaves."""
+
+    def __init__(
+        self,
+        websocket=None,
+        deadline: float = REQUEST_DEADLINE,
+        label: str = "",
+        signal: Optional[Awaitable[str]] = None,
+    ):
+        self.websocket = websocket
+        self.signal = signal
+        self.deadline = time.monotonic() + deadline
+        self.label = label
+        self._watcher: Optional[asyncio.Task] = None
+
+    async def __aenter__(self):
+        self._watcher = asyncio.ensure_future(
+            self.signal if self.signal is not None else watch_client(self.websocket)
+        )
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self._watcher.cancel()
+        await asyncio.gather(self._watcher, return_exceptions=True)
+
+    def _reason(self) -> str:
+        if not self._watcher.done():
+            return "deadline"
+        if self._watcher.cancelled() or self._watcher.exception() is not None:
+            # The socket failed while being read; the client is gone
+            return "disconnect"
+        return self._watcher.result()
+
+    async def run(self, work: Awaitable[Any], stage: str, tts_chars: int = 0) -> Any:
+        """Await `work`, cancelling it if the client leaves or the deadline passes.
+
+        `tts_chars` is the amount of text the stage would synthesize, counted
+        as saved when it is cancelled.
+        """
+        task = asyncio.ensure_future(work)
+        try:
+            remaining = max(0.0, self.deadline - time.monotonic())
+            done, _ = await asyncio.wait(
+                {task, self._watcher},
+                timeout=remaining,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            if task in done:
+                return task.result()
+
+            reason = self._reason()
+            task.cancel()
+            # Wait for the stage to unwind so upstream streams are closed
+            await asyncio.gather(task, return_exceptions=True)
+            record_cancelled(reason, stage, tts_chars)
+            logger.info("Cancelled %s during %s: %s", self.label, stage, reason)
+            raise RequestCancelled(reason, stage)
+        finally:
+            if not task.done():
+                task.cancel()
@@ -0,0 +1,332 @@
+"""
+Server-side graph layout for visualizations.
+
+Coordinates are computed once per topic content hash and cached (in a bounded
+in-process LRU and in the shared cache store), so clients can render the graph
+directly instead of running a force simulation on every load.
+
+Two layouts are available and chosen from the node types:
+
+- layered: for hierarchies (root/branch/leaf nodes or parent-child edges);
+  nodes are placed in rows by depth and ordered by the position of their
+  parents to reduce crossings.
+- force-directed: Fruchterman-Reingold with NumPy. Repulsion is exact for
+  small graphs; larger graphs use a Barnes-Hut approximation built on a
+  quadtree of nested grids, evaluated level by level with array operations.
+
+NumPy is imported only when a layout has to be computed; cached layouts
+(the common case, e.g. `app.py --topic`) never load it.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import math
+import os
+import threading
+from collections import OrderedDict, deque
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+
+from cache_store import cache_store
+
+if TYPE_CHECKING:
+    import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WIDTH = 800
+DEFAULT_HEIGHT = 600
+MARGIN = 40
+
+HIERARCHICAL_NODE_TYPES = {"root", "branch", "leaf"}
+HIERARCHICAL_EDGE_TYPES = {"parent_child", "parent-child"}
+
+# Graphs with more nodes than this use Barnes-Hut instead of exact repulsion
+EXACT_REPULSION_LIMIT = 1000
+BARNES_HUT_THETA = 0.8
+
+Positions = Dict[str, Dict[str, float]]
+
+# Layouts kept in process memory, least recently used evicted first
+LAYOUT_CACHE_MAX_ENTRIES = int(os.getenv("LAYOUT_CACHE_MAX_ENTRIES", "64"))
+
+_layout_cache: "OrderedDict[str, Positions]" = OrderedDict()
+_layout_cache_lock = threading.Lock()
+
+
+def _cached_layout(fingerprint: str) -> Optional[Positions]:
+    with _layout_cache_lock:
+        positions = _layout_cache.get(fingerprint)
+        if positions is not None:
+            _layout_cache.move_to_end(fingerprint)
+        return positions
+
+
+def _remember_layout(fingerprint: str, positions: Positions):
+    with _layout_cache_lock:
+        _layout_cache[fingerprint] = positions
+        _layout_cache.move_to_end(fingerprint)
+        while len(_layout_cache) > LAYOUT_CACHE_MAX_ENTRIES:
+            _layout_cache.popitem(last=False)
+
+
+def layout_fingerprint(visualization_data, width: int, height: int) -> str:
+    """Hash the parts of the topic data that determine its layout."""
+    payload = json.dumps(
+        [
+            [[node.id, node.type] for node in visualization_data.nodes],
+            [
+                [edge.source, edge.target, edge.type]
+                for edge in visualization_data.edges
+            ],
+            width,
+            height,
+        ]
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _edge_index(visualization_data) -> Tuple[List[str], np.ndarray]:
+    import numpy as np
+
+    ids = [node.id for node in visualization_data.nodes]
+    index = {node_id: i for i, node_id in enumerate(ids)}
+    pairs = [
+        (index[edge.source], index[edge.target])
+        for edge in visualization_data.edges
+        if edge.source in index and edge.target in index and edge.source != edge.target
+    ]
+    return ids, np.array(pairs, dtype=np.int64).reshape(-1, 2)
+
+
+def is_hierarchical(visualization_data) -> bool:
+    return any(
+        node.type in HIERARCHICAL_NODE_TYPES for node in visualization_data.nodes
+    ) or any(edge.type in HIERARCHICAL_EDGE_TYPES for edge in visualization_data.edges)
+
+
+def layered_layout(visualization_data, width: int, height: int) -> np.ndarray:
+    """Place nodes in rows by their depth from the roots of the hierarchy."""
+    import numpy as np
+
+    ids, edges = _edge_index(visualization_data)
+    n = len(ids)
+    children: List[List[int]] = [[] for _ in range(n)]
+    has_parent = np.zeros(n, dtype=bool)
+    for source, target in edges:
+        children[source].append(target)
+        has_parent[target] = True
+
+    roots = [
+        i for i, node in enumerate(visualization_data.nodes) if node.type == "root"
+    ]
+    roots = roots or [i for i in range(n) if not has_parent[i]] or [0]
+    depth = np.full(n, -1)
+    queue = deque()
+    for root in roots:
+        depth[root] = 0
+        queue.append(root)
+    while queue:
+        current = queue.popleft()
+        for child in children[current]:
+            if depth[child] < 0:
+                depth[child] = depth[current] + 1
+                queue.append(child)
+    # Nodes unreachable from a root go to a final row
+    depth[depth < 0] = depth.max() + 1
+
+    # Order each row by the mean position of the parents (barycenter heuristic)
+    order = np.zeros(n)
+    parents: List[List[int]] = [[] for _ in range(n)]
+    for source, target in edges:
+        parents[target].append(source)
+    rows = int(depth.max()) + 1
+    for row in range(rows):
+        members = np.flatnonzero(depth == row)
+        keys = [
+            np.mean([order[p] for p in parents[i]]) if parents[i] else float(i)
+            for i in members
+        ]
+        for rank, member in enumerate(members[np.argsort(keys, kind="stable")]):
+            order[member] = rank
+
+    positions = np.zeros((n, 2))
+    for row in range(rows):
+        members = np.flatnonzero(depth == row)
+        slots = len(members) + 1
+        positions[members, 0] = (
+            MARGIN + (order[members] + 1) * (width - 2 * MARGIN) / slots
+        )
+        positions[members, 1] = MARGIN + (row + 0.5) * (height - 2 * MARGIN) / rows
+    return positions
+
+
+def _exact_repulsion(positions: np.ndarray, k: float) -> np.ndarray:
+    import numpy as np
+
+    delta = positions[:, None, :] - positions[None, :, :]
+    distance_sq = np.maximum((delta**2).sum(axis=2), 1e-4)
+    np.fill_diagonal(distance_sq, np.inf)
+    return (k * k * delta / distance_sq[:, :, None]).sum(axis=1)
+
+
+def _barnes_hut_repulsion(positions: np.ndarray, k: float, theta: float) -> np.ndarray:
+    """Approximate all-pairs repulsion with a quadtree of nested grids.
+
+    Level l of the tree is a 2^l x 2^l grid over the bounding square. Every
+    (node, cell) pair is either accepted (cell far enough: size / distance <
+    theta, and the node is not inside it), expanded into the cell's non-empty
+    children, or, at the deepest level, evaluated against the cell's center
+    of mass excluding the node itself.
+    """
+    import numpy as np
+
+    n = len(positions)
+    depth = max(2, min(12, math.ceil(math.log(n, 4)) + 2))
+    origin = positions.min(axis=0)
+    size = max(float((positions.max(axis=0) - origin).max()), 1e-6) * (1 + 1e-9)
+
+    masses, centers, cells = [], [], []
+    for level in range(depth + 1):
+        grid = 1 << level
+        coords = np.minimum(
+            ((positions - origin) / size * grid).astype(np.int64), grid - 1
+        )
+        cell = coords[:, 1] * grid + coords[:, 0]
+        mass = np.bincount(cell, minlength=grid * grid).astype(float)
+        center = np.zeros((grid * grid, 2))
+        for axis in range(2):
+            center[:, axis] = np.bincount(
+                cell, weights=positions[:, axis], minlength=grid * grid
+            )
+        nonempty = mass > 0
+        center[nonempty] /= mass[nonempty, None]
+        masses.append(mass)
+        centers.append(center)
+        cells.append(cell)
+
+    force = np.zeros_like(positions)
+    node_idx = np.arange(n)
+    cell_idx = np.zeros(n, dtype=np.int64)
+    for level in range(depth + 1):
+        grid = 1 << level
+        mass = masses[level][cell_idx]
+        center = centers[level][cell_idx]
+        own = cells[level][node_idx] == cell_idx
+
+        if level == depth:
+            # Leaf cells: remove the node itself from its own cell's mass
+            center = np.where(
+                own[:, None] & (mass[:, None] > 1),
+                (center * mass[:, None] - positions[node_idx])
+                / np.maximum(mass - 1, 1)[:, None],
+                center,
+            )
+            mass = np.where(own, mass - 1, mass)
+            accept = mass > 0
+        else:
+            delta = positions[node_idx] - center
+            distance = np.sqrt((delta**2).sum(axis=1))
+            accept = ~own & (size / grid < theta * np.maximum(distance, 1e-9))
+
+        delta = positions[node_idx[accept]] - center[accept]
+        distance_sq = np.maximum((delta**2).sum(axis=1), 1e-4)
+        contribution = k * k * mass[accept, None] * delta / distance_sq[:, None]
+        np.add.at(force, node_idx[accept], contribution)
+
+        if level == depth:
+            break
+        # Expand the remaining pairs into the non-empty child cells
+        expand_nodes = node_idx[~accept]
+        expand_cells = cell_idx[~accept]
+        cx, cy = expand_cells % grid, expand_cells // grid
+        child_nodes, child_cells = [], []
+        for dy in (0, 1):
+            for dx in (0, 1):
+                child = (2 * cy + dy) * (2 * grid) + (2 * cx + dx)
+                keep = masses[level + 1][child] > 0
+                child_nodes.append(expand_nodes[keep])
+                child_cells.append(child[keep])
+        node_idx = np.concatenate(child_nodes)
+        cell_idx = np.concatenate(child_cells)
+    return force
+
+
+def force_directed_layout(
+    visualization_data, width: int, height: int, iterations: int = None, seed: int = 0
+) -> np.ndarray:
+    """Fruchterman-Reingold layout scaled into the given canvas."""
+    import numpy as np
+
+    ids, edges = _edge_index(visualization_data)
+    n = len(ids)
+    if n == 1:
+        return np.array([[width / 2, height / 2]])
+
+    rng = np.random.default_rng(seed)
+    positions = rng.uniform(-1, 1, size=(n, 2)) * math.sqrt(n)
+    k = 1.0
+    iterations = iterations or (100 if n <= EXACT_REPULSION_LIMIT else 50)
+    temperature = math.sqrt(n)
+    cooling = temperature / (iterations + 1)
+
+    for _ in range(iterations):
+        if n <= EXACT_REPULSION_LIMIT:
+            displacement = _exact_repulsion(positions, k)
+        else:
+            displacement = _barnes_hut_repulsion(positions, k, BARNES_HUT_THETA)
+        if len(edges):
+            delta = positions[edges[:, 0]] - positions[edges[:, 1]]
+            distance = np.maximum(np.sqrt((delta**2).sum(axis=1)), 1e-4)
+            pull = delta * (distance / k)[:, None]
+            np.add.at(displacement, edges[:, 0], -pull)
+            np.add.at(displacement, edges[:, 1], pull)
+        length = np.maximum(np.sqrt((displacement**2).sum(axis=1)), 1e-9)
+        positions += (
+            displacement / length[:, None] * np.minimum(length, temperature)[:, None]
+        )
+        temperature -= cooling
+
+    # Scale into the canvas, keeping the aspect ratio of the layout
+    low, high = positions.min(axis=0), positions.max(axis=0)
+    span = np.maximum(high - low, 1e-9)
+    scale = min((width - 2 * MARGIN) / span[0], (height - 2 * MARGIN) / span[1])
+    offset = np.array([width, height]) / 2 - (low + high) / 2 * scale
+    return positions * scale + offset
+
+
+def compute_layout(
+    visualization_data, width: int = DEFAULT_WIDTH, height: int = DEFAULT_HEIGHT
+) -> Positions:
+    """Return cached node coordinates for a visualization, computing them if needed."""
+    if not visualization_data.nodes:
+        return {}
+
+    fingerprint = layout_fingerprint(visualization_data, width, height)
+    positions = _cached_layout(fingerprint)
+    if positions is None:
+        positions = cache_store.get("layout", fingerprint)
+    if positions is None:
+        hierarchical = is_hierarchical(visualization_data)
+        if hierarchical:
+            coordinates = layered_layout(visualization_data, width, height)
+        else:
+            seed = int(fingerprint[:8], 16)
+            coordinates = force_directed_layout(
+                visualization_data, width, height, seed=seed
+            )
+        positions = {
+            node.id: {"x": round(float(x), 1), "y": round(float(y), 1)}
+            for node, (x, y) in zip(visualization_data.nodes, coordinates)
+        }
+        cache_store.set("layout", fingerprint, positions)
+        logger.info(
+            "Computed layout for %s (%d nodes, %s)",
+            visualization_data.topic,
+            len(positions),
+            "layered" if hierarchical else "force-directed",
+        )
+    _remember_layout(fingerprint, positions)
+    return positions
@@ -0,0 +1,485 @@
+"""
+Compact in-memory store of topic graphs.
+
+Topics used to be rebuilt as lists of pydantic VisualizationNode and
+VisualizationEdge models for every doubt and stream request. Every model
+carried its own copy of repeated strings such as "entity" or
+"parent_child", and finding a node's neighbors meant scanning every edge.
+A TopicGraph keeps a topic as flat tables instead:
+
+- node ids (interned, and shared with the id index) and names in lists; node
+  and edge types as small integers into a per-graph string table;
+- edge endpoints as integer node indexes in arrays;
+- adjacency in compressed sparse row form (an offsets array and one array of
+  neighbors with the matching edge index), so neighborhood and highlight
+  lookups cost O(degree) instead of O(edges);
+- attributes and edge descriptions only for the rows that have them.
+
+Pydantic models are built only at the API boundary, from `export()`.
+`nodes` and `edges` are sequences of lightweight row views, so code written
+for VisualizationData (the layout, the prompt prefix) reads a graph as is.
+Edges whose endpoints are not nodes of the topic are dropped when a graph is
+built. Every consumer already skipped them.
+
+Graphs are built once per topic and process, and kept in an LRU of
+GRAPH_STORE_MAX_TOPICS topics.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import sys
+import threading
+from array import array
+from collections import OrderedDict, deque
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+GRAPH_STORE_MAX_TOPICS = int(os.getenv("GRAPH_STORE_MAX_TOPICS", "32"))
+
+NO_STRING = -1
+
+_WORD_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+class StringTable:
+    """Distinct strings of a graph, each stored once and referred to by index."""
+
+    __slots__ = ("strings", "_index")
+
+    def __init__(self):
+        self.strings: List[str] = []
+        self._index: Dict[str, int] = {}
+
+    def intern(self, value: Optional[str]) -> int:
+        if value is None:
+            return NO_STRING
+        index = self._index.get(value)
+        if index is None:
+            index = self._index[value] = len(self.strings)
+            self.strings.append(sys.intern(value))
+        return index
+
+    def get(self, index: int) -> Optional[str]:
+        return None if index == NO_STRING else self.strings[index]
+
+    def __len__(self) -> int:
+        return len(self.strings)
+
+
+class NodeView:
+    """Read-only view of one node row, with the fields of VisualizationNode."""
+
+    __slots__ = ("graph", "index")
+
+    def __init__(self, graph: "TopicGraph", index: int):
+        self.graph = graph
+        self.index = index
+
+    @property
+    def id(self) -> str:
+        return self.graph.ids[self.index]
+
+    @property
+    def name(self) -> str:
+        return self.graph.names[self.index]
+
+    @property
+    def type(self) -> Optional[str]:
+        return self.graph.node_type(self.index)
+
+    @property
+    def attributes(self) -> Optional[List[dict]]:
+        return self.graph.attributes.get(self.index)
+
+
+class EdgeView:
+    """Read-only view of one edge row, with the fields of VisualizationEdge."""
+
+    __slots__ = ("graph", "index")
+
+    def __init__(self, graph: "TopicGraph", index: int):
+        self.graph = graph
+        self.index = index
+
+    @property
+    def source(self) -> str:
+        return self.graph.ids[self.graph.sources[self.index]]
+
+    @property
+    def target(self) -> str:
+        return self.graph.ids[self.graph.targets[self.index]]
+
+    @property
+    def type(self) -> str:
+        return self.graph.edge_type(self.index)
+
+    @property
+    def description(self) -> Optional[str]:
+        return self.graph.descriptions.get(self.index)
+
+
+class _Rows:
+    """Sequence of row views over a table of a graph."""
+
+    __slots__ = ("graph", "view", "count")
+
+    def __init__(self, graph: "TopicGraph", view, count: int):
+        self.graph = graph
+        self.view = view
+        self.count = count
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __getitem__(self, index: int):
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError(index)
+        return self.view(self.graph, index)
+
+    def __iter__(self):
+        for index in range(self.count):
+            yield self.view(self.graph, index)
+
+
+def _field(item: Any, name: str) -> Any:
+    return item.get(name) if isinstance(item, dict) else getattr(item, name, None)
+
+
+class TopicGraph:
+    """A topic's nodes and edges as interned, array-backed tables with adjacency."""
+
+    __slots__ = (
+        "topic",
+        "narration",
+        "narration_timestamps",
+        "positions",
+        "_fingerprint",
+        "types",
+        "ids",
+        "names",
+        "node_types",
+        "attributes",
+        "index",
+        "sources",
+        "targets",
+        "edge_types",
+        "descriptions",
+        "adjacency_offsets",
+        "adjacency",
+        "incident",
+        "dropped_edges",
+        "__weakref__",
+    )
+
+    def __init__(
+        self,
+        topic: str,
+        nodes: Iterable[Any],
+        edges: Iterable[Any],
+        narration: Optional[str] = None,
+        narration_timestamps: Optional[List[dict]] = None,
+        positions: Optional[Dict[str, Dict[str, float]]] = None,
+    ):
+        """Build the tables from node and edge models or dicts."""
+        self.topic = topic
+        self.narration = narration
+        self.narration_timestamps = narration_timestamps
+        self.positions = positions
+        self.types = StringTable()
+        self.ids: List[str] = []
+        self.names: List[str] = []
+        self.node_types = array("i")
+        self.attributes: Dict[int, List[dict]] = {}
+        self.index: Dict[str, int] = {}
+        for node in nodes:
+            node_id = sys.intern(_field(node, "id"))
+            if node_id in self.index:
+                raise ValueError(f"Duplicate node id {node_id!r} in topic {topic}")
+            self.index[node_id] = len(self.ids)
+            if _field(node, "attributes") is not None:
+                self.attributes[len(self.ids)] = _field(node, "attributes")
+            self.ids.append(node_id)
+            self.names.append(_field(node, "name"))
+            self.node_types.append(self.types.intern(_field(node, "type")))
+
+        self.sources = array("i")
+        self.targets = array("i")
+        self.edge_types = array("i")
+        self.descriptions: Dict[int, str] = {}
+        self.dropped_edges = 0
+        for edge in edges:
+            source = self.index.get(_field(edge, "source"))
+            target = self.index.get(_field(edge, "target"))
+            if source is None or target is None:
+                self.dropped_edges += 1
+                continue
+            if _field(edge, "description") is not None:
+                self.descriptions[len(self.sources)] = _field(edge, "description")
+            self.sources.append(source)
+            self.targets.append(target)
+            self.edge_types.append(self.types.intern(_field(edge, "type")))
+        if self.dropped_edges:
+            logger.warning(
+                "Dropped %d edges with unknown endpoints from topic %s",
+                self.dropped_edges,
+                topic,
+            )
+        self._build_adjacency()
+        self._fingerprint: Optional[str] = None
+
+    @classmethod
+    def from_data(cls, visualization_data) -> "TopicGraph":
+        """Build a graph from a VisualizationData."""
+        return cls(
+            visualization_data.topic,
+            visualization_data.nodes,
+            visualization_data.edges,
+            narration=visualization_data.narration,
+            narration_timestamps=[
+                timing.model_dump()
+                for timing in visualization_data.narration_timestamps or []
+            ]
+            or None,
+            positions=visualization_data.positions,
+        )
+
+    def _build_adjacency(self):
+        # Both directions of every edge, grouped by node (compressed sparse rows)
+        counts = [0] * (len(self.ids) + 1)
+        for source, target in zip(self.sources, self.targets):
+            counts[source + 1] += 1
+            counts[target + 1] += 1
+        for i in range(len(self.ids)):
+            counts[i + 1] += counts[i]
+        self.adjacency_offsets = array("i", counts)
+        fill = counts[:-1]
+        self.adjacency = array("i", bytes(4 * 2 * len(self.sources)))
+        self.incident = array("i", bytes(4 * 2 * len(self.sources)))
+        for edge, (source, target) in enumerate(zip(self.sources, self.targets)):
+            for node, neighbor in ((source, target), (target, source)):
+                self.adjacency[fill[node]] = neighbor
+                self.incident[fill[node]] = edge
+                fill[node] += 1
+
+    @property
+    def fingerprint(self) -> str:
+        """Stable hash of the topic data, computed on first use."""
+        if self._fingerprint is None:
+            payload = json.dumps(self.export())
+            self._fingerprint = hashlib.sha256(payload.encode("utf-8")).hexdigest()
+        return self._fingerprint
+
+    @property
+    def node_count(self) -> int:
+        return len(self.ids)
+
+    @property
+    def edge_count(self) -> int:
+        return len(self.sources)
+
+    @property
+    def nodes(self) -> _Rows:
+        return _Rows(self, NodeView, len(self.ids))
+
+    @property
+    def edges(self) -> _Rows:
+        return _Rows(self, EdgeView, len(self.sources))
+
+    def index_of(self, node_id: str) -> Optional[int]:
+        return self.index.get(node_id)
+
+    def node_type(self, node: int) -> Optional[str]:
+        return self.types.get(self.node_types[node])
+
+    def edge_type(self, edge: int) -> str:
+        return self.types.get(self.edge_types[edge])
+
+    def degree(self, node: int) -> int:
+        return self.adjacency_offsets[node + 1] - self.adjacency_offsets[node]
+
+    def neighbors(self, node: int) -> array:
+        """Indexes of the nodes adjacent to a node (once per connecting edge)."""
+        start, end = self.adjacency_offsets[node], self.adjacency_offsets[node + 1]
+        return self.adjacency[start:end]
+
+    def incident_edges(self, node: int) -> array:
+        """Indexes of the edges that touch a node."""
+        start, end = self.adjacency_offsets[node], self.adjacency_offsets[node + 1]
+        return self.incident[start:end]
+
+    def k_hop(self, seeds: Iterable[str], hops: int) -> Dict[int, int]:
+        """Return the distance of every node within `hops` edges of the seed nodes."""
+        distances = {self.index[seed]: 0 for seed in seeds if seed in self.index}
+        queue = deque(distances)
+        while queue:
+            current = queue.popleft()
+            if distances[current] >= hops:
+                continue
+            for neighbor in self.neighbors(current):
+                if neighbor not in distances:
+                    distances[neighbor] = distances[current] + 1
+                    queue.append(neighbor)
+        return distances
+
+    def edges_among(self, nodes: Iterable[int]) -> List[int]:
+        """Indexes of the edges between the given nodes, in graph order."""
+        members = set(nodes)
+        found = set()
+        for node in members:
+            for edge in self.incident_edges(node):
+                if self.sources[edge] in members and self.targets[edge] in members:
+                    found.add(edge)
+        return sorted(found)
+
+    def mentioned_nodes(self, text: str) -> List[int]:
+        """Indexes of the nodes named in a text, in order of first mention.
+
+        Names match as whole words, case-insensitively and also in the plural;
+        names shorter than three characters are ignored.
+        """
+        words = " " + " ".join(_WORD_PATTERN.findall(text.lower())) + " "
+        found = []
+        for node, name in enumerate(self.names):
+            phrase = " ".join(_WORD_PATTERN.findall(name.lower()))
+            if len(phrase) < 3:
+                continue
+            positions = [
+                position
+                for position in (words.find(f" {phrase} "), words.find(f" {phrase}s "))
+                if position >= 0
+            ]
+            if positions:
+                found.append((min(positions), node))
+        return [node for _, node in sorted(found)]
+
+    def node_record(self, node: int) -> Dict[str, Any]:
+        """The node as a dict without unset fields, as VisualizationNode serializes it."""
+        record: Dict[str, Any] = {"id": self.ids[node], "name": self.names[node]}
+        if self.node_types[node] != NO_STRING:
+            record["type"] = self.node_type(node)
+        if node in self.attributes:
+            record["attributes"] = self.attributes[node]
+        return record
+
+    def edge_record(self, edge: int) -> Dict[str, Any]:
+        """The edge as a dict without unset fields, as VisualizationEdge serializes it."""
+        record = {
+            "source": self.ids[self.sources[edge]],
+            "target": self.ids[self.targets[edge]],
+            "type": self.edge_type(edge),
+        }
+        if edge in self.descriptions:
+            record["description"] = self.descriptions[edge]
+        return record
+
+    def export(self) -> Dict[str, Any]:
+        """The topic as plain data, to validate into VisualizationData at the API boundary."""
+        return {
+            "nodes": [self.node_record(node) for node in range(len(self.ids))],
+            "edges": [self.edge_record(edge) for edge in range(len(self.sources))],
+            "topic": self.topic,
+            "narration": self.narration,
+            "narration_timestamps": self.narration_timestamps,
+            "positions": self.positions,
+        }
+
+    def memory_bytes(self) -> int:
+        """Approximate memory held by the graph's tables."""
+        size = sum(
+            sys.getsizeof(table)
+            for table in (
+                self.ids,
+                self.names,
+                self.node_types,
+                self.index,
+                self.sources,
+                self.targets,
+                self.edge_types,
+                self.adjacency_offsets,
+                self.adjacency,
+                self.incident,
+            )
+        )
+        # Ids are shared with the index; names and types are counted once
+        size += sum(sys.getsizeof(text) for text in self.ids)
+        size += sum(sys.getsizeof(text) for text in self.names)
+        size += sum(sys.getsizeof(text) for text in self.types.strings)
+        return size
+
+
+def as_graph(visualization_data) -> TopicGraph:
+    """Return a TopicGraph for a VisualizationData (or the graph itself)."""
+    if isinstance(visualization_data, TopicGraph):
+        return visualization_data
+    return TopicGraph.from_data(visualization_data)
+
+
+class GraphStore:
+    """Process-wide LRU of topic graphs, built on first use."""
+
+    def __init__(self, max_topics: int = GRAPH_STORE_MAX_TOPICS):
+        self.max_topics = max_topics
+        self._graphs: "OrderedDict[str, TopicGraph]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "builds": 0, "evictions": 0}
+
+    def get(self, topic: str, build: Callable[[], TopicGraph]) -> TopicGraph:
+        """Return the graph of a topic, building it with `build` if needed."""
+        with self._lock:
+            graph = self._graphs.get(topic)
+            if graph is not None:
+                self._graphs.move_to_end(topic)
+                self._counters["hits"] += 1
+                return graph
+
+        # Built outside the lock; a concurrent build of the same topic is harmless
+        graph = build()
+        with self._lock:
+            self._graphs[topic] = graph
+            self._graphs.move_to_end(topic)
+            self._counters["builds"] += 1
+            while len(self._graphs) > self.max_topics:
+                self._graphs.popitem(last=False)
+                self._counters["evictions"] += 1
+        logger.info(
+            "Stored graph of %s: %d nodes, %d edges, ~%d KB",
+            topic,
+            graph.node_count,
+            graph.edge_count,
+            graph.memory_bytes() // 1024,
+        )
+        return graph
+
+    def invalidate(self, topic: Optional[str] = None):
+        """Drop the graph of one topic, or of all topics."""
+        with self._lock:
+            if topic is None:
+                self._graphs.clear()
+            else:
+                self._graphs.pop(topic, None)
+
+    def metrics(self) -> Dict[str, int]:
+        with self._lock:
+            graphs = list(self._graphs.values())
+            counters = dict(self._counters)
+        return {
+            **counters,
+            "topics": len(graphs),
+            "nodes": sum(graph.node_count for graph in graphs),
+            "edges": sum(graph.edge_count for graph in graphs),
+            "memory_bytes": sum(graph.memory_bytes() for graph in graphs),
+        }
+
+
+graph_store = GraphStore()
+
+
+def graph_store_metrics() -> Dict[str, int]:
+    """Return how many topic graphs are stored, their size and the hit counters."""
+    return graph_store.metrics()
@@ -0,0 +1,264 @@
+"""
+Streaming delivery of large visualization graphs.
+
+Instead of serializing a whole VisualizationData into one JSON document, the
+graph is sent as NDJSON records so clients can start rendering after the
+first batch:
+
+    {"type": "header", "topic": ..., "nodes": N, "edges": M, ...}
+    {"type": "nodes", "batch": 0, "items": [...]}
+    {"type": "edges", "batch": 0, "items": [...]}
+    ...
+    {"type": "narration", "narration": ..., "narration_timestamps": [...]}
+    {"type": "end", "nodes_sent": N, "edges_sent": M}
+
+Every edge is sent in the first edges record after both of its endpoints,
+so a client never sees a dangling edge. The graph can be limited to a
+viewport (a rectangle in layout coordinates) and/or to the neighborhood of
+focus nodes; with focus nodes the nearest nodes are sent first.
+
+The module also generates synthetic curriculum graphs of any size for
+benchmarking:
+
+    python graph_stream.py --nodes 10000 [--batch-size 500] [--focus course_0]
+"""
+
+import argparse
+import json
+import time
+import tracemalloc
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from graph_layout import Positions, compute_layout
+from graph_store import as_graph
+
+DEFAULT_BATCH_SIZE = 500
+
+Viewport = Tuple[float, float, float, float]
+
+
+def parse_viewport(value: Optional[str]) -> Optional[Viewport]:
+    """Parse "x0,y0,x1,y1" into a viewport rectangle."""
+    if not value:
+        return None
+    x0, y0, x1, y1 = (float(part) for part in value.split(","))
+    return min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1)
+
+
+def select_nodes(
+    visualization_data,
+    viewport: Optional[Viewport] = None,
+    focus: Optional[Sequence[str]] = None,
+    hops: int = 1,
+    positions: Optional[Positions] = None,
+) -> List[int]:
+    """Return the indices of the nodes to send, nearest to the focus nodes first."""
+    graph = as_graph(visualization_data)
+    selected = list(range(graph.node_count))
+
+    if focus:
+        distances = graph.k_hop(focus, hops)
+        selected = sorted(distances, key=distances.get)
+
+    if viewport is not None:
+        x0, y0, x1, y1 = viewport
+        inside = [
+            (x0 <= p["x"] <= x1 and y0 <= p["y"] <= y1) if p else False
+            for p in (positions.get(node_id) for node_id in graph.ids)
+        ]
+        selected = [i for i in selected if inside[i]]
+    return selected
+
+
+def iter_graph_records(
+    visualization_data,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    viewport: Optional[Viewport] = None,
+    focus: Optional[Sequence[str]] = None,
+    hops: int = 1,
+) -> Iterator[Dict[str, Any]]:
+    """Yield the stream records of a visualization, batch by batch."""
+    batch_size = max(1, batch_size)
+    graph = as_graph(visualization_data)
+    positions = graph.positions
+    if viewport is not None and not positions:
+        positions = compute_layout(graph)
+
+    selected = select_nodes(graph, viewport, focus, hops, positions)
+    # Batch of every node index, -1 for nodes that are not sent
+    batch_of = [-1] * graph.node_count
+    for rank, i in enumerate(selected):
+        batch_of[i] = rank // batch_size
+
+    # Bucket each edge under the batch that completes it
+    edge_batches: Dict[int, List[int]] = {}
+    for edge, (source, target) in enumerate(zip(graph.sources, graph.targets)):
+        if batch_of[source] >= 0 and batch_of[target] >= 0:
+            last = max(batch_of[source], batch_of[target])
+            edge_batches.setdefault(last, []).append(edge)
+    total_edges = sum(len(edges) for edges in edge_batches.values())
+
+    yield {
+        "type": "header",
+        "topic": graph.topic,
+        "nodes": len(selected),
+        "edges": total_edges,
+        "total_nodes": graph.node_count,
+        "total_edges": graph.edge_count,
+        "batch_size": batch_size,
+        "has_positions": bool(positions),
+    }
+
+    for batch, start in enumerate(range(0, len(selected), batch_size)):
+        items = []
+        end = start + batch_size
+        for i in selected[start:end]:
+            item = graph.node_record(i)
+            if positions and item["id"] in positions:
+                item["position"] = positions[item["id"]]
+            items.append(item)
+        yield {"type": "nodes", "batch": batch, "items": items}
+        if batch in edge_batches:
+            yield {
+                "type": "edges",
+                "batch": batch,
+                "items": [graph.edge_record(edge) for edge in edge_batches[batch]],
+            }
+
+    if graph.narration:
+        yield {
+            "type": "narration",
+            "narration": graph.narration,
+            "narration_timestamps": graph.narration_timestamps or [],
+        }
+    yield {"type": "end", "nodes_sent": len(selected), "edges_sent": total_edges}
+
+
+def iter_ndjson(visualization_data, **options) -> Iterator[str]:
+    """Yield the stream records as NDJSON lines."""
+    for record in iter_graph_records(visualization_data, **options):
+        yield json.dumps(record) + "\n"
+
+
+def generate_synthetic_graph(
+    num_nodes: int, cross_links: float = 0.5, seed: int = 0
+) -> Tuple[List[dict], List[dict]]:
+    """Generate a curriculum-shaped graph with `num_nodes` nodes.
+
+    One root (the curriculum), about one course per hundred nodes, and the
+    remaining nodes as concepts under a random course, plus `cross_links`
+    prerequisite edges per concept between concepts of the same course.
+    """
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    num_nodes = max(1, num_nodes)
+    num_courses = min(max(1, num_nodes // 100), num_nodes - 1)
+    num_concepts = num_nodes - 1 - num_courses
+
+    nodes = [{"id": "curriculum", "name": "Curriculum", "type": "root"}]
+    nodes += [
+        {"id": f"course_{i}", "name": f"Course {i}", "type": "branch"}
+        for i in range(num_courses)
+    ]
+    nodes += [
+        {"id": f"concept_{i}", "name": f"Concept {i}", "type": "leaf"}
+        for i in range(num_concepts)
+    ]
+
+    edges = [
+        {"source": "curriculum", "target": f"course_{i}", "type": "parent_child"}
+        for i in range(num_courses)
+    ]
+    course_of = rng.integers(0, max(1, num_courses), size=num_concepts)
+    edges += [
+        {"source": f"course_{course}", "target": f"concept_{i}", "type": "parent_child"}
+        for i, course in enumerate(course_of)
+    ]
+
+    # Prerequisites link concepts of the same course
+    if num_concepts > 1:
+        order = np.argsort(course_of, kind="stable")
+        sources = rng.integers(0, num_concepts, size=int(num_concepts * cross_links))
+        position = np.empty(num_concepts, dtype=np.int64)
+        position[order] = np.arange(num_concepts)
+        targets = order[np.minimum(position[sources] + 1, num_concepts - 1)]
+        same_course = (course_of[sources] == course_of[targets]) & (sources != targets)
+        edges += [
+            {"source": f"concept_{s}", "target": f"concept_{t}", "type": "prerequisite"}
+            for s, t in zip(sources[same_course], targets[same_course])
+        ]
+    return nodes, edges
+
+
+def benchmark(visualization_data, **options) -> Dict[str, Any]:
+    """Compare one-shot serialization with streaming for time and peak memory."""
+    tracemalloc.start()
+    started = time.perf_counter()
+    blob = visualization_data.model_dump_json()
+    monolithic = {
+        "seconds": round(time.perf_counter() - started, 4),
+        "bytes": len(blob),
+        "peak_memory_bytes": tracemalloc.get_traced_memory()[1],
+    }
+    del blob
+    tracemalloc.reset_peak()
+
+    started = time.perf_counter()
+    first_batch = None
+    streamed_bytes = 0
+    records = 0
+    for line in iter_ndjson(visualization_data, **options):
+        records += 1
+        streamed_bytes += len(line)
+        if first_batch is None and line.startswith('{"type": "nodes"'):
+            first_batch = time.perf_counter() - started
+    streaming = {
+        "seconds": round(time.perf_counter() - started, 4),
+        "first_batch_seconds": round(first_batch or 0.0, 4),
+        "bytes": streamed_bytes,
+        "records": records,
+        "peak_memory_bytes": tracemalloc.get_traced_memory()[1],
+    }
+    tracemalloc.stop()
+    return {
+        "nodes": len(visualization_data.nodes),
+        "edges": len(visualization_data.edges),
+        "monolithic": monolithic,
+        "streaming": streaming,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark streaming of large graphs")
+    parser.add_argument("--nodes", type=int, default=10000, help="Synthetic graph size")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument(
+        "--focus", type=str, default="", help="Comma-separated node ids"
+    )
+    parser.add_argument("--hops", type=int, default=1)
+    parser.add_argument("--viewport", type=str, default="", help="x0,y0,x1,y1")
+    args = parser.parse_args()
+
+    from app import VisualizationData
+
+    # Built directly, so benchmarks are not limited by MAX_SYNTHETIC_NODES
+    started = time.perf_counter()
+    nodes, edges = generate_synthetic_graph(args.nodes)
+    visualization_data = VisualizationData(
+        nodes=nodes, edges=edges, topic=f"synthetic_{args.nodes}"
+    )
+    generated = time.perf_counter() - started
+    result = benchmark(
+        visualization_data,
+        batch_size=args.batch_size,
+        viewport=parse_viewport(args.viewport),
+        focus=[node_id for node_id in args.focus.split(",") if node_id] or None,
+        hops=args.hops,
+    )
+    result["generate_seconds"] = round(generated, 4)
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
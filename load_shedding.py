@@ -0,0 +1,208 @@
+"""
+Degraded answers for doubts while the chat API is overloaded.
+
+When the chat scheduler's queue is deeper than SHED_QUEUE_DEPTH, recent chat
+latency (p95) is above SHED_LATENCY_P95 seconds, or the chat circuit is
+open, doubts are answered from a fast path instead of waiting on upstream:
+
+1. the topic FAQ: questions shipped in `static/data/<topic>_faq.json` plus
+   answers learned from earlier doubts, when the doubt asks the same
+   question (same normalized text or nearly identical wording);
+2. the sentences of the topic's narration script about the highlighted
+   nodes (or most similar to the doubt);
+3. a short notice asking the student to try again.
+
+Degraded answers are marked as such, so clients can offer to re-ask later.
+"""
+
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from pydantic import BaseModel
+
+from cache_store import cache_store, normalize_doubt
+from openai_scheduler import OutboundScheduler, chat_scheduler
+from prompt_context import similarity_scores, tokenize
+from resilience import ResilientCaller, chat_calls
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = Path(__file__).parent / "static" / "data"
+
+SHED_QUEUE_DEPTH = int(os.getenv("SHED_QUEUE_DEPTH", "20"))
+SHED_LATENCY_P95 = float(os.getenv("SHED_LATENCY_P95", "8.0"))
+# Questions that differ in one key term ("foreign" vs "primary key") still
+# share most words, so only near-identical wording may reuse an answer
+FAQ_MATCH_THRESHOLD = float(os.getenv("FAQ_MATCH_THRESHOLD", "0.9"))
+# Learned FAQ entries kept per topic
+FAQ_MAX_ENTRIES = int(os.getenv("FAQ_MAX_ENTRIES", "200"))
+SCRIPT_SEGMENT_SENTENCES = 3
+
+BUSY_NOTICE = (
+    "I'm answering a lot of questions right now, so I can't give you a full "
+    "answer yet. Please ask again in a moment."
+)
+
+_SENTENCE_PATTERN = re.compile(r"(?<=[.!?])\s+")
+
+_counters: Dict[str, int] = {"faq": 0, "script": 0, "notice": 0}
+_counters_lock = threading.Lock()
+
+
+class DegradedAnswer(BaseModel):
+    """An answer produced without calling the chat API."""
+
+    narration: str
+    highlights: List[str] = []
+    source: str
+    reason: str
+
+
+def shed_reason(
+    scheduler: OutboundScheduler = chat_scheduler, caller: ResilientCaller = chat_calls
+) -> Optional[str]:
+    """Return why doubts should take the fast path now, or None if upstream is healthy."""
+    if caller.breaker.state == "open":
+        return "upstream unavailable"
+    depth = scheduler.queue_depth()
+    if depth > SHED_QUEUE_DEPTH:
+        return f"queue depth {depth}"
+    p95 = caller.latency_quantile(0.95)
+    if p95 is not None and p95 > SHED_LATENCY_P95:
+        return f"latency p95 {p95:.1f}s"
+    return None
+
+
+def load_faq(topic: str, data_dir: Path = DATA_DIR) -> List[dict]:
+    """Return the shipped and learned FAQ entries of a topic."""
+    entries = []
+    path = Path(data_dir) / f"{topic}_faq.json"
+    if path.exists():
+        try:
+            entries.extend(json.loads(path.read_text()))
+        except (OSError, json.JSONDecodeError) as e:
+            logger.warning("Skipping unreadable FAQ %s: %s", path.name, e)
+    entries.extend(cache_store.get("faq", topic) or [])
+    return entries
+
+
+def remember_answer(topic: str, doubt: str, narration: str, highlights: List[str]):
+    """Add a full answer to the topic's learned FAQ for later degraded answers."""
+    if not narration or not doubt.strip():
+        return
+    question = normalize_doubt(doubt)
+
+    def add(entries: Optional[List[dict]]) -> List[dict]:
+        entries = [e for e in entries or [] if e["question"] != question]
+        entries.append(
+            {"question": question, "answer": narration, "highlights": highlights}
+        )
+        return entries[-FAQ_MAX_ENTRIES:]
+
+    # Workers answer doubts on the same topic concurrently; the FAQ is read and
+    # rewritten in one transaction so their entries do not overwrite each other
+    try:
+        cache_store.update("faq", topic, add)
+    except sqlite3.Error:
+        pass  # Already logged by the store; the answer itself was delivered
+
+
+def match_faq(topic: str, doubt: str) -> Optional[dict]:
+    """Return the FAQ entry asking the same question as a doubt, if any.
+
+    The normalized question must match exactly, or be nearly identical by
+    TF-IDF similarity.
+    """
+    entries = load_faq(topic)
+    if not entries:
+        return None
+    question = normalize_doubt(doubt)
+    for entry in reversed(entries):
+        if normalize_doubt(entry["question"]) == question:
+            return entry
+    scores = similarity_scores(question, [entry["question"] for entry in entries])
+    best = int(scores.argmax())
+    if scores[best] < FAQ_MATCH_THRESHOLD:
+        return None
+    return entries[best]
+
+
+def script_segment(
+    topic: str,
+    doubt: str,
+    highlighted_elements: Optional[List[str]] = None,
+    data_dir: Path = DATA_DIR,
+) -> Optional[str]:
+    """Return the script sentences about the highlighted nodes, or most similar to the doubt."""
+    path = Path(data_dir) / f"{topic}_script.json"
+    try:
+        script_data = json.loads(path.read_text())
+    except (OSError, json.JSONDecodeError):
+        return None
+    sentences = [s for s in _SENTENCE_PATTERN.split(script_data.get("script", "")) if s]
+    if not sentences:
+        return None
+
+    selected: List[int] = []
+    if highlighted_elements:
+        # Words that refer to the highlighted nodes: their ids and mapped terms
+        terms = set()
+        for node_id in highlighted_elements:
+            terms.update(tokenize(node_id))
+        for word, node_id in (script_data.get("component_mappings") or {}).items():
+            if node_id in highlighted_elements:
+                terms.update(tokenize(word))
+        selected = [i for i, s in enumerate(sentences) if terms & set(tokenize(s))]
+
+    if not selected:
+        scores = similarity_scores(doubt, sentences)
+        selected = sorted(int(i) for i in scores.argsort()[::-1] if scores[i] > 0)
+    selected = sorted(selected[:SCRIPT_SEGMENT_SENTENCES])
+    return " ".join(sentences[i] for i in selected) if selected else None
+
+
+def degraded_answer(
+    topic: str,
+    doubt: str,
+    highlighted_elements: Optional[List[str]] = None,
+    reason: str = "",
+) -> DegradedAnswer:
+    """Answer a doubt from the fast path: FAQ, then script segment, then a notice."""
+    entry = match_faq(topic, doubt)
+    if entry is not None:
+        answer = DegradedAnswer(
+            narration=entry["answer"],
+            highlights=entry.get("highlights") or [],
+            source="faq",
+            reason=reason,
+        )
+    else:
+        segment = script_segment(topic, doubt, highlighted_elements)
+        if segment:
+            answer = DegradedAnswer(
+                narration=segment,
+                highlights=list(highlighted_elements or []),
+                source="script",
+                reason=reason,
+            )
+        else:
+            answer = DegradedAnswer(
+                narration=BUSY_NOTICE, source="notice", reason=reason
+            )
+
+    with _counters_lock:
+        _counters[answer.source] += 1
+    logger.info("Degraded answer for %s from %s (%s)", topic, answer.source, reason)
+    return answer
+
+
+def shedding_metrics() -> Dict[str, int]:
+    """Return how many degraded answers came from each source."""
+    with _counters_lock:
+        return dict(_counters)
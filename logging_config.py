@@ -0,0 +1,230 @@
+"""
+Non-blocking logging for the server processes.
+
+`setup_logging()` replaces `logging.basicConfig` in the bridge: log calls on
+the event loop only filter the record and put it on a bounded queue; a
+QueueListener thread formats and writes it. Messages use lazy %-style
+arguments (`logger.info("Synthesized %d chars", n)`), so records that are
+sampled out are never formatted, and the message template identifies a log
+site. Records with mutable arguments are merged before they are queued,
+since the arguments could change before the writer thread gets to them.
+
+Settings:
+
+- LOG_SAMPLE: per-logger share of DEBUG/INFO records kept, e.g.
+  "realtime_audio=0.1,ws_sender=0.5". Warnings and errors are never sampled.
+- LOG_RATE_LIMIT / LOG_RATE_BURST: token bucket per log site (logger and
+  template). A record that passes after some were suppressed carries their
+  count in `suppressed`.
+- LOG_QUEUE_SIZE: records waiting for the writer thread; when it is full,
+  records are dropped (and counted) instead of blocking the caller.
+- LOG_FORMAT: "json" (default) writes one JSON object per line, including
+  any `extra={...}` fields; "text" keeps the classic format.
+"""
+
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+LOG_SAMPLE = os.getenv("LOG_SAMPLE", "")
+LOG_RATE_LIMIT = float(os.getenv("LOG_RATE_LIMIT", "20"))
+LOG_RATE_BURST = float(os.getenv("LOG_RATE_BURST", "50"))
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+# Log sites tracked by the rate limiter before its buckets are reset
+MAX_RATE_KEYS = 2048
+
+TEXT_FORMAT = "%(levelname)s:%(name)s:%(message)s"
+
+# Attributes every LogRecord has (and uvicorn's ANSI-colored copy of the
+# message); anything else came from `extra`
+_RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {
+    "message",
+    "asctime",
+    "color_message",
+}
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_setup_lock = threading.Lock()
+
+
+def parse_sample_rates(spec: str) -> Dict[str, float]:
+    """Parse "name=rate,name=rate" into per-logger sample rates."""
+    rates = {}
+    for item in spec.split(","):
+        name, _, rate = item.partition("=")
+        if name.strip() and rate.strip():
+            rates[name.strip()] = min(1.0, max(0.0, float(rate)))
+    return rates
+
+
+class SamplingFilter(logging.Filter):
+    """Samples low-severity records per logger and rate-limits every log site."""
+
+    def __init__(
+        self,
+        sample_rates: Optional[Dict[str, float]] = None,
+        rate: float = LOG_RATE_LIMIT,
+        burst: float = LOG_RATE_BURST,
+    ):
+        super().__init__()
+        self.sample_rates = sample_rates or {}
+        self.rate = rate
+        self.burst = burst
+        # (logger, template) -> [tokens, last refill, suppressed]
+        self._buckets: Dict[Tuple[str, str], list] = {}
+        self._lock = threading.Lock()
+        self.sampled_out = 0
+        self.rate_limited = 0
+
+    def _sample_rate(self, name: str) -> float:
+        # The most specific configured logger name wins, as with logger levels
+        while name:
+            if name in self.sample_rates:
+                return self.sample_rates[name]
+            name = name.rpartition(".")[0]
+        return 1.0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno < logging.WARNING:
+            rate = self._sample_rate(record.name)
+            if rate < 1.0 and random.random() >= rate:
+                self.sampled_out += 1
+                return False
+        if self.rate <= 0:
+            return True
+
+        key = (record.name, str(record.msg))
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                if len(self._buckets) >= MAX_RATE_KEYS:
+                    self._buckets.clear()
+                bucket = self._buckets[key] = [self.burst, now, 0]
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            if bucket[0] < 1:
+                bucket[2] += 1
+                self.rate_limited += 1
+                return False
+            bucket[0] -= 1
+            if bucket[2]:
+                record.suppressed = bucket[2]
+                bucket[2] = 0
+        return True
+
+
+# Log arguments that cannot change between the log call and the writer thread
+_IMMUTABLE_ARGS = (str, bytes, int, float, bool, type(None))
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops records instead of blocking, and formats only what it must."""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Unlike the default, leave msg and args for the listener thread to merge
+        # when the arguments are immutable. Anything else (a list, a model) may
+        # change before the listener runs, so the message is merged now; so is
+        # the traceback, which must be rendered while it still exists
+        args = record.args
+        values = args.values() if isinstance(args, dict) else args or ()
+        if not all(isinstance(value, _IMMUTABLE_ARGS) for value in values):
+            record.msg = record.getMessage()
+            record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record, with `extra` fields as keys."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for name, value in vars(record).items():
+            if name not in _RECORD_ATTRIBUTES:
+                entry[name] = value
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+def setup_logging(
+    level: str = LOG_LEVEL, log_format: str = LOG_FORMAT, stream=None
+) -> NonBlockingQueueHandler:
+    """Route every log record through a queue to a writer thread (idempotent)."""
+    global _listener
+    with _setup_lock:
+        root = logging.getLogger()
+        for handler in root.handlers:
+            if isinstance(handler, NonBlockingQueueHandler):
+                return handler
+
+        output = logging.StreamHandler(stream or sys.stderr)
+        output.setFormatter(
+            JsonFormatter() if log_format == "json" else logging.Formatter(TEXT_FORMAT)
+        )
+        log_queue: queue.Queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+        handler = NonBlockingQueueHandler(log_queue)
+        handler.addFilter(SamplingFilter(parse_sample_rates(LOG_SAMPLE)))
+
+        # Replace basicConfig's synchronous stream handler; keep any others (e.g. pytest's)
+        for existing in list(root.handlers):
+            if type(existing) is logging.StreamHandler:
+                root.removeHandler(existing)
+        root.addHandler(handler)
+        root.setLevel(level)
+
+        _listener = logging.handlers.QueueListener(log_queue, output)
+        _listener.start()
+        atexit.register(stop_logging)
+        return handler
+
+
+def stop_logging():
+    """Write out the queued records and stop the writer thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def logging_metrics() -> Dict[str, int]:
+    """Return how many records were sampled out, rate limited or dropped."""
+    for handler in logging.getLogger().handlers:
+        if isinstance(handler, NonBlockingQueueHandler):
+            sampler = handler.filters[0]
+            return {
+                "queued": handler.queue.qsize(),
+                "dropped": handler.dropped,
+                "sampled_out": sampler.sampled_out,
+                "rate_limited": sampler.rate_limited,
+            }
+    return {}
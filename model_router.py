@@ -0,0 +1,236 @@
+"""
+Routing doubts to a chat model by how hard they look.
+
+Most doubts are short lookups ("what does PK mean?") that a small, fast
+model answers as well as a large one; a few are multi-step questions
+(normalizing a schema, comparing isolation levels) that need the large
+model. A cheap local classifier scores each doubt from its length, keyword
+features and topic, and picks a route:
+
+- "simple": ROUTER_SIMPLE_MODEL (default gpt-4o-mini), shorter answers
+- "complex": ROUTER_COMPLEX_MODEL (default gpt-4)
+
+The rules (keywords, weights, threshold, topics) can be replaced with a JSON
+file named by ROUTER_RULES. Latency and token usage are kept per route so
+the split can be tuned.
+"""
+
+import json
+import logging
+import os
+import re
+import threading
+from collections import deque
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from pydantic import BaseModel
+
+logger = logging.getLogger(__name__)
+
+ROUTER_SIMPLE_MODEL = os.getenv("ROUTER_SIMPLE_MODEL", "gpt-4o-mini")
+ROUTER_COMPLEX_MODEL = os.getenv("ROUTER_COMPLEX_MODEL", "gpt-4")
+ROUTER_RULES = os.getenv("ROUTER_RULES", "")
+
+# Latency samples kept per route for the quantiles
+LATENCY_WINDOW = 500
+
+_WORD_PATTERN = re.compile(r"[a-z0-9]+(?:[-'][a-z0-9]+)*")
+
+
+class Route(BaseModel):
+    """A chat model and the answer budget used for one class of doubts."""
+
+    name: str
+    model: str
+    # Only applied to plain-text completions; function-calling completions carry
+    # the answer in their arguments, which must not be cut off
+    max_tokens: Optional[int] = None
+
+
+class RouterRules(BaseModel):
+    """Features of the doubt classifier and the score at which a doubt is complex."""
+
+    threshold: float = 1.0
+    # Doubts this long score length_weight; shorter ones proportionally less
+    long_doubt_words: int = 40
+    length_weight: float = 0.8
+    # Matched at the start of a word of the lowercased doubt, so stems such as
+    # "normaliz" match "normalization" but "prove" does not match "improve"
+    complex_keywords: List[str] = [
+        "normaliz",
+        "normal form",
+        "1nf",
+        "2nf",
+        "3nf",
+        "bcnf",
+        "functional dependenc",
+        "decompos",
+        "denormaliz",
+        "difference between",
+        "compare",
+        "trade-off",
+        "tradeoff",
+        "why",
+        "how would",
+        "design",
+        "step by step",
+        "walk me through",
+        "explain how",
+        "isolation level",
+        "deadlock",
+        "concurren",
+        "optimiz",
+        "query plan",
+        "prove",
+    ]
+    complex_keyword_weight: float = 0.6
+    simple_patterns: List[str] = [
+        r"^what (is|are|does) (an? |the )?[\w -]{1,30}( mean| stand for)?\??$",
+        r"\bstand(s)? for\b",
+        r"^define\b",
+        r"^(is|are|can|does) [\w -]{1,40}\?$",
+    ]
+    simple_pattern_weight: float = -0.8
+    # Several questions in one doubt
+    multi_question_weight: float = 0.5
+    # Looking at many elements at once usually means a structural question
+    many_highlights: int = 4
+    many_highlights_weight: float = 0.3
+    complex_topics: List[str] = []
+    complex_topic_weight: float = 0.5
+    simple_max_tokens: int = 300
+
+
+class RouteDecision(BaseModel):
+    """The route chosen for a doubt, with the score and features behind it."""
+
+    route: Route
+    score: float
+    features: Dict[str, float]
+
+
+def load_rules(source: str = ROUTER_RULES) -> RouterRules:
+    """Load classifier rules from a JSON file, falling back to the defaults."""
+    if not source:
+        return RouterRules()
+    try:
+        return RouterRules(**json.loads(Path(source).read_text()))
+    except (OSError, ValueError) as e:
+        logger.warning("Using default routing rules, could not load %s: %s", source, e)
+        return RouterRules()
+
+
+class ModelRouter:
+    """Classifies doubts into routes and keeps per-route latency and token metrics."""
+
+    def __init__(
+        self,
+        rules: Optional[RouterRules] = None,
+        simple_model: str = ROUTER_SIMPLE_MODEL,
+        complex_model: str = ROUTER_COMPLEX_MODEL,
+    ):
+        self.rules = rules or RouterRules()
+        self.routes = {
+            "simple": Route(
+                name="simple",
+                model=simple_model,
+                max_tokens=self.rules.simple_max_tokens,
+            ),
+            "complex": Route(name="complex", model=complex_model),
+        }
+        self._simple_patterns = [re.compile(p) for p in self.rules.simple_patterns]
+        self._keyword_patterns = [
+            re.compile(r"\b" + re.escape(keyword))
+            for keyword in self.rules.complex_keywords
+        ]
+        self._lock = threading.Lock()
+        self._latencies: Dict[str, deque] = {
+            name: deque(maxlen=LATENCY_WINDOW) for name in self.routes
+        }
+        self._counters: Dict[str, Dict[str, int]] = {
+            name: {
+                "requests": 0,
+                "completed": 0,
+                "prompt_tokens": 0,
+                "completion_tokens": 0,
+            }
+            for name in self.routes
+        }
+
+    def features(
+        self, topic: str, doubt: str, highlighted_elements: Optional[List[str]] = None
+    ) -> Dict[str, float]:
+        """Score contributions of each feature of a doubt."""
+        rules = self.rules
+        text = " ".join(doubt.lower().split())
+        words = _WORD_PATTERN.findall(text)
+        keywords = sum(1 for pattern in self._keyword_patterns if pattern.search(text))
+        features = {
+            "length": rules.length_weight
+            * min(1.0, len(words) / max(1, rules.long_doubt_words)),
+            "keywords": rules.complex_keyword_weight * min(keywords, 3),
+        }
+        if any(pattern.search(text) for pattern in self._simple_patterns):
+            features["simple_pattern"] = rules.simple_pattern_weight
+        if text.count("?") > 1:
+            features["multi_question"] = rules.multi_question_weight
+        if len(highlighted_elements or []) >= rules.many_highlights:
+            features["highlights"] = rules.many_highlights_weight
+        if topic in rules.complex_topics:
+            features["topic"] = rules.complex_topic_weight
+        return features
+
+    def route(
+        self, topic: str, doubt: str, highlighted_elements: Optional[List[str]] = None
+    ) -> RouteDecision:
+        """Pick the route of a doubt."""
+        features = self.features(topic, doubt, highlighted_elements)
+        score = round(sum(features.values()), 3)
+        name = "complex" if score >= self.rules.threshold else "simple"
+        with self._lock:
+            self._counters[name]["requests"] += 1
+        logger.debug("Routed doubt to %s (score %.2f)", name, score)
+        return RouteDecision(route=self.routes[name], score=score, features=features)
+
+    def record(self, route: Route, latency: float, usage: Any = None):
+        """Record the latency and token usage of a completed call on a route."""
+        with self._lock:
+            self._latencies[route.name].append(latency)
+            counters = self._counters[route.name]
+            counters["completed"] += 1
+            if usage is not None:
+                counters["prompt_tokens"] += getattr(usage, "prompt_tokens", 0) or 0
+                counters["completion_tokens"] += (
+                    getattr(usage, "completion_tokens", 0) or 0
+                )
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            snapshot = {
+                name: (dict(self._counters[name]), sorted(self._latencies[name]))
+                for name in self.routes
+            }
+        metrics = {}
+        for name, (counters, samples) in snapshot.items():
+
+            def quantile(q: float) -> Optional[float]:
+                if not samples:
+                    return None
+                return round(samples[min(len(samples) - 1, int(q * len(samples)))], 3)
+
+            metrics[name] = {
+                "model": self.routes[name].model,
+                **counters,
+                "latency_p50": quantile(0.5),
+                "latency_p95": quantile(0.95),
+            }
+        return metrics
+
+
+model_router = ModelRouter(load_rules())
+
+
+def router_metrics() -> Dict[str, Any]:
+    """Return per-route request counts, latency and token usage."""
+    return model_router.metrics()
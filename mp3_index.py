@@ -0,0 +1,170 @@
+"""
+Frame index of MP3 audio, for exact durations and time-based seeking.
+
+An MP3 stream is a sequence of frames, each starting with a 4-byte header
+that gives its length and the number of samples it decodes to. Walking the
+headers (without decoding any audio) yields the exact duration of a
+narration and the byte offset at which every frame starts, so a player can
+start at any time by fetching the file from the frame that contains it.
+
+Leading ID3v2 tags and a Xing/Info/VBRI header frame (which carries no
+audio) are skipped; a damaged header is skipped by scanning for the next
+frame sync. Layer III frames may borrow bits from the previous frame (the
+bit reservoir), so a decoder that starts mid-stream can drop the first
+frame it receives; the ~25 ms of audio that may be lost is far less than a
+word.
+"""
+
+from array import array
+from bisect import bisect_right
+from typing import List, Optional, Tuple
+
+# Bitrates in kbit/s by bitrate index, for (MPEG-1 or not, layer)
+_BITRATES = {
+    (True, 1): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (True, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (True, 3): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (False, 1): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (False, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    (False, 3): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+
+# Sample rates by version bits (0: MPEG-2.5, 2: MPEG-2, 3: MPEG-1)
+_SAMPLE_RATES = {
+    0: (11025, 12000, 8000),
+    2: (22050, 24000, 16000),
+    3: (44100, 48000, 32000),
+}
+
+# Offset of a Xing/Info tag after the header, for (MPEG-1, mono)
+_XING_OFFSETS = {
+    (True, False): 32,
+    (True, True): 17,
+    (False, False): 17,
+    (False, True): 9,
+}
+
+
+def parse_frame_header(data, offset: int) -> Optional[Tuple[int, int, int]]:
+    """Return (frame length, samples, sample rate) of the frame at `offset`, or None."""
+    if offset + 4 > len(data) or data[offset] != 0xFF:
+        return None
+    b1, b2 = data[offset + 1], data[offset + 2]
+    if b1 & 0xE0 != 0xE0:
+        return None
+    version = (b1 >> 3) & 0x3
+    layer = 4 - ((b1 >> 1) & 0x3)
+    bitrate_index = b2 >> 4
+    rate_index = (b2 >> 2) & 0x3
+    # Reserved version, layer or sample rate, and free-format or bad bitrates
+    if version == 1 or layer == 4 or rate_index == 3 or bitrate_index in (0, 15):
+        return None
+
+    mpeg1 = version == 3
+    bitrate = _BITRATES[(mpeg1, layer)][bitrate_index] * 1000
+    sample_rate = _SAMPLE_RATES[version][rate_index]
+    padding = (b2 >> 1) & 0x1
+    if layer == 1:
+        return (12 * bitrate // sample_rate + padding) * 4, 384, sample_rate
+    samples = 1152 if layer == 2 or mpeg1 else 576
+    return samples // 8 * bitrate // sample_rate + padding, samples, sample_rate
+
+
+def _id3_size(data) -> int:
+    if len(data) < 10 or bytes(data[:3]) != b"ID3":
+        return 0
+    size = 0
+    for byte in data[6:10]:
+        size = (size << 7) | (byte & 0x7F)
+    footer = 10 if data[5] & 0x10 else 0
+    return 10 + size + footer
+
+
+def _is_info_frame(data, offset: int, length: int) -> bool:
+    mpeg1 = (data[offset + 1] >> 3) & 0x3 == 3
+    mono = data[offset + 3] >> 6 == 3
+    end = offset + min(length, 64)
+    frame = bytes(data[offset:end])
+    tag = 4 + _XING_OFFSETS[(mpeg1, mono)]
+    end = tag + 4
+    return frame[tag:end] in (b"Xing", b"Info") or frame[36:40] == b"VBRI"
+
+
+class Mp3Index:
+    """Byte offsets and start times of the audio frames of an MP3 file."""
+
+    def __init__(self, offsets: array, starts_ms: array, end: int, duration_ms: float):
+        self.offsets = offsets
+        self.starts_ms = starts_ms
+        # Byte after the last frame (trailing tags are not audio)
+        self.end = end
+        self._duration_ms = duration_ms
+
+    @property
+    def frames(self) -> int:
+        return len(self.offsets)
+
+    @property
+    def duration_ms(self) -> int:
+        return int(round(self._duration_ms))
+
+    def offset_at(self, ms: float) -> Tuple[int, int]:
+        """Return the offset and start time of the frame playing at `ms`."""
+        frame = max(0, bisect_right(self.starts_ms, max(0.0, ms)) - 1)
+        return self.offsets[frame], int(self.starts_ms[frame])
+
+    def seek_table(self, interval_ms: int = 1000) -> List[Tuple[int, int]]:
+        """Return (time, offset) pairs for a frame about every `interval_ms`."""
+        table = []
+        next_ms = 0.0
+        for start, offset in zip(self.starts_ms, self.offsets):
+            if start >= next_ms:
+                table.append((int(start), offset))
+                next_ms = start + max(1, interval_ms)
+        return table
+
+
+def index_mp3(data) -> Optional[Mp3Index]:
+    """Index the frames of MP3 audio (any bytes-like object); None if it has none."""
+    view = memoryview(data)
+    size = len(view)
+    offsets = array("L")
+    starts_ms = array("d")
+    position = _id3_size(view)
+    elapsed_ms = 0.0
+    end = position
+    synced = False
+
+    while position + 4 <= size:
+        header = parse_frame_header(view, position)
+        if header is not None and not synced:
+            # Only trust a sync found by scanning if the next frame follows it
+            next_position = position + header[0]
+            if (
+                next_position + 4 <= size
+                and parse_frame_header(view, next_position) is None
+            ):
+                header = None
+        if header is None:
+            synced = False
+            position += 1
+            continue
+
+        length, samples, sample_rate = header
+        if not offsets and not synced and _is_info_frame(view, position, length):
+            position += length
+            synced = True
+            continue
+        if position + length > size:
+            # Truncated last frame
+            break
+        offsets.append(position)
+        starts_ms.append(elapsed_ms)
+        elapsed_ms += samples * 1000 / sample_rate
+        position += length
+        end = position
+        synced = True
+
+    if not offsets:
+        return None
+    return Mp3Index(offsets, starts_ms, end, elapsed_ms)
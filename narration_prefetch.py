@@ -0,0 +1,473 @@
+"""
+Playback-aware prefetch of upcoming narration audio.
+
+Narration scripts are split into segments of a few sentences. Each segment
+has a start and end on an estimated timeline and the ids of the nodes it
+highlights. Nodes come from the script's component mappings and timestamp
+phrases, and from the topic's node names. Clients send playback heartbeats
+with their position: `{"type": "playback", "topic", "session_id",
+"position_ms"}` on /ws/session, or POST /api/narration/{topic}/playback.
+The position can also be given as `segment` and `offset_ms`.
+
+On every heartbeat the segments that start within NARRATION_PREFETCH_WINDOW_MS
+after the playhead (at most NARRATION_PREFETCH_SEGMENTS) are synthesized at
+prefetch priority into the audio cache. Asking for a segment's narration is
+then a cache hit, and the transition to the next segment does not wait on TTS.
+
+- A segment wanted by several sessions is synthesized once.
+- A seek moves the window. Synthesis of segments that have left every
+  session's window is cancelled, so a student jumping around does not queue up
+  audio that will never play.
+- Sessions that stop sending heartbeats are dropped after
+  NARRATION_PLAYBACK_TTL seconds, and their prefetches are released.
+
+When upcoming segments highlight nodes, the doubt context of the topic is
+prepared as well. The doubt text is unknown ahead of time, so this covers the
+parts that do not depend on it: the topic graph, its prompt prefix and the node
+text index that scores doubts against nodes.
+"""
+
+import asyncio
+import bisect
+import json
+import logging
+import os
+import re
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from pydantic import BaseModel
+
+from audio_cache import audio_cache, audio_cache_key
+from audio_formats import AUDIO_FORMATS, DEFAULT_FORMAT, DEFAULT_SPEED
+from openai_scheduler import Priority
+from realtime_audio import (
+    estimate_duration_ms,
+    generate_word_timings,
+    measured_duration_ms,
+    synthesize_audio,
+)
+
+logger = logging.getLogger(__name__)
+
+NARRATION_PREFETCH_WINDOW_MS = int(os.getenv("NARRATION_PREFETCH_WINDOW_MS", "30000"))
+NARRATION_PREFETCH_SEGMENTS = int(os.getenv("NARRATION_PREFETCH_SEGMENTS", "3"))
+NARRATION_SEGMENT_SENTENCES = int(os.getenv("NARRATION_SEGMENT_SENTENCES", "2"))
+NARRATION_PLAYBACK_TTL = float(os.getenv("NARRATION_PLAYBACK_TTL", "60"))
+# A heartbeat this far from where playback should be counts as a seek
+NARRATION_SEEK_TOLERANCE_MS = int(os.getenv("NARRATION_SEEK_TOLERANCE_MS", "3000"))
+
+DATA_DIR = Path(__file__).parent / "static" / "data"
+
+_SENTENCE_PATTERN = re.compile(r"(?<=[.!?])\s+")
+# Timestamp lists go by different names across the script files
+_TIMESTAMP_KEYS = ("timestamps", "narration_timestamps", "word_timings")
+
+
+class NarrationSegment(BaseModel):
+    """A few sentences of a narration script, on the estimated timeline."""
+
+    index: int
+    text: str
+    start_ms: int
+    end_ms: int
+    node_ids: List[str] = []
+
+
+class NarrationPlan(BaseModel):
+    """The segments of a topic's narration script."""
+
+    topic: str
+    segments: List[NarrationSegment]
+    duration_ms: int
+    # Topic nodes (id and name), for the word timings of prefetched segments
+    nodes: List[Dict[str, str]] = []
+
+    def segment_at(self, position_ms: int) -> int:
+        """Index of the segment playing at a position."""
+        starts = [segment.start_ms for segment in self.segments]
+        return max(0, bisect.bisect_right(starts, position_ms) - 1)
+
+    def upcoming(
+        self, index: int, position_ms: int, window_ms: int, limit: int
+    ) -> List[NarrationSegment]:
+        """Segments after `index` that start within the look-ahead window."""
+        first = index + 1
+        last = first + limit
+        return [
+            segment
+            for segment in self.segments[first:last]
+            if segment.start_ms < position_ms + window_ms
+        ]
+
+
+def _contains_phrase(text: str, phrase: str) -> bool:
+    return bool(phrase) and re.search(rf"\b{re.escape(phrase)}\b", text) is not None
+
+
+def build_plan(
+    topic: str,
+    script: Dict[str, Any],
+    nodes: List[Dict[str, Any]],
+    sentences_per_segment: int = NARRATION_SEGMENT_SENTENCES,
+) -> Optional[NarrationPlan]:
+    """Split a script into segments and find the nodes each one highlights."""
+    script_text = (script.get("script") or "").strip()
+    sentences = [s for s in _SENTENCE_PATTERN.split(script_text) if s]
+    if not sentences:
+        return None
+
+    # Phrase -> node ids it refers to
+    phrases: Dict[str, Set[str]] = {}
+    for phrase, node_id in (script.get("component_mappings") or {}).items():
+        phrases.setdefault(phrase.lower(), set()).add(node_id)
+    for key in _TIMESTAMP_KEYS:
+        for entry in script.get(key) or []:
+            ids = entry.get("node_ids") or entry.get("node_id") or []
+            ids = [ids] if isinstance(ids, str) else ids
+            if entry.get("word") and ids:
+                phrases.setdefault(entry["word"].lower(), set()).update(ids)
+    for node in nodes:
+        if node.get("id") and len(node.get("name") or "") >= 3:
+            phrases.setdefault(node["name"].lower(), set()).add(node["id"])
+
+    segments = []
+    start = 0
+    step = max(1, sentences_per_segment)
+    for index, first in enumerate(range(0, len(sentences), step)):
+        end = first + step
+        text = " ".join(sentences[first:end])
+        lowered = text.lower()
+        node_ids = sorted(
+            {
+                node_id
+                for phrase, ids in phrases.items()
+                if _contains_phrase(lowered, phrase)
+                for node_id in ids
+            }
+        )
+        duration = estimate_duration_ms(text)
+        segments.append(
+            NarrationSegment(
+                index=index,
+                text=text,
+                start_ms=start,
+                end_ms=start + duration,
+                node_ids=node_ids,
+            )
+        )
+        start += duration
+    return NarrationPlan(
+        topic=topic,
+        segments=segments,
+        duration_ms=start,
+        nodes=[
+            {"id": node["id"], "name": node["name"]}
+            for node in nodes
+            if node.get("id") and node.get("name")
+        ],
+    )
+
+
+_plans: Dict[Tuple[str, str], Tuple[float, Optional[NarrationPlan]]] = {}
+
+
+def load_plan(topic: str, data_dir: Path = DATA_DIR) -> Optional[NarrationPlan]:
+    """Return the segment plan of a topic's script (rebuilt when the file changes)."""
+    if not re.fullmatch(r"[\w-]+", topic or ""):
+        return None
+    script_path = Path(data_dir) / f"{topic}_script.json"
+    try:
+        mtime = script_path.stat().st_mtime
+    except OSError:
+        return None
+    cached = _plans.get((str(data_dir), topic))
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+
+    plan = None
+    try:
+        script = json.loads(script_path.read_text())
+        nodes = []
+        visualization_path = Path(data_dir) / f"{topic}_visualization.json"
+        if visualization_path.exists():
+            nodes = json.loads(visualization_path.read_text()).get("nodes", [])
+        plan = build_plan(topic, script, nodes)
+    except (OSError, ValueError) as e:
+        logger.warning("Could not read the narration script of %s: %s", topic, e)
+    _plans[(str(data_dir), topic)] = (mtime, plan)
+    return plan
+
+
+def segment_cache_key(
+    segment: NarrationSegment,
+    voice: str = "alloy",
+    audio_format: str = DEFAULT_FORMAT,
+    speed: float = DEFAULT_SPEED,
+) -> str:
+    """Audio cache key of a segment, as a narration request for its text looks it up."""
+    response_format = AUDIO_FORMATS[audio_format].response_format
+    return audio_cache_key(
+        segment.text, voice, response_format=response_format, speed=speed
+    )
+
+
+async def prefetch_segment(
+    plan: NarrationPlan,
+    segment: NarrationSegment,
+    voice: str = "alloy",
+    audio_format: str = DEFAULT_FORMAT,
+    speed: float = DEFAULT_SPEED,
+):
+    """Synthesize a segment into the audio cache, with its word timings."""
+    with await synthesize_audio(
+        segment.text,
+        voice,
+        priority=Priority.PREFETCH,
+        audio_format=audio_format,
+        speed=speed,
+    ) as buffer:
+        duration = measured_duration_ms(buffer, audio_format)
+    timings = await generate_word_timings(
+        segment.text, duration or estimate_duration_ms(segment.text), plan.nodes
+    )
+    audio_cache.update_meta(
+        segment_cache_key(segment, voice, audio_format, speed),
+        topic=plan.topic,
+        segment=segment.index,
+        word_timings=timings,
+    )
+
+
+def prepare_doubt_context(topic: str):
+    """Build the doubt-independent parts of a topic's doubt context."""
+    from app import topic_graph
+    from prompt_cache import prefix_cache
+    from prompt_context import node_text_index
+
+    graph = topic_graph(topic)
+    node_text_index(graph)
+    prefix_cache.get(topic, graph)
+
+
+class PlaybackState:
+    """Where one session's narration playback is, and what is prefetched for it."""
+
+    __slots__ = ("topic", "position_ms", "playing", "speed", "updated", "wanted")
+
+    def __init__(self, topic: str):
+        self.topic = topic
+        self.position_ms = 0
+        self.playing = False
+        self.speed = DEFAULT_SPEED
+        self.updated = time.monotonic()
+        # Cache keys of the segments prefetched for this session
+        self.wanted: Set[str] = set()
+
+
+class NarrationPrefetcher:
+    """Prefetches narration segments ahead of each session's playhead.
+
+    Runs on the event loop: heartbeats start and cancel prefetch tasks.
+    """
+
+    def __init__(
+        self,
+        window_ms: int = NARRATION_PREFETCH_WINDOW_MS,
+        max_segments: int = NARRATION_PREFETCH_SEGMENTS,
+        ttl: float = NARRATION_PLAYBACK_TTL,
+        seek_tolerance_ms: int = NARRATION_SEEK_TOLERANCE_MS,
+        prefetch: Callable[..., Any] = prefetch_segment,
+        prepare: Callable[[str], None] = prepare_doubt_context,
+        plans: Callable[[str], Optional[NarrationPlan]] = load_plan,
+    ):
+        self.window_ms = window_ms
+        self.max_segments = max_segments
+        self.ttl = ttl
+        self.seek_tolerance_ms = seek_tolerance_ms
+        self.prefetch = prefetch
+        self.prepare = prepare
+        self.plans = plans
+        self._sessions: Dict[str, PlaybackState] = {}
+        # Cache key -> running prefetch, and the sessions that want it
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._wanted_by: Dict[str, Set[str]] = {}
+        self._prepared: Set[str] = set()
+        self._counters = {
+            "heartbeats": 0,
+            "seeks": 0,
+            "prefetched": 0,
+            "already_cached": 0,
+            "cancelled": 0,
+            "failed": 0,
+            "contexts_prepared": 0,
+        }
+
+    def heartbeat(
+        self,
+        session_key: str,
+        topic: str,
+        position_ms: Optional[int] = None,
+        segment: Optional[int] = None,
+        offset_ms: int = 0,
+        state: str = "playing",
+        voice: str = "alloy",
+        audio_format: str = DEFAULT_FORMAT,
+        speed: float = DEFAULT_SPEED,
+    ) -> Dict[str, Any]:
+        """Record a playback position and prefetch the segments ahead of it."""
+        now = time.monotonic()
+        self._counters["heartbeats"] += 1
+        self._expire(now)
+        plan = self.plans(topic)
+        if plan is None or not plan.segments:
+            return {"topic": topic, "segments": 0, "upcoming": []}
+
+        if segment is not None:
+            index = min(max(0, segment), len(plan.segments) - 1)
+            position = plan.segments[index].start_ms + max(0, offset_ms)
+        else:
+            position = max(0, position_ms or 0)
+            index = plan.segment_at(position)
+
+        playback = self._sessions.get(session_key)
+        if playback is not None and playback.topic != topic:
+            self._release(session_key)
+            playback = None
+        seek = False
+        if playback is not None:
+            expected = playback.position_ms
+            if playback.playing:
+                expected += (now - playback.updated) * 1000 * playback.speed
+            seek = abs(position - expected) > self.seek_tolerance_ms
+            self._counters["seeks"] += seek
+        if state == "stopped":
+            self._release(session_key)
+            return self._report(
+                plan, index, position, [], voice, audio_format, speed, seek
+            )
+
+        playback = playback or self._sessions.setdefault(
+            session_key, PlaybackState(topic)
+        )
+        playback.position_ms = position
+        playback.playing = state == "playing"
+        playback.speed = speed
+        playback.updated = now
+
+        window = plan.upcoming(index, position, self.window_ms, self.max_segments)
+        wanted = {
+            segment_cache_key(upcoming, voice, audio_format, speed): upcoming
+            for upcoming in window
+        }
+        # Segments behind the playhead or outside the window after a seek
+        for key in playback.wanted - wanted.keys():
+            self._unwant(key, session_key)
+        for key, upcoming in wanted.items():
+            self._want(key, session_key, plan, upcoming, voice, audio_format, speed)
+        playback.wanted = set(wanted)
+
+        if topic not in self._prepared and any(
+            upcoming.node_ids for upcoming in window
+        ):
+            self._prepared.add(topic)
+            asyncio.ensure_future(self._prepare(topic))
+        return self._report(
+            plan, index, position, window, voice, audio_format, speed, seek
+        )
+
+    def _want(self, key, session_key, plan, segment, voice, audio_format, speed):
+        wanted_by = self._wanted_by.setdefault(key, set())
+        new = session_key not in wanted_by
+        wanted_by.add(session_key)
+        if key in self._tasks:
+            return
+        if audio_cache.contains(key):
+            self._counters["already_cached"] += new
+            return
+        task = asyncio.ensure_future(
+            self.prefetch(
+                plan, segment, voice=voice, audio_format=audio_format, speed=speed
+            )
+        )
+        self._tasks[key] = task
+        task.add_done_callback(lambda task, key=key: self._finished(key, task))
+
+    def _unwant(self, key: str, session_key: str):
+        wanted_by = self._wanted_by.get(key)
+        if wanted_by is None:
+            return
+        wanted_by.discard(session_key)
+        if wanted_by:
+            return
+        del self._wanted_by[key]
+        task = self._tasks.get(key)
+        if task is not None and not task.done():
+            task.cancel()
+
+    def _finished(self, key: str, task: asyncio.Task):
+        self._tasks.pop(key, None)
+        if task.cancelled():
+            self._counters["cancelled"] += 1
+        elif task.exception() is not None:
+            self._counters["failed"] += 1
+            logger.warning("Could not prefetch narration segment: %s", task.exception())
+        else:
+            self._counters["prefetched"] += 1
+
+    async def _prepare(self, topic: str):
+        try:
+            await asyncio.to_thread(self.prepare, topic)
+            self._counters["contexts_prepared"] += 1
+        except Exception as e:
+            self._prepared.discard(topic)
+            logger.warning("Could not prepare the doubt context of %s: %s", topic, e)
+
+    def _release(self, session_key: str):
+        playback = self._sessions.pop(session_key, None)
+        for key in playback.wanted if playback else ():
+            self._unwant(key, session_key)
+
+    def _expire(self, now: float):
+        for session_key, playback in list(self._sessions.items()):
+            if now - playback.updated > self.ttl:
+                self._release(session_key)
+
+    def _report(self, plan, index, position, window, voice, audio_format, speed, seek):
+        upcoming = []
+        for segment in window:
+            key = segment_cache_key(segment, voice, audio_format, speed)
+            upcoming.append(
+                {
+                    "index": segment.index,
+                    "start_ms": segment.start_ms,
+                    "text": segment.text,
+                    "node_ids": segment.node_ids,
+                    "audio_key": key,
+                    "ready": key not in self._tasks and audio_cache.contains(key),
+                }
+            )
+        return {
+            "topic": plan.topic,
+            "segment": index,
+            "position_ms": int(position),
+            "segments": len(plan.segments),
+            "seek": seek,
+            "upcoming": upcoming,
+        }
+
+    def metrics(self) -> Dict[str, int]:
+        return {
+            **self._counters,
+            "sessions": len(self._sessions),
+            "in_flight": len(self._tasks),
+        }
+
+
+narration_prefetcher = NarrationPrefetcher()
+
+
+def narration_prefetch_metrics() -> Dict[str, int]:
+    """Return heartbeat, seek and prefetch counters and the prefetches in flight."""
+    return narration_prefetcher.metrics()
@@ -0,0 +1,192 @@
+"""
+Background pre-synthesis of the static topic narrations.
+
+Every `static/data/*_script.json` carries a narration script that is known
+before any student connects. This module synthesizes the audio and word
+timings for each script with a bounded pool of workers and stores them in the
+audio cache, so the first student on a topic gets cached playback instead of
+waiting on TTS. Requests run at prefetch priority and therefore never delay
+interactive doubts.
+
+Warm-up is resumable: scripts whose audio and timings are already cached are
+skipped, so an interrupted run picks up where it stopped.
+
+Usage:
+    python narration_warmup.py [--workers 4] [--voice alloy] [--topics er,gis]
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import time
+from pathlib import Path
+from typing import Callable, List, Optional
+
+from pydantic import BaseModel
+
+from audio_cache import audio_cache, audio_cache_key
+from audio_formats import AUDIO_FORMATS, DEFAULT_FORMAT, DEFAULT_SPEED
+from openai_scheduler import Priority
+from realtime_audio import (
+    estimate_duration_ms,
+    generate_word_timings,
+    measured_duration_ms,
+    synthesize_audio,
+)
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = Path(__file__).parent / "static" / "data"
+
+
+class NarrationJob(BaseModel):
+    """A narration script to synthesize."""
+
+    topic: str
+    text: str
+    nodes: List[dict] = []
+
+
+class WarmupProgress(BaseModel):
+    """Progress of a warm-up run."""
+
+    total: int = 0
+    completed: int = 0
+    skipped: int = 0
+    failed: int = 0
+    running: bool = False
+    in_progress: List[str] = []
+    errors: List[str] = []
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+
+
+def discover_narrations(data_dir: Path = DATA_DIR, topics: Optional[List[str]] = None):
+    """Collect the narration scripts (and their topic nodes) from the data directory."""
+    jobs = []
+    for script_path in sorted(Path(data_dir).glob("*_script.json")):
+        topic = script_path.name[: -len("_script.json")]
+        if topics and topic not in topics:
+            continue
+        try:
+            script = json.loads(script_path.read_text()).get("script", "")
+        except (OSError, json.JSONDecodeError) as e:
+            logger.warning("Skipping unreadable script %s: %s", script_path.name, e)
+            continue
+        if not script:
+            continue
+
+        nodes = []
+        visualization_path = Path(data_dir) / f"{topic}_visualization.json"
+        if visualization_path.exists():
+            try:
+                nodes = json.loads(visualization_path.read_text()).get("nodes", [])
+            except (OSError, json.JSONDecodeError):
+                pass
+        jobs.append(NarrationJob(topic=topic, text=script, nodes=nodes))
+    return jobs
+
+
+def narration_cache_key(text: str, voice: str) -> str:
+    """Cache key of a narration synthesized in the deployment's default format."""
+    audio_format = AUDIO_FORMATS[DEFAULT_FORMAT]
+    return audio_cache_key(
+        text, voice, response_format=audio_format.response_format, speed=DEFAULT_SPEED
+    )
+
+
+def is_warm(job: NarrationJob, voice: str) -> bool:
+    meta = audio_cache.get_meta(narration_cache_key(job.text, voice))
+    return bool(meta and meta.get("word_timings") is not None)
+
+
+async def warm_narration(job: NarrationJob, voice: str = "alloy"):
+    """Synthesize and cache the audio and word timings of one narration."""
+    with await synthesize_audio(job.text, voice, priority=Priority.PREFETCH) as buffer:
+        duration = measured_duration_ms(buffer, DEFAULT_FORMAT)
+    timings = await generate_word_timings(
+        job.text, duration or estimate_duration_ms(job.text), job.nodes
+    )
+    audio_cache.update_meta(
+        narration_cache_key(job.text, voice), topic=job.topic, word_timings=timings
+    )
+
+
+async def warm_narrations(
+    workers: int = 4,
+    voice: str = "alloy",
+    topics: Optional[List[str]] = None,
+    data_dir: Path = DATA_DIR,
+    progress: Optional[WarmupProgress] = None,
+    on_progress: Optional[Callable[[WarmupProgress], None]] = None,
+) -> WarmupProgress:
+    """Pre-synthesize every narration script with a bounded pool of workers."""
+    progress = progress or WarmupProgress()
+    jobs = discover_narrations(data_dir, topics)
+    progress.total = len(jobs)
+    progress.running = True
+    progress.started_at = time.time()
+
+    queue: asyncio.Queue = asyncio.Queue()
+    for job in jobs:
+        queue.put_nowait(job)
+
+    async def worker():
+        while True:
+            try:
+                job = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            if is_warm(job, voice):
+                progress.skipped += 1
+                continue
+            progress.in_progress.append(job.topic)
+            try:
+                await warm_narration(job, voice)
+                progress.completed += 1
+            except Exception as e:
+                progress.failed += 1
+                progress.errors.append(f"{job.topic}: {str(e)}")
+                logger.error("Error warming narration for %s: %s", job.topic, e)
+            finally:
+                progress.in_progress.remove(job.topic)
+            done = progress.completed + progress.skipped + progress.failed
+            logger.info("Narration warm-up %s/%s: %s", done, progress.total, job.topic)
+            if on_progress:
+                on_progress(progress)
+
+    try:
+        await asyncio.gather(*(worker() for _ in range(max(1, workers))))
+    finally:
+        progress.running = False
+        progress.finished_at = time.time()
+        if on_progress:
+            on_progress(progress)
+
+    logger.info(
+        "Narration warm-up finished: %d synthesized, %d already cached, %d failed",
+        progress.completed,
+        progress.skipped,
+        progress.failed,
+    )
+    return progress
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Pre-synthesize static topic narrations"
+    )
+    parser.add_argument("--workers", type=int, default=4, help="Concurrent TTS workers")
+    parser.add_argument("--voice", type=str, default="alloy", help="TTS voice")
+    parser.add_argument("--topics", type=str, default="", help="Comma-separated topics")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    topics = [topic for topic in args.topics.split(",") if topic] or None
+    progress = asyncio.run(warm_narrations(args.workers, args.voice, topics))
+    print(progress.model_dump_json())
+
+
+if __name__ == "__main__":
+    main()
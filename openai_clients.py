@@ -0,0 +1,48 @@
+"""
+Shared OpenAI clients, created on first use.
+
+Importing the OpenAI SDK takes about half a second, so no module imports it
+at the top: topic-only invocations (`app.py --topic`) never pay for it, and
+bridge workers pay once, when the first doubt or narration needs the API.
+
+The synchronous client is shared by the whole process. Async clients hold
+an HTTP connection pool bound to the event loop that created them, so one
+is kept per running loop.
+"""
+
+import asyncio
+import os
+import threading
+import weakref
+from typing import Any, Optional
+
+_lock = threading.Lock()
+_sync_client: Optional[Any] = None
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Any]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def sync_client():
+    """Return the process-wide OpenAI client."""
+    global _sync_client
+    with _lock:
+        if _sync_client is None:
+            from openai import OpenAI
+
+            _sync_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        return _sync_client
+
+
+def async_client():
+    """Return the AsyncOpenAI client of the running event loop."""
+    loop = asyncio.get_running_loop()
+    with _lock:
+        client = _async_clients.get(loop)
+        if client is None:
+            from openai import AsyncOpenAI
+
+            client = _async_clients[loop] = AsyncOpenAI(
+                api_key=os.getenv("OPENAI_API_KEY")
+            )
+        return client
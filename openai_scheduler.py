@@ -0,0 +1,561 @@
+"""
+Admission control and rate limiting for outbound OpenAI calls.
+
+Every chat completion and text-to-speech request goes through a shared
+scheduler before it reaches the API. A scheduler enforces token-bucket limits
+for requests and tokens per minute plus a concurrency cap, and admits queued
+calls strictly by priority class:
+
+    INTERACTIVE (student doubts) > NARRATION (live narration) > PREFETCH
+
+Queues are bounded per class and every queued call carries a deadline; calls
+that cannot be admitted in time are rejected with AdmissionRejected instead
+of hanging. A 429 from upstream pauses admissions for the advertised
+retry-after period and the call is re-queued; this is the only layer that
+retries 429s (resilience.py leaves them alone).
+
+Limits are enforced per process. The bridge divides the account-wide limits
+between its BRIDGE_WORKERS worker processes, but the short-lived
+`app.py --doubt` processes that server.js spawns for each doubt each get the
+full limits and know nothing of one another. Concurrent doubts answered that
+way can exceed the account's limits; upstream 429s then pause each process.
+
+The scheduler can be used from the event loop (`submit`, `slot`) and from
+plain threads such as the `app.py --doubt` process (`submit_sync`,
+`slot_sync`). Streamed responses keep their admission until the stream is
+exhausted or closed, so the concurrency cap and token accounting cover the
+whole response rather than just the request that opened it.
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from enum import IntEnum
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class Priority(IntEnum):
+    """Priority classes, lower values are admitted first."""
+
+    INTERACTIVE = 0
+    NARRATION = 1
+    PREFETCH = 2
+
+
+# Default time a call may wait in the queue before it is rejected (seconds)
+DEFAULT_DEADLINES = {
+    Priority.INTERACTIVE: float(os.getenv("OPENAI_DEADLINE_INTERACTIVE", "15")),
+    Priority.NARRATION: float(os.getenv("OPENAI_DEADLINE_NARRATION", "30")),
+    Priority.PREFETCH: float(os.getenv("OPENAI_DEADLINE_PREFETCH", "120")),
+}
+
+# Maximum number of queued calls per priority class
+DEFAULT_QUEUE_LIMITS = {
+    Priority.INTERACTIVE: int(os.getenv("OPENAI_QUEUE_INTERACTIVE", "64")),
+    Priority.NARRATION: int(os.getenv("OPENAI_QUEUE_NARRATION", "64")),
+    Priority.PREFETCH: int(os.getenv("OPENAI_QUEUE_PREFETCH", "256")),
+}
+
+MAX_RATE_LIMIT_RETRIES = 2
+
+# Upper bound on how long a queued call sleeps before re-checking admission
+POLL_INTERVAL = 0.25
+
+
+class AdmissionRejected(Exception):
+    """Raised when a call cannot be admitted (queue full or deadline passed)."""
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Continuously refilling token bucket with a per-minute rate."""
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def time_until(self, amount: float, now: float) -> float:
+        """Seconds until `amount` tokens are available (0 if available now)."""
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def consume(self, amount: float, now: float):
+        self._refill(now)
+        self.tokens -= min(amount, self.capacity)
+
+    def refund(self, amount: float, now: float):
+        self._refill(now)
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class _Waiter:
+    __slots__ = ("priority", "tokens", "deadline", "wake", "granted", "removed")
+
+    def __init__(self, priority: Priority, tokens: int, deadline: float, wake):
+        self.priority = priority
+        self.tokens = tokens
+        self.deadline = deadline
+        self.wake = wake
+        self.granted = False
+        self.removed = False
+
+
+class Grant:
+    """Admission of one call; pass it back to `release` when the call is done."""
+
+    __slots__ = ("priority", "tokens", "admitted_at", "waited")
+
+    def __init__(self, priority: Priority, tokens: int, waited: float):
+        self.priority = priority
+        self.tokens = tokens
+        self.admitted_at = time.monotonic()
+        self.waited = waited
+
+
+class HeldStream:
+    """Iterator over a streamed response that holds its admission until closed."""
+
+    def __init__(self, scheduler: "OutboundScheduler", grant: Grant, stream):
+        self._scheduler = scheduler
+        self._grant = grant
+        self._stream = stream
+        self._used_tokens: Optional[int] = None
+        self._released = False
+        self._chunks = iter(stream)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            chunk = next(self._chunks)
+        except BaseException:
+            # Exhausted or failed, either way the call is over
+            self.close()
+            raise
+        self._used_tokens = usage_tokens(chunk) or self._used_tokens
+        return chunk
+
+    def close(self):
+        if self._released:
+            return
+        self._released = True
+        try:
+            close = getattr(self._stream, "close", None)
+            if close is not None:
+                close()
+        finally:
+            self._scheduler.release(self._grant, used_tokens=self._used_tokens)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __del__(self):
+        # Safety net for streams that are dropped without being closed
+        self.close()
+
+
+class HeldAsyncStream:
+    """Async iterator over a streamed response that holds its admission until closed."""
+
+    def __init__(self, scheduler: "OutboundScheduler", grant: Grant, stream):
+        self._scheduler = scheduler
+        self._grant = grant
+        self._stream = stream
+        self._used_tokens: Optional[int] = None
+        self._released = False
+        self._chunks = stream.__aiter__()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            chunk = await self._chunks.__anext__()
+        except BaseException:
+            await self.close()
+            raise
+        self._used_tokens = usage_tokens(chunk) or self._used_tokens
+        return chunk
+
+    def _release(self):
+        if not self._released:
+            self._released = True
+            self._scheduler.release(self._grant, used_tokens=self._used_tokens)
+
+    async def close(self):
+        if self._released:
+            return
+        try:
+            close = getattr(self._stream, "close", None) or getattr(
+                self._stream, "aclose", None
+            )
+            if close is not None:
+                await close()
+        finally:
+            self._release()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    def __del__(self):
+        # The upstream stream cannot be awaited here, but the slot is freed
+        self._release()
+
+
+class OutboundScheduler:
+    """Priority-aware admission control in front of one upstream API."""
+
+    def __init__(
+        self,
+        name: str,
+        requests_per_minute: float,
+        tokens_per_minute: Optional[float] = None,
+        max_concurrency: int = 8,
+        queue_limits: Optional[Dict[Priority, int]] = None,
+        deadlines: Optional[Dict[Priority, float]] = None,
+    ):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.queue_limits = dict(queue_limits or DEFAULT_QUEUE_LIMITS)
+        self.deadlines = dict(deadlines or DEFAULT_DEADLINES)
+        self._requests = TokenBucket(requests_per_minute)
+        self._tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self._lock = threading.Lock()
+        self._queue = []
+        self._sequence = itertools.count()
+        self._queued = {priority: 0 for priority in Priority}
+        self._inflight = 0
+        self._paused_until = 0.0
+        self._metrics = {
+            "admitted": 0,
+            "rejected_queue_full": 0,
+            "rejected_deadline": 0,
+            "rate_limited": 0,
+            "total_wait_seconds": 0.0,
+            "max_queue_depth": 0,
+        }
+
+    # Admission core (all _locked methods expect self._lock to be held)
+
+    def _delay_locked(self, waiter: _Waiter, now: float) -> float:
+        delay = max(0.0, self._paused_until - now)
+        delay = max(delay, self._requests.time_until(1, now))
+        if self._tokens is not None and waiter.tokens:
+            delay = max(delay, self._tokens.time_until(waiter.tokens, now))
+        return delay
+
+    def _pump_locked(self) -> float:
+        """Admit queued calls in priority order; return the delay until the next try."""
+        now = time.monotonic()
+        while self._queue:
+            _, _, waiter = self._queue[0]
+            if waiter.removed:
+                heapq.heappop(self._queue)
+                continue
+            if self._inflight >= self.max_concurrency:
+                return POLL_INTERVAL
+            delay = self._delay_locked(waiter, now)
+            if delay > 0:
+                return delay
+            heapq.heappop(self._queue)
+            self._requests.consume(1, now)
+            if self._tokens is not None and waiter.tokens:
+                self._tokens.consume(waiter.tokens, now)
+            self._queued[waiter.priority] -= 1
+            self._inflight += 1
+            waiter.granted = True
+            waiter.wake()
+        return POLL_INTERVAL
+
+    def _enqueue_locked(
+        self, priority: Priority, tokens: int, deadline: Optional[float], wake
+    ):
+        if self._queued[priority] >= self.queue_limits[priority]:
+            self._metrics["rejected_queue_full"] += 1
+            raise AdmissionRejected(
+                f"{self.name} queue for {priority.name.lower()} calls is full",
+                retry_after=1.0,
+            )
+        if deadline is None:
+            deadline = self.deadlines[priority]
+        waiter = _Waiter(priority, tokens, time.monotonic() + deadline, wake)
+        heapq.heappush(self._queue, (int(priority), next(self._sequence), waiter))
+        self._queued[priority] += 1
+        depth = sum(self._queued.values())
+        self._metrics["max_queue_depth"] = max(self._metrics["max_queue_depth"], depth)
+        return waiter
+
+    def _check_locked(self, waiter: _Waiter, started: float):
+        """Return a Grant if the waiter was admitted, raise if it expired, else None."""
+        if waiter.granted:
+            waited = time.monotonic() - started
+            self._metrics["admitted"] += 1
+            self._metrics["total_wait_seconds"] += waited
+            return Grant(waiter.priority, waiter.tokens, waited)
+        if time.monotonic() >= waiter.deadline:
+            waiter.removed = True
+            self._queued[waiter.priority] -= 1
+            self._metrics["rejected_deadline"] += 1
+            raise AdmissionRejected(
+                f"{self.name} call ({waiter.priority.name.lower()}) was not admitted "
+                f"before its deadline",
+                retry_after=max(0.0, self._paused_until - time.monotonic()) or 1.0,
+            )
+        return None
+
+    def _abandon_locked(self, waiter: _Waiter):
+        if waiter.granted:
+            # Admitted just as the caller was cancelled, give the slot back
+            self._inflight -= 1
+        elif not waiter.removed:
+            waiter.removed = True
+            self._queued[waiter.priority] -= 1
+
+    # Public API
+
+    async def acquire(
+        self,
+        priority: Priority = Priority.INTERACTIVE,
+        tokens: int = 0,
+        deadline: Optional[float] = None,
+    ) -> Grant:
+        """Wait on the event loop until a call may be sent upstream."""
+        loop = asyncio.get_running_loop()
+        event = asyncio.Event()
+        started = time.monotonic()
+        with self._lock:
+            waiter = self._enqueue_locked(
+                priority, tokens, deadline, lambda: loop.call_soon_threadsafe(event.set)
+            )
+        try:
+            while True:
+                with self._lock:
+                    delay = self._pump_locked()
+                    grant = self._check_locked(waiter, started)
+                    if grant:
+                        return grant
+                    delay = min(delay, max(0.0, waiter.deadline - time.monotonic()))
+                try:
+                    await asyncio.wait_for(event.wait(), timeout=delay or 0.001)
+                except asyncio.TimeoutError:
+                    pass
+        except asyncio.CancelledError:
+            with self._lock:
+                self._abandon_locked(waiter)
+            raise
+
+    def acquire_sync(
+        self,
+        priority: Priority = Priority.INTERACTIVE,
+        tokens: int = 0,
+        deadline: Optional[float] = None,
+    ) -> Grant:
+        """Block the current thread until a call may be sent upstream."""
+        event = threading.Event()
+        started = time.monotonic()
+        with self._lock:
+            waiter = self._enqueue_locked(priority, tokens, deadline, event.set)
+        while True:
+            with self._lock:
+                delay = self._pump_locked()
+                grant = self._check_locked(waiter, started)
+                if grant:
+                    return grant
+                delay = min(delay, max(0.0, waiter.deadline - time.monotonic()))
+            event.wait(timeout=delay or 0.001)
+
+    def release(self, grant: Grant, used_tokens: Optional[int] = None):
+        """Mark a call as finished, refunding unused token-bucket capacity."""
+        with self._lock:
+            self._inflight -= 1
+            if self._tokens is not None and used_tokens is not None:
+                unused = grant.tokens - used_tokens
+                if unused > 0:
+                    self._tokens.refund(unused, time.monotonic())
+            self._pump_locked()
+
+    def penalize(self, retry_after: Optional[float] = None):
+        """Pause admissions after upstream answered 429."""
+        with self._lock:
+            self._metrics["rate_limited"] += 1
+            pause = retry_after if retry_after else 1.0
+            self._paused_until = max(self._paused_until, time.monotonic() + pause)
+        logger.warning(
+            "%s rate limited upstream, pausing admissions for %.1fs", self.name, pause
+        )
+
+    @asynccontextmanager
+    async def slot(
+        self, priority: Priority = Priority.INTERACTIVE, tokens: int = 0, deadline=None
+    ):
+        grant = await self.acquire(priority, tokens, deadline)
+        try:
+            yield grant
+        finally:
+            self.release(grant)
+
+    @contextmanager
+    def slot_sync(
+        self, priority: Priority = Priority.INTERACTIVE, tokens: int = 0, deadline=None
+    ):
+        grant = self.acquire_sync(priority, tokens, deadline)
+        try:
+            yield grant
+        finally:
+            self.release(grant)
+
+    async def submit(
+        self,
+        call: Callable[[], Awaitable[Any]],
+        priority: Priority = Priority.INTERACTIVE,
+        tokens: int = 0,
+        deadline: Optional[float] = None,
+        stream: bool = False,
+    ) -> Any:
+        """Run an async upstream call once admitted, re-queueing it after a 429.
+
+        With `stream=True` the call returns an async iterator; it is wrapped in a
+        HeldAsyncStream that keeps the admission until it is exhausted or closed.
+        """
+        for attempt in range(MAX_RATE_LIMIT_RETRIES + 1):
+            grant = await self.acquire(priority, tokens, deadline)
+            try:
+                result = await call()
+            except asyncio.CancelledError:
+                # Cancelled by a deadline or a winning hedge; free the slot
+                self.release(grant)
+                raise
+            except Exception as e:
+                self.release(grant)
+                if not is_rate_limit_error(e) or attempt == MAX_RATE_LIMIT_RETRIES:
+                    raise
+                self.penalize(retry_after_seconds(e))
+                continue
+            if stream:
+                return HeldAsyncStream(self, grant, result)
+            self.release(grant, used_tokens=usage_tokens(result))
+            return result
+
+    def submit_sync(
+        self,
+        call: Callable[[], Any],
+        priority: Priority = Priority.INTERACTIVE,
+        tokens: int = 0,
+        deadline: Optional[float] = None,
+        stream: bool = False,
+    ) -> Any:
+        """Run a blocking upstream call once admitted, re-queueing it after a 429.
+
+        With `stream=True` the call returns an iterator; it is wrapped in a
+        HeldStream that keeps the admission until it is exhausted or closed.
+        """
+        for attempt in range(MAX_RATE_LIMIT_RETRIES + 1):
+            grant = self.acquire_sync(priority, tokens, deadline)
+            try:
+                result = call()
+            except Exception as e:
+                self.release(grant)
+                if not is_rate_limit_error(e) or attempt == MAX_RATE_LIMIT_RETRIES:
+                    raise
+                self.penalize(retry_after_seconds(e))
+                continue
+            if stream:
+                return HeldStream(self, grant, result)
+            self.release(grant, used_tokens=usage_tokens(result))
+            return result
+
+    def metrics(self) -> Dict[str, Any]:
+        """Return queue depths, in-flight calls and admission counters."""
+        with self._lock:
+            metrics = dict(self._metrics)
+            metrics["queue_depth"] = {
+                p.name.lower(): n for p, n in self._queued.items()
+            }
+            metrics["inflight"] = self._inflight
+            metrics["paused_for"] = max(0.0, self._paused_until - time.monotonic())
+        admitted = metrics["admitted"]
+        metrics["avg_wait_seconds"] = (
+            metrics["total_wait_seconds"] / admitted if admitted else 0.0
+        )
+        return metrics
+
+    def queue_depth(self) -> int:
+        with self._lock:
+            return sum(self._queued.values())
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    return getattr(error, "status_code", None) == 429
+
+
+def retry_after_seconds(error: Exception) -> Optional[float]:
+    """Read the retry-after header of a 429 response, if any."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def usage_tokens(result: Any) -> Optional[int]:
+    usage = getattr(result, "usage", None)
+    return getattr(usage, "total_tokens", None) if usage is not None else None
+
+
+def estimate_chat_tokens(messages, max_tokens: int = 500) -> int:
+    """Estimate the tokens a chat completion will consume (prompt + completion)."""
+    characters = sum(len(str(message.get("content") or "")) for message in messages)
+    return characters // 4 + max_tokens
+
+
+# The account-wide limits are split evenly between bridge worker processes;
+# other processes using the API (`app.py --doubt`) are not accounted for
+_worker_share = max(1, int(os.getenv("BRIDGE_WORKERS", "1")))
+
+chat_scheduler = OutboundScheduler(
+    "chat",
+    requests_per_minute=float(os.getenv("OPENAI_CHAT_RPM", "500")) / _worker_share,
+    tokens_per_minute=float(os.getenv("OPENAI_CHAT_TPM", "30000")) / _worker_share,
+    max_concurrency=max(
+        1, int(os.getenv("OPENAI_CHAT_CONCURRENCY", "16")) // _worker_share
+    ),
+)
+
+tts_scheduler = OutboundScheduler(
+    "tts",
+    requests_per_minute=float(os.getenv("OPENAI_TTS_RPM", "50")) / _worker_share,
+    max_concurrency=max(
+        1, int(os.getenv("OPENAI_TTS_CONCURRENCY", "8")) // _worker_share
+    ),
+)
+
+
+def scheduler_metrics() -> Dict[str, Any]:
+    return {"chat": chat_scheduler.metrics(), "tts": tts_scheduler.metrics()}
@@ -0,0 +1,184 @@
+"""
+Per-topic prompt prefix cache for doubt processing.
+
+Provider-side prompt caching only applies to a byte-identical prefix of the
+request, and only once that prefix is at least 1024 tokens long. The static
+part of the doubt prompt (instructions, topic summary and narration) is
+therefore rendered once per topic and reused verbatim; everything that depends
+on the individual request, including the graph context selected within the
+prompt_context token budget, is appended after it. A prefix is rebuilt
+whenever the fingerprint of the topic data changes.
+
+The topic graph itself is deliberately kept out of the prefix: putting it there
+would make every doubt prompt pay for the whole graph. Prefixes shorter than
+the provider minimum are simply not cached upstream, which `cacheable_topics`
+in the metrics reports.
+"""
+
+import hashlib
+import logging
+import threading
+from typing import Dict, Optional, Tuple
+
+from pydantic import BaseModel
+
+from graph_store import as_graph
+from prompt_context import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# Providers only cache prompt prefixes of at least this many tokens
+PROVIDER_CACHE_MIN_TOKENS = 1024
+
+DOUBT_INSTRUCTIONS = """\
+You are an AI assistant helping students understand database concepts through \
+interactive visualizations. Each visualization is a graph of elements (entities, \
+attributes, relationships, components and processes) connected by typed edges, \
+shown to the student together with a spoken narration.
+
+How to answer:
+- Answer the student's question directly in the first sentence, then explain why.
+- Ground every explanation in the visualization data given with the question, and \
+refer to elements by their names so the student can find them on screen.
+- Keep answers short enough to be read aloud: a few sentences of plain prose, \
+without markdown, tables or code blocks unless the question asks for a query.
+- When a question is ambiguous, answer the most likely reading and mention the \
+alternative in one sentence.
+- When a question is about something the visualization does not show, say so, \
+answer from general database knowledge and relate it to the closest element.
+- Use correct database terminology (keys, cardinality, normalization, \
+transactions, indexes, query plans) and define a term the first time you use it.
+- For follow-up questions, build on the earlier answers of the conversation \
+instead of repeating them.
+
+How to highlight:
+- Use the highlight_elements function to highlight the parts of the \
+visualization that your answer talks about.
+- Be specific about which elements should be highlighted to help the student \
+understand the concept; prefer a few precise elements over many loose ones.
+- Only use element IDs that appear in the visualization data given with the \
+question, exactly as written.
+- The elements the student is currently looking at are given with the question; \
+keep them highlighted when the answer is about them."""
+
+
+class TopicPrefix(BaseModel):
+    """The rendered static part of the doubt prompt of a topic."""
+
+    text: str
+    tokens: int
+
+    @property
+    def cacheable(self) -> bool:
+        return self.tokens >= PROVIDER_CACHE_MIN_TOKENS
+
+
+def topic_fingerprint(visualization_data) -> str:
+    """Return a stable hash of the topic data used to build a prefix."""
+    # Stored topic graphs hash their tables once
+    fingerprint = getattr(visualization_data, "fingerprint", None)
+    if fingerprint is not None:
+        return fingerprint
+    return hashlib.sha256(
+        visualization_data.model_dump_json().encode("utf-8")
+    ).hexdigest()
+
+
+def build_topic_prefix(topic: str, visualization_data) -> TopicPrefix:
+    """Render the static system prompt for a topic.
+
+    The prompt holds the instructions, a summary of the topic graph and the
+    narration; the elements relevant to a doubt are sent with the doubt.
+    """
+    graph = as_graph(visualization_data)
+    node_types = sorted(
+        {graph.node_type(node) for node in range(graph.node_count)} - {None}
+    )
+    lines = [
+        DOUBT_INSTRUCTIONS,
+        "",
+        f"The current visualization is about: {topic.replace('_', ' ').title()}",
+        f"It contains {graph.node_count} elements and {graph.edge_count} edges "
+        f"of types: {', '.join(node_types) or 'none'}.",
+    ]
+    if graph.narration:
+        lines += ["", "Narration of the visualization:", graph.narration]
+
+    text = "\n".join(lines)
+    return TopicPrefix(text=text, tokens=estimate_tokens(text))
+
+
+class PromptPrefixCache:
+    """Thread-safe store of rendered prompt prefixes keyed by topic."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Tuple[str, TopicPrefix]] = {}
+        self._metrics = {
+            "hits": 0,
+            "misses": 0,
+            "invalidations": 0,
+            "reused_bytes": 0,
+            "upstream_prompt_tokens": 0,
+            "upstream_cached_tokens": 0,
+        }
+
+    def get(self, topic: str, visualization_data) -> TopicPrefix:
+        """Return the prefix for a topic, rebuilding it if the topic data changed."""
+        fingerprint = topic_fingerprint(visualization_data)
+        with self._lock:
+            entry = self._entries.get(topic)
+            if entry and entry[0] == fingerprint:
+                self._metrics["hits"] += 1
+                self._metrics["reused_bytes"] += len(entry[1].text.encode("utf-8"))
+                return entry[1]
+            if entry:
+                self._metrics["invalidations"] += 1
+                logger.info(
+                    "Topic data for %s changed, rebuilding prompt prefix", topic
+                )
+            self._metrics["misses"] += 1
+
+        prefix = build_topic_prefix(topic, visualization_data)
+        with self._lock:
+            self._entries[topic] = (fingerprint, prefix)
+        return prefix
+
+    def invalidate(self, topic: Optional[str] = None):
+        """Drop the prefix of one topic, or of all topics."""
+        with self._lock:
+            if topic is None:
+                dropped = len(self._entries)
+                self._entries.clear()
+            else:
+                dropped = 1 if self._entries.pop(topic, None) else 0
+            self._metrics["invalidations"] += dropped
+
+    def record_usage(self, usage):
+        """Record how many prompt tokens the provider served from its cache."""
+        if usage is None:
+            return
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached_tokens = getattr(details, "cached_tokens", 0) or 0
+        with self._lock:
+            self._metrics["upstream_prompt_tokens"] += usage.prompt_tokens or 0
+            self._metrics["upstream_cached_tokens"] += cached_tokens
+
+    def metrics(self) -> Dict[str, float]:
+        """Return prefix reuse counters and the upstream cache hit ratio."""
+        with self._lock:
+            metrics = dict(self._metrics)
+            metrics["topics"] = len(self._entries)
+            metrics["cacheable_topics"] = sum(
+                1 for _, prefix in self._entries.values() if prefix.cacheable
+            )
+        lookups = metrics["hits"] + metrics["misses"]
+        metrics["hit_ratio"] = metrics["hits"] / lookups if lookups else 0.0
+        prompt_tokens = metrics["upstream_prompt_tokens"]
+        metrics["upstream_cached_ratio"] = (
+            metrics["upstream_cached_tokens"] / prompt_tokens if prompt_tokens else 0.0
+        )
+        return metrics
+
+
+prefix_cache = PromptPrefixCache()
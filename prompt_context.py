@@ -0,0 +1,252 @@
+"""
+Prompt context extraction for doubt processing.
+
+Instead of dumping every node and edge of a topic into the system prompt, this
+module picks the part of the graph that is relevant to a doubt: the k-hop
+neighborhood around the highlighted elements plus the nodes whose names and
+properties are most similar to the doubt text (TF-IDF cosine similarity). The
+selection is trimmed to a token budget so prompt size stays flat as the
+visualizations grow.
+"""
+
+import os
+import re
+import json
+import math
+import threading
+import weakref
+from collections import Counter
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+
+from pydantic import BaseModel
+
+from graph_store import TopicGraph, as_graph
+
+if TYPE_CHECKING:
+    import numpy as np
+
+DEFAULT_TOKEN_BUDGET = int(os.getenv("DOUBT_CONTEXT_TOKEN_BUDGET", "600"))
+DEFAULT_HOPS = int(os.getenv("DOUBT_CONTEXT_HOPS", "1"))
+
+# Rough characters-per-token ratio for English text and JSON
+CHARS_PER_TOKEN = 4
+
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+class PromptContext(BaseModel):
+    """Subset of a visualization selected for a doubt prompt."""
+
+    nodes: List[dict]
+    edges: List[dict]
+    total_nodes: int
+    total_edges: int
+    token_estimate: int
+
+    @property
+    def truncated(self) -> bool:
+        return len(self.nodes) < self.total_nodes or len(self.edges) < self.total_edges
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimate the number of prompt tokens used by a piece of text."""
+    return max(1, math.ceil(len(text) / CHARS_PER_TOKEN))
+
+
+def tokenize(text: str) -> List[str]:
+    """Split text into lowercase terms, also splitting snake_case identifiers."""
+    return _TOKEN_PATTERN.findall(text.lower().replace("_", " "))
+
+
+def node_text(node) -> str:
+    """Collect the searchable text of a node: id, name, type and properties."""
+    parts = [node.id, node.name, node.type or ""]
+    for attribute in node.attributes or []:
+        parts.extend(
+            str(value) for value in attribute.values() if not isinstance(value, bool)
+        )
+    return " ".join(parts)
+
+
+def similarity_scores(query: str, documents: List[str]) -> "np.ndarray":
+    """Return the TF-IDF cosine similarity between a query and each document."""
+    # NumPy is imported on first use so importing this module stays cheap
+    import numpy as np
+
+    if not documents:
+        return np.zeros(0)
+
+    doc_terms = [tokenize(doc) for doc in documents]
+    vocabulary: Dict[str, int] = {}
+    for terms in doc_terms:
+        for term in terms:
+            vocabulary.setdefault(term, len(vocabulary))
+
+    query_counts = Counter(tokenize(query))
+    if not any(term in vocabulary for term in query_counts):
+        return np.zeros(len(documents))
+
+    tf = np.zeros((len(documents), len(vocabulary)))
+    for row, terms in enumerate(doc_terms):
+        for term in terms:
+            tf[row, vocabulary[term]] += 1
+
+    df = np.count_nonzero(tf, axis=0)
+    idf = np.log((1 + len(documents)) / (1 + df)) + 1
+    doc_vectors = tf * idf
+    doc_vectors /= np.linalg.norm(doc_vectors, axis=1, keepdims=True).clip(min=1e-12)
+
+    # Query terms no document contains match nothing but still count in the
+    # query's norm, so a question that differs in its key term scores lower
+    unseen_idf = math.log(1 + len(documents)) + 1
+    query_vector = np.zeros(len(vocabulary))
+    unseen = 0.0
+    for term, count in query_counts.items():
+        if term in vocabulary:
+            query_vector[vocabulary[term]] = count
+        else:
+            unseen += (count * unseen_idf) ** 2
+    query_vector *= idf
+    query_vector /= max(math.sqrt(query_vector @ query_vector + unseen), 1e-12)
+
+    return doc_vectors @ query_vector
+
+
+class NodeTextIndex:
+    """TF-IDF vectors of a graph's node texts as postings, built once per graph.
+
+    Scores are the cosine similarities of similarity_scores(), but a doubt only
+    touches the postings of its own terms instead of a dense node x term matrix.
+    """
+
+    def __init__(self, documents: List[str]):
+        import numpy as np
+
+        counts = [Counter(tokenize(doc)) for doc in documents]
+        self.size = len(documents)
+        df = Counter(term for terms in counts for term in terms)
+        self.idf = {
+            term: math.log((1 + self.size) / (1 + freq)) + 1
+            for term, freq in df.items()
+        }
+        postings: Dict[str, Tuple[List[int], List[float]]] = {}
+        for doc, terms in enumerate(counts):
+            weights = {term: count * self.idf[term] for term, count in terms.items()}
+            norm = max(math.sqrt(sum(w * w for w in weights.values())), 1e-12)
+            for term, weight in weights.items():
+                docs, values = postings.setdefault(term, ([], []))
+                docs.append(doc)
+                values.append(weight / norm)
+        self.postings = {
+            term: (np.array(docs, dtype=np.int64), np.array(values))
+            for term, (docs, values) in postings.items()
+        }
+
+    def scores(self, query: str) -> "np.ndarray":
+        """Return the similarity between the query and every indexed text."""
+        import numpy as np
+
+        scores = np.zeros(self.size)
+        terms = Counter(tokenize(query))
+        if not any(term in self.idf for term in terms):
+            return scores
+        unseen_idf = math.log(1 + self.size) + 1
+        weights = {
+            term: count * self.idf.get(term, unseen_idf)
+            for term, count in terms.items()
+        }
+        norm = max(math.sqrt(sum(w * w for w in weights.values())), 1e-12)
+        for term, weight in weights.items():
+            if term not in self.postings:
+                continue
+            docs, values = self.postings[term]
+            scores[docs] += values * (weight / norm)
+        return scores
+
+
+_text_indexes: "weakref.WeakKeyDictionary[TopicGraph, NodeTextIndex]" = (
+    weakref.WeakKeyDictionary()
+)
+_text_index_lock = threading.Lock()
+
+
+def node_text_index(graph: TopicGraph) -> NodeTextIndex:
+    """Return the text index of a graph, building it on first use."""
+    with _text_index_lock:
+        index = _text_indexes.get(graph)
+    if index is None:
+        index = NodeTextIndex([node_text(node) for node in graph.nodes])
+        with _text_index_lock:
+            _text_indexes[graph] = index
+    return index
+
+
+def extract_prompt_context(
+    visualization_data,
+    doubt: str,
+    highlighted_elements: Optional[List[str]] = None,
+    token_budget: Optional[int] = None,
+    hops: Optional[int] = None,
+) -> PromptContext:
+    """Select the nodes and edges of a visualization that are relevant to a doubt."""
+    token_budget = DEFAULT_TOKEN_BUDGET if token_budget is None else token_budget
+    hops = DEFAULT_HOPS if hops is None else hops
+
+    graph = as_graph(visualization_data)
+    seeds = [
+        element for element in highlighted_elements or [] if element in graph.index
+    ]
+    distances = graph.k_hop(seeds, hops)
+    similarities = node_text_index(graph).scores(doubt)
+
+    # Highlighted nodes come first, then their neighborhood and the nodes that
+    # match the doubt; with no signal at all, the best connected nodes are used.
+    def relevance(index: int) -> float:
+        score = float(similarities[index])
+        if index in distances:
+            score += 2.0 if distances[index] == 0 else 1.0 / (1 + distances[index])
+        return score
+
+    ranked = sorted(
+        range(graph.node_count), key=lambda i: (-relevance(i), -graph.degree(i))
+    )
+    if seeds or similarities.any():
+        ranked = [i for i in ranked if relevance(i) > 0]
+
+    used_tokens = 0
+    selected_nodes = []
+    selected = []
+    for index in ranked:
+        entry = {
+            "id": graph.ids[index],
+            "name": graph.names[index],
+            "type": graph.node_type(index),
+        }
+        cost = estimate_tokens(json.dumps(entry))
+        if used_tokens + cost > token_budget:
+            break
+        selected_nodes.append(entry)
+        selected.append(index)
+        used_tokens += cost
+
+    # Only the edges touching selected nodes are looked at
+    selected_edges = []
+    for edge in graph.edges_among(selected):
+        entry = {
+            "source": graph.ids[graph.sources[edge]],
+            "target": graph.ids[graph.targets[edge]],
+            "type": graph.edge_type(edge),
+        }
+        cost = estimate_tokens(json.dumps(entry))
+        if used_tokens + cost > token_budget:
+            break
+        selected_edges.append(entry)
+        used_tokens += cost
+
+    return PromptContext(
+        nodes=selected_nodes,
+        edges=selected_edges,
+        total_nodes=graph.node_count,
+        total_edges=graph.edge_count,
+        token_estimate=used_tokens,
+    )
@@ -2,16 +2,36 @@ import os
 import json
 import logging
 import asyncio
-import websockets
+import contextlib
+import time
 from typing import Dict, List, Optional, Union, Any, AsyncGenerator
-from openai import AsyncOpenAI
-from fastapi import WebSocket, WebSocketDisconnect
+from starlette.websockets import WebSocket, WebSocketDisconnect
 from pydantic import BaseModel
 
-logging.basicConfig(level=logging.INFO)
+from audio_buffer import BLOCK_SIZE, AudioBuffer, SpooledAudio
+from audio_cache import audio_cache, audio_cache_key
+from audio_formats import (
+    AUDIO_FORMATS, DEFAULT_FORMAT, DEFAULT_SPEED, PCM_SAMPLE_RATE, PCM_SAMPLE_WIDTH,
+    clamp_speed, negotiate_format
+)
+from cache_store import DOUBT_CACHE_TTL, cache_store, doubt_cache_key
+from openai_scheduler import (
+    AdmissionRejected, Priority, chat_scheduler, tts_scheduler, estimate_chat_tokens
+)
+from ws_sender import BackpressureSender, SessionSender, SlowClientError
+from resilience import chat_calls, tts_calls
+from load_shedding import degraded_answer, remember_answer, shed_reason
+from model_router import model_router
+from cancellation import RequestCancelled, RequestScope
+from openai_clients import async_client
+from mp3_index import index_mp3
+from visualization_state import record_doubt, state_key, visualization_states
+from session_context import SessionContext, session_contexts
+
 logger = logging.getLogger(__name__)
 
-client = AsyncOpenAI(api_key=os.environ.get('OPENAI_API_KEY'))
+# Requests one multiplexed session may run concurrently
+WS_SESSION_MAX_REQUESTS = int(os.getenv('WS_SESSION_MAX_REQUESTS', '8'))
 
 class WordTiming(BaseModel):
     word: str
@@ -24,38 +44,148 @@ class StreamingResponse(BaseModel):
     data: Any
     timestamp: Optional[int] = None
 
-async def stream_text_to_speech(text: str, voice: str = "alloy") -> AsyncGenerator[bytes, None]:
+
+async def synthesize_audio(text: str, voice: str = "alloy", priority: Priority = Priority.NARRATION,
+                           use_cache: bool = True, audio_format: str = DEFAULT_FORMAT,
+                           speed: float = DEFAULT_SPEED) -> AudioBuffer:
+    """Synthesize speech into a bounded-memory buffer; repeated narrations come from the cache."""
+    response_format = AUDIO_FORMATS[audio_format].response_format
+    key = audio_cache_key(text, voice, response_format=response_format, speed=speed)
+    if use_cache:
+        cached = audio_cache.open(key)
+        if cached is not None:
+            logger.info("Serving cached audio %s for text of length %s", key, len(text))
+            return cached
+
+    async def request(timeout: float) -> SpooledAudio:
+        async def fetch():
+            # Read the response incrementally; long narrations spill to disk instead of memory
+            spool = SpooledAudio()
+            try:
+                async with async_client().audio.speech.with_streaming_response.create(
+                    model="tts-1",
+                    voice=voice,
+                    input=text,
+                    response_format=response_format,
+                    speed=speed,
+                    timeout=timeout
+                ) as response:
+                    async for block in response.iter_bytes(BLOCK_SIZE):
+                        spool.write(block)
+            except BaseException:
+                spool.close()
+                raise
+            return spool
+
+        return await tts_scheduler.submit(fetch, priority)
+
+    # Deadlines, retries and hedging (for short texts) come from the TTS call policy;
+    # while upstream is failing, previously cached audio is served even when use_cache is off
+    buffer = await tts_calls.call(
+        request,
+        hedge=len(text) <= tts_calls.policy.hedge_max_chars,
+        fallback=lambda: audio_cache.open(key)
+    )
+
+    if use_cache and isinstance(buffer, SpooledAudio):
+        audio_cache.put_buffer(key, buffer, voice=voice, model="tts-1",
+                               response_format=response_format, speed=speed, text_length=len(text))
+        cached = audio_cache.open(key)
+        if cached is not None:
+            # Stream from the shared page cache and drop the private spool
+            buffer.close()
+            return cached
+    return buffer
+
+
+async def synthesize_speech(text: str, voice: str = "alloy",
+                            priority: Priority = Priority.NARRATION, use_cache: bool = True,
+                            audio_format: str = DEFAULT_FORMAT,
+                            speed: float = DEFAULT_SPEED) -> bytes:
+    """Synthesize speech and return the whole audio as bytes (streaming uses synthesize_audio)."""
+    with await synthesize_audio(text, voice, priority, use_cache, audio_format, speed) as buffer:
+        return buffer.read()
+
+
+async def stream_text_to_speech(text: str, voice: str = "alloy",
+                                priority: Priority = Priority.NARRATION, use_cache: bool = True,
+                                audio_format: str = DEFAULT_FORMAT, speed: float = DEFAULT_SPEED,
+                                buffer: Optional[AudioBuffer] = None
+                                ) -> AsyncGenerator[bytes, None]:
+    """Stream the header and chunks of spoken text.
+
+    An already synthesized `buffer` is streamed (and closed) instead of synthesizing the text.
+    """
     try:
-        logger.info(f"Starting text-to-speech streaming for text of length {len(text)}")
-        
-        response = await client.audio.speech.create(
-            model="tts-1",
-            voice=voice,
-            input=text,
-            response_format="mp3",
-            speed=1.0
-        )
+        logger.info("Starting text-to-speech streaming for text of length %s as %s",
+                    len(text), audio_format)
         
-        chunk_size = 8192
-        audio_data = response.content
+        audio_spec = AUDIO_FORMATS[audio_format]
+        if buffer is None:
+            buffer = await synthesize_audio(text, voice, priority, use_cache, audio_format, speed)
         
-        header = json.dumps({
-            "type": "header",
-            "data": {
-                "content_type": "audio/mpeg",
-                "total_size": len(audio_data)
-            }
-        }).encode()
-        yield header
-        
-        for i in range(0, len(audio_data), chunk_size):
-            chunk = audio_data[i:i+chunk_size]
-            yield chunk
-            await asyncio.sleep(0.01)
+        try:
+            header = json.dumps({
+                "type": "header",
+                "data": {
+                    "content_type": audio_spec.content_type,
+                    "format": audio_spec.name,
+                    "sample_rate": audio_spec.sample_rate,
+                    "total_size": buffer.size,
+                    "duration_ms": measured_duration_ms(buffer, audio_format)
+                }
+            }).encode()
+            yield header
+
+            # Chunks are memoryview slices of the spool or of the mapped cache file, so
+            # nothing is copied here; flow control is left to the sender, so chunks are
+            # only spaced by a yield to the event loop
+            for chunk in buffer.chunks(audio_spec):
+                yield chunk
+                await asyncio.sleep(0)
+        finally:
+            buffer.close()
             
         logger.info("Completed text-to-speech streaming")
     except Exception as e:
-        logger.error(f"Error in text-to-speech streaming: {str(e)}")
+        logger.error("Error in text-to-speech streaming: %s", e)
+        raise
+
+
+def estimate_duration_ms(text: str) -> int:
+    """Estimate the spoken duration of text at 150 words per minute."""
+    return int((len(text.split()) / 150) * 60 * 1000)
+
+
+def measured_duration_ms(buffer: AudioBuffer, audio_format: str = DEFAULT_FORMAT) -> Optional[int]:
+    """Return the real duration of synthesized audio, or None for unmeasured formats (opus)."""
+    if buffer.duration_ms is None:
+        if audio_format == "mp3":
+            # Exact: the frame headers give the samples of every frame
+            index = index_mp3(buffer.view())
+            buffer.duration_ms = index.duration_ms if index is not None else None
+        elif audio_format in ("wav", "pcm"):
+            header_size = 44 if audio_format == "wav" else 0
+            bytes_per_second = PCM_SAMPLE_RATE * PCM_SAMPLE_WIDTH
+            buffer.duration_ms = int(max(0, buffer.size - header_size) * 1000 / bytes_per_second)
+    return buffer.duration_ms
+
+
+async def synthesize_with_timings(scope: RequestScope, text: str, nodes: List[Dict] = None,
+                                  **tts_options):
+    """Synthesize spoken text, then time its words over the measured duration of the audio.
+
+    Returns the audio buffer (the caller closes it) and the word timings; where
+    the duration cannot be measured, the 150 wpm estimate is used.
+    """
+    buffer = await scope.run(synthesize_audio(text, **tts_options), stage="tts",
+                             tts_chars=len(text))
+    try:
+        audio_format = tts_options.get('audio_format', DEFAULT_FORMAT)
+        duration = measured_duration_ms(buffer, audio_format) or estimate_duration_ms(text)
+        return buffer, await generate_word_timings(text, duration, nodes)
+    except BaseException:
+        buffer.close()
         raise
 
 async def generate_word_timings(text: str, audio_duration: int, nodes: List[Dict] = None) -> List[Dict]:
@@ -89,64 +219,136 @@ async def generate_word_timings(text: str, audio_duration: int, nodes: List[Dict
     
     return word_timings
 
-async def handle_websocket_connection(websocket: WebSocket, topic: str):
-    await websocket.accept()
-    
-    try:
-        data = await websocket.receive_text()
-        request_data = json.loads(data)
-        
-        text = request_data.get('text', '')
-        nodes = request_data.get('nodes', [])
-        
-        if not text:
-            await websocket.send_json({"error": "No text provided"})
-            await websocket.close()
-            return
-        
-        words = text.split()
-        word_count = len(words)
-        estimated_duration_ms = int((word_count / 150) * 60 * 1000)
-        
-        word_timings = await generate_word_timings(text, estimated_duration_ms, nodes)
-        
-        await websocket.send_json({
-            "type": "timing",
-            "data": word_timings
-        })
-        
-        first_chunk = True
-        async for audio_chunk in stream_text_to_speech(text):
-            if first_chunk and audio_chunk.startswith(b'{'): 
+
+async def stream_audio_frames(sender, text: str, **tts_options):
+    """Send the header and audio chunks of spoken text through a sender."""
+    first_chunk = True
+    # Closing the generator promptly releases the audio buffer when the stream is cancelled
+    async with contextlib.aclosing(stream_text_to_speech(text, **tts_options)) as audio_stream:
+        async for audio_chunk in audio_stream:
+            if first_chunk and audio_chunk.startswith(b'{'):
                 try:
                     header_info = json.loads(audio_chunk.decode('utf-8'))
-                    await websocket.send_json(header_info)
+                    await sender.send_json(header_info)
                     first_chunk = False
                     continue
-                except:
+                except Exception:
                     pass
-            
-            await websocket.send_bytes(audio_chunk)
-        
+
+            await sender.send_bytes(audio_chunk)
+
+
+async def send_cancelled(websocket: WebSocket, error: RequestCancelled):
+    logger.info("%s", error)
+    if error.reason == "disconnect":
+        return
+    try:
         await websocket.send_json({
-            "type": "end",
-            "data": {"message": "Audio streaming completed"}
+            "type": "cancelled", "reason": error.reason, "stage": error.stage
+        })
+        await websocket.close()
+    except Exception:
+        pass
+
+
+async def send_busy_error(websocket: WebSocket, error: AdmissionRejected):
+    logger.warning("Request rejected by scheduler: %s", error)
+    try:
+        await websocket.send_json({
+            "type": "error", "error": str(error), "retry_after": error.retry_after
+        })
+        await websocket.close(code=1013)
+    except Exception:
+        pass
+
+
+def requested_format(request_data: Dict) -> str:
+    """The audio format to send a client, negotiated from the formats its request accepts."""
+    return negotiate_format(request_data.get('accept_formats') or request_data.get('format')).name
+
+
+async def serve_narration(sender, scope: RequestScope, request_data: Dict):
+    """Stream the word timings and spoken audio of a narration text."""
+    text = request_data.get('text', '')
+    nodes = request_data.get('nodes', [])
+    audio_format = requested_format(request_data)
+    speed = clamp_speed(request_data.get('speed'))
+
+    if not text:
+        await sender.send_json({"error": "No text provided"})
+        return
+
+    # The scope stops synthesis as soon as the client leaves
+    buffer, word_timings = await synthesize_with_timings(scope, text, nodes,
+                                                         audio_format=audio_format, speed=speed)
+    with buffer:
+        await sender.send_json({
+            "type": "timing",
+            "data": word_timings
         })
+        await scope.run(stream_audio_frames(sender, text, buffer=buffer, audio_format=audio_format),
+                        stage="tts", tts_chars=len(text))
+
+    await sender.send_json({
+        "type": "end",
+        "data": {"message": "Audio streaming completed"}
+    })
+
+async def handle_websocket_connection(websocket: WebSocket, topic: str):
+    await websocket.accept()
+    
+    try:
+        data = await websocket.receive_text()
+        request_data = json.loads(data)
+        request_data.setdefault('topic', topic)
+        
+        # Frames go through a bounded send queue so a slow client cannot pile up audio in memory
+        async with RequestScope(websocket, label=f"tts:{topic}") as scope, \
+                BackpressureSender(websocket, label=f"tts:{topic}") as sender:
+            await serve_narration(sender, scope, request_data)
+        await websocket.close()
         
     except WebSocketDisconnect:
         logger.info("WebSocket client disconnected")
+    except SlowClientError as e:
+        logger.info("Closed connection to slow WebSocket client: %s", e)
+    except RequestCancelled as e:
+        await send_cancelled(websocket, e)
+    except AdmissionRejected as e:
+        await send_busy_error(websocket, e)
     except Exception as e:
-        logger.error(f"Error in WebSocket handler: {str(e)}")
+        logger.error("Error in WebSocket handler: %s", e)
         try:
             await websocket.send_json({"error": str(e)})
             await websocket.close()
         except:
             pass
 
-async def process_doubt_with_openai(topic: str, doubt: str, visualization_description: str, current_state: Dict = None) -> str:
+
+async def process_doubt_with_openai(topic: str, doubt: str, visualization_description: str,
+                                    current_state: Dict = None,
+                                    session_id: Optional[str] = None) -> str:
     try:
-        logger.info(f"Processing doubt with OpenAI: {doubt}")
+        logger.info("Processing doubt with OpenAI (%d chars)", len(doubt))
         
+        # Earlier turns of the session, trimmed to a fixed token budget
+        if session_id:
+            conversation = session_contexts.context(state_key(topic, session_id))
+        else:
+            conversation = SessionContext()
+
+        # Answers are shared with the other bridge workers through the cache store
+        cache_key = doubt_cache_key(topic, doubt, visualization_description, current_state or {},
+                                    *conversation.cache_context())
+        cached_text = cache_store.get("doubt_text", cache_key)
+        if cached_text is not None:
+            logger.info("Serving cached answer for doubt")
+            return cached_text
+
+        reason = shed_reason()
+        if reason:
+            raise AdmissionRejected(f"Shedding load: {reason}")
+
         context = {
             "topic": topic,
             "doubt": doubt,
@@ -180,94 +382,314 @@ Please help me understand this better by:
 
 IMPORTANT: Keep your response under 300 words total to ensure it can be converted to audio."""
         
-        response = await client.chat.completions.create(
-            model="gpt-4o-realtime-preview-2024-12-17",
-            messages=[
-                {"role": "system", "content": system_message},
-                {"role": "user", "content": user_message}
-            ],
-            max_tokens=500,
-            temperature=0.7
+        messages = [
+            {"role": "system", "content": system_message},
+            *conversation.messages(),
+            {"role": "user", "content": user_message}
+        ]
+        # Simple lookups go to the small, fast model; multi-step questions to the large one
+        highlighted = (current_state or {}).get('highlighted_elements')
+        route = model_router.route(topic, doubt, highlighted).route
+        max_tokens = route.max_tokens or 500
+        started = time.monotonic()
+        response = await chat_calls.call(
+            lambda timeout: chat_scheduler.submit(
+                lambda: async_client().chat.completions.create(
+                    model=route.model,
+                    messages=messages,
+                    max_tokens=max_tokens,
+                    temperature=0.7,
+                    timeout=timeout
+                ),
+                Priority.INTERACTIVE,
+                tokens=estimate_chat_tokens(messages, max_tokens=max_tokens)
+            )
         )
+        model_router.record(route, time.monotonic() - started, response.usage)
         
         response_text = response.choices[0].message.content
-        logger.info(f"Received response from OpenAI: {response_text[:100]}...")
+        logger.info("Received response from OpenAI (%d chars)", len(response_text))
         
+        cache_store.set("doubt_text", cache_key, response_text, ttl=DOUBT_CACHE_TTL)
+        remember_answer(topic, doubt, response_text, [])
         return response_text
+    except AdmissionRejected:
+        raise
     except Exception as e:
-        logger.error(f"Error processing doubt with OpenAI: {str(e)}")
+        logger.error("Error processing doubt with OpenAI: %s", e)
         return f"I'm sorry, I encountered an error while processing your doubt: {str(e)}"
 
-async def handle_doubt_websocket(websocket: WebSocket):
-    await websocket.accept()
-    
+
+async def serve_state_sync(sender, scope: RequestScope, request_data: Dict):
+    """Version handshake on reconnect: only the state patches since the client's version."""
+    topic = request_data.get('topic', '')
+    session_id = request_data.get('session_id')
+    if not session_id:
+        await sender.send_json({"error": "No session_id provided"})
+        return
+    await sender.send_json({
+        "type": "state_sync",
+        "data": visualization_states.sync(
+            state_key(topic, session_id), request_data.get('since_version')
+        )
+    })
+
+
+def mentioned_topic_nodes(topic: str, text: str) -> List[Dict]:
+    """The id and name of each topic node named in a text, in order of first mention."""
+    # Imported here: app pulls in the chat stack, which narration-only processes never need
+    from app import topic_graph
+    graph = topic_graph(topic)
+    return [
+        {"id": graph.ids[node], "name": graph.names[node]}
+        for node in graph.mentioned_nodes(text)
+    ]
+
+
+async def serve_doubt(sender, scope: RequestScope, request_data: Dict):
+    """Answer a doubt and stream the spoken answer."""
+    topic = request_data.get('topic', '')
+    doubt = request_data.get('doubt', '')
+    current_state = request_data.get('current_state', {})
+    visualization_description = request_data.get('visualization_description', '')
+    audio_format = requested_format(request_data)
+    speed = clamp_speed(request_data.get('speed'))
+
+    # Clients that track a session get state patches instead of full payloads
+    session_id = request_data.get('session_id')
+    since_version = request_data.get('since_version')
+
+    if not doubt:
+        await sender.send_json({"error": "No doubt provided"})
+        return
+
+    await sender.send_json({
+        "type": "status",
+        "data": {"message": "Processing your doubt..."}
+    })
+
+    degraded = None
     try:
-        # Receive the doubt request
-        data = await websocket.receive_text()
-        request_data = json.loads(data)
-        
-        topic = request_data.get('topic', '')
-        doubt = request_data.get('doubt', '')
-        current_state = request_data.get('current_state', {})
-        visualization_description = request_data.get('visualization_description', '')
-        
-        if not doubt:
-            await websocket.send_json({"error": "No doubt provided"})
-            await websocket.close()
-            return
-        
-        await websocket.send_json({
-            "type": "status",
-            "data": {"message": "Processing your doubt..."}
-        })
-        
-        response_text = await process_doubt_with_openai(
+        # Cancelled as soon as the student leaves, so the completion stops being generated
+        response_text = await scope.run(process_doubt_with_openai(
             topic=topic,
             doubt=doubt,
             visualization_description=visualization_description,
-            current_state=current_state
+            current_state=current_state,
+            session_id=session_id
+        ), stage="chat")
+    except AdmissionRejected as e:
+        # Overloaded: answer from the topic FAQ or script right away instead of failing
+        highlighted = (current_state or {}).get('highlighted_elements')
+        degraded = degraded_answer(topic, doubt, highlighted, str(e))
+        response_text = degraded.narration
+    degraded_info = {
+        "degraded": degraded is not None,
+        "degraded_source": degraded.source if degraded else None
+    }
+    if session_id:
+        # Summarizing older turns happens in the background, after this answer
+        session_contexts.record_turn(state_key(topic, session_id), doubt, response_text)
+
+    # The topic elements the answer names are highlighted, and only those are timed
+    nodes = await asyncio.to_thread(mentioned_topic_nodes, topic, response_text)
+    if session_id:
+        # The state is recorded before synthesis, so it carries estimated timings
+        word_timings = await generate_word_timings(
+            response_text, estimate_duration_ms(response_text), nodes
         )
-        
-        await websocket.send_json({
+        highlights = [node['id'] for node in nodes]
+        if degraded:
+            highlights = highlights or degraded.highlights
+        await sender.send_json({
+            "type": "state_patch",
+            "data": record_doubt(
+                topic, session_id, response_text, highlights, word_timings, since_version
+            ),
+            **degraded_info
+        })
+    else:
+        await sender.send_json({
             "type": "text",
-            "data": response_text
+            "data": response_text,
+            **degraded_info
         })
-        
-        words = response_text.split()
-        word_count = len(words)
-        estimated_duration_ms = int((word_count / 150) * 60 * 1000)
-        
-        word_timings = await generate_word_timings(response_text, estimated_duration_ms)
-        
-        await websocket.send_json({
+
+    # Fast-path answers repeat, so their audio is worth caching
+    buffer, word_timings = await synthesize_with_timings(
+        scope, response_text, nodes, priority=Priority.INTERACTIVE,
+        use_cache=degraded is not None, audio_format=audio_format, speed=speed
+    )
+    with buffer:
+        # Timed against the synthesized audio, so they supersede any estimate in the state patch
+        await sender.send_json({
             "type": "timing",
             "data": word_timings
         })
+        frames = stream_audio_frames(sender, response_text, buffer=buffer,
+                                     audio_format=audio_format)
+        await scope.run(frames, stage="tts", tts_chars=len(response_text))
+
+    await sender.send_json({
+        "type": "end",
+        "data": {"message": "Doubt handling completed"}
+    })
+
+async def handle_doubt_websocket(websocket: WebSocket):
+    await websocket.accept()
+    
+    try:
+        # Receive the doubt request
+        data = await websocket.receive_text()
+        request_data = json.loads(data)
+        topic = request_data.get('topic', '')
+        serve = serve_state_sync if request_data.get('type') == 'sync' else serve_doubt
         
-        first_chunk = True
-        async for audio_chunk in stream_text_to_speech(response_text):
-            if first_chunk and audio_chunk.startswith(b'{'): 
-                try:
-                    header_info = json.loads(audio_chunk.decode('utf-8'))
-                    await websocket.send_json(header_info)
-                    first_chunk = False
-                    continue
-                except:
-                    pass
-            
-            await websocket.send_bytes(audio_chunk)
-        
-        await websocket.send_json({
-            "type": "end",
-            "data": {"message": "Doubt handling completed"}
-        })
+        # Frames go through a bounded send queue so a slow client cannot pile up audio in memory;
+        # the scope cancels the completion and the synthesis as soon as the student leaves
+        async with RequestScope(websocket, label=f"doubt:{topic}") as scope, \
+                BackpressureSender(websocket, label=f"doubt:{topic}") as sender:
+            await serve(sender, scope, request_data)
+        await websocket.close()
         
     except WebSocketDisconnect:
         logger.info("WebSocket client disconnected")
+    except SlowClientError as e:
+        logger.info("Closed connection to slow WebSocket client: %s", e)
+    except RequestCancelled as e:
+        await send_cancelled(websocket, e)
+    except AdmissionRejected as e:
+        await send_busy_error(websocket, e)
     except Exception as e:
-        logger.error(f"Error in doubt WebSocket handler: {str(e)}")
+        logger.error("Error in doubt WebSocket handler: %s", e)
         try:
             await websocket.send_json({"error": str(e)})
             await websocket.close()
         except:
-            pass 
\ No newline at end of file
+            pass
+
+
+async def serve_playback(sender, scope: RequestScope, request_data: Dict):
+    """Playback heartbeat: prefetch the narration segments ahead of the playhead."""
+    # narration_prefetch imports this module
+    from narration_prefetch import narration_prefetcher
+    topic = request_data.get('topic', '')
+    session_id = request_data.get('session_id')
+    if not session_id:
+        await sender.send_json({"error": "No session_id provided"})
+        return
+    await sender.send_json({
+        "type": "playback",
+        "data": narration_prefetcher.heartbeat(
+            state_key(topic, session_id), topic,
+            position_ms=request_data.get('position_ms'),
+            segment=request_data.get('segment'),
+            offset_ms=request_data.get('offset_ms') or 0,
+            state=request_data.get('state', 'playing'),
+            voice=request_data.get('voice', 'alloy'),
+            audio_format=requested_format(request_data),
+            speed=clamp_speed(request_data.get('speed'))
+        )
+    })
+
+SESSION_HANDLERS = {
+    "narration": serve_narration,
+    "doubt": serve_doubt,
+    "sync": serve_state_sync,
+    "playback": serve_playback,
+}
+
+
+async def run_session_request(session: SessionSender, request_id: str, request_data: Dict,
+                              signal: asyncio.Future):
+    """Serve one request of a session, reporting its failure on its own stream."""
+    kind = request_data['type']
+    stream = session.stream(request_id)
+    reply = None
+    try:
+        async with RequestScope(label=f"session:{kind}:{request_id}", signal=signal) as scope:
+            await SESSION_HANDLERS[kind](stream, scope, request_data)
+    except RequestCancelled as e:
+        if e.reason != "disconnect":
+            reply = {"type": "cancelled", "reason": e.reason, "stage": e.stage}
+    except AdmissionRejected as e:
+        logger.warning("Session request rejected by scheduler: %s", e)
+        reply = {"type": "error", "error": str(e), "retry_after": e.retry_after}
+    except (SlowClientError, ConnectionError, WebSocketDisconnect):
+        pass
+    except Exception as e:
+        logger.error("Error in session request %s: %s", request_id, e)
+        reply = {"type": "error", "error": str(e)}
+    finally:
+        if reply is not None:
+            try:
+                await stream.send_json(reply)
+            except Exception:
+                pass
+        session.end_stream(request_id)
+
+
+async def handle_session_websocket(websocket: WebSocket):
+    """Serve many concurrent narration, doubt and sync requests over one WebSocket.
+
+    Every client message carries an "id" and a "type" ("narration", "doubt", "sync",
+    "playback" or "cancel"). JSON replies carry the id of their request and audio frames
+    are prefixed with it (see ws_sender.frame_binary); streams are interleaved fairly.
+    A request that cannot start is answered with a control frame without an "id":
+    {"type": "rejected", "request_id", "error"}.
+    """
+    await websocket.accept()
+    requests: Dict[str, tuple] = {}
+    loop = asyncio.get_running_loop()
+
+    async with SessionSender(websocket, label="session") as session:
+        try:
+            while True:
+                try:
+                    message = json.loads(await websocket.receive_text())
+                    request_id = str(message['id'])
+                    kind = message['type']
+                except (ValueError, KeyError, TypeError):
+                    await session.send_json({
+                        "type": "error", "error": "Messages need an id and a type"
+                    })
+                    continue
+
+                if kind == 'cancel':
+                    if request_id in requests and not requests[request_id][1].done():
+                        requests[request_id][1].set_result("cancel")
+                    continue
+
+                error = None
+                if kind not in SESSION_HANDLERS:
+                    error = f"Unknown request type: {kind}"
+                elif request_id in requests:
+                    error = f"Request {request_id} is already running"
+                elif len(requests) >= WS_SESSION_MAX_REQUESTS:
+                    error = f"At most {WS_SESSION_MAX_REQUESTS} requests may run at once"
+                if error:
+                    # A control frame, so a running request with the same id keeps its stream
+                    await session.send_json({
+                        "type": "rejected", "request_id": request_id, "error": error
+                    })
+                    continue
+
+                signal = loop.create_future()
+                task = asyncio.create_task(
+                    run_session_request(session, request_id, message, signal)
+                )
+                requests[request_id] = (task, signal)
+                task.add_done_callback(
+                    lambda _, request_id=request_id: requests.pop(request_id, None)
+                )
+
+        except WebSocketDisconnect:
+            logger.info("Session WebSocket client disconnected")
+        except (SlowClientError, ConnectionError) as e:
+            logger.info("Closed WebSocket session: %s", e)
+        finally:
+            running = list(requests.values())
+            for task, signal in running:
+                if not signal.done():
+                    signal.set_result("disconnect")
+            await asyncio.gather(*(task for task, _ in running), return_exceptions=True)
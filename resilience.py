@@ -0,0 +1,442 @@
+"""
+Deadlines, retries, hedging and circuit breaking for upstream API calls.
+
+Every call type (TTS, chat) has a policy:
+
+- deadline: total time allowed for the call, across retries. Each attempt
+  gets at most `attempt_timeout` of it.
+- retries with full-jitter exponential backoff for transient errors:
+  timeouts, connection errors and 5xx responses. Other errors (bad requests,
+  authentication) are raised at once and do not count against the circuit.
+  Neither do 429s and admission rejections: the scheduler already re-queues
+  rate-limited calls after the advertised retry-after, so retrying them here
+  as well would compound the backoff.
+- hedging (async calls only): when the first attempt has not finished after
+  the recent p95 latency, a duplicate request is sent and the first response
+  wins; the losing response is closed. Only short inputs are hedged, so
+  duplicates stay cheap.
+- circuit breaker: after `failure_threshold` consecutive failures the
+  circuit opens and calls fail fast (or use their fallback, e.g. cached
+  audio) until `reset_timeout` has passed; then one trial call is let
+  through.
+
+Policies are read from the environment, e.g. TTS_CALL_DEADLINE,
+TTS_CALL_RETRIES, TTS_HEDGE_MAX_CHARS, CHAT_BREAKER_THRESHOLD.
+"""
+
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from pydantic import BaseModel
+
+from openai_scheduler import AdmissionRejected, is_rate_limit_error
+
+logger = logging.getLogger(__name__)
+
+# Client exception classes (openai, httpx) that mean the request never got an
+# answer; matched by name so this module does not import the clients eagerly
+TRANSIENT_ERROR_NAMES = {"APIConnectionError", "TimeoutException", "TransportError"}
+
+# Latency samples kept per call type for the hedging quantile
+LATENCY_WINDOW = 200
+MIN_HEDGE_SAMPLES = 20
+
+
+class CallPolicy(BaseModel):
+    """Resilience settings of one call type."""
+
+    name: str
+    deadline: float = 30.0
+    attempt_timeout: float = 15.0
+    retries: int = 2
+    backoff_base: float = 0.25
+    backoff_max: float = 4.0
+    hedge: bool = False
+    hedge_quantile: float = 0.95
+    hedge_min_delay: float = 0.05
+    hedge_max_chars: int = 300
+    failure_threshold: int = 5
+    reset_timeout: float = 30.0
+
+
+def policy_from_env(name: str, **defaults) -> CallPolicy:
+    """Build a policy, letting <NAME>_* environment variables override the defaults."""
+    prefix = name.upper()
+    env_names = {
+        "deadline": f"{prefix}_CALL_DEADLINE",
+        "attempt_timeout": f"{prefix}_CALL_TIMEOUT",
+        "retries": f"{prefix}_CALL_RETRIES",
+        "hedge": f"{prefix}_HEDGE",
+        "hedge_max_chars": f"{prefix}_HEDGE_MAX_CHARS",
+        "failure_threshold": f"{prefix}_BREAKER_THRESHOLD",
+        "reset_timeout": f"{prefix}_BREAKER_RESET",
+    }
+    values = dict(defaults)
+    for field, env_name in env_names.items():
+        value = os.getenv(env_name)
+        if value is not None:
+            values[field] = (
+                value.lower() in ("1", "true", "yes") if field == "hedge" else value
+            )
+    return CallPolicy(name=name, **values)
+
+
+def is_transient_error(error: BaseException) -> bool:
+    """Whether retrying here may succeed: timeouts, connection errors and 5xx.
+
+    429s are not: the scheduler has already retried them.
+    """
+    if isinstance(error, (asyncio.TimeoutError, TimeoutError, ConnectionError)):
+        return True
+    if any(cls.__name__ in TRANSIENT_ERROR_NAMES for cls in type(error).__mro__):
+        return True
+    status = getattr(error, "status_code", None)
+    return isinstance(status, int) and status >= 500
+
+
+def discard_result(result: Any):
+    """Close a response nobody will read, e.g. the losing side of a hedge."""
+    close = getattr(result, "close", None)
+    aclose = getattr(result, "aclose", None)
+    try:
+        if callable(close):
+            close()
+        elif callable(aclose):
+            asyncio.ensure_future(aclose())
+    except Exception as e:
+        logger.debug("Could not close a discarded response: %s", e)
+
+
+def _discard_when_done(task: asyncio.Future):
+    if not task.cancelled() and task.exception() is None:
+        discard_result(task.result())
+
+
+class CircuitOpenError(AdmissionRejected):
+    """Raised instead of calling upstream while the circuit is open."""
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker with a half-open trial call."""
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.trial_in_flight = False
+        self.opens = 0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def retry_after(self) -> float:
+        if self.opened_at is None:
+            return 0.0
+        return max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at))
+
+    def allow(self) -> bool:
+        """Whether a call may go upstream; in half-open state only one trial may."""
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half_open" and not self.trial_in_flight:
+                self.trial_in_flight = True
+                return True
+            return False
+
+    def cancel_trial(self):
+        """Let another trial through after one ended without a verdict."""
+        with self._lock:
+            self.trial_in_flight = False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self.trial_in_flight = False
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    self.opens += 1
+                    logger.warning(
+                        "Circuit opened after %d consecutive failures", self.failures
+                    )
+                self.opened_at = time.monotonic()
+
+
+class ResilientCaller:
+    """Applies a CallPolicy to upstream calls and keeps their metrics."""
+
+    def __init__(self, policy: CallPolicy):
+        self.policy = policy
+        self.breaker = CircuitBreaker(policy.failure_threshold, policy.reset_timeout)
+        self._latencies: deque = deque(maxlen=LATENCY_WINDOW)
+        self._lock = threading.Lock()
+        self.counters = {
+            "calls": 0,
+            "successes": 0,
+            "failures": 0,
+            "timeouts": 0,
+            "retries": 0,
+            "rejected_open": 0,
+            "fallbacks": 0,
+            "hedges": 0,
+            "hedge_wins": 0,
+            "cancelled": 0,
+            "permanent_errors": 0,
+            "rate_limited": 0,
+        }
+
+    def _count(self, name: str, amount: int = 1):
+        with self._lock:
+            self.counters[name] += amount
+
+    def latency_quantile(self, quantile: float) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self._latencies)
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(quantile * len(samples)))]
+
+    def hedge_delay(self) -> Optional[float]:
+        """Delay before sending a hedge, or None while there are too few samples."""
+        with self._lock:
+            enough = len(self._latencies) >= MIN_HEDGE_SAMPLES
+        if not enough:
+            return None
+        return max(
+            self.policy.hedge_min_delay,
+            self.latency_quantile(self.policy.hedge_quantile),
+        )
+
+    def backoff(self, attempt: int) -> float:
+        """Full-jitter exponential backoff before retry number `attempt` (from 0)."""
+        cap = min(self.policy.backoff_max, self.policy.backoff_base * 2**attempt)
+        return random.uniform(0, cap)
+
+    def _succeeded(self, started: float):
+        with self._lock:
+            self._latencies.append(time.monotonic() - started)
+            self.counters["successes"] += 1
+        self.breaker.record_success()
+
+    def _reject_open(self):
+        self._count("rejected_open")
+        raise CircuitOpenError(
+            f"{self.policy.name} upstream is unavailable",
+            retry_after=self.breaker.retry_after(),
+        )
+
+    async def _attempt(
+        self, call: Callable[[float], Awaitable[Any]], timeout: float, hedge: bool
+    ):
+        """Run one attempt, sending a hedged duplicate if it is slower than usual."""
+        delay = self.hedge_delay() if hedge else None
+        primary = asyncio.ensure_future(call(timeout))
+        if delay is None or delay >= timeout:
+            return await asyncio.wait_for(primary, timeout)
+
+        tasks = {primary}
+        started = time.monotonic()
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done:
+                self._count("hedges")
+                tasks.add(asyncio.ensure_future(call(timeout - delay)))
+            error = winner = None
+            while tasks and winner is None:
+                remaining = timeout - (time.monotonic() - started)
+                if remaining <= 0:
+                    raise asyncio.TimeoutError()
+                done, _ = await asyncio.wait(
+                    tasks, timeout=remaining, return_when=asyncio.FIRST_COMPLETED
+                )
+                tasks -= done
+                for task in done:
+                    if task.exception() is not None:
+                        error = task.exception()
+                    elif winner is None:
+                        winner = task
+                    else:
+                        # Both attempts finished together; only one is returned
+                        discard_result(task.result())
+            if winner is None:
+                raise error
+            if winner is not primary:
+                self._count("hedge_wins")
+            return winner.result()
+        finally:
+            for task in tasks:
+                # A duplicate may still complete before the cancellation lands
+                task.add_done_callback(_discard_when_done)
+                task.cancel()
+
+    async def call(
+        self,
+        call: Callable[[float], Awaitable[Any]],
+        hedge: bool = False,
+        fallback: Optional[Callable[[], Any]] = None,
+    ) -> Any:
+        """Run an async call under the policy.
+
+        `call` receives the seconds left for the attempt. `hedge` marks calls
+        that may be duplicated. `fallback` is used when the circuit is open
+        or every attempt failed; returning None means there is no fallback.
+        """
+        self._count("calls")
+        if not self.breaker.allow():
+            return self._fallback_or(fallback, self._reject_open)
+
+        deadline = time.monotonic() + self.policy.deadline
+        for attempt in range(self.policy.retries + 1):
+            started = time.monotonic()
+            timeout = min(self.policy.attempt_timeout, deadline - started)
+            try:
+                result = await self._attempt(call, timeout, hedge and self.policy.hedge)
+            except asyncio.CancelledError:
+                # The client went away; the upstream request was abandoned with it
+                self._count("cancelled")
+                self.breaker.cancel_trial()
+                raise
+            except AdmissionRejected:
+                self.breaker.cancel_trial()
+                raise
+            except Exception as e:
+                if not is_transient_error(e):
+                    self._not_retried(e)
+                    raise
+                if isinstance(e, asyncio.TimeoutError):
+                    self._count("timeouts")
+                pause = self.backoff(attempt)
+                if (
+                    attempt == self.policy.retries
+                    or time.monotonic() + pause >= deadline
+                ):
+                    return self._failed(e, fallback)
+                self._count("retries")
+                logger.warning(
+                    "%s call failed (%s), retrying in %.2fs",
+                    self.policy.name,
+                    type(e).__name__,
+                    pause,
+                )
+                await asyncio.sleep(pause)
+                continue
+            self._succeeded(started)
+            return result
+
+    def call_sync(
+        self, call: Callable[[float], Any], fallback: Optional[Callable[[], Any]] = None
+    ) -> Any:
+        """Blocking variant of `call` (no hedging); `call` must honour its timeout."""
+        self._count("calls")
+        if not self.breaker.allow():
+            return self._fallback_or(fallback, self._reject_open)
+
+        deadline = time.monotonic() + self.policy.deadline
+        for attempt in range(self.policy.retries + 1):
+            started = time.monotonic()
+            timeout = min(self.policy.attempt_timeout, deadline - started)
+            try:
+                result = call(timeout)
+            except (AdmissionRejected, asyncio.CancelledError):
+                self.breaker.cancel_trial()
+                raise
+            except Exception as e:
+                if not is_transient_error(e):
+                    self._not_retried(e)
+                    raise
+                if "timeout" in type(e).__name__.lower():
+                    self._count("timeouts")
+                pause = self.backoff(attempt)
+                if (
+                    attempt == self.policy.retries
+                    or time.monotonic() + pause >= deadline
+                ):
+                    return self._failed(e, fallback)
+                self._count("retries")
+                logger.warning(
+                    "%s call failed (%s), retrying in %.2fs",
+                    self.policy.name,
+                    type(e).__name__,
+                    pause,
+                )
+                time.sleep(pause)
+                continue
+            self._succeeded(started)
+            return result
+
+    def _not_retried(self, error: Exception):
+        """Count an error raised without retrying; the circuit only tracks upstream health."""
+        self._count(
+            "rate_limited" if is_rate_limit_error(error) else "permanent_errors"
+        )
+        self.breaker.cancel_trial()
+
+    def _failed(self, error: Exception, fallback: Optional[Callable[[], Any]]):
+        self._count("failures")
+        self.breaker.record_failure()
+
+        def reraise():
+            raise error
+
+        return self._fallback_or(fallback, reraise)
+
+    def _fallback_or(
+        self, fallback: Optional[Callable[[], Any]], otherwise: Callable[[], Any]
+    ):
+        result = fallback() if fallback else None
+        if result is None:
+            return otherwise()
+        self._count("fallbacks")
+        return result
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            counters = dict(self.counters)
+        p50, p95 = self.latency_quantile(0.5), self.latency_quantile(0.95)
+        return {
+            **counters,
+            "hedge_win_rate": (
+                round(counters["hedge_wins"] / counters["hedges"], 3)
+                if counters["hedges"]
+                else None
+            ),
+            "latency_p50": round(p50, 3) if p50 is not None else None,
+            "latency_p95": round(p95, 3) if p95 is not None else None,
+            "breaker": self.breaker.state,
+            "breaker_opens": self.breaker.opens,
+        }
+
+
+tts_calls = ResilientCaller(
+    policy_from_env(
+        "tts", deadline=20.0, attempt_timeout=10.0, hedge=True, hedge_max_chars=300
+    )
+)
+chat_calls = ResilientCaller(
+    policy_from_env("chat", deadline=60.0, attempt_timeout=45.0, retries=1)
+)
+
+
+def resilience_metrics() -> Dict[str, Any]:
+    """Return the metrics of every call type."""
+    return {caller.policy.name: caller.metrics() for caller in (tts_calls, chat_calls)}
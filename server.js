@@ -40,6 +40,31 @@ app.use(express.static(join(__dirname, 'client/dist')));
 // Cache for visualization data
 const visualizationCache = new Map();
 
+// Doubt processes are killed when their client disconnects or after this deadline,
+// so abandoned questions stop using the OpenAI API
+const DOUBT_DEADLINE_MS = parseInt(process.env.DOUBT_DEADLINE_MS || '120000', 10);
+const cancelledDoubts = { disconnect: 0, deadline: 0 };
+
+function cancelProcess(child, reason) {
+  if (child.exitCode !== null || child.signalCode !== null) {
+    return;
+  }
+  cancelledDoubts[reason] += 1;
+  console.log(`Cancelling Python process ${child.pid} (${reason}); cancelled so far:`, cancelledDoubts);
+  child.kill('SIGTERM');
+}
+
+function trackProcess(socket, child, deadlineMs) {
+  socket.data.processes = socket.data.processes || new Set();
+  socket.data.processes.add(child);
+  const timer = setTimeout(() => cancelProcess(child, 'deadline'), deadlineMs);
+  child.on('close', () => {
+    clearTimeout(timer);
+    socket.data.processes.delete(child);
+  });
+  return child;
+}
+
 // Endpoint to get an ephemeral token for WebRTC connection
 app.get('/token', async (req, res) => {
   try {
@@ -249,15 +274,17 @@ io.on('connection', (socket) => {
         topic: data.topic,
         doubt: data.doubt,
         current_state: currentState,
-        current_time: currentTime
+        current_time: currentTime,
+        // Follow-up doubts on this connection share one conversation context
+        session_id: data.session_id || socket.id
       };
       
       // Spawn Python process to handle the doubt
-      const pythonProcess = spawn('python', [
+      const pythonProcess = trackProcess(socket, spawn('python', [
         'app.py', 
         '--doubt', 
         '--topic', data.topic
-      ]);
+      ]), DOUBT_DEADLINE_MS);
       
       // Send the doubt request to the Python process
       pythonProcess.stdin.write(JSON.stringify(doubtRequest));
@@ -325,6 +352,9 @@ io.on('connection', (socket) => {
   // Handle disconnect
   socket.on('disconnect', () => {
     console.log('Client disconnected:', socket.id);
+    for (const child of socket.data.processes || []) {
+      cancelProcess(child, 'disconnect');
+    }
   });
 });
 
@@ -0,0 +1,341 @@
+"""
+Per-session conversation context for follow-up doubts.
+
+Doubts used to be answered without any memory of the session, so a
+follow-up such as "why is that?" lost what "that" was. Each student session
+now keeps its conversation in the shared cache store, and the doubt prompt
+gets a bounded slice of it:
+
+- a rolling summary of the older turns;
+- the last SESSION_RECENT_TURNS turns verbatim (long answers clipped), newest
+  first until the budget is spent.
+
+The slice never exceeds SESSION_CONTEXT_TOKEN_BUDGET tokens, of which the
+summary gets at most SESSION_SUMMARY_TOKEN_BUDGET, so prompt size and
+follow-up latency stay flat however long the session runs.
+
+Turns that leave the recent window are first shown as a one-line digest
+(the doubt and the start of the answer), which costs nothing. A model then
+folds them into the summary in a background thread at prefetch priority, so
+summarizing never sits on a doubt's critical path. One-shot doubt processes
+(`app.py --doubt`) turn background summaries off, since the process would
+exit before a summary arrives; their older turns are merged into the summary
+as digests instead.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+from typing import Callable, Dict, List
+
+from pydantic import BaseModel
+
+from cache_store import cache_store
+from model_router import ROUTER_SIMPLE_MODEL
+from openai_scheduler import Priority, chat_scheduler, estimate_chat_tokens
+from prompt_context import CHARS_PER_TOKEN, estimate_tokens
+from resilience import chat_calls
+
+logger = logging.getLogger(__name__)
+
+SESSION_CONTEXT_TOKEN_BUDGET = int(os.getenv("SESSION_CONTEXT_TOKEN_BUDGET", "500"))
+SESSION_SUMMARY_TOKEN_BUDGET = int(os.getenv("SESSION_SUMMARY_TOKEN_BUDGET", "200"))
+SESSION_RECENT_TURNS = int(os.getenv("SESSION_RECENT_TURNS", "3"))
+SESSION_CONTEXT_TTL = float(os.getenv("SESSION_CONTEXT_TTL", str(24 * 3600)))
+SESSION_SUMMARY_MODEL = os.getenv("SESSION_SUMMARY_MODEL", ROUTER_SIMPLE_MODEL)
+
+# Longest doubt or answer stored per turn
+TURN_TOKENS = 250
+# How long one process may hold a session's summarizing lease
+SUMMARY_LEASE_TTL = 60.0
+
+SUMMARY_PROMPT = (
+    "You keep a running summary of a tutoring session about a database "
+    "visualization. Merge the new exchanges into the summary. Keep what the "
+    "student asked, what was explained and which elements were discussed; "
+    "drop greetings and repetition. Answer with the summary only, in at most "
+    "{words} words."
+)
+
+
+def clip(text: str, tokens: int) -> str:
+    """Shorten text to about `tokens` tokens, at a word boundary."""
+    limit = tokens * CHARS_PER_TOKEN
+    text = " ".join((text or "").split())
+    if len(text) <= limit:
+        return text
+    return text[:limit].rsplit(" ", 1)[0] + " ..."
+
+
+def fit_lines(lines: List[str], tokens: int) -> str:
+    """Join the most recent lines that fit in `tokens` tokens."""
+    kept: List[str] = []
+    used = 0
+    for line in reversed([line for line in lines if line]):
+        cost = estimate_tokens(line)
+        if used + cost > tokens:
+            if not kept:
+                kept.append(clip(line, tokens))
+            break
+        kept.append(line)
+        used += cost
+    return "\n".join(reversed(kept))
+
+
+class Turn(BaseModel):
+    """A doubt of the session and the answer it got."""
+
+    seq: int
+    doubt: str
+    answer: str
+
+    def digest(self) -> str:
+        answer = self.answer.split(". ")[0]
+        return f"Student asked: {clip(self.doubt, 30)} Answer: {clip(answer, 40)}"
+
+
+def _digest_tokens(turns: List[Dict]) -> int:
+    return sum(estimate_tokens(Turn(**turn).digest()) for turn in turns)
+
+
+class SessionContext(BaseModel):
+    """The part of a session's conversation that goes into the next prompt."""
+
+    summary: str = ""
+    turns: List[Turn] = []
+    token_estimate: int = 0
+
+    @property
+    def empty(self) -> bool:
+        return not self.summary and not self.turns
+
+    def messages(self) -> List[Dict[str, str]]:
+        """Chat messages for the conversation so far, oldest first."""
+        messages = []
+        if self.summary:
+            messages.append(
+                {
+                    "role": "system",
+                    "content": f"Earlier in this session:\n{self.summary}",
+                }
+            )
+        for turn in self.turns:
+            messages.append({"role": "user", "content": turn.doubt})
+            messages.append({"role": "assistant", "content": turn.answer})
+        return messages
+
+    def cache_context(self) -> List[str]:
+        """Extra doubt cache key parts: follow-ups are only shared within a conversation."""
+        if self.empty:
+            return []
+        payload = json.dumps([self.summary, [turn.seq for turn in self.turns]])
+        return [hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]]
+
+
+def summarize_turns(summary: str, turns: List[Turn], tokens: int) -> str:
+    """Fold turns into a summary with the small chat model, at prefetch priority."""
+    from openai_clients import sync_client
+
+    exchanges = "\n".join(
+        f"Student: {turn.doubt}\nTutor: {turn.answer}" for turn in turns
+    )
+    messages = [
+        {"role": "system", "content": SUMMARY_PROMPT.format(words=tokens * 3 // 4)},
+        {
+            "role": "user",
+            "content": f"Summary so far:\n{summary or '(none)'}\n\nNew exchanges:\n{exchanges}",
+        },
+    ]
+    response = chat_calls.call_sync(
+        lambda timeout: chat_scheduler.submit_sync(
+            lambda: sync_client().chat.completions.create(
+                model=SESSION_SUMMARY_MODEL,
+                messages=messages,
+                max_tokens=tokens,
+                temperature=0.2,
+                timeout=timeout,
+            ),
+            Priority.PREFETCH,
+            tokens=estimate_chat_tokens(messages, max_tokens=tokens),
+        )
+    )
+    return (response.choices[0].message.content or "").strip()
+
+
+class SessionContextStore:
+    """Recent turns and a rolling summary per session, held to a token budget."""
+
+    def __init__(
+        self,
+        store=cache_store,
+        budget: int = SESSION_CONTEXT_TOKEN_BUDGET,
+        summary_budget: int = SESSION_SUMMARY_TOKEN_BUDGET,
+        recent_turns: int = SESSION_RECENT_TURNS,
+        ttl: float = SESSION_CONTEXT_TTL,
+        summarize: Callable[[str, List[Turn], int], str] = summarize_turns,
+    ):
+        self.store = store
+        self.budget = budget
+        self.summary_budget = min(summary_budget, budget)
+        self.recent_turns = recent_turns
+        self.ttl = ttl
+        self.summarize = summarize
+        # Off in one-shot processes, which would exit before the summary arrives
+        self.background_summaries = True
+        self._lock = threading.Lock()
+        self._summarizing: set = set()
+        self._counters = {"turns": 0, "digests_merged": 0, "summaries": 0, "failed": 0}
+
+    @staticmethod
+    def _initial() -> Dict:
+        return {
+            "summary": "",
+            "summary_version": 0,
+            # Left the recent window, not yet in the summary
+            "folded": [],
+            "turns": [],
+            "next_seq": 1,
+        }
+
+    def _load(self, key: str) -> Dict:
+        return self.store.get("session_context", key) or self._initial()
+
+    def context(self, key: str) -> SessionContext:
+        """Return the summary and recent turns that fit the token budget."""
+        entry = self._load(key)
+        folded = [Turn(**turn).digest() for turn in entry["folded"]]
+        summary = fit_lines([entry["summary"], *folded], self.summary_budget)
+        remaining = self.budget - (estimate_tokens(summary) if summary else 0)
+
+        turns: List[Turn] = []
+        for turn in reversed(entry["turns"]):
+            cost = estimate_tokens(turn["doubt"]) + estimate_tokens(turn["answer"])
+            if cost > remaining:
+                break
+            turns.insert(0, Turn(**turn))
+            remaining -= cost
+        return SessionContext(
+            summary=summary, turns=turns, token_estimate=self.budget - remaining
+        )
+
+    def record_turn(self, key: str, doubt: str, answer: str):
+        """Add an answered doubt, moving the oldest turns out of the recent window.
+
+        The read and the write are one transaction of the shared store, so
+        processes answering doubts of the same session never drop each other's
+        turns.
+        """
+        merged = []
+
+        def add(entry):
+            entry = entry or self._initial()
+            entry["turns"].append(
+                {
+                    "seq": entry["next_seq"],
+                    "doubt": clip(doubt, TURN_TOKENS),
+                    "answer": clip(answer, TURN_TOKENS),
+                }
+            )
+            entry["next_seq"] += 1
+            while len(entry["turns"]) > self.recent_turns:
+                entry["folded"].append(entry["turns"].pop(0))
+            # Digests wait for the model summary while they fit the summary budget;
+            # without background summaries they are merged right away
+            while entry["folded"] and (
+                not self.background_summaries
+                or _digest_tokens(entry["folded"]) > self.summary_budget
+            ):
+                turn = Turn(**entry["folded"].pop(0))
+                entry["summary"] = fit_lines(
+                    [entry["summary"], turn.digest()], self.summary_budget
+                )
+                entry["summary_version"] += 1
+                merged.append(turn.seq)
+            return entry
+
+        entry = self.store.update("session_context", key, add, ttl=self.ttl)
+        with self._lock:
+            self._counters["turns"] += 1
+            self._counters["digests_merged"] += len(merged)
+        if entry["folded"] and self.background_summaries:
+            self.schedule_summary(key)
+
+    def summarize_pending(self, key: str) -> bool:
+        """Fold the turns that left the recent window into the summary with the model."""
+        # Threads of one process are already serialized by _summarizing; the
+        # lease keeps other processes from summarizing the same turns
+        lease, owner = f"session_summary:{key}", str(os.getpid())
+        if not self.store.try_lease(lease, owner, SUMMARY_LEASE_TTL):
+            return False
+        try:
+            return self._summarize_folded(key)
+        finally:
+            self.store.release_lease(lease, owner)
+
+    def _summarize_folded(self, key: str) -> bool:
+        entry = self._load(key)
+        if not entry["folded"]:
+            return False
+        folded = [Turn(**turn) for turn in entry["folded"]]
+        try:
+            summary = self.summarize(entry["summary"], folded, self.summary_budget)
+        except Exception as e:
+            with self._lock:
+                self._counters["failed"] += 1
+            logger.warning("Could not summarize session %s: %s", key, e)
+            return False
+        if not summary:
+            return False
+
+        applied = []
+
+        def fold(latest):
+            latest = latest or self._initial()
+            if latest["summary_version"] != entry["summary_version"]:
+                # The summary changed meanwhile; the next turn tries again
+                return latest
+            latest["folded"] = [
+                turn for turn in latest["folded"] if turn["seq"] > folded[-1].seq
+            ]
+            latest["summary"] = fit_lines([summary], self.summary_budget)
+            latest["summary_version"] += 1
+            applied.append(True)
+            return latest
+
+        self.store.update("session_context", key, fold, ttl=self.ttl)
+        if not applied:
+            return False
+        with self._lock:
+            self._counters["summaries"] += 1
+        logger.info("Summarized %d turns of session %s", len(folded), key)
+        return True
+
+    def schedule_summary(self, key: str):
+        """Summarize a session's folded turns in a background thread (once at a time)."""
+        with self._lock:
+            if key in self._summarizing:
+                return
+            self._summarizing.add(key)
+
+        def run():
+            try:
+                self.summarize_pending(key)
+            finally:
+                with self._lock:
+                    self._summarizing.discard(key)
+
+        threading.Thread(target=run, name="session-summary", daemon=True).start()
+
+    def metrics(self) -> Dict[str, int]:
+        with self._lock:
+            return {**self._counters, "summarizing": len(self._summarizing)}
+
+
+session_contexts = SessionContextStore()
+
+
+def session_context_metrics() -> Dict[str, int]:
+    """Return how many turns were recorded, merged as digests or summarized."""
+    return session_contexts.metrics()
@@ -9,44 +9,69 @@ import os
 import json
 import logging
 import asyncio
+import contextlib
 import sys
 import argparse
 import socket
-from fastapi import FastAPI, HTTPException, Request
-from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import List, Dict, Any, Optional
-import uvicorn
+import signal
+import multiprocessing
+from fastapi import APIRouter, HTTPException, Request, WebSocket
+from pydantic import BaseModel, ConfigDict, Field
+from typing import List, Dict, Any, Literal, Optional
 import time
 
 # Import the text-to-speech functionality from the existing backend
-from realtime_audio import stream_text_to_speech, generate_word_timings
+from realtime_audio import (
+    stream_text_to_speech, generate_word_timings, estimate_duration_ms,
+    handle_websocket_connection, handle_doubt_websocket, handle_session_websocket
+)
+from openai_scheduler import scheduler_metrics
+from resilience import resilience_metrics
+from load_shedding import shedding_metrics
+from model_router import router_metrics
+from cancellation import cancellation_metrics
+from session_context import session_context_metrics
+from traffic_capture import TrafficCaptureMiddleware, traffic_capture_metrics, traffic_recorder
+from graph_store import graph_store_metrics
+from narration_prefetch import (
+    load_plan, narration_prefetch_metrics, narration_prefetcher, segment_cache_key
+)
+from logging_config import logging_metrics, setup_logging
+from dotenv import load_dotenv
+from narration_warmup import WarmupProgress, warm_narrations
+from ws_sender import connection_metrics
+from cache_store import cache_store, purge_expired_periodically
+from audio_cache import audio_cache
+from audio_buffer import BLOCK_SIZE
+from audio_formats import (
+    AUDIO_FORMATS, ENABLED_FORMATS, DEFAULT_FORMAT,
+    clamp_speed, formats_from_accept, negotiate_format
+)
+from app import (
+    MAX_BATCH_CONCURRENCY, DoubtBatchItem, compute_topic_layout, process_doubt_batch, topic_graph
+)
+from graph_stream import DEFAULT_BATCH_SIZE, iter_ndjson, parse_viewport
+from visualization_state import state_key, visualization_states
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Parse command-line arguments
-parser = argparse.ArgumentParser(description='Socket.IO TTS Bridge')
-parser.add_argument('--mode', type=str, default='tts', help='Mode to run in (tts, doubt)')
-parser.add_argument('--port', type=int, default=0, help='Port to run on (0 for auto)')
-args = parser.parse_args()
-
-# Create FastAPI app
-app = FastAPI(
-    title="Socket.IO TTS Bridge",
-    description="Bridge between Socket.IO server and Python TTS functionality",
-    version="1.0.0"
-)
+# Routes are collected here and mounted by create_app(), so importing this
+# module neither parses arguments nor builds the application
+router = APIRouter()
 
-# Enable CORS
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    """Parse the bridge's command-line arguments."""
+    parser = argparse.ArgumentParser(description='Socket.IO TTS Bridge')
+    parser.add_argument('--mode', type=str, default='tts', help='Mode to run in (tts, doubt)')
+    parser.add_argument('--port', type=int, default=0, help='Port to run on (0 for auto)')
+    parser.add_argument('--warmup', action='store_true',
+                        help='Pre-synthesize static narrations at startup')
+    parser.add_argument('--warmup-workers', type=int, default=4,
+                        help='Concurrent TTS workers for warm-up')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Number of worker processes sharing the port')
+    return parser.parse_args(argv)
 
 class TTSRequest(BaseModel):
     """Request model for text-to-speech generation."""
@@ -57,7 +82,9 @@ class TTSRequest(BaseModel):
 class WordTimingRequest(BaseModel):
     """Request model for word timing generation."""
     text: str
-    audio_duration: int
+    audio_duration: Optional[int] = None
+    # Cached MP3 narration whose measured duration the timings should span
+    audio_key: Optional[str] = None
     nodes: Optional[List[Dict[str, Any]]] = None
 
 class DoubtRequest(BaseModel):
@@ -66,30 +93,326 @@ class DoubtRequest(BaseModel):
     doubt: str
     current_state: Dict[str, Any]
 
-@app.get("/")
+
+class DoubtBatchRequest(BaseModel):
+    """Request model for batch doubt processing."""
+    items: List[DoubtBatchItem]
+    concurrency: int = Field(4, ge=1, le=MAX_BATCH_CONCURRENCY)
+
+
+class StateChanges(BaseModel):
+    """Changes a client may make to its visualization state; a None item removes it."""
+    nodes: Dict[str, Optional[Dict[str, Any]]] = {}
+    highlights: Dict[str, Optional[Literal[True]]] = {}
+    model_config = ConfigDict(extra="forbid")
+
+
+class StateUpdateRequest(BaseModel):
+    """Request model for visualization state changes."""
+    session_id: str
+    changes: StateChanges
+    since_version: Optional[int] = None
+
+
+class PlaybackHeartbeat(BaseModel):
+    """Request model for narration playback heartbeats."""
+    session_id: str
+    position_ms: Optional[int] = None
+    # Alternatively, the segment playing and the offset into it
+    segment: Optional[int] = None
+    offset_ms: int = 0
+    state: str = "playing"
+    voice: str = "alloy"
+    format: Optional[str] = None
+    speed: Optional[float] = None
+
+
+# Progress of the optional narration warm-up
+warmup_progress = WarmupProgress()
+
+# Only one worker process runs the warm-up; it holds this lease while it does
+WARMUP_LEASE = "narration_warmup"
+WARMUP_LEASE_TTL = 120
+worker_id = f"{socket.gethostname()}:{os.getpid()}"
+
+
+def publish_warmup_progress(progress: WarmupProgress):
+    """Share warm-up progress with the other workers and renew the lease."""
+    cache_store.set("warmup", "progress", progress.dict())
+    if progress.running:
+        cache_store.try_lease(WARMUP_LEASE, worker_id, WARMUP_LEASE_TTL)
+
+
+def start_warmup(app, warmup_workers: int):
+    """Pre-synthesize static narrations in the background (when --warmup is set)."""
+    if not cache_store.try_lease(WARMUP_LEASE, worker_id, WARMUP_LEASE_TTL):
+        logger.info("Narration warm-up is already running in another worker")
+        return
+    logger.info("Starting narration warm-up with %s workers", warmup_workers)
+    app.state.warmup_task = asyncio.create_task(
+        warm_narrations(
+            workers=warmup_workers, progress=warmup_progress, on_progress=publish_warmup_progress
+        )
+    )
+
+
+def create_app(warmup: bool = False, warmup_workers: int = 4):
+    """Build the bridge application."""
+    from fastapi import FastAPI
+    from fastapi.middleware.cors import CORSMiddleware
+
+    @contextlib.asynccontextmanager
+    async def lifespan(app):
+        if warmup:
+            start_warmup(app, warmup_workers)
+        # Expired answers, layouts, sessions and states would otherwise stay in the cache file
+        app.state.purge_task = asyncio.create_task(purge_expired_periodically())
+        yield
+        app.state.purge_task.cancel()
+        traffic_recorder.close()
+
+    app = FastAPI(
+        title="Socket.IO TTS Bridge",
+        description="Bridge between Socket.IO server and Python TTS functionality",
+        version="1.0.0",
+        lifespan=lifespan
+    )
+
+    # Enable CORS
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["*"],
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+    if traffic_recorder.enabled:
+        # Opt-in (TRAFFIC_CAPTURE): anonymized request traces for traffic_replay.py
+        app.add_middleware(TrafficCaptureMiddleware, recorder=traffic_recorder)
+        logger.info("Capturing traffic to %s", traffic_recorder.path)
+    app.include_router(router)
+    return app
+
+
+_default_app = None
+
+
+def __getattr__(name):
+    # `uvicorn socket_bridge:app` still works: the default app is built on first access
+    global _default_app
+    if name == 'app':
+        if _default_app is None:
+            _default_app = create_app()
+        return _default_app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+@router.get("/")
 async def read_root():
     """Root endpoint to check if the service is running."""
     return {"status": "ok", "message": "Socket.IO TTS Bridge is running"}
 
-@app.post("/api/tts/generate-timings")
+
+@router.get("/api/tts/formats")
+async def tts_formats():
+    """List the audio formats clients may request."""
+    return {"formats": ENABLED_FORMATS, "default": DEFAULT_FORMAT}
+
+
+@router.get("/api/metrics")
+async def metrics():
+    """Report scheduler queues, upstream call resilience and WebSocket buffers."""
+    return {
+        "schedulers": scheduler_metrics(),
+        "upstream": resilience_metrics(),
+        "degraded_answers": shedding_metrics(),
+        "routes": router_metrics(),
+        "cancelled": cancellation_metrics(),
+        "logging": logging_metrics(),
+        "session_context": session_context_metrics(),
+        "traffic_capture": traffic_capture_metrics(),
+        "graph_store": graph_store_metrics(),
+        "narration_prefetch": narration_prefetch_metrics(),
+        "websockets": connection_metrics()
+    }
+
+
+@router.get("/api/tts/warmup")
+async def warmup_status():
+    """Report the progress of the narration warm-up (whichever worker runs it)."""
+    return cache_store.get("warmup", "progress") or warmup_progress.dict()
+
+
+@router.get("/api/visualization/{topic}/layout")
+async def visualization_layout(topic: str):
+    """Return precomputed node coordinates so clients can skip their own layout pass."""
+    try:
+        # Layout of a large graph is CPU-bound; keep it off the event loop
+        return await asyncio.to_thread(compute_topic_layout, topic)
+    except Exception as e:
+        logger.error("Error computing layout for %s: %s", topic, e)
+        raise HTTPException(status_code=500, detail=f"Error computing layout: {str(e)}")
+
+
+@router.get("/api/visualization/{topic}/stream")
+async def visualization_stream(topic: str, batch_size: int = DEFAULT_BATCH_SIZE,
+                               viewport: Optional[str] = None, focus: Optional[str] = None,
+                               hops: int = 1):
+    """Stream a topic's graph as NDJSON batches, limited to a viewport or neighborhood if given."""
+    try:
+        viewport_rect = parse_viewport(viewport)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="viewport must be x0,y0,x1,y1")
+    focus_ids = [node_id for node_id in (focus or "").split(",") if node_id] or None
+
+    from starlette.responses import StreamingResponse
+    from starlette.concurrency import iterate_in_threadpool
+
+    # Loading, layout and serialization are CPU-bound; run them off the event loop
+    visualization_data = await asyncio.to_thread(topic_graph, topic)
+    lines = iter_ndjson(visualization_data, batch_size=batch_size, viewport=viewport_rect,
+                        focus=focus_ids, hops=hops)
+    return StreamingResponse(iterate_in_threadpool(lines), media_type="application/x-ndjson")
+
+
+@router.get("/api/visualization/{topic}/state")
+async def visualization_state(topic: str, session_id: str, since_version: Optional[int] = None):
+    """Version handshake: return the state patches since the client's version (or a snapshot)."""
+    return visualization_states.sync(state_key(topic, session_id), since_version)
+
+
+@router.post("/api/visualization/{topic}/state")
+async def update_visualization_state(topic: str, request: StateUpdateRequest):
+    """Apply node property or highlight changes and return the resulting patches."""
+    key = state_key(topic, request.session_id)
+    # The narration and timeline belong to the server; clients only change nodes and highlights
+    _, previous = visualization_states.merge(key, request.changes.dict(exclude_unset=True))
+    since_version = previous if request.since_version is None else request.since_version
+    return visualization_states.sync(key, since_version)
+
+
+@router.get("/api/narration/{topic}/segments")
+async def narration_segments(topic: str, voice: str = "alloy", format: Optional[str] = None,
+                             speed: Optional[float] = None):
+    """List the segments of a topic's narration, with the cache keys of their audio."""
+    plan = load_plan(topic)
+    if plan is None:
+        raise HTTPException(status_code=404, detail="No narration script for this topic")
+    audio_format, speed = negotiate_format(format).name, clamp_speed(speed)
+    return {
+        "topic": topic,
+        "duration_ms": plan.duration_ms,
+        "segments": [
+            {**segment.dict(), "audio_key": segment_cache_key(segment, voice, audio_format, speed)}
+            for segment in plan.segments
+        ]
+    }
+
+
+@router.post("/api/narration/{topic}/playback")
+async def narration_playback(topic: str, request: PlaybackHeartbeat):
+    """Playback heartbeat: prefetch the narration segments ahead of the playhead."""
+    return narration_prefetcher.heartbeat(
+        state_key(topic, request.session_id), topic,
+        position_ms=request.position_ms,
+        segment=request.segment,
+        offset_ms=request.offset_ms,
+        state=request.state,
+        voice=request.voice,
+        audio_format=negotiate_format(request.format).name,
+        speed=clamp_speed(request.speed)
+    )
+
+
+@router.post("/api/tts/generate-timings")
 async def generate_timings(request: WordTimingRequest):
     """Generate word timings for text-to-speech audio."""
     try:
-        logger.info(f"Generating word timings for text of length {len(request.text)}")
+        logger.info("Generating word timings for text of length %s", len(request.text))
         
+        index = audio_cache.index(request.audio_key) if request.audio_key else None
+        audio_duration = index.duration_ms if index is not None else request.audio_duration
+
         # Generate word timings using the existing functionality
         timings = await generate_word_timings(
             request.text,
-            request.audio_duration,
+            audio_duration or estimate_duration_ms(request.text),
             request.nodes
         )
         
-        return {"timings": timings}
+        return {"timings": timings, "audio_duration": audio_duration}
     except Exception as e:
-        logger.error(f"Error generating word timings: {str(e)}")
+        logger.error("Error generating word timings: %s", e)
         raise HTTPException(status_code=500, detail=f"Error generating word timings: {str(e)}")
 
-@app.post("/api/tts/stream")
+
+@router.get("/api/tts/audio/{key}")
+async def cached_audio(key: str, start_ms: Optional[int] = None):
+    """Serve a cached narration straight from disk (zero-copy where the server supports it).
+
+    HTTP Range requests are answered from the file. MP3 narrations can also be
+    started at a time: `start_ms` serves the file from the frame playing at
+    that time, whose start is returned in X-Audio-Start-Ms.
+    """
+    path = audio_cache.path(key)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Audio not cached")
+
+    from starlette.responses import FileResponse, StreamingResponse
+
+    meta = audio_cache.get_meta(key) or {}
+    audio_format = next(
+        (f for f in AUDIO_FORMATS.values() if f.response_format == meta.get("response_format")),
+        AUDIO_FORMATS["mp3"]
+    )
+    index = audio_cache.index(key) if audio_format.name == "mp3" else None
+    headers = {"X-Audio-Duration-Ms": str(index.duration_ms)} if index is not None else {}
+    if start_ms is None or index is None or start_ms <= 0:
+        return FileResponse(path, media_type=audio_format.content_type, headers=headers)
+
+    buffer = audio_cache.open(key)
+    if buffer is None:
+        raise HTTPException(status_code=404, detail="Audio not cached")
+    offset, frame_start_ms = index.offset_at(start_ms)
+
+    def remaining_audio():
+        # Frames are self-contained, so the tail of the file from a frame header is playable
+        with buffer:
+            view = buffer.view()
+            for block_start in range(offset, buffer.size, BLOCK_SIZE):
+                block_end = block_start + BLOCK_SIZE
+                yield bytes(view[block_start:block_end])
+
+    headers.update({
+        "X-Audio-Start-Ms": str(frame_start_ms),
+        "Content-Length": str(buffer.size - offset)
+    })
+    return StreamingResponse(
+        remaining_audio(), media_type=audio_format.content_type, headers=headers
+    )
+
+
+@router.get("/api/tts/audio/{key}/index")
+async def cached_audio_index(key: str, interval_ms: int = 1000):
+    """Return the measured duration and a time to byte offset table of a cached MP3 narration.
+
+    Clients seek by requesting the bytes from a table offset with an HTTP Range header.
+    """
+    index = audio_cache.index(key)
+    if index is None:
+        raise HTTPException(status_code=404, detail="No MP3 audio cached for this key")
+    return {
+        "duration_ms": index.duration_ms,
+        "frames": index.frames,
+        "audio_end": index.end,
+        "seek_table": [
+            {"time_ms": time_ms, "offset": offset}
+            for time_ms, offset in index.seek_table(max(10, interval_ms))
+        ]
+    }
+
+
+@router.post("/api/tts/stream")
 async def tts_stream(request: Request):
     """Stream text-to-speech audio as binary chunks."""
     try:
@@ -98,31 +421,39 @@ async def tts_stream(request: Request):
         text = body.get("text")
         voice = body.get("voice", "alloy")
         
+        # The body may name formats explicitly; otherwise the Accept header decides
+        requested = (body.get("accept_formats") or body.get("format")
+                     or formats_from_accept(request.headers.get("accept")))
+        audio_format = negotiate_format(requested)
+        speed = clamp_speed(body.get("speed"))
+
         if not text:
             raise HTTPException(status_code=400, detail="No text provided")
         
-        logger.info(f"Streaming TTS for text of length {len(text)}")
+        logger.info("Streaming TTS for text of length %s as %s", len(text), audio_format.name)
         
         # Create a response that streams the audio
         from starlette.responses import StreamingResponse
         
         async def audio_generator():
-            async for chunk in stream_text_to_speech(text, voice):
+            chunks = stream_text_to_speech(text, voice, audio_format=audio_format.name, speed=speed)
+            async for chunk in chunks:
                 yield chunk
         
         return StreamingResponse(
             audio_generator(),
-            media_type="audio/mpeg"
+            media_type=audio_format.content_type
         )
     except Exception as e:
-        logger.error(f"Error streaming TTS: {str(e)}")
+        logger.error("Error streaming TTS: %s", e)
         raise HTTPException(status_code=500, detail=f"Error streaming TTS: {str(e)}")
 
-@app.post("/api/doubt/process")
+
+@router.post("/api/doubt/process")
 async def process_doubt(request: DoubtRequest):
     """Process a doubt and generate a response."""
     try:
-        logger.info(f"Processing doubt: {request.doubt}")
+        logger.info("Processing doubt (%d chars)", len(request.doubt))
         
         # Here you would call your doubt processing logic
         # For now, we'll just return a mock response
@@ -135,20 +466,127 @@ async def process_doubt(request: DoubtRequest):
             }
         }
     except Exception as e:
-        logger.error(f"Error processing doubt: {str(e)}")
+        logger.error("Error processing doubt: %s", e)
         raise HTTPException(status_code=500, detail=f"Error processing doubt: {str(e)}")
 
-def find_available_port(start_port=8001, max_attempts=100):
-    """Find an available port starting from start_port."""
-    for port in range(start_port, start_port + max_attempts):
+
+@router.websocket("/ws/tts/{topic}")
+async def tts_websocket(websocket: WebSocket, topic: str):
+    """Stream narration audio and word timings over a WebSocket."""
+    await handle_websocket_connection(websocket, topic)
+
+
+@router.websocket("/ws/doubt")
+async def doubt_websocket(websocket: WebSocket):
+    """Answer a doubt and stream the spoken answer over a WebSocket."""
+    await handle_doubt_websocket(websocket)
+
+
+@router.websocket("/ws/session")
+async def session_websocket(websocket: WebSocket):
+    """Carry many concurrent narration and doubt requests, tagged with ids, over one WebSocket."""
+    await handle_session_websocket(websocket)
+
+
+@router.post("/api/doubt/batch")
+async def process_doubt_batch_endpoint(request: DoubtBatchRequest):
+    """Answer a batch of doubts, streaming NDJSON results in completion order."""
+    if not request.items:
+        raise HTTPException(status_code=400, detail="No doubts provided")
+
+    ids = [item.id for item in request.items]
+    if len(set(ids)) != len(ids):
+        raise HTTPException(status_code=400, detail="Item ids must be unique")
+
+    logger.info("Processing batch of %s doubts", len(request.items))
+
+    from starlette.responses import StreamingResponse
+
+    async def result_generator():
+        async for result in process_doubt_batch(request.items, request.concurrency):
+            yield json.dumps(result) + "\n"
+
+    return StreamingResponse(result_generator(), media_type="application/x-ndjson")
+
+
+def bind_socket(host='0.0.0.0', port=0, start_port=8001, max_attempts=100):
+    """Bind the listening socket before starting the server.
+
+    The socket stays bound from here on, so there is no window in which another
+    bridge starting at the same time can take the port. With port 0 the first
+    free port from start_port is used. Worker processes do not bind the port
+    themselves: they all inherit this one socket and accept from it.
+    """
+    ports = [port] if port else range(start_port, start_port + max_attempts)
+    for candidate in ports:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         try:
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                s.bind(('0.0.0.0', port))
-                return port
+            sock.bind((host, candidate))
         except OSError:
+            sock.close()
+            if port:
+                raise
             continue
+        sock.listen(2048)
+        sock.set_inheritable(True)
+        return sock
     raise RuntimeError(f"Could not find an available port after {max_attempts} attempts")
 
+
+def run_worker(sock, warmup: bool = False, warmup_workers: int = 4):
+    """Serve the app on an already bound socket (one worker process)."""
+    import uvicorn
+
+    # Spawned workers start from a fresh interpreter, so each sets up its own logging
+    setup_logging()
+    load_dotenv()
+    app = create_app(warmup=warmup, warmup_workers=warmup_workers)
+    # log_config=None leaves uvicorn's loggers on the queued root handler
+    host, port = sock.getsockname()[:2]
+    config = uvicorn.Config(app, host=host, port=port, log_config=None)
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+def run_workers(sock, workers, warmup: bool = False, warmup_workers: int = 4):
+    """Run several worker processes accepting connections on the same socket."""
+    # Each worker takes its share of the upstream rate limits (see openai_scheduler)
+    os.environ['BRIDGE_WORKERS'] = str(workers)
+    context = multiprocessing.get_context('spawn')
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    def spawn():
+        process = context.Process(
+            target=run_worker, args=(sock, warmup, warmup_workers), daemon=True
+        )
+        process.start()
+        return process
+
+    processes = [spawn() for _ in range(workers)]
+    logger.info("Started %s workers: %s", workers, [p.pid for p in processes])
+    while not stopping:
+        for index, process in enumerate(processes):
+            if not process.is_alive() and not stopping:
+                logger.warning("Worker %s exited with code %s, restarting",
+                               process.pid, process.exitcode)
+                processes[index] = spawn()
+        time.sleep(0.5)
+
+    logger.info("Stopping workers")
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        process.join(timeout=10)
+        if process.is_alive():
+            process.kill()
+
 def handle_stdin_input():
     """Handle input from stdin for doubt processing."""
     try:
@@ -166,7 +604,7 @@ def handle_stdin_input():
         doubt = data.get('doubt', '')
         current_state = data.get('current_state', {})
         
-        logger.info(f"Processing doubt from stdin: {doubt}")
+        logger.info("Processing doubt from stdin (%d chars)", len(doubt))
         
         # Here you would call your doubt processing logic
         # For now, we'll just print a mock response
@@ -202,30 +640,41 @@ def handle_stdin_input():
         print(json.dumps(end_signal), flush=True)
         
     except json.JSONDecodeError as e:
-        logger.error(f"Error parsing JSON input: {str(e)}")
+        logger.error("Error parsing JSON input: %s", e)
         error_response = {
             "type": "error",
             "content": f"Error parsing input: {str(e)}"
         }
         print(json.dumps(error_response), flush=True)
     except Exception as e:
-        logger.error(f"Error processing doubt from stdin: {str(e)}")
+        logger.error("Error processing doubt from stdin: %s", e)
         error_response = {
             "type": "error",
             "content": f"Error: {str(e)}"
         }
         print(json.dumps(error_response), flush=True)
 
-if __name__ == "__main__":
+
+def main():
+    args = parse_args()
+    # Log records are written by a background thread, never on the event loop
+    setup_logging()
+    load_dotenv()
+
     if args.mode == 'doubt':
         # Run in doubt processing mode (read from stdin)
         handle_stdin_input()
     else:
-        # Run the FastAPI app with uvicorn
-        port = args.port
-        if port == 0:
-            # Find an available port
-            port = find_available_port()
-        
-        logger.info(f"Starting Socket.IO Bridge on port {port}")
-        uvicorn.run(app, host="0.0.0.0", port=port) 
\ No newline at end of file
+        # Run the FastAPI app with uvicorn on a pre-bound socket
+        sock = bind_socket(port=args.port)
+        port = sock.getsockname()[1]
+        
+        logger.info("Starting Socket.IO Bridge on port %s with %s worker(s)", port, args.workers)
+        if args.workers > 1:
+            run_workers(sock, args.workers, args.warmup, args.warmup_workers)
+        else:
+            run_worker(sock, args.warmup, args.warmup_workers)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+Tests for app.py
+"""
+
+import asyncio
+import threading
+import time
+
+import pytest
+from pydantic import ValidationError
+
+import app
+from app import DoubtBatchItem, DoubtResponse, group_duplicate_doubts
+from socket_bridge import DoubtBatchRequest
+
+
+def item(id, doubt, topic="er", highlighted=None):
+    state = {"highlighted_elements": highlighted} if highlighted else None
+    return DoubtBatchItem(id=id, topic=topic, doubt=doubt, current_state=state)
+
+
+def test_near_identical_doubts_are_grouped():
+    items = [
+        item("a", "What is a primary key?"),
+        item("b", "what is a primary key"),
+        item("c", "What is a primary key?", topic="gis"),
+        item("d", "What is a primary key?", highlighted=["course"]),
+        item("e", "What is a foreign key?"),
+        item("f", "WHAT is a Primary Key??"),
+        item("g", "Is A a subset of B?"),
+        item("h", "Is B a subset of A?"),
+        item("i", "is a a subset of b"),
+    ]
+    groups = group_duplicate_doubts(items)
+    assert [[i.id for i in group] for group in groups] == [
+        ["a", "b", "f"],
+        ["c"],
+        ["d"],
+        ["e"],
+        ["g", "i"],
+        ["h"],
+    ]
+
+
+def test_batch_fans_out_duplicates_in_completion_order(monkeypatch):
+    delays = {"slow question": 0.2, "quick question": 0.03, "middle question": 0.08}
+    lock = threading.Lock()
+    running = {"now": 0, "peak": 0}
+    threads = set()
+
+    def process_doubt(topic, doubt, current_state, stream, priority):
+        with lock:
+            running["now"] += 1
+            running["peak"] = max(running["peak"], running["now"])
+        threads.add(threading.current_thread().name)
+        time.sleep(delays[doubt])
+        with lock:
+            running["now"] -= 1
+        return DoubtResponse(narration=doubt.upper(), highlights=[])
+
+    monkeypatch.setattr(app, "process_doubt", process_doubt)
+    items = [
+        item("1", "slow question"),
+        item("2", "quick question"),
+        item("3", "Slow question?"),
+        item("4", "middle question"),
+    ]
+
+    async def run(concurrency):
+        return [r async for r in app.process_doubt_batch(items, concurrency)]
+
+    results = asyncio.run(run(100))
+    assert [(r["id"], r["duplicate_of"]) for r in results] == [
+        ("2", None),
+        ("4", None),
+        ("1", None),
+        ("3", "1"),
+    ]
+    assert results[3]["response"]["narration"] == "SLOW QUESTION"
+    assert running["peak"] == 3
+    assert all(name.startswith("doubt-batch") for name in threads)
+
+    running["peak"] = 0
+    assert len(asyncio.run(run(1))) == 4 and running["peak"] == 1
+
+
+def test_batch_concurrency_is_bounded():
+    with pytest.raises(ValidationError):
+        DoubtBatchRequest(items=[], concurrency=app.MAX_BATCH_CONCURRENCY + 1)
+    with pytest.raises(ValidationError):
+        DoubtBatchRequest(items=[], concurrency=0)
+    assert DoubtBatchRequest(items=[]).concurrency == 4
+
+
+def test_synthetic_topics_are_capped(monkeypatch):
+    monkeypatch.setattr(app, "MAX_SYNTHETIC_NODES", 500)
+    assert app.synthetic_size("synthetic_500") == 500
+    for topic in ("synthetic_501", "synthetic_0", "synthetic_", "er", "synthetic_1x"):
+        assert app.synthetic_size(topic) is None
+    assert app.synthetic_size("synthetic_" + "9" * 10_000) is None
+
+    assert len(app.build_visualization_data("synthetic_40").nodes) == 40
+    capped = app.build_visualization_data("synthetic_100000000")
+    assert len(capped.nodes) == 3
@@ -0,0 +1,45 @@
+"""
+Tests for audio_buffer.py
+"""
+
+from audio_buffer import MappedAudioFile, SpooledAudio
+from audio_cache import AudioCache
+from audio_formats import AUDIO_FORMATS
+
+
+def test_spooled_audio_spills_to_disk_past_threshold():
+    audio = bytes(range(256)) * 64
+    spool = SpooledAudio(threshold=4096)
+    for offset in range(0, len(audio), 1000):
+        end = offset + 1000
+        spool.write(audio[offset:end])
+    assert spool.spilled
+    assert spool.size == len(audio)
+
+    chunks = list(spool.chunks(AUDIO_FORMATS["opus"]))
+    assert all(isinstance(chunk, memoryview) for chunk in chunks)
+    assert len(chunks[0]) == AUDIO_FORMATS["opus"].first_chunk_size
+    assert b"".join(chunks) == audio
+    del chunks
+    spool.close()
+
+
+def test_small_audio_stays_in_memory():
+    spool = SpooledAudio(threshold=4096)
+    spool.write(b"abc")
+    assert not spool.spilled
+    assert spool.read() == b"abc"
+
+
+def test_cache_stores_buffers_and_serves_them_mapped(tmp_path):
+    cache = AudioCache(str(tmp_path))
+    spool = SpooledAudio(threshold=10)
+    spool.write(b"x" * 100)
+    cache.put_buffer("key", spool, voice="alloy")
+    spool.close()
+
+    assert cache.get_meta("key")["size"] == 100
+    with cache.open("key") as cached:
+        assert isinstance(cached, MappedAudioFile)
+        assert cached.read() == b"x" * 100
+    assert cache.open("missing") is None
@@ -0,0 +1,47 @@
+"""
+Tests for audio_cache.py
+"""
+
+import os
+
+from audio_cache import AudioCache
+
+
+def age(cache, key, seconds_ago):
+    path = cache.directory / f"{key}.audio"
+    mtime = path.stat().st_mtime - seconds_ago
+    os.utime(path, (mtime, mtime))
+
+
+def test_least_recently_used_entries_are_evicted_past_the_budget(tmp_path):
+    cache = AudioCache(str(tmp_path), max_bytes=300)
+    for i, key in enumerate(("a", "b", "c")):
+        cache.put(key, b"x" * 100, voice="alloy")
+        age(cache, key, 30 - 10 * i)
+    # Reading "a" makes "b" the least recently used entry
+    assert cache.get("a") == b"x" * 100
+
+    cache.put("d", b"y" * 100)
+    assert [cache.contains(key) for key in "abcd"] == [True, False, True, True]
+    assert cache.get("b") is None and cache.open("b") is None
+    assert not (tmp_path / "b.audio").exists()
+    assert cache.evictions == 1
+
+    # An entry larger than the budget is kept; everything else goes
+    cache.put("big", b"z" * 500)
+    assert cache.contains("big")
+    assert not any(cache.contains(key) for key in "acd")
+
+
+def test_eviction_counts_entries_written_by_other_processes(tmp_path):
+    cache = AudioCache(str(tmp_path), max_bytes=250)
+    other = AudioCache(str(tmp_path), max_bytes=0)
+    other.put("old", b"x" * 200)
+    age(other, "old", 60)
+    cache.put("new", b"y" * 100)
+    assert not cache.contains("old") and cache.contains("new")
+
+    unlimited = AudioCache(str(tmp_path), max_bytes=0)
+    for key in ("p", "q", "r"):
+        unlimited.put(key, b"z" * 200)
+    assert all(unlimited.contains(key) for key in ("new", "p", "q", "r"))
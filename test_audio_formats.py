@@ -0,0 +1,45 @@
+"""
+Tests for audio_formats.py
+"""
+
+from audio_formats import (
+    AUDIO_FORMATS,
+    DEFAULT_FORMAT,
+    DEFAULT_SPEED,
+    clamp_speed,
+    formats_from_accept,
+    iter_chunks,
+    negotiate_format,
+)
+
+
+def test_accept_header_is_ordered_by_quality():
+    assert formats_from_accept("audio/mpeg, audio/wav") == ["mp3", "wav"]
+    accept = "audio/mpeg;q=0.5, audio/L16; rate=24000, audio/ogg; codecs=opus;q=0.9"
+    assert formats_from_accept(accept) == ["pcm", "opus", "mp3"]
+    assert formats_from_accept("audio/wav;q=0, AUDIO/MPEG;q=x, audio/ogg") == ["opus"]
+    assert formats_from_accept("text/html, */*") == []
+    assert formats_from_accept(None) == []
+
+
+def test_negotiation_falls_back_to_the_default():
+    assert negotiate_format("flac, opus").name == "opus"
+    assert negotiate_format(["wav", "mp3"]).name == "wav"
+    assert negotiate_format(["flac"]).name == DEFAULT_FORMAT
+    assert negotiate_format(42).name == DEFAULT_FORMAT
+    assert negotiate_format(None).name == DEFAULT_FORMAT
+
+
+def test_speed_is_clamped_or_defaulted():
+    assert clamp_speed(1.5) == 1.5 and clamp_speed("2") == 2.0
+    assert clamp_speed(10) == 4.0 and clamp_speed(0) == 0.25
+    for malformed in (None, "fast", "", [1], {}, float("nan"), "inf"):
+        assert clamp_speed(malformed) == DEFAULT_SPEED
+
+
+def test_chunks_follow_the_format_policy():
+    pcm = AUDIO_FORMATS["pcm"]
+    audio = bytes(pcm.first_chunk_size + 2 * pcm.chunk_size + 10)
+    sizes = [len(chunk) for chunk in iter_chunks(audio, pcm)]
+    assert sizes == [pcm.first_chunk_size, pcm.chunk_size, pcm.chunk_size, 10]
+    assert all(size % 2 == 0 for size in sizes[:-1])
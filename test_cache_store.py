@@ -0,0 +1,42 @@
+"""
+Tests for cache_store.py
+"""
+
+import multiprocessing
+
+from cache_store import SQLiteCacheStore, doubt_cache_key
+
+
+def write_entry(path):
+    SQLiteCacheStore(path).set("doubt_text", "key", {"answer": "from another process"})
+
+
+def test_entries_are_shared_between_processes(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    process = multiprocessing.get_context("spawn").Process(
+        target=write_entry, args=(path,)
+    )
+    process.start()
+    process.join(timeout=30)
+    assert SQLiteCacheStore(path).get("doubt_text", "key") == {
+        "answer": "from another process"
+    }
+
+
+def test_ttl_and_leases(tmp_path):
+    store = SQLiteCacheStore(str(tmp_path / "cache.sqlite3"))
+    store.set("ns", "expired", 1, ttl=-1)
+    assert store.get("ns", "expired") is None
+    assert store.try_lease("warmup", "worker-1", ttl=60)
+    assert store.try_lease("warmup", "worker-1", ttl=60)
+    assert not store.try_lease("warmup", "worker-2", ttl=60)
+    store.release_lease("warmup", "worker-2")
+    assert not store.try_lease("warmup", "worker-2", ttl=60)
+    store.release_lease("warmup", "worker-1")
+    assert store.try_lease("warmup", "worker-2", ttl=60)
+
+
+def test_doubt_cache_key_ignores_formatting():
+    assert doubt_cache_key("er", "What is a key?", []) == doubt_cache_key(
+        "er", "  what is a   KEY ", []
+    )
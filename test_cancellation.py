@@ -0,0 +1,66 @@
+"""
+Tests for cancellation.py
+"""
+
+import asyncio
+
+import pytest
+
+from cancellation import RequestCancelled, RequestScope, cancellation_metrics
+
+
+class FakeWebSocket:
+    def __init__(self, messages, delay=0.01):
+        self.messages = list(messages)
+        self.delay = delay
+
+    async def receive(self):
+        await asyncio.sleep(self.delay)
+        if self.messages:
+            return self.messages.pop(0)
+        await asyncio.Event().wait()
+
+
+async def slow_work(cleaned_up):
+    try:
+        await asyncio.sleep(10)
+    finally:
+        cleaned_up.append(True)
+
+
+def test_disconnect_cancels_running_stage():
+    async def scenario():
+        cleaned_up = []
+        websocket = FakeWebSocket([{"type": "websocket.disconnect"}])
+        async with RequestScope(websocket) as scope:
+            with pytest.raises(RequestCancelled) as error:
+                await scope.run(slow_work(cleaned_up), stage="tts", tts_chars=42)
+        return cleaned_up, error.value
+
+    before = cancellation_metrics()
+    cleaned_up, error = asyncio.run(asyncio.wait_for(scenario(), 2))
+    after = cancellation_metrics()
+    assert cleaned_up == [True]
+    assert (error.reason, error.stage) == ("disconnect", "tts")
+    assert after["disconnect"] == before["disconnect"] + 1
+    assert after["tts_chars_saved"] == before["tts_chars_saved"] + 42
+
+
+def test_cancel_message_and_deadline():
+    async def scenario():
+        reasons = []
+        cancel = {"type": "websocket.receive", "text": '{"type": "cancel"}'}
+        async with RequestScope(FakeWebSocket([cancel])) as scope:
+            try:
+                await scope.run(slow_work([]), stage="chat")
+            except RequestCancelled as e:
+                reasons.append(e.reason)
+        async with RequestScope(FakeWebSocket([]), deadline=0.05) as scope:
+            assert await scope.run(asyncio.sleep(0, "done"), stage="chat") == "done"
+            try:
+                await scope.run(slow_work([]), stage="chat")
+            except RequestCancelled as e:
+                reasons.append(e.reason)
+        return reasons
+
+    assert asyncio.run(asyncio.wait_for(scenario(), 2)) == ["cancel", "deadline"]
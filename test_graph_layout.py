@@ -0,0 +1,83 @@
+"""
+Tests for graph_layout.py
+"""
+
+from types import SimpleNamespace
+
+import numpy as np
+
+import graph_layout
+from cache_store import SQLiteCacheStore
+
+
+def make_graph(nodes, edges, topic="test"):
+    return SimpleNamespace(
+        topic=topic,
+        nodes=[
+            SimpleNamespace(id=node_id, type=node_type) for node_id, node_type in nodes
+        ],
+        edges=[
+            SimpleNamespace(source=source, target=target, type=edge_type)
+            for source, target, edge_type in edges
+        ],
+    )
+
+
+def test_barnes_hut_approximates_exact_repulsion():
+    positions = np.random.default_rng(0).normal(size=(1500, 2)) * 20
+    exact = graph_layout._exact_repulsion(positions, 1.0)
+    approximate = graph_layout._barnes_hut_repulsion(positions, 1.0, 0.8)
+    error = np.linalg.norm(exact - approximate, axis=1) / np.linalg.norm(exact, axis=1)
+    assert np.median(error) < 0.02
+
+
+def test_hierarchies_are_laid_out_in_rows(tmp_path, monkeypatch):
+    monkeypatch.setattr(
+        graph_layout, "cache_store", SQLiteCacheStore(str(tmp_path / "c.db"))
+    )
+    graph = make_graph(
+        [("root", "root"), ("a", "branch"), ("b", "leaf"), ("c", "leaf")],
+        [
+            ("root", "a", "parent_child"),
+            ("a", "b", "parent_child"),
+            ("a", "c", "parent_child"),
+        ],
+    )
+    positions = graph_layout.compute_layout(graph)
+    assert positions["root"]["y"] < positions["a"]["y"] < positions["b"]["y"]
+    assert positions["b"]["y"] == positions["c"]["y"]
+    assert positions["b"]["x"] != positions["c"]["x"]
+
+
+def test_layout_is_cached_by_content(tmp_path, monkeypatch):
+    monkeypatch.setattr(
+        graph_layout, "cache_store", SQLiteCacheStore(str(tmp_path / "c.db"))
+    )
+    graph = make_graph(
+        [("x", "entity"), ("y", "entity"), ("z", "entity")], [("x", "y", "link")]
+    )
+    positions = graph_layout.compute_layout(graph, 400, 300)
+    assert all(
+        graph_layout.MARGIN <= p["x"] <= 400 - graph_layout.MARGIN
+        and graph_layout.MARGIN <= p["y"] <= 300 - graph_layout.MARGIN
+        for p in positions.values()
+    )
+
+    # A new process (empty in-memory cache) reuses the shared entry
+    graph_layout._layout_cache.clear()
+    monkeypatch.setattr(graph_layout, "force_directed_layout", None)
+    assert graph_layout.compute_layout(graph, 400, 300) == positions
+
+
+def test_in_process_cache_evicts_least_recently_used(tmp_path, monkeypatch):
+    monkeypatch.setattr(
+        graph_layout, "cache_store", SQLiteCacheStore(str(tmp_path / "c.db"))
+    )
+    monkeypatch.setattr(graph_layout, "LAYOUT_CACHE_MAX_ENTRIES", 2)
+    graph_layout._layout_cache.clear()
+    graph = make_graph([("x", "entity"), ("y", "entity")], [("x", "y", "link")])
+    for width in (300, 400, 300, 500):
+        graph_layout.compute_layout(graph, width, 300)
+    assert [
+        graph_layout.layout_fingerprint(graph, width, 300) for width in (300, 500)
+    ] == list(graph_layout._layout_cache)
@@ -0,0 +1,94 @@
+"""
+Tests for graph_store.py
+"""
+
+from app import VisualizationData, load_visualization_data, topic_graph
+from graph_store import GraphStore, TopicGraph
+from graph_stream import iter_graph_records
+from prompt_cache import topic_fingerprint
+
+
+def make_graph():
+    return TopicGraph(
+        "school",
+        [
+            {"id": "student", "name": "Student", "type": "entity"},
+            {"id": "course", "name": "Course", "type": "entity"},
+            {"id": "enrolls", "name": "Enrolls", "type": "relationship"},
+            {"id": "note", "name": "Note", "attributes": [{"name": "text"}]},
+        ],
+        [
+            {"source": "student", "target": "enrolls", "type": "participates"},
+            {"source": "enrolls", "target": "course", "type": "participates"},
+            {"source": "course", "target": "ghost", "type": "participates"},
+            {"source": "note", "target": "course", "type": "about", "description": "d"},
+        ],
+    )
+
+
+def test_tables_intern_types_and_index_adjacency():
+    graph = make_graph()
+    assert graph.node_count == 4 and graph.edge_count == 3
+    assert graph.dropped_edges == 1
+    assert graph.types.strings == ["entity", "relationship", "participates", "about"]
+    assert list(graph.node_types) == [0, 0, 1, -1]
+
+    course = graph.index_of("course")
+    assert graph.degree(course) == 2
+    assert sorted(graph.ids[i] for i in graph.neighbors(course)) == ["enrolls", "note"]
+    assert graph.k_hop(["student", "unknown"], 2) == {0: 0, 2: 1, 1: 2}
+    assert graph.edges_among([0, 1, 2]) == [0, 1]
+    assert graph.node_record(3) == {
+        "id": "note",
+        "name": "Note",
+        "attributes": [{"name": "text"}],
+    }
+    assert graph.edge_record(2) == {
+        "source": "note",
+        "target": "course",
+        "type": "about",
+        "description": "d",
+    }
+    assert graph.nodes[-1].id == "note" and graph.edges[0].target == "enrolls"
+
+
+def test_topics_are_materialized_unchanged_at_the_boundary():
+    graph = topic_graph("er")
+    assert topic_graph("er") is graph
+    data = load_visualization_data("er")
+    assert isinstance(data, VisualizationData)
+    assert TopicGraph.from_data(data).export() == graph.export()
+    assert topic_fingerprint(graph) == topic_fingerprint(topic_graph("er"))
+
+    records = list(iter_graph_records(graph, batch_size=3))
+    from_models = list(iter_graph_records(data, batch_size=3))
+    assert records == from_models
+
+
+def test_store_evicts_least_recently_used_topics():
+    store = GraphStore(max_topics=2)
+    builds = []
+
+    def build(topic):
+        builds.append(topic)
+        return TopicGraph(topic, [{"id": "a", "name": "A"}], [])
+
+    for topic in ("a", "b", "a", "c", "b"):
+        store.get(topic, lambda: build(topic))
+    assert builds == ["a", "b", "c", "b"]
+    metrics = store.metrics()
+    assert metrics["topics"] == 2 and metrics["hits"] == 1 and metrics["evictions"] == 2
+    assert metrics["nodes"] == 2 and metrics["memory_bytes"] > 0
+
+
+def test_nodes_named_in_a_text_are_found_in_order():
+    graph = make_graph()
+    text = "A NOTE: every student enrolls in courses (see Course and Notes)."
+    assert [graph.ids[i] for i in graph.mentioned_nodes(text)] == [
+        "note",
+        "student",
+        "enrolls",
+        "course",
+    ]
+    assert graph.mentioned_nodes("Coursework is not a course name match") == [1]
+    assert graph.mentioned_nodes("") == []
@@ -0,0 +1,95 @@
+"""
+Tests for graph_stream.py
+"""
+
+import json
+
+import pytest
+
+from graph_store import TopicGraph
+from graph_stream import (
+    generate_synthetic_graph,
+    iter_graph_records,
+    iter_ndjson,
+    parse_viewport,
+)
+
+
+def make_graph():
+    nodes = [{"id": f"n{i}", "name": f"Node {i}", "type": "concept"} for i in range(7)]
+    edges = [
+        {"source": "n6", "target": "n0", "type": "link"},
+        {"source": "n0", "target": "n1", "type": "link"},
+        {"source": "n1", "target": "n2", "type": "link"},
+        {"source": "n4", "target": "n5", "type": "link"},
+        {"source": "n2", "target": "n3", "type": "link"},
+    ]
+    positions = {f"n{i}": {"x": 10.0 * i, "y": 10.0 * i} for i in range(7)}
+    return TopicGraph("chain", nodes, edges, narration="Hello.", positions=positions)
+
+
+def check_edges_follow_endpoints(records):
+    seen = set()
+    for record in records:
+        if record["type"] == "nodes":
+            seen.update(item["id"] for item in record["items"])
+        elif record["type"] == "edges":
+            for edge in record["items"]:
+                assert edge["source"] in seen and edge["target"] in seen
+    return seen
+
+
+def test_nodes_are_batched_and_edges_follow_their_endpoints():
+    records = list(iter_graph_records(make_graph(), batch_size=3))
+    assert [record["type"] for record in records] == [
+        "header",
+        "nodes",
+        "edges",
+        "nodes",
+        "edges",
+        "nodes",
+        "edges",
+        "narration",
+        "end",
+    ]
+    header = records[0]
+    assert (header["nodes"], header["edges"], header["batch_size"]) == (7, 5, 3)
+    assert header["has_positions"]
+    batches = [r for r in records if r["type"] == "nodes"]
+    assert [len(batch["items"]) for batch in batches] == [3, 3, 1]
+    assert batches[0]["items"][1]["position"] == {"x": 10.0, "y": 10.0}
+    # n6 -> n0 is only complete once n6 arrives in the last batch
+    assert records[6]["items"] == [{"source": "n6", "target": "n0", "type": "link"}]
+    assert check_edges_follow_endpoints(records) == {f"n{i}" for i in range(7)}
+    assert records[-1] == {"type": "end", "nodes_sent": 7, "edges_sent": 5}
+
+
+def test_focus_and_viewport_limit_the_stream():
+    graph = make_graph()
+    records = list(iter_graph_records(graph, batch_size=2, focus=["n1"], hops=1))
+    ids = [item["id"] for r in records if r["type"] == "nodes" for item in r["items"]]
+    assert ids[0] == "n1" and set(ids) == {"n0", "n1", "n2"}
+    check_edges_follow_endpoints(records)
+    assert records[-1]["edges_sent"] == 2
+
+    viewport = parse_viewport("45,45,15,15")
+    assert viewport == (15.0, 15.0, 45.0, 45.0)
+    records = list(iter_graph_records(graph, viewport=viewport))
+    ids = [item["id"] for r in records if r["type"] == "nodes" for item in r["items"]]
+    assert ids == ["n2", "n3", "n4"]
+    assert records[-1]["edges_sent"] == 1
+
+    lines = list(iter_ndjson(graph, focus=["n4"], hops=0))
+    assert json.loads(lines[1])["items"] == [
+        {**graph.node_record(4), "position": {"x": 40.0, "y": 40.0}}
+    ]
+    with pytest.raises(ValueError):
+        parse_viewport("1,2,3")
+
+
+def test_synthetic_graphs_have_valid_edges():
+    nodes, edges = generate_synthetic_graph(300)
+    ids = {node["id"] for node in nodes}
+    assert len(nodes) == len(ids) == 300
+    assert all(edge["source"] in ids and edge["target"] in ids for edge in edges)
+    assert generate_synthetic_graph(300) == (nodes, edges)
@@ -0,0 +1,148 @@
+"""
+Tests for load_shedding.py
+"""
+
+import json
+import threading
+
+import load_shedding
+from cache_store import SQLiteCacheStore
+from load_shedding import (
+    BUSY_NOTICE,
+    degraded_answer,
+    load_faq,
+    match_faq,
+    remember_answer,
+    script_segment,
+    shed_reason,
+    shedding_metrics,
+)
+from resilience import CallPolicy, ResilientCaller
+
+
+class Queue:
+    def __init__(self, depth=0):
+        self.depth = depth
+
+    def queue_depth(self):
+        return self.depth
+
+
+def use_store(tmp_path, monkeypatch):
+    store = SQLiteCacheStore(str(tmp_path / "c.db"))
+    monkeypatch.setattr(load_shedding, "cache_store", store)
+    return store
+
+
+def test_shed_reason_thresholds(monkeypatch):
+    monkeypatch.setattr(load_shedding, "SHED_QUEUE_DEPTH", 20)
+    monkeypatch.setattr(load_shedding, "SHED_LATENCY_P95", 8.0)
+    caller = ResilientCaller(CallPolicy(name="chat", failure_threshold=2))
+    queue = Queue()
+    assert shed_reason(queue, caller) is None
+
+    queue.depth = 20
+    assert shed_reason(queue, caller) is None
+    queue.depth = 21
+    assert shed_reason(queue, caller) == "queue depth 21"
+
+    queue.depth = 0
+    caller._latencies.extend([1.0] * 90 + [9.5] * 10)
+    assert shed_reason(queue, caller) == "latency p95 9.5s"
+
+    caller.breaker.record_failure()
+    caller.breaker.record_failure()
+    queue.depth = 50
+    assert shed_reason(queue, caller) == "upstream unavailable"
+
+
+def test_degraded_answers_fall_back_from_faq_to_script_to_notice(tmp_path, monkeypatch):
+    use_store(tmp_path, monkeypatch)
+    before = shedding_metrics()
+
+    answer = degraded_answer("er", "Can a student enroll in courses?", reason="busy")
+    assert answer.source == "script" and "enroll" in answer.narration
+    assert answer.reason == "busy"
+
+    remember_answer(
+        "er", "Can a student enroll in courses?", "Yes, many.", ["enrollment"]
+    )
+    answer = degraded_answer("er", "can a student enroll in courses", ["student"])
+    assert answer.source == "faq" and answer.narration == "Yes, many."
+    assert answer.highlights == ["enrollment"]
+
+    # No FAQ, no script: only the notice is left
+    answer = degraded_answer("xml", "What is a DTD?")
+    assert answer.source == "notice" and answer.narration == BUSY_NOTICE
+
+    after = shedding_metrics()
+    assert [after[s] - before[s] for s in ("faq", "script", "notice")] == [1, 1, 1]
+
+
+def test_faq_only_answers_the_same_question(tmp_path, monkeypatch):
+    use_store(tmp_path, monkeypatch)
+    remember_answer("er", "What is a primary key?", "It identifies a row.", [])
+    remember_answer("er", "Why does 3NF preserve dependencies?", "It keeps FDs.", [])
+    remember_answer("er", "How do students enroll in courses?", "Enrollment.", [])
+
+    assert match_faq("er", "what is a PRIMARY key")["answer"] == "It identifies a row."
+    for near_miss in (
+        "What is a foreign key?",
+        "What is a key?",
+        "Why does BCNF not preserve dependencies?",
+        "Why does BCNF preserve dependencies?",
+    ):
+        assert match_faq("er", near_miss) is None, near_miss
+
+
+def test_learned_answers_from_concurrent_workers_are_all_kept(tmp_path, monkeypatch):
+    use_store(tmp_path, monkeypatch)
+    monkeypatch.setattr(load_shedding, "FAQ_MAX_ENTRIES", 500)
+
+    def learn(worker):
+        for i in range(25):
+            remember_answer("er", f"Question {worker}-{i}?", "Answer.", [])
+
+    workers = [threading.Thread(target=learn, args=(w,)) for w in range(8)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    assert len(load_faq("er", tmp_path)) == 200
+
+    remember_answer("er", "QUESTION 0-0", "Better answer.", ["student"])
+    entries = load_faq("er", tmp_path)
+    assert len(entries) == 200 and entries[-1]["answer"] == "Better answer."
+
+    monkeypatch.setattr(load_shedding, "FAQ_MAX_ENTRIES", 5)
+    remember_answer("er", "One more?", "Answer.", [])
+    assert [e["question"] for e in load_faq("er", tmp_path)][-2:] == [
+        "question 0-0",
+        "one more",
+    ]
+    assert len(load_faq("er", tmp_path)) == 5
+
+
+def test_script_segment_prefers_sentences_about_highlighted_nodes(tmp_path):
+    script = {
+        "script": (
+            "Students are people. A course has a title. Each enrollment has a "
+            "grade. Students enroll in courses. Grades are letters."
+        ),
+        "component_mappings": {"enroll": "enrollment", "title": "course"},
+    }
+    (tmp_path / "er_script.json").write_text(json.dumps(script))
+
+    # Node ids and the words mapped to them select sentences, in script order
+    assert script_segment("er", "", ["enrollment"], data_dir=tmp_path) == (
+        "Each enrollment has a grade. Students enroll in courses."
+    )
+    assert script_segment("er", "", ["course"], data_dir=tmp_path) == (
+        "A course has a title."
+    )
+    # Without matching nodes the sentences most similar to the doubt are used
+    assert script_segment("er", "which letters", ["teacher"], tmp_path) == (
+        "Grades are letters."
+    )
+    assert script_segment("er", "zebra", None, data_dir=tmp_path) is None
+    assert script_segment("missing", "grades", None, data_dir=tmp_path) is None
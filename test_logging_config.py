@@ -0,0 +1,66 @@
+"""
+Tests for logging_config.py
+"""
+
+import json
+import logging
+import queue
+
+from logging_config import (
+    JsonFormatter,
+    NonBlockingQueueHandler,
+    SamplingFilter,
+    parse_sample_rates,
+)
+
+
+def make_record(
+    name="realtime_audio", level=logging.INFO, msg="Sent %d bytes", args=(1,)
+):
+    return logging.LogRecord(name, level, __file__, 1, msg, args, None)
+
+
+def test_rate_limit_is_per_log_site_and_reports_suppressed():
+    sampler = SamplingFilter(rate=0.001, burst=2)
+    passed = [sampler.filter(make_record(args=(i,))) for i in range(5)]
+    assert passed == [True, True, False, False, False]
+    assert sampler.filter(make_record(msg="Another site %d"))
+
+    sampler._buckets[("realtime_audio", "Sent %d bytes")][0] = 1
+    record = make_record()
+    assert sampler.filter(record) and record.suppressed == 3
+
+
+def test_sampling_skips_info_but_keeps_warnings():
+    sampler = SamplingFilter(
+        parse_sample_rates("realtime_audio=0, ws_sender=0.5"), rate=0
+    )
+    assert not sampler.filter(make_record("realtime_audio.child"))
+    assert sampler.filter(make_record(level=logging.WARNING))
+    assert sampler.filter(make_record("app"))
+    assert sampler._sample_rate("ws_sender") == 0.5
+
+
+def test_queue_handler_drops_without_formatting_when_full():
+    handler = NonBlockingQueueHandler(queue.Queue(maxsize=1))
+    record = make_record()
+    handler.handle(record)
+    handler.handle(make_record())
+    assert handler.dropped == 1
+    # The message is still a template; the writer thread merges the arguments
+    assert handler.queue.get_nowait().msg == "Sent %d bytes"
+
+    record.topic = "er"
+    entry = json.loads(JsonFormatter().format(record))
+    assert entry["message"] == "Sent 1 bytes" and entry["topic"] == "er"
+
+
+def test_mutable_arguments_are_merged_before_queueing():
+    handler = NonBlockingQueueHandler(queue.Queue())
+    highlights = ["student"]
+    handler.handle(make_record(msg="Highlights %s", args=(highlights,)))
+    handler.handle(make_record(msg="Counts %(n)d", args=({"n": 2},)))
+    highlights.append("course")
+    record = handler.queue.get_nowait()
+    assert record.getMessage() == "Highlights ['student']" and record.args is None
+    assert handler.queue.get_nowait().getMessage() == "Counts 2"
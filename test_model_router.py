@@ -0,0 +1,39 @@
+"""
+Tests for model_router.py
+"""
+
+from model_router import ModelRouter, RouterRules
+
+
+def test_short_lookups_are_simple_and_multi_step_questions_complex():
+    router = ModelRouter(simple_model="small", complex_model="large")
+    assert router.route("er", "what does PK mean?").route.model == "small"
+    assert router.route("er", "Define cardinality").route.name == "simple"
+    decision = router.route(
+        "er",
+        "How would I normalize this schema to 3NF and "
+        "what functional dependencies are there?",
+    )
+    assert decision.route.model == "large"
+    assert decision.features["keywords"] > 0
+
+
+def test_keywords_match_whole_words_or_stems():
+    router = ModelRouter()
+    for doubt in ("How can I improve this?", "Who approves an order?"):
+        assert router.features("er", doubt)["keywords"] == 0, doubt
+    for doubt in ("Why is it split?", "Prove it", "Is it denormalized?"):
+        assert router.features("er", doubt)["keywords"] > 0, doubt
+
+
+def test_rules_are_configurable_and_routes_keep_metrics():
+    router = ModelRouter(RouterRules(complex_topics=["normalization"]))
+    assert router.route("normalization", "why is this split?").route.name == "complex"
+    assert router.route("er", "why is this split?").route.name == "simple"
+
+    route = router.routes["simple"]
+    router.record(route, 0.4)
+    router.record(route, 0.2)
+    metrics = router.metrics()["simple"]
+    assert metrics["requests"] == 1 and metrics["completed"] == 2
+    assert metrics["latency_p50"] == 0.4
@@ -0,0 +1,61 @@
+"""
+Tests for mp3_index.py
+"""
+
+from audio_buffer import SpooledAudio
+from audio_cache import AudioCache
+from mp3_index import index_mp3, parse_frame_header
+from realtime_audio import measured_duration_ms
+
+# MPEG-2 Layer III, 64 kbit/s, 24 kHz, mono: 192 bytes and 24 ms per frame
+FRAME = bytes([0xFF, 0xF3, 0x84, 0xC4]) + bytes(188)
+ID3_TAG = b"ID3\x03\x00\x00\x00\x00\x00\x05" + bytes(5)
+ID3V1_TAG = b"TAG" + bytes(125)
+
+
+def info_frame():
+    frame = bytearray(FRAME)
+    frame[13:17] = b"Info"
+    return bytes(frame)
+
+
+def test_frame_header_gives_length_and_samples():
+    assert parse_frame_header(FRAME, 0) == (192, 576, 24000)
+    # MPEG-1 Layer III, 128 kbit/s, 44.1 kHz, padded
+    assert parse_frame_header(bytes([0xFF, 0xFB, 0x92, 0x44]), 0) == (418, 1152, 44100)
+    assert parse_frame_header(bytes([0xFF, 0xF3, 0xF4, 0xC4]), 0) is None
+
+
+def test_index_skips_tags_info_frame_and_junk():
+    data = ID3_TAG + info_frame() + FRAME * 100 + b"junk" + FRAME * 25 + ID3V1_TAG
+    index = index_mp3(data)
+    assert index.frames == 125
+    assert index.duration_ms == 125 * 24
+    assert index.offsets[0] == len(ID3_TAG) + len(FRAME)
+    assert index.end == len(data) - len(ID3V1_TAG)
+
+    offset, start_ms = index.offset_at(1000)
+    assert start_ms == 984 and offset == index.offsets[41]
+    assert index.offset_at(-5) == (index.offsets[0], 0)
+    assert [time_ms for time_ms, _ in index.seek_table(1000)][:3] == [0, 1008, 2016]
+    assert index_mp3(b"not audio") is None
+
+
+def test_measured_duration_and_cached_index(tmp_path):
+    spool = SpooledAudio()
+    spool.write(FRAME * 50)
+    assert measured_duration_ms(spool, "mp3") == 1200
+    assert spool.duration_ms == 1200
+
+    pcm = SpooledAudio()
+    pcm.write(bytes(48000))
+    assert measured_duration_ms(pcm, "pcm") == 1000
+    assert measured_duration_ms(SpooledAudio(), "opus") is None
+
+    cache = AudioCache(str(tmp_path))
+    cache.put("narration", FRAME * 50, response_format="mp3")
+    cache.put("speech", bytes(100), response_format="opus")
+    assert cache.index("narration").duration_ms == 1200
+    assert cache.index("narration") is cache.index("narration")
+    assert cache.index("speech") is None
+    assert cache.index("missing") is None
@@ -0,0 +1,99 @@
+"""
+Tests for narration_prefetch.py
+"""
+
+import asyncio
+
+from narration_prefetch import (
+    NarrationPlan,
+    NarrationPrefetcher,
+    build_plan,
+    load_plan,
+)
+
+SCRIPT = {
+    "script": (
+        "Students enroll in courses. Each course has a code. "
+        "A trigger fires on events. Rules decide what happens. "
+        "Finally we look at the whole system."
+    ),
+    "component_mappings": {"course": "course"},
+    "timestamps": [
+        {"word": "trigger", "start_time": 0, "end_time": 1, "node_id": "trg"}
+    ],
+}
+NODES = [{"id": "student", "name": "Students"}, {"id": "rules", "name": "Rules"}]
+
+
+def make_plan():
+    return build_plan("school", SCRIPT, NODES, sentences_per_segment=2)
+
+
+def test_script_is_split_into_timed_segments_with_their_nodes():
+    plan = make_plan()
+    assert [segment.node_ids for segment in plan.segments] == [
+        ["course", "student"],
+        ["rules", "trg"],
+        [],
+    ]
+    first, second, third = plan.segments
+    assert first.start_ms == 0 and second.start_ms == first.end_ms
+    assert plan.duration_ms == third.end_ms
+    assert plan.segment_at(0) == 0 and plan.segment_at(second.start_ms + 1) == 1
+    assert plan.upcoming(0, 0, 60_000, 5) == [second, third]
+    assert plan.upcoming(0, 0, 60_000, 1) == [second]
+    assert plan.upcoming(0, 0, second.start_ms, 5) == []
+
+
+def test_heartbeats_prefetch_ahead_and_cancel_on_seek():
+    plan = make_plan()
+    started, prepared = [], []
+
+    async def prefetch(plan, segment, **options):
+        started.append(segment.index)
+        await asyncio.sleep(10)
+
+    async def run():
+        prefetcher = NarrationPrefetcher(
+            window_ms=60_000,
+            max_segments=1,
+            prefetch=prefetch,
+            prepare=prepared.append,
+            plans=lambda topic: plan,
+        )
+        report = prefetcher.heartbeat("s1", "school", position_ms=0)
+        prefetcher.heartbeat("s2", "school", segment=0, offset_ms=500)
+        await asyncio.sleep(0.05)
+        assert [item["index"] for item in report["upcoming"]] == [1]
+        assert started == [1] and prepared == ["school"]
+
+        # s1 seeks ahead: segment 1 is still wanted by s2
+        report = prefetcher.heartbeat("s1", "school", segment=1)
+        await asyncio.sleep(0.05)
+        assert report["seek"] and started == [1, 2]
+        assert prefetcher.metrics()["in_flight"] == 2
+
+        # s2 stops: nobody wants segment 1 any more
+        prefetcher.heartbeat("s2", "school", position_ms=0, state="stopped")
+        await asyncio.sleep(0.05)
+        metrics = prefetcher.metrics()
+        assert metrics["cancelled"] == 1 and metrics["in_flight"] == 1
+        assert metrics["sessions"] == 1 and metrics["seeks"] == 1
+
+        prefetcher.ttl = 0
+        prefetcher.heartbeat("s3", "school", position_ms=plan.duration_ms)
+        await asyncio.sleep(0.05)
+        assert prefetcher.metrics()["cancelled"] == 2
+
+    asyncio.run(run())
+
+
+def test_scripts_without_sentences_have_no_plan(tmp_path):
+    (tmp_path / "empty_script.json").write_text('{"script": "  "}')
+    assert load_plan("empty", tmp_path) is None
+
+    assert build_plan("empty", {"script": ""}, []) is None
+    empty = NarrationPlan(topic="empty", segments=[], duration_ms=0, nodes=[])
+    prefetcher = NarrationPrefetcher(plans=lambda topic: empty)
+    report = prefetcher.heartbeat("s1", "empty", segment=2)
+    assert report == {"topic": "empty", "segments": 0, "upcoming": []}
@@ -0,0 +1,61 @@
+"""
+Tests for narration_warmup.py
+"""
+
+import asyncio
+import json
+
+import narration_warmup
+from audio_buffer import SpooledAudio
+from audio_cache import AudioCache
+from narration_warmup import discover_narrations, narration_cache_key, warm_narrations
+
+
+def write_topics(data_dir):
+    nodes = [{"id": "student", "name": "Student"}]
+    (data_dir / "er_script.json").write_text(json.dumps({"script": "A student."}))
+    (data_dir / "er_visualization.json").write_text(json.dumps({"nodes": nodes}))
+    (data_dir / "gis_script.json").write_text(json.dumps({"script": "Maps."}))
+    (data_dir / "empty_script.json").write_text(json.dumps({"script": ""}))
+    (data_dir / "broken_script.json").write_text("{")
+    (data_dir / "xml_visualization.json").write_text(json.dumps({"nodes": []}))
+
+
+def test_discover_narrations_reads_scripts_and_nodes(tmp_path):
+    write_topics(tmp_path)
+    jobs = discover_narrations(tmp_path)
+    assert [job.topic for job in jobs] == ["er", "gis"]
+    assert jobs[0].text == "A student." and jobs[0].nodes[0]["id"] == "student"
+    assert jobs[1].nodes == []
+    assert [job.topic for job in discover_narrations(tmp_path, ["gis"])] == ["gis"]
+
+
+def test_warm_up_synthesizes_once_and_resumes(tmp_path, monkeypatch):
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    write_topics(data_dir)
+    cache = AudioCache(str(tmp_path / "audio"))
+    monkeypatch.setattr(narration_warmup, "audio_cache", cache)
+    synthesized = []
+
+    async def synthesize_audio(text, voice, priority):
+        synthesized.append(text)
+        await asyncio.sleep(0.01)
+        cache.put(narration_cache_key(text, voice), b"audio")
+        buffer = SpooledAudio()
+        buffer.write(b"audio")
+        return buffer
+
+    monkeypatch.setattr(narration_warmup, "synthesize_audio", synthesize_audio)
+    # A previous run already cached the audio and timings of one topic
+    cache.put(narration_cache_key("Maps.", "alloy"), b"audio", word_timings=[])
+
+    progress = asyncio.run(warm_narrations(workers=3, data_dir=data_dir))
+    assert synthesized == ["A student."]
+    assert (progress.total, progress.completed, progress.skipped) == (2, 1, 1)
+    meta = cache.get_meta(narration_cache_key("A student.", "alloy"))
+    assert meta["topic"] == "er" and len(meta["word_timings"]) == 2
+    assert not progress.running and progress.in_progress == []
+
+    progress = asyncio.run(warm_narrations(workers=3, data_dir=data_dir))
+    assert synthesized == ["A student."] and progress.skipped == 2
@@ -0,0 +1,159 @@
+"""
+Tests for openai_scheduler.py
+"""
+
+import asyncio
+import time
+
+import pytest
+
+from openai_scheduler import AdmissionRejected, OutboundScheduler, Priority
+
+
+def test_priority_order_when_saturated():
+    async def scenario():
+        scheduler = OutboundScheduler(
+            "test", requests_per_minute=6000, max_concurrency=1
+        )
+        order = []
+        blocker = await scheduler.acquire(Priority.INTERACTIVE)
+
+        async def call(priority, label):
+            async with scheduler.slot(priority):
+                order.append(label)
+
+        tasks = [
+            asyncio.create_task(call(Priority.PREFETCH, "prefetch")),
+            asyncio.create_task(call(Priority.NARRATION, "narration")),
+            asyncio.create_task(call(Priority.INTERACTIVE, "doubt")),
+        ]
+        await asyncio.sleep(0.01)
+        assert scheduler.metrics()["queue_depth"]["prefetch"] == 1
+        scheduler.release(blocker)
+        await asyncio.gather(*tasks)
+        return order
+
+    assert asyncio.run(scenario()) == ["doubt", "narration", "prefetch"]
+
+
+def test_bounded_queue_rejects():
+    async def scenario():
+        scheduler = OutboundScheduler(
+            "test",
+            requests_per_minute=6000,
+            max_concurrency=1,
+            queue_limits={priority: 1 for priority in Priority},
+        )
+        blocker = await scheduler.acquire()
+        waiting = asyncio.create_task(scheduler.acquire())
+        await asyncio.sleep(0.01)
+        with pytest.raises(AdmissionRejected):
+            await scheduler.acquire()
+        scheduler.release(blocker)
+        scheduler.release(await waiting)
+        return scheduler.metrics()
+
+    metrics = asyncio.run(scenario())
+    assert metrics["rejected_queue_full"] == 1
+    assert metrics["inflight"] == 0
+
+
+def test_deadline_rejection_and_token_bucket():
+    scheduler = OutboundScheduler(
+        "test", requests_per_minute=60, tokens_per_minute=1000
+    )
+    scheduler.release(scheduler.acquire_sync(tokens=1000), used_tokens=1000)
+    with pytest.raises(AdmissionRejected):
+        scheduler.acquire_sync(tokens=500, deadline=0.05)
+    assert scheduler.metrics()["rejected_deadline"] == 1
+
+
+def test_rate_limit_requeues_call():
+    class Response:
+        headers = {"retry-after": "0.01"}
+
+    class RateLimited(Exception):
+        status_code = 429
+        response = Response()
+
+    attempts = []
+
+    def call():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise RateLimited()
+        return "ok"
+
+    scheduler = OutboundScheduler("test", requests_per_minute=6000)
+    assert scheduler.submit_sync(call) == "ok"
+    assert len(attempts) == 2
+    assert scheduler.metrics()["rate_limited"] == 1
+
+
+class Usage:
+    total_tokens = 100
+
+
+class Chunk:
+    def __init__(self, usage=None):
+        self.usage = usage
+
+
+def test_streams_hold_their_admission_until_read():
+    scheduler = OutboundScheduler(
+        "test", requests_per_minute=6000, tokens_per_minute=1000, max_concurrency=1
+    )
+
+    def slow_stream():
+        for _ in range(3):
+            time.sleep(0.02)
+            yield Chunk()
+        yield Chunk(Usage())
+
+    stream = scheduler.submit_sync(slow_stream, tokens=600, stream=True)
+    next(stream)
+    assert scheduler.metrics()["inflight"] == 1
+    with pytest.raises(AdmissionRejected):
+        scheduler.acquire_sync(deadline=0.05)
+    assert len(list(stream)) == 3
+    assert scheduler.metrics()["inflight"] == 0
+    # The unused part of the estimate was refunded from the final usage
+    scheduler.release(scheduler.acquire_sync(tokens=900, deadline=0.05))
+
+    # Closing a stream early frees the slot as well
+    stream = scheduler.submit_sync(slow_stream, stream=True)
+    next(stream)
+    stream.close()
+    assert scheduler.metrics()["inflight"] == 0
+
+
+def test_async_streams_hold_their_admission_until_closed():
+    async def slow_stream():
+        for _ in range(3):
+            await asyncio.sleep(0.02)
+            yield Chunk()
+
+    async def scenario():
+        scheduler = OutboundScheduler(
+            "test", requests_per_minute=6000, max_concurrency=1
+        )
+
+        async def call():
+            return slow_stream()
+
+        stream = await scheduler.submit(call, stream=True)
+        waiting = asyncio.create_task(scheduler.acquire())
+        await asyncio.sleep(0.01)
+        assert not waiting.done()
+        chunks = [chunk async for chunk in stream]
+        await asyncio.sleep(0.01)
+        # The queued call was only admitted once the stream was read
+        assert len(chunks) == 3 and waiting.done()
+        scheduler.release(waiting.result())
+
+        stream = await scheduler.submit(call, stream=True)
+        await stream.__anext__()
+        await stream.close()
+        return scheduler.metrics()
+
+    assert asyncio.run(scenario())["inflight"] == 0
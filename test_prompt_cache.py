@@ -0,0 +1,45 @@
+"""
+Tests for prompt_cache.py
+"""
+
+from app import VisualizationNode, load_visualization_data, topic_graph
+from graph_store import TopicGraph
+from graph_stream import generate_synthetic_graph
+from prompt_cache import PromptPrefixCache, build_topic_prefix
+from prompt_context import estimate_tokens
+
+
+def test_prefix_is_byte_identical():
+    cache = PromptPrefixCache()
+    first = cache.get("er", topic_graph("er"))
+    second = cache.get("er", topic_graph("er"))
+    assert first.text.encode("utf-8") == second.text.encode("utf-8")
+    assert build_topic_prefix("er", load_visualization_data("er")) == first
+    assert first.tokens == estimate_tokens(first.text)
+    assert "Student" in first.text and "3 elements and 2 edges" in first.text
+
+    cache.get("triggers", topic_graph("triggers"))
+    metrics = cache.metrics()
+    assert metrics["hits"] == 1 and metrics["misses"] == 2
+    assert metrics["topics"] == 2
+
+
+def test_prefix_is_rebuilt_when_topic_data_changes():
+    cache = PromptPrefixCache()
+    data = load_visualization_data("er")
+    before = cache.get("er", data).text
+    data.nodes.append(VisualizationNode(id="teacher", name="Teacher", type="entity"))
+    after = cache.get("er", data).text
+    assert after != before and "4 elements" in after
+    assert cache.metrics()["invalidations"] == 1
+
+
+def test_graph_is_left_to_the_bounded_request_context():
+    graph = TopicGraph("synthetic_2000", *generate_synthetic_graph(2000))
+    prefix = build_topic_prefix("synthetic_2000", graph)
+    small = build_topic_prefix(
+        "synthetic_20", TopicGraph("synthetic_20", *generate_synthetic_graph(20))
+    )
+    # The prefix does not grow with the graph; only the summary line changes
+    assert prefix.tokens - small.tokens < 5
+    assert "Elements of the visualization" not in prefix.text
@@ -0,0 +1,68 @@
+"""
+Tests for prompt_context.py
+"""
+
+from app import (
+    VisualizationData,
+    VisualizationEdge,
+    VisualizationNode,
+    load_visualization_data,
+)
+import numpy as np
+
+from prompt_context import (
+    NodeTextIndex,
+    estimate_tokens,
+    extract_prompt_context,
+    similarity_scores,
+)
+
+
+def make_chain(length):
+    nodes = [
+        VisualizationNode(id=f"n{i}", name=f"Node {i}", type="generic")
+        for i in range(length)
+    ]
+    edges = [
+        VisualizationEdge(source=f"n{i}", target=f"n{i + 1}", type="connection")
+        for i in range(length - 1)
+    ]
+    return VisualizationData(nodes=nodes, edges=edges, topic="chain")
+
+
+def test_highlighted_neighborhood_comes_first():
+    data = make_chain(50)
+    context = extract_prompt_context(data, "why?", ["n10"], token_budget=10_000, hops=1)
+    assert [node["id"] for node in context.nodes][:1] == ["n10"]
+    assert {node["id"] for node in context.nodes} == {"n9", "n10", "n11"}
+    assert len(context.edges) == 2
+
+
+def test_similarity_selects_matching_nodes():
+    data = load_visualization_data("er")
+    context = extract_prompt_context(data, "What is the course_id key?", [])
+    assert context.nodes[0]["id"] == "course"
+
+
+def test_text_index_matches_dense_similarity():
+    documents = ["course course_id key", "student name", "", "student course"]
+    index = NodeTextIndex(documents)
+    for query in ("What is the course_id key?", "student", "nothing here"):
+        assert np.allclose(index.scores(query), similarity_scores(query, documents))
+
+
+def test_unknown_query_terms_lower_similarity():
+    documents = ["what is a primary key", "what is a weak entity"]
+    exact, near_miss = (
+        similarity_scores(query, documents)[0]
+        for query in ("what is a primary key", "what is a foreign key")
+    )
+    assert np.isclose(exact, 1.0) and near_miss < 0.7
+
+
+def test_token_budget_is_respected():
+    data = make_chain(500)
+    context = extract_prompt_context(data, "tell me about node", [], token_budget=200)
+    assert context.truncated
+    assert context.token_estimate <= 200
+    assert sum(estimate_tokens(str(node)) for node in context.nodes) <= 200
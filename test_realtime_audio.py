@@ -0,0 +1,127 @@
+"""
+Tests for realtime_audio.py
+"""
+
+import asyncio
+import json
+
+from starlette.websockets import WebSocketDisconnect
+
+import realtime_audio
+import visualization_state
+from audio_buffer import SpooledAudio
+from cache_store import SQLiteCacheStore
+from cancellation import RequestScope
+from session_context import SessionContextStore
+from visualization_state import VisualizationStateStore, state_key
+
+ANSWER = "Each Student enrolls in courses through Enrolls."
+
+
+class ScriptedWebSocket:
+    def __init__(self, messages, release):
+        self.incoming = [json.dumps(m) for m in messages]
+        self.release = release
+        self.sent = []
+
+    async def accept(self):
+        pass
+
+    async def receive_text(self):
+        if self.incoming:
+            return self.incoming.pop(0)
+        self.release.set()
+        await asyncio.sleep(0.05)
+        raise WebSocketDisconnect()
+
+    async def send_text(self, text):
+        self.sent.append(json.loads(text))
+
+    async def close(self, code=1000):
+        pass
+
+
+class Sender:
+    def __init__(self):
+        self.messages = []
+
+    async def send_json(self, message):
+        self.messages.append(message)
+
+
+def test_doubt_patch_highlights_the_elements_the_answer_names(tmp_path, monkeypatch):
+    store = SQLiteCacheStore(str(tmp_path / "c.db"))
+    states = VisualizationStateStore(store)
+    monkeypatch.setattr(visualization_state, "visualization_states", states)
+    monkeypatch.setattr(realtime_audio, "session_contexts", SessionContextStore(store))
+
+    async def answer(**request):
+        return ANSWER
+
+    async def synthesize(scope, text, nodes=None, **options):
+        timings = await realtime_audio.generate_word_timings(text, 1000, nodes)
+        return SpooledAudio(), timings
+
+    async def no_audio(sender, text, **options):
+        pass
+
+    monkeypatch.setattr(realtime_audio, "process_doubt_with_openai", answer)
+    monkeypatch.setattr(realtime_audio, "synthesize_with_timings", synthesize)
+    monkeypatch.setattr(realtime_audio, "stream_audio_frames", no_audio)
+
+    async def run():
+        sender = Sender()
+        never = asyncio.get_running_loop().create_future()
+        async with RequestScope(signal=never) as scope:
+            request = {"topic": "er", "doubt": "How do students enroll?"}
+            await realtime_audio.serve_doubt(
+                sender, scope, {**request, "session_id": "s1"}
+            )
+        return sender.messages
+
+    messages = asyncio.run(run())
+    patch = next(m for m in messages if m["type"] == "state_patch")["data"]
+    added = [
+        op["path"]
+        for entry in patch["patches"]
+        for op in entry["ops"]
+        if op["path"].startswith("/highlights/")
+    ]
+    assert added == [
+        "/highlights/student",
+        "/highlights/enrollment",
+        "/highlights/course",
+    ]
+    timing = next(m for m in messages if m["type"] == "timing")["data"]
+    # Only the named elements are matched against the words
+    assert {t["node_id"] for t in timing} == {None, "student", "enrollment"}
+    snapshot = states.snapshot(state_key("er", "s1"))["snapshot"]
+    assert list(snapshot["highlights"]) == ["student", "enrollment", "course"]
+
+
+def test_duplicate_request_id_is_rejected_without_ending_the_running_stream(
+    monkeypatch,
+):
+    async def run():
+        release = asyncio.Event()
+
+        async def slow_doubt(sender, scope, request):
+            await release.wait()
+            await sender.send_json({"type": "end"})
+
+        monkeypatch.setitem(realtime_audio.SESSION_HANDLERS, "doubt", slow_doubt)
+        websocket = ScriptedWebSocket(
+            [{"id": "1", "type": "doubt"}, {"id": "1", "type": "doubt"}], release
+        )
+        await realtime_audio.handle_session_websocket(websocket)
+        return websocket.sent
+
+    # The rejection carries no "id", so it cannot be mistaken for the running request
+    assert asyncio.run(run()) == [
+        {
+            "type": "rejected",
+            "request_id": "1",
+            "error": "Request 1 is already running",
+        },
+        {"id": "1", "type": "end"},
+    ]
@@ -0,0 +1,134 @@
+"""
+Tests for resilience.py
+"""
+
+import asyncio
+from types import SimpleNamespace
+
+import openai
+import pytest
+
+from openai_scheduler import MAX_RATE_LIMIT_RETRIES, OutboundScheduler
+from resilience import CallPolicy, ResilientCaller, is_transient_error
+
+
+def status_error(cls, status, headers=None):
+    response = SimpleNamespace(status_code=status, headers=headers or {}, request=None)
+    return cls("upstream", response=response, body=None)
+
+
+class Response:
+    def __init__(self, name):
+        self.name = name
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def make_caller(**settings):
+    policy = CallPolicy(name="test", backoff_base=0.0, failure_threshold=2, **settings)
+    return ResilientCaller(policy)
+
+
+def test_only_transient_errors_are_retried():
+    assert is_transient_error(asyncio.TimeoutError())
+    assert is_transient_error(openai.APITimeoutError(request=None))
+    assert is_transient_error(openai.APIConnectionError(request=None))
+    assert is_transient_error(status_error(openai.InternalServerError, 503))
+    # The scheduler re-queues 429s itself
+    assert not is_transient_error(status_error(openai.RateLimitError, 429))
+    assert not is_transient_error(status_error(openai.BadRequestError, 400))
+    assert not is_transient_error(status_error(openai.AuthenticationError, 401))
+    assert not is_transient_error(ValueError("bad input"))
+
+    caller = make_caller(retries=3)
+    calls = []
+
+    def bad_request(timeout):
+        calls.append(timeout)
+        raise status_error(openai.BadRequestError, 400)
+
+    for _ in range(3):
+        with pytest.raises(openai.BadRequestError):
+            caller.call_sync(bad_request, fallback=lambda: "cached")
+    assert len(calls) == 3
+    assert caller.breaker.state == "closed" and caller.breaker.failures == 0
+    metrics = caller.metrics()
+    assert metrics["permanent_errors"] == 3 and metrics["retries"] == 0
+
+    def unavailable(timeout):
+        calls.append(timeout)
+        raise status_error(openai.InternalServerError, 503)
+
+    calls.clear()
+    assert caller.call_sync(unavailable, fallback=lambda: "cached") == "cached"
+    assert len(calls) == 4 and caller.breaker.failures == 1
+
+
+def test_rate_limits_are_only_retried_by_the_scheduler():
+    scheduler = OutboundScheduler("test", requests_per_minute=6000)
+    caller = make_caller(retries=3)
+    calls = []
+
+    def rate_limited():
+        calls.append(1)
+        raise status_error(openai.RateLimitError, 429, {"retry-after": "0.01"})
+
+    with pytest.raises(openai.RateLimitError):
+        caller.call_sync(lambda timeout: scheduler.submit_sync(rate_limited))
+    assert len(calls) == MAX_RATE_LIMIT_RETRIES + 1
+    assert scheduler.metrics()["rate_limited"] == MAX_RATE_LIMIT_RETRIES
+    metrics = caller.metrics()
+    assert metrics["rate_limited"] == 1 and metrics["retries"] == 0
+    assert caller.breaker.failures == 0
+
+
+def test_permanent_errors_release_the_half_open_trial():
+    caller = make_caller(retries=0, reset_timeout=0.0)
+
+    async def failing(error):
+        raise error
+
+    async def run():
+        for _ in range(2):
+            with pytest.raises(openai.APIConnectionError):
+                await caller.call(
+                    lambda t: failing(openai.APIConnectionError(request=None))
+                )
+        assert caller.breaker.opened_at is not None
+        with pytest.raises(openai.BadRequestError):
+            await caller.call(
+                lambda t: failing(status_error(openai.BadRequestError, 400))
+            )
+        # The rejected request says nothing about upstream health
+        assert caller.breaker.opened_at is not None and caller.breaker.allow()
+
+    asyncio.run(run())
+
+
+def test_losing_hedge_is_closed():
+    caller = make_caller(hedge=True, hedge_min_delay=0.02)
+    caller._latencies.extend([0.001] * 20)
+
+    async def run():
+        both_started = asyncio.Event()
+        responses = []
+
+        async def call(timeout):
+            response = Response(f"attempt {len(responses)}")
+            responses.append(response)
+            if len(responses) == 2:
+                both_started.set()
+            await both_started.wait()
+            return response
+
+        winner = await caller.call(call, hedge=True)
+        await asyncio.sleep(0.01)
+        return winner, responses
+
+    winner, responses = asyncio.run(run())
+    assert len(responses) == 2 and winner in responses
+    assert not winner.closed
+    assert [r.closed for r in responses if r is not winner] == [True]
+    assert caller.metrics()["hedges"] == 1
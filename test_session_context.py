@@ -0,0 +1,111 @@
+"""
+Tests for session_context.py
+"""
+
+import multiprocessing
+import threading
+
+from cache_store import SQLiteCacheStore
+from prompt_context import estimate_tokens
+from session_context import SessionContextStore
+
+
+def make_store(tmp_path, summarize=None, **options):
+    store = SessionContextStore(
+        SQLiteCacheStore(str(tmp_path / "cache.sqlite3")),
+        summarize=summarize or (lambda summary, turns, tokens: ""),
+        **options,
+    )
+    return store
+
+
+def test_context_stays_within_budget_as_the_session_grows(tmp_path):
+    contexts = make_store(tmp_path, budget=300, summary_budget=100, recent_turns=3)
+    contexts.background_summaries = False
+    for turn in range(30):
+        contexts.record_turn(
+            "er:s1", f"Question {turn} about keys?", f"Answer {turn}. " + "word " * 150
+        )
+        context = contexts.context("er:s1")
+        assert context.token_estimate <= 300
+        assert estimate_tokens(context.summary or " ") <= 100
+
+    assert len(context.turns) <= 3
+    assert context.turns[-1].doubt == "Question 29 about keys?"
+    assert "Question 26" in context.summary
+    messages = context.messages()
+    assert messages[0]["role"] == "system" and messages[-1]["role"] == "assistant"
+
+
+def test_folded_turns_are_summarized_in_the_background(tmp_path):
+    calls = []
+    done = threading.Event()
+
+    def summarize(summary, turns, tokens):
+        calls.append([turn.seq for turn in turns])
+        done.set()
+        return "The student asked about keys and joins."
+
+    contexts = make_store(tmp_path, summarize, recent_turns=2)
+    for turn in range(3):
+        contexts.record_turn("er:s1", f"Doubt {turn}?", f"Answer {turn}.")
+    assert done.wait(5)
+    while contexts.metrics()["summarizing"]:
+        threading.Event().wait(0.01)
+
+    context = contexts.context("er:s1")
+    assert calls == [[1]]
+    assert context.summary == "The student asked about keys and joins."
+    assert [turn.seq for turn in context.turns] == [2, 3]
+    assert contexts.metrics()["summaries"] == 1
+
+
+def test_follow_ups_are_cached_per_conversation(tmp_path):
+    contexts = make_store(tmp_path)
+    assert contexts.context("er:s1").cache_context() == []
+    contexts.record_turn("er:s1", "What is a key?", "A key identifies a row.")
+    contexts.record_turn("er:s2", "What is a key?", "A key identifies a row.")
+    first = contexts.context("er:s1").cache_context()
+    assert first and first == contexts.context("er:s2").cache_context()
+    contexts.record_turn("er:s1", "Why?", "Because rows must be distinguishable.")
+    assert contexts.context("er:s1").cache_context() != first
+
+
+def record_turns(path, worker, start):
+    contexts = SessionContextStore(SQLiteCacheStore(path), recent_turns=100)
+    contexts.background_summaries = False
+    start.wait()
+    for i in range(25):
+        contexts.record_turn("er:s1", f"Doubt {worker}-{i}?", "Answer.")
+
+
+def test_turns_are_not_lost_across_processes(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    context = multiprocessing.get_context("spawn")
+    start = context.Barrier(4)
+    processes = [
+        context.Process(target=record_turns, args=(path, worker, start))
+        for worker in range(4)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(timeout=60)
+
+    entry = SQLiteCacheStore(path).get("session_context", "er:s1")
+    assert sorted(turn["seq"] for turn in entry["turns"]) == list(range(1, 101))
+    assert len({turn["doubt"] for turn in entry["turns"]}) == 100
+
+
+def test_summary_lease_is_released(tmp_path):
+    contexts = make_store(tmp_path, lambda summary, turns, tokens: "Summary.")
+    contexts.background_summaries = False
+    contexts.recent_turns = 1
+    contexts.record_turn("er:s1", "First?", "One.")
+    contexts.background_summaries = True
+    contexts.record_turn("er:s1", "Second?", "Two.")
+    while contexts.metrics()["summarizing"]:
+        threading.Event().wait(0.01)
+    assert contexts.metrics()["summaries"] == 1
+    # Another process may summarize the next turns right away
+    assert contexts.store.try_lease("session_summary:er:s1", "other", ttl=60)
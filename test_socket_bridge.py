@@ -6,6 +6,16 @@ Test script for socket_bridge.py
 import subprocess
 import json
 import time
+import asyncio
+import contextlib
+
+import pytest
+from pydantic import ValidationError
+
+import cache_store
+import socket_bridge
+from cache_store import SQLiteCacheStore
+from visualization_state import VisualizationStateStore
 
 def test_doubt_mode():
     """Test the doubt mode of socket_bridge.py"""
@@ -61,5 +71,62 @@ def test_doubt_mode():
     # Close the process
     process.terminate()
     
+def test_lifespan_purges_expired_cache_entries(tmp_path, monkeypatch):
+    """The bridge deletes expired cache entries in the background while it runs"""
+    store = SQLiteCacheStore(str(tmp_path / "c.db"))
+    monkeypatch.setattr(cache_store, "cache_store", store)
+    monkeypatch.setattr(cache_store, "CACHE_PURGE_INTERVAL", 0.01)
+    store.set("doubt_text", "old", "answer", ttl=-1)
+    store.set("doubt_text", "new", "answer", ttl=60)
+    app = socket_bridge.create_app()
+    
+    async def serve():
+        async with app.router.lifespan_context(app):
+            await asyncio.sleep(0.1)
+            task = app.state.purge_task
+            assert not task.done()
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
+        return task
+    
+    assert asyncio.run(serve()).cancelled()
+    rows = store._connection().execute("SELECT key FROM cache").fetchall()
+    assert rows == [("new",)]
+    
+def test_state_update_returns_only_its_own_patch(tmp_path, monkeypatch):
+    """Patches are reported since the version the update itself was applied to"""
+    states = VisualizationStateStore(SQLiteCacheStore(str(tmp_path / "s.db")))
+    monkeypatch.setattr(socket_bridge, "visualization_states", states)
+    modify = states.modify
+    
+    def modify_after_another_worker(key, change):
+        # Another worker changes the state just before this update is applied
+        modify(key, lambda state: {**state, "narration": "Other worker"})
+        return modify(key, change)
+    
+    monkeypatch.setattr(states, "modify", modify_after_another_worker)
+    request = socket_bridge.StateUpdateRequest(
+        session_id="s1",
+        changes={"nodes": {"student": {"color": "red"}}, "highlights": {"course": True}}
+    )
+    result = asyncio.run(socket_bridge.update_visualization_state("er", request))
+    assert result["version"] == 2 and result["since"] == 1
+    ops = [op for patch in result["patches"] for op in patch["ops"]]
+    assert {op["path"] for op in ops} == {"/nodes/student", "/highlights/course"}
+    
+def test_state_update_only_accepts_node_properties_and_highlights():
+    for changes in (
+        {"narration": "Injected"},
+        {"timeline": []},
+        {"highlights": {"course": "yes"}},
+        {"nodes": {"student": "red"}},
+    ):
+        with pytest.raises(ValidationError):
+            socket_bridge.StateUpdateRequest(session_id="s1", changes=changes)
+    request = socket_bridge.StateUpdateRequest(
+        session_id="s1", changes={"highlights": {"course": None}}
+    )
+    assert request.changes.dict(exclude_unset=True) == {"highlights": {"course": None}}
+    
 if __name__ == "__main__":
     test_doubt_mode() 
\ No newline at end of file
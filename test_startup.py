@@ -0,0 +1,56 @@
+"""
+Tests for import-time cost of the entry points (app.py, socket_bridge.py, realtime_audio.py)
+"""
+
+import os
+import subprocess
+import sys
+
+import pytest
+
+# Cumulative `python -X importtime` budget per entry point, in milliseconds.
+# Generous compared with a warm run (roughly 150 / 200 / 400 ms) so slow CI
+# machines pass, but far below the cost of loading the OpenAI SDK eagerly.
+IMPORT_BUDGET_MS = {
+    "app": float(os.getenv("IMPORT_BUDGET_APP_MS", "600")),
+    "realtime_audio": float(os.getenv("IMPORT_BUDGET_REALTIME_AUDIO_MS", "800")),
+    "socket_bridge": float(os.getenv("IMPORT_BUDGET_SOCKET_BRIDGE_MS", "1200")),
+}
+
+# Modules that must only load on first use
+LAZY_MODULES = {
+    "app": ["openai", "numpy", "fastapi", "uvicorn"],
+    "realtime_audio": ["openai", "numpy", "fastapi", "uvicorn"],
+    "socket_bridge": ["openai", "numpy", "uvicorn"],
+}
+
+
+def import_module(module):
+    # An unknown flag in argv makes any import-time argument parsing fail
+    code = (
+        "import sys; sys.argv[1:] = ['--not-an-option']; "
+        f"import {module}; "
+        f"print(','.join(m for m in {LAZY_MODULES[module]!r} if m in sys.modules))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env={**os.environ, "OPENAI_API_KEY": os.getenv("OPENAI_API_KEY", "sk-test")},
+        capture_output=True,
+        text=True,
+        timeout=60,
+    )
+    assert result.returncode == 0, result.stderr[-2000:]
+    cumulative_us = None
+    for line in result.stderr.splitlines():
+        fields = line.split("|")
+        if len(fields) == 3 and fields[2].strip() == module:
+            cumulative_us = int(fields[1])
+    return cumulative_us / 1000, result.stdout.strip()
+
+
+@pytest.mark.parametrize("module", sorted(IMPORT_BUDGET_MS))
+def test_entry_point_imports_lazily_within_budget(module):
+    elapsed_ms, loaded = import_module(module)
+    assert loaded == "", f"{module} imported {loaded} at import time"
+    assert elapsed_ms < IMPORT_BUDGET_MS[module], f"{module}: {elapsed_ms:.0f} ms"
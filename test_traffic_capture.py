@@ -0,0 +1,93 @@
+"""
+Tests for traffic_capture.py
+"""
+
+import json
+
+from fastapi import FastAPI, WebSocket
+from starlette.testclient import TestClient
+
+from traffic_capture import TrafficCaptureMiddleware, TrafficRecorder, anonymize
+from traffic_replay import diff_reports, endpoint, summarize
+from ws_sender import frame_binary
+
+
+def test_anonymize_hashes_ids_and_masks_personal_text():
+    message = {
+        "session_id": "alice",
+        "doubt": "Mail me at alice@example.com or call 555 123 4567, see https://x.io/a",
+        "nodes": [{"label": "Student"}],
+    }
+    clean = anonymize(message, "salt", limit=60)
+    assert clean["session_id"] != "alice"
+    assert clean["session_id"] == anonymize(message, "salt")["session_id"]
+    assert clean["session_id"] != anonymize(message, "other")["session_id"]
+    assert clean["doubt"] == "Mail me at <email> or call <number>, see <url>"
+    assert clean["nodes"] == [{"label": "Student"}]
+    assert len(anonymize({"text": "word " * 100}, "salt", limit=60)["text"]) == 60
+
+
+def test_middleware_traces_http_and_session_requests(tmp_path):
+    app = FastAPI()
+
+    @app.post("/api/doubt/process")
+    async def process(body: dict):
+        return {"answer": "yes"}
+
+    @app.websocket("/ws/session")
+    async def session(websocket: WebSocket):
+        await websocket.accept()
+        for _ in range(2):
+            message = await websocket.receive_json()
+            await websocket.send_bytes(frame_binary(message["id"], b"audio"))
+            await websocket.send_json({"id": message["id"], "type": "end"})
+        await websocket.close()
+
+    path = tmp_path / "capture.jsonl"
+    recorder = TrafficRecorder(str(path), salt="salt")
+    client = TestClient(TrafficCaptureMiddleware(app, recorder))
+    client.post("/api/doubt/process", json={"topic": "er", "doubt": "Why?"})
+    with client.websocket_connect("/ws/session") as websocket:
+        for request_id in ("a", "b"):
+            websocket.send_json(
+                {"id": request_id, "type": "narration", "session_id": "s"}
+            )
+            websocket.receive_bytes()
+            websocket.receive_json()
+    recorder.close()
+
+    http, first, second = [json.loads(line) for line in path.read_text().splitlines()]
+    assert http["status"] == 200 and http["topic"] == "er" and http["doubt_chars"] == 4
+    assert endpoint(http) == "POST /api/doubt/process"
+    assert [first["request_id"], second["request_id"]] == ["a", "b"]
+    assert first["status"] == "end" and first["frames"] == 2
+    assert first["connection"] == second["connection"]
+    assert first["request"]["session_id"] != "s"
+    assert second["gap_ms"] is not None and endpoint(second) == "session:narration"
+
+
+def test_report_percentiles_and_baseline_diff():
+    results = [
+        {
+            "endpoint": "session:doubt",
+            "status": "end",
+            "lag_ms": 0.0,
+            "first_byte_ms": float(ms),
+            "duration_ms": float(ms * 2),
+        }
+        for ms in range(1, 101)
+    ]
+    results.append({**results[0], "status": "error"})
+    report = summarize(results, speed=10)
+    stats = report["endpoints"]["session:doubt"]
+    assert stats["requests"] == 101 and stats["errors"] == 1
+    assert stats["first_byte_ms_p50"] == 51 and stats["first_byte_ms_p99"] == 100
+    assert stats["duration_ms_max"] == 200
+
+    faster = summarize([{**r, "duration_ms": r["duration_ms"] / 2} for r in results])
+    rows = {
+        (row["endpoint"], row["metric"]): row["change_pct"]
+        for row in diff_reports(faster, report)
+    }
+    assert rows[("session:doubt", "duration_ms_p50")] == -50.0
+    assert rows[("session:doubt", "first_byte_ms_p99")] == 0.0
@@ -0,0 +1,78 @@
+"""
+Tests for visualization_state.py
+"""
+
+import multiprocessing
+
+from cache_store import SQLiteCacheStore
+from visualization_state import VisualizationStateStore, apply_patch, diff
+
+
+def timing(word, start):
+    return {"word": word, "start_time": start, "end_time": start + 100, "node_id": None}
+
+
+def test_diff_round_trips_and_splices_timelines():
+    old = {
+        "highlights": {"a": True, "b/c": True},
+        "nodes": {"a": {"color": "red", "size": 2}},
+        "timeline": [timing("one", 0), timing("two", 100), timing("three", 200)],
+    }
+    new = {
+        "highlights": {"a": True, "d": True},
+        "nodes": {"a": {"color": "blue", "size": 2}},
+        "timeline": [
+            timing("one", 0),
+            timing("inserted", 100),
+            timing("two", 100),
+            timing("three", 200),
+        ],
+    }
+    ops = diff(old, new)
+    assert apply_patch(old, ops) == new
+    # Only the changed timeline entries travel, not the whole timeline
+    assert not any(op["path"] in ("/timeline", "/timeline/0") for op in ops)
+    assert {"op": "remove", "path": "/highlights/b~1c"} in ops
+    assert {"op": "replace", "path": "/nodes/a/color", "value": "blue"} in ops
+
+
+def test_sync_returns_patches_since_version_or_snapshot(tmp_path):
+    states = VisualizationStateStore(
+        SQLiteCacheStore(str(tmp_path / "s.db")), history=2
+    )
+    for color in ("red", "green", "blue"):
+        states.merge("er:s1", {"nodes": {"student": {"color": color}}})
+
+    caught_up = states.sync("er:s1", 1)
+    assert caught_up["version"] == 3
+    assert [patch["version"] for patch in caught_up["patches"]] == [2, 3]
+
+    document = states.sync("er:s1", None)["snapshot"]
+    assert document["nodes"]["student"]["color"] == "blue"
+    # Version 0 is older than the retained history
+    assert "snapshot" in states.sync("er:s1", 0)
+    assert states.sync("er:s1", 3)["patches"] == []
+
+
+def merge_colors(path, worker):
+    states = VisualizationStateStore(SQLiteCacheStore(path), history=100)
+    for i in range(10):
+        states.merge("er:s1", {"nodes": {f"w{worker}-{i}": {"color": "red"}}})
+
+
+def test_versions_are_not_lost_across_processes(tmp_path):
+    path = str(tmp_path / "s.db")
+    context = multiprocessing.get_context("spawn")
+    processes = [
+        context.Process(target=merge_colors, args=(path, worker)) for worker in range(4)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(timeout=60)
+
+    states = VisualizationStateStore(SQLiteCacheStore(path), history=100)
+    caught_up = states.sync("er:s1", 0)
+    assert caught_up["version"] == 40
+    assert [patch["version"] for patch in caught_up["patches"]] == list(range(1, 41))
+    assert len(states.snapshot("er:s1")["snapshot"]["nodes"]) == 40
@@ -0,0 +1,89 @@
+"""
+Tests for ws_sender.py
+"""
+
+import asyncio
+
+import pytest
+
+from ws_sender import (
+    BackpressureSender,
+    SessionSender,
+    SlowClientError,
+    connection_metrics,
+    parse_binary,
+)
+
+
+class SlowWebSocket:
+    def __init__(self, delay):
+        self.delay = delay
+        self.received = 0
+        self.close_code = None
+        self.frames = []
+
+    async def send_bytes(self, data):
+        await asyncio.sleep(self.delay)
+        self.received += len(data)
+        self.frames.append(data)
+
+    async def send_text(self, text):
+        await asyncio.sleep(self.delay)
+
+    async def close(self, code=1000):
+        self.close_code = code
+
+
+def test_pause_policy_bounds_buffered_bytes():
+    async def scenario():
+        websocket = SlowWebSocket(0.001)
+        async with BackpressureSender(
+            websocket, high_watermark=40_000, low_watermark=10_000
+        ) as sender:
+            for _ in range(50):
+                await sender.send_bytes(b"x" * 8192)
+            assert connection_metrics()["open_connections"] == 1
+        return websocket, sender
+
+    websocket, sender = asyncio.run(scenario())
+    assert websocket.received == 50 * 8192
+    assert sender.peak_buffered_bytes <= 40_000
+    assert sender.pauses > 0
+    assert connection_metrics()["open_connections"] == 0
+
+
+def test_drop_policy_closes_slow_client():
+    async def scenario():
+        websocket = SlowWebSocket(1)
+        with pytest.raises(SlowClientError):
+            async with BackpressureSender(
+                websocket, high_watermark=20_000, low_watermark=5_000, policy="drop"
+            ) as sender:
+                for _ in range(10):
+                    await sender.send_bytes(b"x" * 8192)
+        return websocket
+
+    assert asyncio.run(scenario()).close_code == 1013
+
+
+def test_session_interleaves_streams_fairly():
+    async def scenario():
+        websocket = SlowWebSocket(0.001)
+        async with SessionSender(websocket, quantum=8192) as session:
+            narration, doubt = session.stream("n1"), session.stream("d1")
+            for _ in range(20):
+                await narration.send_bytes(b"n" * 8000)
+            for _ in range(3):
+                await doubt.send_bytes(b"d" * 8000)
+            while session.buffered_bytes:
+                await asyncio.sleep(0.01)
+        return websocket
+
+    frames = [parse_binary(frame) for frame in asyncio.run(scenario()).frames]
+    assert all(
+        payload == request_id[:1].encode() * 8000 for request_id, payload in frames
+    )
+    order = [request_id for request_id, _ in frames]
+    # The later stream is served every other frame instead of after the whole narration
+    last_doubt = max(i for i, request_id in enumerate(order) if request_id == "d1")
+    assert order.count("d1") == 3 and last_doubt < 10
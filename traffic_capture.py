@@ -0,0 +1,377 @@
+"""
+Opt-in capture of bridge traffic, for replaying what students actually do.
+
+With TRAFFIC_CAPTURE set to a file path, the bridge appends one JSON line per
+request it serves: HTTP requests, single-request WebSockets (/ws/tts,
+/ws/doubt) and each request multiplexed on a /ws/session socket. A trace
+holds when the request arrived and the gap since the previous one, its
+path, topic and anonymized request message, the bytes and frames sent back,
+and the time to the first response byte and to the end of the response.
+traffic_replay.py re-drives a capture against a bridge.
+
+Traces are anonymized before they are written:
+
+- session ids become salted hashes (TRAFFIC_CAPTURE_SALT; random per process
+  unless set, so set it to correlate sessions across workers);
+- e-mail addresses, URLs and long digit runs in any string are masked;
+- strings are cut to TRAFFIC_CAPTURE_TEXT_CHARS characters.
+
+TRAFFIC_CAPTURE_SAMPLE keeps a share of the connections. Recording never
+blocks a request: traces go through a bounded queue to a writer thread and
+are dropped (and counted) when it is full.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import queue
+import random
+import re
+import secrets
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from ws_sender import parse_binary
+
+logger = logging.getLogger(__name__)
+
+TRAFFIC_CAPTURE = os.getenv("TRAFFIC_CAPTURE", "")
+TRAFFIC_CAPTURE_SALT = os.getenv("TRAFFIC_CAPTURE_SALT", "")
+TRAFFIC_CAPTURE_SAMPLE = float(os.getenv("TRAFFIC_CAPTURE_SAMPLE", "1.0"))
+TRAFFIC_CAPTURE_TEXT_CHARS = int(os.getenv("TRAFFIC_CAPTURE_TEXT_CHARS", "500"))
+TRAFFIC_CAPTURE_QUEUE = int(os.getenv("TRAFFIC_CAPTURE_QUEUE", "10000"))
+
+# Request bodies longer than this are measured but not kept
+MAX_CAPTURED_BODY = 64 * 1024
+
+# Frames that finish a WebSocket request (syncs and heartbeats get one frame)
+END_TYPES = ("end", "error", "cancelled", "state_sync", "playback")
+
+# Keys whose values identify a student
+_ID_KEYS = ("session_id", "sessionId", "user_id", "client_id")
+
+_PATTERNS = [
+    (re.compile(r"[\w.+-]+@[\w-]+\.[\w.-]+"), "<email>"),
+    (re.compile(r"https?://\S+"), "<url>"),
+    (re.compile(r"\+?\d[\d -]{4,}\d"), "<number>"),
+]
+
+
+def hash_id(value: Any, salt: str) -> str:
+    return hashlib.sha256(f"{salt}:{value}".encode("utf-8")).hexdigest()[:12]
+
+
+def scrub_text(text: str, limit: int = TRAFFIC_CAPTURE_TEXT_CHARS) -> str:
+    """Mask e-mail addresses, URLs and numbers, and cut the text to `limit` characters."""
+    for pattern, replacement in _PATTERNS:
+        text = pattern.sub(replacement, text)
+    return text[:limit]
+
+
+def anonymize(value: Any, salt: str, limit: int = TRAFFIC_CAPTURE_TEXT_CHARS) -> Any:
+    """Return a copy of a request message with identifying values hashed or masked."""
+    if isinstance(value, dict):
+        return {
+            key: (
+                hash_id(item, salt)
+                if key in _ID_KEYS and item is not None
+                else anonymize(item, salt, limit)
+            )
+            for key, item in value.items()
+        }
+    if isinstance(value, list):
+        return [anonymize(item, salt, limit) for item in value]
+    if isinstance(value, str):
+        return scrub_text(value, limit)
+    return value
+
+
+class TrafficRecorder:
+    """Appends anonymized request traces to a JSONL file from a writer thread."""
+
+    def __init__(
+        self,
+        path: str = TRAFFIC_CAPTURE,
+        salt: str = TRAFFIC_CAPTURE_SALT,
+        sample: float = TRAFFIC_CAPTURE_SAMPLE,
+        queue_size: int = TRAFFIC_CAPTURE_QUEUE,
+    ):
+        self.path = path
+        self.salt = salt or secrets.token_hex(16)
+        self.sample = sample
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._writer: Optional[threading.Thread] = None
+        self._last_arrival: Optional[float] = None
+        self.recorded = 0
+        self.dropped = 0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    def sampled(self) -> bool:
+        return self.sample >= 1.0 or random.random() < self.sample
+
+    def arrival(self) -> Dict[str, float]:
+        """Timestamp a new request and the gap since the previous one."""
+        now = time.time()
+        with self._lock:
+            gap = None if self._last_arrival is None else now - self._last_arrival
+            self._last_arrival = now
+        return {
+            "ts": round(now, 4),
+            "gap_ms": None if gap is None else round(gap * 1000, 1),
+        }
+
+    def record(self, trace: Dict[str, Any]):
+        """Queue a finished trace for writing; never blocks."""
+        with self._lock:
+            if self._writer is None:
+                self._writer = threading.Thread(
+                    target=self._write, name="traffic-capture", daemon=True
+                )
+                self._writer.start()
+        try:
+            self._queue.put_nowait(trace)
+        except queue.Full:
+            self.dropped += 1
+
+    def _write(self):
+        with open(self.path, "a", encoding="utf-8") as output:
+            while True:
+                trace = self._queue.get()
+                if trace is None:
+                    return
+                output.write(json.dumps(trace, default=str) + "\n")
+                self.recorded += 1
+                if self._queue.empty():
+                    output.flush()
+
+    def close(self, timeout: float = 5.0):
+        """Write out the queued traces and stop the writer thread."""
+        writer = self._writer
+        if writer is None:
+            return
+        self._queue.put(None)
+        writer.join(timeout)
+        self._writer = None
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "recorded": self.recorded,
+            "queued": self._queue.qsize(),
+            "dropped": self.dropped,
+        }
+
+
+class _Trace:
+    """Timing and sizes of one request while it is being answered."""
+
+    def __init__(self, recorder: TrafficRecorder, fields: Dict[str, Any]):
+        self.recorder = recorder
+        self.fields = {**recorder.arrival(), **fields}
+        self.started = time.monotonic()
+        self.first_byte: Optional[float] = None
+        self.response_bytes = 0
+        self.frames = 0
+
+    def sent(self, size: int):
+        if self.first_byte is None:
+            self.first_byte = time.monotonic()
+        self.response_bytes += size
+        self.frames += 1
+
+    def finish(self, status: Any):
+        elapsed = time.monotonic() - self.started
+        self.recorder.record(
+            {
+                **self.fields,
+                "status": status,
+                "response_bytes": self.response_bytes,
+                "frames": self.frames,
+                "first_byte_ms": (
+                    None
+                    if self.first_byte is None
+                    else round((self.first_byte - self.started) * 1000, 1)
+                ),
+                "duration_ms": round(elapsed * 1000, 1),
+            }
+        )
+
+
+def _request_fields(message: Any, salt: str) -> Dict[str, Any]:
+    fields: Dict[str, Any] = {"request": anonymize(message, salt)}
+    if isinstance(message, dict):
+        fields["topic"] = message.get("topic")
+        for key in ("doubt", "text"):
+            if isinstance(message.get(key), str):
+                fields[f"{key}_chars"] = len(message[key])
+    return fields
+
+
+class TrafficCaptureMiddleware:
+    """ASGI middleware that traces every HTTP and WebSocket request it passes."""
+
+    def __init__(self, app, recorder: TrafficRecorder):
+        self.app = app
+        self.recorder = recorder
+
+    async def __call__(self, scope, receive, send):
+        if not self.recorder.sampled():
+            await self.app(scope, receive, send)
+        elif scope["type"] == "http":
+            await self._http(scope, receive, send)
+        elif scope["type"] == "websocket":
+            await self._websocket(scope, receive, send)
+        else:
+            await self.app(scope, receive, send)
+
+    async def _http(self, scope, receive, send):
+        body = bytearray()
+        request_bytes = 0
+        trace = _Trace(
+            self.recorder,
+            {
+                "kind": "http",
+                "method": scope["method"],
+                "path": scope["path"],
+                "query": scrub_text(scope.get("query_string", b"").decode("latin-1")),
+            },
+        )
+        status = None
+
+        async def capture_receive():
+            nonlocal request_bytes
+            message = await receive()
+            if message["type"] == "http.request":
+                chunk = message.get("body", b"")
+                request_bytes += len(chunk)
+                if len(body) + len(chunk) <= MAX_CAPTURED_BODY:
+                    body.extend(chunk)
+            return message
+
+        async def capture_send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                trace.sent(len(message.get("body", b"")))
+            await send(message)
+
+        try:
+            await self.app(scope, capture_receive, capture_send)
+        finally:
+            trace.fields["request_bytes"] = request_bytes
+            if body and request_bytes <= MAX_CAPTURED_BODY:
+                try:
+                    trace.fields.update(
+                        _request_fields(json.loads(body), self.recorder.salt)
+                    )
+                except ValueError:
+                    pass
+            trace.finish(status if status is not None else "failed")
+
+    async def _websocket(self, scope, receive, send):
+        path = scope["path"]
+        multiplexed = path.startswith("/ws/session")
+        connection = secrets.token_hex(6)
+        # Request id (None on single-request sockets) -> trace
+        traces: Dict[Optional[str], _Trace] = {}
+
+        def start(message: Any, raw: str):
+            request_id = None
+            if multiplexed:
+                if not isinstance(message, dict) or "id" not in message:
+                    return
+                request_id = str(message["id"])
+                if message.get("type") == "cancel":
+                    if request_id in traces:
+                        traces[request_id].fields["cancel_requested"] = True
+                    return
+            elif traces:
+                # Later messages on a single-request socket are cancels
+                return
+            traces[request_id] = _Trace(
+                self.recorder,
+                {
+                    "kind": "websocket",
+                    "path": path,
+                    "connection": connection,
+                    "request_id": request_id,
+                    "request_bytes": len(raw.encode("utf-8")),
+                    **_request_fields(message, self.recorder.salt),
+                },
+            )
+
+        def finish(request_id: Optional[str], status: str):
+            trace = traces.pop(request_id, None)
+            if trace is not None:
+                trace.finish(status)
+
+        async def capture_receive():
+            message = await receive()
+            if message["type"] == "websocket.receive" and message.get("text"):
+                try:
+                    start(json.loads(message["text"]), message["text"])
+                except ValueError:
+                    pass
+            elif message["type"] == "websocket.disconnect":
+                for request_id in list(traces):
+                    finish(request_id, "disconnect")
+            return message
+
+        async def capture_send(message):
+            if message["type"] == "websocket.send":
+                self._sent(message, multiplexed, traces, finish)
+            elif message["type"] == "websocket.close":
+                for request_id in list(traces):
+                    finish(request_id, "closed")
+            await send(message)
+
+        try:
+            await self.app(scope, capture_receive, capture_send)
+        finally:
+            for request_id in list(traces):
+                finish(request_id, "failed")
+
+    @staticmethod
+    def _sent(message, multiplexed: bool, traces, finish):
+        frame_type = None
+        if message.get("bytes") is not None:
+            data = message["bytes"]
+            request_id = parse_binary(data)[0] if multiplexed else None
+            size = len(data)
+        else:
+            text = message.get("text") or ""
+            size = len(text.encode("utf-8"))
+            request_id = None
+            try:
+                frame = json.loads(text)
+                if isinstance(frame, dict):
+                    # Validation errors are sent as {"error": ...} without a type
+                    frame_type = frame.get(
+                        "type", "error" if "error" in frame else None
+                    )
+                    request_id = (
+                        str(frame["id"]) if multiplexed and "id" in frame else None
+                    )
+            except ValueError:
+                pass
+        trace = traces.get(request_id)
+        if trace is None:
+            return
+        trace.sent(size)
+        if frame_type in END_TYPES:
+            finish(request_id, frame_type)
+
+
+traffic_recorder = TrafficRecorder()
+
+
+def traffic_capture_metrics() -> Dict[str, Any]:
+    """Return how many traces were written, are queued or were dropped."""
+    return traffic_recorder.metrics()
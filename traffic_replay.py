@@ -0,0 +1,612 @@
+"""
+Replay captured bridge traffic at 1x-50x speed and compare latency runs.
+
+Reads a capture written by traffic_capture.py (TRAFFIC_CAPTURE) and re-sends
+every request at its recorded arrival time, divided by --speed. HTTP
+requests are re-issued with their captured method, path and body. Single-
+request WebSockets are re-opened. Multiplexed /ws/session connections are
+re-opened with their requests sent at their original offsets.
+
+Without --target, a bridge is started locally against a stand-in for the
+OpenAI API. The stand-in answers chat completions and speech requests after
+latencies drawn from a simple model: a first-token or first-byte delay plus
+a per-token or per-character cost, with log-normal jitter. Replays are
+therefore repeatable, free, and measure the bridge rather than upstream.
+Upstream latency is not scaled with --speed, so a faster replay packs more
+concurrent requests onto the same upstream.
+
+The report has p50/p90/p99/max of the time to first response byte and to
+the end of each response, per endpoint. With --baseline, it is diffed
+against a previous report.
+
+Usage:
+    python traffic_replay.py capture.jsonl [--speed 10] [--output run.json]
+        [--baseline previous.json] [--target http://127.0.0.1:8000]
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from typing import Any, Dict, List, Optional, Tuple
+
+from pydantic import BaseModel
+
+from traffic_capture import END_TYPES
+from ws_sender import parse_binary
+
+logger = logging.getLogger(__name__)
+
+MIN_SPEED = 1.0
+MAX_SPEED = 50.0
+
+# One MPEG-2 Layer III frame (64 kbit/s, 24 kHz, mono): 192 bytes, 24 ms
+STUB_MP3_FRAME = bytes([0xFF, 0xF3, 0x84, 0xC4]) + bytes(188)
+STUB_FRAME_MS = 24
+
+# Paths with ids or topics, reported as one endpoint
+_PATH_TEMPLATES = [
+    (re.compile(r"^/api/visualization/[^/]+/"), "/api/visualization/{topic}/"),
+    (re.compile(r"^/api/tts/audio/[^/]+"), "/api/tts/audio/{key}"),
+    (re.compile(r"^/ws/tts/[^/]+"), "/ws/tts/{topic}"),
+]
+
+# Compared against a baseline (replay lag only checks the replayer itself)
+DIFF_METRICS = [
+    f"{metric}_{label}"
+    for metric in ("first_byte_ms", "duration_ms")
+    for label in ("p50", "p90", "p99")
+]
+
+STUB_ANSWER = (
+    "A primary key uniquely identifies each row of a table, and a foreign key "
+    "refers to the primary key of another table to link related rows."
+)
+
+
+class LatencyModel(BaseModel):
+    """Latency of the stand-in OpenAI API."""
+
+    chat_first_token_ms: float = 450.0
+    chat_ms_per_token: float = 12.0
+    chat_answer_tokens: int = 180
+    tts_first_byte_ms: float = 300.0
+    tts_ms_per_char: float = 1.5
+    # Sigma of the log-normal factor applied to every latency
+    jitter: float = 0.25
+    seed: int = 0
+
+
+class StubUpstream:
+    """OpenAI-compatible chat and speech endpoints with modelled latency."""
+
+    def __init__(self, model: LatencyModel):
+        self.model = model
+        self.random = random.Random(model.seed)
+        self.requests = {"chat": 0, "speech": 0}
+
+    def _jitter(self, ms: float) -> float:
+        return ms * self.random.lognormvariate(0.0, self.model.jitter) / 1000
+
+    def app(self):
+        from starlette.applications import Starlette
+        from starlette.responses import JSONResponse, StreamingResponse
+        from starlette.routing import Route
+
+        async def chat(request):
+            body = await request.json()
+            self.requests["chat"] += 1
+            prompt_tokens = sum(
+                len(str(m.get("content") or "")) // 4 for m in body["messages"]
+            )
+            tokens = min(
+                body.get("max_tokens") or self.model.chat_answer_tokens,
+                self.model.chat_answer_tokens,
+            )
+            words = (STUB_ANSWER + " ") * (tokens // 25 + 1)
+            answer = " ".join(words.split()[: max(1, tokens * 3 // 4)])
+            usage = {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": tokens,
+                "total_tokens": prompt_tokens + tokens,
+            }
+            first = self._jitter(self.model.chat_first_token_ms)
+            per_token = self._jitter(self.model.chat_ms_per_token)
+            base = {"id": "stub", "created": int(time.time()), "model": body["model"]}
+
+            if not body.get("stream"):
+                await asyncio.sleep(first + per_token * tokens)
+                return JSONResponse(
+                    {
+                        **base,
+                        "object": "chat.completion",
+                        "choices": [
+                            {
+                                "index": 0,
+                                "message": {"role": "assistant", "content": answer},
+                                "finish_reason": "stop",
+                            }
+                        ],
+                        "usage": usage,
+                    }
+                )
+
+            async def events():
+                await asyncio.sleep(first)
+                for word in answer.split():
+                    chunk = {
+                        **base,
+                        "object": "chat.completion.chunk",
+                        "choices": [
+                            {
+                                "index": 0,
+                                "delta": {"content": word + " "},
+                                "finish_reason": None,
+                            }
+                        ],
+                    }
+                    yield f"data: {json.dumps(chunk)}\n\n"
+                    await asyncio.sleep(per_token * 4 / 3)
+                final = {**base, "object": "chat.completion.chunk", "choices": []}
+                yield f"data: {json.dumps({**final, 'usage': usage})}\n\n"
+                yield "data: [DONE]\n\n"
+
+            return StreamingResponse(events(), media_type="text/event-stream")
+
+        async def speech(request):
+            body = await request.json()
+            self.requests["speech"] += 1
+            text = body.get("input", "")
+            # Spoken at about 150 words per minute
+            frames = max(1, len(text.split()) * 400 // STUB_FRAME_MS)
+            first = self._jitter(self.model.tts_first_byte_ms)
+            rest = self._jitter(self.model.tts_ms_per_char * len(text))
+
+            async def audio():
+                await asyncio.sleep(first)
+                batch = 50
+                for start in range(0, frames, batch):
+                    count = min(batch, frames - start)
+                    yield STUB_MP3_FRAME * count
+                    await asyncio.sleep(rest * count / frames)
+
+            return StreamingResponse(audio(), media_type="audio/mpeg")
+
+        return Starlette(
+            routes=[
+                Route("/v1/chat/completions", chat, methods=["POST"]),
+                Route("/v1/audio/speech", speech, methods=["POST"]),
+            ]
+        )
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def serve_in_thread(app, port: int):
+    """Run an ASGI app with uvicorn in a daemon thread; return the server."""
+    import uvicorn
+
+    config = uvicorn.Config(
+        app, host="127.0.0.1", port=port, log_level="warning", log_config=None
+    )
+    server = uvicorn.Server(config)
+    threading.Thread(target=server.run, name="stub-upstream", daemon=True).start()
+    deadline = time.monotonic() + 10
+    while not server.started and time.monotonic() < deadline:
+        time.sleep(0.05)
+    return server
+
+
+def start_bridge(upstream_port: int, workdir: str, workers: int = 1):
+    """Start socket_bridge.py against the stand-in upstream; return (process, url)."""
+    port = free_port()
+    env = {
+        **os.environ,
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{upstream_port}/v1",
+        "OPENAI_API_KEY": "stub",
+        "TTS_CACHE_DIR": os.path.join(workdir, "tts"),
+        "CACHE_DB_PATH": os.path.join(workdir, "bridge.sqlite3"),
+        "TRAFFIC_CAPTURE": "",
+        "LOG_LEVEL": os.getenv("LOG_LEVEL", "WARNING"),
+    }
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            os.path.join(
+                os.path.dirname(os.path.abspath(__file__)), "socket_bridge.py"
+            ),
+            "--port",
+            str(port),
+            "--workers",
+            str(workers),
+        ],
+        env=env,
+    )
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(f"{url}/api/tts/formats", timeout=1).read()
+            return process, url
+        except OSError:
+            if process.poll() is not None:
+                break
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("The bridge did not start")
+
+
+def load_traces(path: str, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Read a capture, ordered by arrival."""
+    traces = []
+    with open(path, encoding="utf-8") as capture:
+        for line in capture:
+            if line.strip():
+                traces.append(json.loads(line))
+    traces.sort(key=lambda trace: trace["ts"])
+    return traces[:limit] if limit else traces
+
+
+def endpoint(trace: Dict[str, Any]) -> str:
+    """Name the endpoint of a trace for the report (topics and keys folded)."""
+    path = trace.get("path", "")
+    for pattern, template in _PATH_TEMPLATES:
+        path = pattern.sub(template, path)
+    if trace.get("kind") == "http":
+        return f"{trace.get('method', 'GET')} {path}"
+    if trace.get("request_id") is not None:
+        return f"session:{(trace.get('request') or {}).get('type')}"
+    return f"ws {path}"
+
+
+def percentile(samples: List[float], q: float) -> Optional[float]:
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 1)
+
+
+class Replayer:
+    """Re-sends captured requests at their (scaled) arrival times."""
+
+    def __init__(self, target: str, speed: float = 1.0, timeout: float = 120.0):
+        self.target = target.rstrip("/")
+        self.ws_target = re.sub(r"^http", "ws", self.target)
+        self.speed = min(MAX_SPEED, max(MIN_SPEED, speed))
+        self.timeout = timeout
+        self.results: List[Dict[str, Any]] = []
+
+    async def run(self, traces: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        if not traces:
+            return []
+        self._origin = traces[0]["ts"]
+        self._start = time.monotonic()
+        tasks = []
+        sessions: Dict[str, List[Dict[str, Any]]] = {}
+        for trace in traces:
+            if trace.get("kind") == "websocket" and trace.get("request_id") is not None:
+                sessions.setdefault(trace.get("connection", ""), []).append(trace)
+            elif trace.get("kind") == "websocket":
+                tasks.append(self._single_websocket(trace))
+            else:
+                tasks.append(self._http(trace))
+        tasks.extend(self._session(requests) for requests in sessions.values())
+        await asyncio.gather(*tasks)
+        return self.results
+
+    def _offset(self, trace: Dict[str, Any]) -> float:
+        return (trace["ts"] - self._origin) / self.speed
+
+    async def _wait_until(self, trace: Dict[str, Any]) -> float:
+        """Sleep until the trace is due; return how late it is sent, in ms."""
+        delay = self._offset(trace) - (time.monotonic() - self._start)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return max(0.0, -delay) * 1000
+
+    def _result(self, trace, lag_ms, status, sent_at, first_at=None):
+        now = time.monotonic()
+        self.results.append(
+            {
+                "endpoint": endpoint(trace),
+                "status": status,
+                "lag_ms": round(lag_ms, 1),
+                "first_byte_ms": (
+                    None if first_at is None else round((first_at - sent_at) * 1000, 1)
+                ),
+                "duration_ms": round((now - sent_at) * 1000, 1),
+                "captured_duration_ms": trace.get("duration_ms"),
+            }
+        )
+
+    async def _http(self, trace):
+        lag = await self._wait_until(trace)
+        query = f"?{trace['query']}" if trace.get("query") else ""
+        body = trace.get("request")
+        request = urllib.request.Request(
+            f"{self.target}{trace['path']}{query}",
+            method=trace.get("method", "GET"),
+            data=json.dumps(body).encode("utf-8") if body is not None else None,
+            headers={"Content-Type": "application/json"},
+        )
+
+        def send() -> Tuple[Any, float, Optional[float]]:
+            sent_at = time.monotonic()
+            try:
+                with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                    first = response.read(1)
+                    first_at = time.monotonic() if first else None
+                    response.read()
+                    return response.status, sent_at, first_at
+            except urllib.error.HTTPError as e:
+                return e.code, sent_at, time.monotonic()
+            except OSError as e:
+                return type(e).__name__, sent_at, None
+
+        status, sent_at, first_at = await asyncio.to_thread(send)
+        self._result(trace, lag, status, sent_at, first_at)
+
+    async def _single_websocket(self, trace):
+        import websockets
+
+        lag = await self._wait_until(trace)
+        sent_at = time.monotonic()
+        first_at = None
+        status = "closed"
+        try:
+            async with websockets.connect(
+                f"{self.ws_target}{trace['path']}", max_size=None
+            ) as websocket:
+                await websocket.send(json.dumps(trace.get("request") or {}))
+                async with asyncio.timeout(self.timeout):
+                    async for frame in websocket:
+                        first_at = first_at or time.monotonic()
+                        frame_type = _frame_type(frame)
+                        if frame_type in END_TYPES:
+                            status = frame_type
+                            break
+        except (OSError, asyncio.TimeoutError, websockets.WebSocketException) as e:
+            status = type(e).__name__
+        self._result(trace, lag, status, sent_at, first_at)
+
+    async def _session(self, requests):
+        import websockets
+
+        # request id -> [trace, lag, sent_at, first_at]
+        pending: Dict[str, list] = {}
+        finished = asyncio.Event()
+        await self._wait_until(requests[0])
+        try:
+            async with websockets.connect(
+                f"{self.ws_target}{requests[0]['path']}", max_size=None
+            ) as websocket:
+
+                async def send_all():
+                    for trace in requests:
+                        lag = await self._wait_until(trace)
+                        pending[str(trace["request_id"])] = [
+                            trace,
+                            lag,
+                            time.monotonic(),
+                            None,
+                        ]
+                        await websocket.send(json.dumps(trace.get("request") or {}))
+
+                async def receive_all():
+                    async for frame in websocket:
+                        if isinstance(frame, bytes):
+                            request_id, frame_type = parse_binary(frame)[0], None
+                        else:
+                            request_id = str(json.loads(frame).get("id"))
+                            frame_type = _frame_type(frame)
+                        entry = pending.get(request_id)
+                        if entry is None:
+                            continue
+                        entry[3] = entry[3] or time.monotonic()
+                        if frame_type in END_TYPES:
+                            del pending[request_id]
+                            self._result(
+                                entry[0], entry[1], frame_type, entry[2], entry[3]
+                            )
+                            if not pending and sender.done():
+                                finished.set()
+                                return
+
+                sender = asyncio.ensure_future(send_all())
+                receiver = asyncio.ensure_future(receive_all())
+                try:
+                    async with asyncio.timeout(
+                        self._offset(requests[-1])
+                        - self._offset(requests[0])
+                        + self.timeout
+                    ):
+                        await sender
+                        if pending:
+                            await finished.wait()
+                except asyncio.TimeoutError:
+                    pass
+                finally:
+                    receiver.cancel()
+        except (OSError, websockets.WebSocketException) as e:
+            logger.warning("Session replay failed: %s", e)
+        for trace, lag, sent_at, first_at in pending.values():
+            self._result(trace, lag, "unfinished", sent_at, first_at)
+
+
+def _frame_type(frame) -> Optional[str]:
+    if isinstance(frame, bytes):
+        return None
+    try:
+        message = json.loads(frame)
+    except ValueError:
+        return None
+    if not isinstance(message, dict):
+        return None
+    return message.get("type", "error" if "error" in message else None)
+
+
+def summarize(results: List[Dict[str, Any]], **meta) -> Dict[str, Any]:
+    """Latency percentiles per endpoint (and over all requests)."""
+    groups: Dict[str, List[Dict[str, Any]]] = {"all": results}
+    for result in results:
+        groups.setdefault(result["endpoint"], []).append(result)
+    endpoints = {}
+    for name, group in sorted(groups.items()):
+        ok = [
+            r
+            for r in group
+            if r["status"] in (200, 206, "end", "state_sync", "playback", "closed")
+        ]
+        stats: Dict[str, Any] = {"requests": len(group), "errors": len(group) - len(ok)}
+        for metric in ("first_byte_ms", "duration_ms", "lag_ms"):
+            samples = [r[metric] for r in ok if r[metric] is not None]
+            for label, q in (("p50", 0.5), ("p90", 0.9), ("p99", 0.99)):
+                stats[f"{metric}_{label}"] = percentile(samples, q)
+            stats[f"{metric}_max"] = max(samples) if samples else None
+        endpoints[name] = stats
+    return {**meta, "endpoints": endpoints}
+
+
+def diff_reports(
+    current: Dict[str, Any], baseline: Dict[str, Any]
+) -> List[Dict[str, Any]]:
+    """Compare the latency percentiles of two reports, endpoint by endpoint."""
+    rows = []
+    for name, stats in current["endpoints"].items():
+        previous = baseline.get("endpoints", {}).get(name)
+        if previous is None:
+            continue
+        for metric, value in stats.items():
+            if metric not in DIFF_METRICS:
+                continue
+            before = previous.get(metric)
+            if value is None or before is None:
+                continue
+            change = None if before == 0 else round((value - before) / before * 100, 1)
+            rows.append(
+                {
+                    "endpoint": name,
+                    "metric": metric,
+                    "baseline": before,
+                    "current": value,
+                    "change_pct": change,
+                }
+            )
+    return rows
+
+
+def print_report(report: Dict[str, Any], diff: Optional[List[Dict[str, Any]]] = None):
+    print(
+        f"{'endpoint':32} {'n':>5} {'err':>4} "
+        f"{'ttfb p50':>9} {'p99':>8} {'total p50':>10} {'p99':>8}"
+    )
+    for name, stats in report["endpoints"].items():
+        print(
+            f"{name[:32]:32} {stats['requests']:>5} {stats['errors']:>4} "
+            f"{stats['first_byte_ms_p50'] or '-':>9} {stats['first_byte_ms_p99'] or '-':>8} "
+            f"{stats['duration_ms_p50'] or '-':>10} {stats['duration_ms_p99'] or '-':>8}"
+        )
+    if diff:
+        print(
+            f"\n{'endpoint':32} {'metric':20} {'baseline':>9} {'current':>9} {'change':>8}"
+        )
+        for row in diff:
+            change = "-" if row["change_pct"] is None else f"{row['change_pct']:+.1f}%"
+            print(
+                f"{row['endpoint'][:32]:32} {row['metric']:20} "
+                f"{row['baseline']:>9} {row['current']:>9} {change:>8}"
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay captured bridge traffic")
+    parser.add_argument("capture", help="JSONL file written with TRAFFIC_CAPTURE")
+    parser.add_argument(
+        "--speed", type=float, default=1.0, help="Time compression, 1-50"
+    )
+    parser.add_argument(
+        "--target", help="Bridge URL; by default a local bridge is started"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=1, help="Workers of the local bridge"
+    )
+    parser.add_argument("--limit", type=int, help="Only replay the first N requests")
+    parser.add_argument(
+        "--timeout", type=float, default=120.0, help="Per-request timeout (s)"
+    )
+    parser.add_argument("--output", help="Write the report to this JSON file")
+    parser.add_argument(
+        "--baseline", help="Report of a previous run to compare against"
+    )
+    parser.add_argument(
+        "--latency-model", help="JSON file overriding the upstream model"
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if not MIN_SPEED <= args.speed <= MAX_SPEED:
+        logger.warning(
+            "Speed %.1f is outside %g-%g; clamping", args.speed, MIN_SPEED, MAX_SPEED
+        )
+    traces = load_traces(args.capture, args.limit)
+    model = LatencyModel()
+    if args.latency_model:
+        with open(args.latency_model, encoding="utf-8") as f:
+            model = LatencyModel(**json.load(f))
+
+    bridge = upstream = None
+    target = args.target
+    with tempfile.TemporaryDirectory(prefix="replay-") as workdir:
+        try:
+            if target is None:
+                stub = StubUpstream(model)
+                upstream_port = free_port()
+                upstream = serve_in_thread(stub.app(), upstream_port)
+                bridge, target = start_bridge(upstream_port, workdir, args.workers)
+            replayer = Replayer(target, args.speed, args.timeout)
+            started = time.monotonic()
+            results = asyncio.run(replayer.run(traces))
+            report = summarize(
+                results,
+                capture=args.capture,
+                speed=replayer.speed,
+                target=args.target or "local bridge with stub upstream",
+                latency_model=model.model_dump() if args.target is None else None,
+                wall_seconds=round(time.monotonic() - started, 2),
+            )
+        finally:
+            if bridge is not None:
+                bridge.terminate()
+                bridge.wait(timeout=10)
+            if upstream is not None:
+                upstream.should_exit = True
+
+    diff = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            diff = diff_reports(report, json.load(f))
+        report["baseline"] = args.baseline
+        report["diff"] = diff
+    print_report(report, diff)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
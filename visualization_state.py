@@ -0,0 +1,258 @@
+"""
+Versioned visualization state with JSON-patch deltas.
+
+Each student session on a topic has a state document:
+
+    {
+        "highlights": {"<node id>": true, ...},
+        "nodes": {"<node id>": {"<property>": value, ...}, ...},
+        "narration": "...",
+        "timeline": [<word timing>, ...]
+    }
+
+Every change bumps the state's version and records the RFC 6902 operations
+(add / remove / replace) that turn the previous document into the new one:
+highlights are added or removed by key, node properties are replaced in
+place, and the timeline is spliced around the prefix and suffix it shares
+with the previous one. Clients report the last version they applied and
+receive only the patches since then. A client that is too far behind, or
+that never synced, gets a full snapshot instead.
+
+States live in the shared cache store, so every bridge worker and doubt
+process sees the same versions.
+"""
+
+import copy
+import logging
+import os
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from cache_store import cache_store
+
+logger = logging.getLogger(__name__)
+
+# Number of versions whose patches are kept for catching up
+STATE_HISTORY = int(os.getenv("VISUALIZATION_STATE_HISTORY", "50"))
+STATE_TTL = float(os.getenv("VISUALIZATION_STATE_TTL", str(24 * 3600)))
+
+Patch = List[Dict[str, Any]]
+
+
+def empty_state() -> Dict[str, Any]:
+    return {"highlights": {}, "nodes": {}, "narration": "", "timeline": []}
+
+
+def _escape(token: Any) -> str:
+    return str(token).replace("~", "~0").replace("/", "~1")
+
+
+def _unescape(token: str) -> str:
+    return token.replace("~1", "/").replace("~0", "~")
+
+
+def diff(old: Any, new: Any, path: str = "") -> Patch:
+    """Return the JSON-patch operations that turn `old` into `new`."""
+    if isinstance(old, dict) and isinstance(new, dict):
+        ops: Patch = []
+        for key in old:
+            if key not in new:
+                ops.append({"op": "remove", "path": f"{path}/{_escape(key)}"})
+        for key, value in new.items():
+            if key not in old:
+                ops.append(
+                    {"op": "add", "path": f"{path}/{_escape(key)}", "value": value}
+                )
+            else:
+                ops.extend(diff(old[key], value, f"{path}/{_escape(key)}"))
+        return ops
+
+    if isinstance(old, list) and isinstance(new, list):
+        # Splice: keep the shared prefix and suffix, patch the middle
+        prefix = 0
+        while prefix < min(len(old), len(new)) and old[prefix] == new[prefix]:
+            prefix += 1
+        suffix = 0
+        while (
+            suffix < min(len(old), len(new)) - prefix
+            and old[len(old) - 1 - suffix] == new[len(new) - 1 - suffix]
+        ):
+            suffix += 1
+        old_end, new_end = len(old) - suffix, len(new) - suffix
+        old_middle, new_middle = old[prefix:old_end], new[prefix:new_end]
+
+        ops = []
+        shared = min(len(old_middle), len(new_middle))
+        for i in range(shared):
+            ops.extend(diff(old_middle[i], new_middle[i], f"{path}/{prefix + i}"))
+        # Remove from the end so earlier indices stay valid
+        for i in reversed(range(shared, len(old_middle))):
+            ops.append({"op": "remove", "path": f"{path}/{prefix + i}"})
+        for i in range(shared, len(new_middle)):
+            ops.append(
+                {"op": "add", "path": f"{path}/{prefix + i}", "value": new_middle[i]}
+            )
+        return ops
+
+    if old != new:
+        return [{"op": "replace", "path": path, "value": new}]
+    return []
+
+
+def apply_patch(document: Any, ops: Patch) -> Any:
+    """Apply JSON-patch operations to a copy of `document`."""
+    document = copy.deepcopy(document)
+    for op in ops:
+        if op["path"] == "":
+            document = copy.deepcopy(op["value"])
+            continue
+        tokens = [_unescape(token) for token in op["path"].split("/")[1:]]
+        parent = document
+        for token in tokens[:-1]:
+            parent = parent[int(token)] if isinstance(parent, list) else parent[token]
+        last = tokens[-1]
+
+        if isinstance(parent, list):
+            index = len(parent) if last == "-" else int(last)
+            if op["op"] == "add":
+                parent.insert(index, copy.deepcopy(op["value"]))
+            elif op["op"] == "remove":
+                del parent[index]
+            elif op["op"] == "replace":
+                parent[index] = copy.deepcopy(op["value"])
+            else:
+                raise ValueError(f"Unsupported patch operation: {op['op']}")
+        else:
+            if op["op"] in ("add", "replace"):
+                parent[last] = copy.deepcopy(op["value"])
+            elif op["op"] == "remove":
+                del parent[last]
+            else:
+                raise ValueError(f"Unsupported patch operation: {op['op']}")
+    return document
+
+
+def state_key(topic: str, session_id: str) -> str:
+    return f"{topic}:{session_id}"
+
+
+class VisualizationStateStore:
+    """Versioned per-session states with a bounded history of patches."""
+
+    def __init__(
+        self, store=cache_store, history: int = STATE_HISTORY, ttl: float = STATE_TTL
+    ):
+        self.store = store
+        self.history = history
+        self.ttl = ttl
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _initial() -> Dict[str, Any]:
+        return {"version": 0, "state": empty_state(), "log": []}
+
+    def _load(self, key: str) -> Dict[str, Any]:
+        return self.store.get("visualization_state", key) or self._initial()
+
+    def snapshot(self, key: str) -> Dict[str, Any]:
+        entry = self._load(key)
+        return {"version": entry["version"], "snapshot": entry["state"]}
+
+    def modify(self, key: str, change: Callable[[Dict[str, Any]], Dict[str, Any]]):
+        """Derive a new state from the current one, recording the patch between them.
+
+        The read and the write are one transaction of the shared store, so two
+        processes changing the same state never both derive the same version.
+        Returns the new version and the version it was derived from.
+        """
+        versions = {}
+
+        def apply(entry):
+            entry = entry or self._initial()
+            versions["previous"] = entry["version"]
+            state = change(copy.deepcopy(entry["state"]))
+            ops = diff(entry["state"], state)
+            if ops:
+                entry["version"] += 1
+                entry["state"] = state
+                log = entry["log"] + [{"version": entry["version"], "ops": ops}]
+                first = max(0, len(log) - self.history)
+                entry["log"] = log[first:]
+            return entry
+
+        with self._lock:
+            entry = self.store.update("visualization_state", key, apply, ttl=self.ttl)
+        return entry["version"], versions["previous"]
+
+    def update(self, key: str, state: Dict[str, Any]) -> int:
+        """Replace the state, recording the patch from the previous version."""
+        return self.modify(key, lambda _: state)[0]
+
+    def merge(self, key: str, changes: Dict[str, Any]) -> Tuple[int, int]:
+        """Update parts of the state (e.g. some node properties) and keep the rest.
+
+        Items of dict sections are merged one level deep; a None item removes it.
+        Returns the new version and the version it was derived from, like modify.
+        """
+
+        def apply(state):
+            for section, value in changes.items():
+                if not (
+                    isinstance(value, dict) and isinstance(state.get(section), dict)
+                ):
+                    state[section] = value
+                    continue
+                for item, properties in value.items():
+                    current = state[section].get(item)
+                    if properties is None:
+                        state[section].pop(item, None)
+                    elif isinstance(current, dict) and isinstance(properties, dict):
+                        state[section][item] = {**current, **properties}
+                    else:
+                        state[section][item] = properties
+            return state
+
+        return self.modify(key, apply)
+
+    def sync(self, key: str, since_version: Optional[int] = None) -> Dict[str, Any]:
+        """Return the patches after `since_version`, or a snapshot if they are unavailable."""
+        entry = self._load(key)
+        version = entry["version"]
+        if since_version is None or since_version > version:
+            return {"version": version, "snapshot": entry["state"]}
+        patches = [patch for patch in entry["log"] if patch["version"] > since_version]
+        if len(patches) != version - since_version:
+            # The client is older than the retained history
+            return {"version": version, "snapshot": entry["state"]}
+        return {"version": version, "since": since_version, "patches": patches}
+
+
+def record_doubt(
+    topic: str,
+    session_id: str,
+    narration: str,
+    highlights: List[str],
+    timeline: List[dict],
+    since_version: Optional[int] = None,
+) -> Dict[str, Any]:
+    """Store the state after answering a doubt and return what the client needs to catch up.
+
+    The answer replaces the highlights, narration and timeline; node properties
+    set earlier in the session are kept.
+    """
+    key = state_key(topic, session_id)
+
+    def answer(state):
+        state["highlights"] = {node_id: True for node_id in highlights or []}
+        state["narration"] = narration or ""
+        state["timeline"] = timeline or []
+        return state
+
+    version, previous = visualization_states.modify(key, answer)
+    logger.info("Visualization state %s at version %s", key, version)
+    return visualization_states.sync(
+        key, previous if since_version is None else since_version
+    )
+
+
+visualization_states = VisualizationStateStore()
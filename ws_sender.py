@@ -0,0 +1,461 @@
+"""
+Backpressure-aware WebSocket sending.
+
+Producers (TTS, doubt handling) do not write to the socket directly. They hand
+frames to a per-connection BackpressureSender, which queues them and drains the
+queue to the socket from a separate task. The queue is bounded by bytes with a
+high and a low watermark:
+
+- policy "pause": when the buffered bytes reach the high watermark the
+  producer waits until the client has drained the queue to the low
+  watermark. A client that stays stalled longer than `stall_timeout` is
+  treated as a slow consumer and dropped.
+- policy "drop": reaching the high watermark drops the client immediately.
+
+Dropping closes the socket with code 1013 (try again later) and raises
+SlowClientError in the producer, so server memory per connection stays
+bounded no matter how slow the client is.
+
+A SessionSender carries many concurrent requests over one socket. Each
+request writes to its own StreamSender (same interface, same watermarks per
+stream); JSON frames get the request's "id" and binary frames are prefixed
+with it (see frame_binary). The drain task interleaves the streams with
+deficit round robin, so a long narration cannot starve a doubt answer that
+starts after it.
+"""
+
+import asyncio
+import itertools
+import json
+import logging
+import os
+import time
+from collections import deque
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HIGH_WATERMARK = int(os.getenv("WS_SEND_HIGH_WATERMARK", str(512 * 1024)))
+DEFAULT_LOW_WATERMARK = int(os.getenv("WS_SEND_LOW_WATERMARK", str(128 * 1024)))
+DEFAULT_POLICY = os.getenv("WS_SLOW_CLIENT_POLICY", "pause")
+DEFAULT_STALL_TIMEOUT = float(os.getenv("WS_SLOW_CLIENT_TIMEOUT", "10"))
+
+POLICIES = ("pause", "drop")
+
+# Bytes a session stream may send per round before the next stream's turn
+DEFAULT_SESSION_QUANTUM = int(os.getenv("WS_SESSION_QUANTUM", str(16 * 1024)))
+
+_connection_ids = itertools.count(1)
+_active_senders: Dict[int, "BackpressureSender"] = {}
+
+
+class SlowClientError(Exception):
+    """Raised in the producer when its client was dropped for being too slow."""
+
+
+class BackpressureSender:
+    """Bounded per-connection send queue between producers and a WebSocket."""
+
+    def __init__(
+        self,
+        websocket,
+        label: str = "",
+        high_watermark: int = DEFAULT_HIGH_WATERMARK,
+        low_watermark: int = DEFAULT_LOW_WATERMARK,
+        policy: str = DEFAULT_POLICY,
+        stall_timeout: float = DEFAULT_STALL_TIMEOUT,
+    ):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown slow client policy: {policy}")
+        if low_watermark > high_watermark:
+            raise ValueError("low_watermark must not exceed high_watermark")
+        self.websocket = websocket
+        self.id = next(_connection_ids)
+        self.label = label
+        self.high_watermark = high_watermark
+        self.low_watermark = low_watermark
+        self.policy = policy
+        self.stall_timeout = stall_timeout
+
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._below_low = asyncio.Event()
+        self._below_low.set()
+        self._drained = asyncio.Event()
+        self._drained.set()
+        self._task: Optional[asyncio.Task] = None
+        self._error: Optional[BaseException] = None
+
+        self.buffered_bytes = 0
+        self.peak_buffered_bytes = 0
+        self.sent_bytes = 0
+        self.sent_frames = 0
+        self.pauses = 0
+        self.paused_seconds = 0.0
+        self.dropped = False
+
+    async def __aenter__(self):
+        self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            await self.flush()
+        await self.close()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._drain())
+            _active_senders[self.id] = self
+
+    async def _drain(self):
+        try:
+            while True:
+                kind, payload, size = await self._queue.get()
+                if kind == "bytes":
+                    await self.websocket.send_bytes(payload)
+                else:
+                    await self.websocket.send_text(payload)
+                self.buffered_bytes -= size
+                self.sent_bytes += size
+                self.sent_frames += 1
+                if self.buffered_bytes <= self.low_watermark:
+                    self._below_low.set()
+                if self._queue.empty():
+                    self._drained.set()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # The client went away or the socket failed; surface it to the producer
+            self._error = e
+            self._below_low.set()
+            self._drained.set()
+
+    def _raise_if_failed(self):
+        if self._error is not None:
+            raise self._error
+
+    async def _enqueue(self, kind: str, payload, size: int):
+        self._raise_if_failed()
+        if self.buffered_bytes + size > self.high_watermark and self.buffered_bytes > 0:
+            await self._apply_backpressure()
+        if self.buffered_bytes + size > self.low_watermark:
+            self._below_low.clear()
+        self._drained.clear()
+        self.buffered_bytes += size
+        self.peak_buffered_bytes = max(self.peak_buffered_bytes, self.buffered_bytes)
+        self._queue.put_nowait((kind, payload, size))
+
+    async def _apply_backpressure(self):
+        if self.policy == "drop":
+            await self._drop("send queue exceeded high watermark")
+        self.pauses += 1
+        started = time.monotonic()
+        self._below_low.clear()
+        try:
+            await asyncio.wait_for(self._below_low.wait(), timeout=self.stall_timeout)
+        except asyncio.TimeoutError:
+            await self._drop(f"client stalled for more than {self.stall_timeout:.0f}s")
+        finally:
+            self.paused_seconds += time.monotonic() - started
+        self._raise_if_failed()
+
+    async def _drop(self, reason: str):
+        self.dropped = True
+        logger.warning(
+            "Dropping slow WebSocket client %d (%s): %s, %d bytes buffered",
+            self.id,
+            self.label,
+            reason,
+            self.buffered_bytes,
+        )
+        await self.close()
+        try:
+            await self.websocket.close(code=1013)
+        except Exception:
+            pass
+        raise SlowClientError(reason)
+
+    async def send_bytes(self, data: bytes):
+        """Queue a binary frame, waiting or dropping the client per the policy."""
+        await self._enqueue("bytes", data, len(data))
+
+    async def send_json(self, data: Any):
+        """Queue a JSON text frame."""
+        text = json.dumps(data)
+        await self._enqueue("text", text, len(text))
+
+    async def flush(self):
+        """Wait until every queued frame has been written to the socket."""
+        await self._drained.wait()
+        self._raise_if_failed()
+
+    async def close(self):
+        """Stop the drain task and discard anything still queued."""
+        _active_senders.pop(self.id, None)
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._task = None
+        while not self._queue.empty():
+            self._queue.get_nowait()
+        self.buffered_bytes = 0
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "label": self.label,
+            "policy": self.policy,
+            "buffered_bytes": self.buffered_bytes,
+            "peak_buffered_bytes": self.peak_buffered_bytes,
+            "sent_bytes": self.sent_bytes,
+            "sent_frames": self.sent_frames,
+            "pauses": self.pauses,
+            "paused_seconds": round(self.paused_seconds, 3),
+        }
+
+
+def frame_binary(request_id: str, data) -> bytes:
+    """Prefix a binary frame with its request id: one length byte, then the UTF-8 id."""
+    prefix = request_id.encode("utf-8")
+    if len(prefix) > 255:
+        raise ValueError("Request ids must be at most 255 bytes")
+    return b"".join((bytes((len(prefix),)), prefix, data))
+
+
+def parse_binary(frame: bytes) -> Tuple[str, bytes]:
+    """Split an id-prefixed binary frame into its request id and payload."""
+    length = frame[0]
+    end = 1 + length
+    return frame[1:end].decode("utf-8"), frame[end:]
+
+
+class StreamSender:
+    """The frames of one request within a SessionSender."""
+
+    def __init__(self, session: "SessionSender", request_id: Optional[str]):
+        self.session = session
+        self.request_id = request_id
+        self.queue: deque = deque()
+        self.buffered_bytes = 0
+        self.deficit = 0
+        self.scheduled = False
+        self.below_low = asyncio.Event()
+        self.below_low.set()
+
+    async def send_bytes(self, data: bytes):
+        """Queue a binary frame prefixed with the request id."""
+        frame = frame_binary(self.request_id, data)
+        await self.session._enqueue(self, "bytes", frame, len(frame))
+
+    async def send_json(self, data: Any):
+        """Queue a JSON text frame tagged with the request id."""
+        if self.request_id is not None:
+            data = {"id": self.request_id, **data}
+        text = json.dumps(data)
+        await self.session._enqueue(self, "text", text, len(text))
+
+
+class SessionSender:
+    """Fair, bounded send queues for the concurrent requests of one WebSocket."""
+
+    def __init__(
+        self,
+        websocket,
+        label: str = "",
+        high_watermark: int = DEFAULT_HIGH_WATERMARK,
+        low_watermark: int = DEFAULT_LOW_WATERMARK,
+        policy: str = DEFAULT_POLICY,
+        stall_timeout: float = DEFAULT_STALL_TIMEOUT,
+        quantum: int = DEFAULT_SESSION_QUANTUM,
+    ):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown slow client policy: {policy}")
+        if low_watermark > high_watermark:
+            raise ValueError("low_watermark must not exceed high_watermark")
+        self.websocket = websocket
+        self.id = next(_connection_ids)
+        self.label = label
+        self.high_watermark = high_watermark
+        self.low_watermark = low_watermark
+        self.policy = policy
+        self.stall_timeout = stall_timeout
+        self.quantum = quantum
+
+        self.streams: Dict[Optional[str], StreamSender] = {}
+        # Control frames (protocol errors) that belong to no request
+        self.control = StreamSender(self, None)
+        self._ready: deque = deque()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._error: Optional[BaseException] = None
+
+        self.peak_buffered_bytes = 0
+        self.sent_bytes = 0
+        self.sent_frames = 0
+        self.pauses = 0
+        self.paused_seconds = 0.0
+        self.dropped = False
+
+    async def __aenter__(self):
+        self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    @property
+    def buffered_bytes(self) -> int:
+        return sum(stream.buffered_bytes for stream in self._ready)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._drain())
+            _active_senders[self.id] = self
+
+    def stream(self, request_id: str) -> StreamSender:
+        """Return the sender of a request, creating it on first use."""
+        if request_id not in self.streams:
+            self.streams[request_id] = StreamSender(self, request_id)
+        return self.streams[request_id]
+
+    def end_stream(self, request_id: str):
+        """Forget a finished request; frames it already queued are still sent."""
+        self.streams.pop(request_id, None)
+
+    async def send_json(self, data: Any):
+        """Queue a control frame that belongs to no request."""
+        await self.control.send_json(data)
+
+    async def _drain(self):
+        try:
+            while True:
+                while not self._ready:
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                stream = self._ready.popleft()
+                stream.deficit += self.quantum
+                while stream.queue and stream.queue[0][2] <= stream.deficit:
+                    kind, payload, size = stream.queue.popleft()
+                    if kind == "bytes":
+                        await self.websocket.send_bytes(payload)
+                    else:
+                        await self.websocket.send_text(payload)
+                    stream.deficit -= size
+                    stream.buffered_bytes -= size
+                    self.sent_bytes += size
+                    self.sent_frames += 1
+                    if stream.buffered_bytes <= self.low_watermark:
+                        stream.below_low.set()
+                if stream.queue:
+                    self._ready.append(stream)
+                else:
+                    stream.deficit = 0
+                    stream.scheduled = False
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # The client went away or the socket failed; surface it to every producer
+            self._error = e
+            for stream in self._ready:
+                stream.below_low.set()
+            for stream in self.streams.values():
+                stream.below_low.set()
+
+    def _raise_if_failed(self):
+        if self._error is not None:
+            raise self._error
+
+    async def _enqueue(self, stream: StreamSender, kind: str, payload, size: int):
+        self._raise_if_failed()
+        if (
+            stream.buffered_bytes + size > self.high_watermark
+            and stream.buffered_bytes > 0
+        ):
+            await self._apply_backpressure(stream)
+        if stream.buffered_bytes + size > self.low_watermark:
+            stream.below_low.clear()
+        stream.buffered_bytes += size
+        stream.queue.append((kind, payload, size))
+        if not stream.scheduled:
+            stream.scheduled = True
+            self._ready.append(stream)
+            self._wakeup.set()
+        self.peak_buffered_bytes = max(self.peak_buffered_bytes, self.buffered_bytes)
+
+    async def _apply_backpressure(self, stream: StreamSender):
+        if self.policy == "drop":
+            await self._drop("send queue exceeded high watermark")
+        self.pauses += 1
+        started = time.monotonic()
+        stream.below_low.clear()
+        try:
+            await asyncio.wait_for(stream.below_low.wait(), timeout=self.stall_timeout)
+        except asyncio.TimeoutError:
+            await self._drop(f"client stalled for more than {self.stall_timeout:.0f}s")
+        finally:
+            self.paused_seconds += time.monotonic() - started
+        self._raise_if_failed()
+
+    async def _drop(self, reason: str):
+        self.dropped = True
+        logger.warning(
+            "Dropping slow WebSocket session %d (%s): %s, %d bytes buffered",
+            self.id,
+            self.label,
+            reason,
+            self.buffered_bytes,
+        )
+        self._error = SlowClientError(reason)
+        await self.close()
+        try:
+            await self.websocket.close(code=1013)
+        except Exception:
+            pass
+        raise SlowClientError(reason)
+
+    async def close(self):
+        """Stop the drain task and discard anything still queued."""
+        _active_senders.pop(self.id, None)
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._task = None
+        if self._error is None:
+            self._error = ConnectionError("WebSocket session closed")
+        for stream in self._ready:
+            stream.queue.clear()
+            stream.buffered_bytes = 0
+            stream.below_low.set()
+        self._ready.clear()
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "label": self.label,
+            "policy": self.policy,
+            "streams": len(self.streams),
+            "buffered_bytes": self.buffered_bytes,
+            "peak_buffered_bytes": self.peak_buffered_bytes,
+            "sent_bytes": self.sent_bytes,
+            "sent_frames": self.sent_frames,
+            "pauses": self.pauses,
+            "paused_seconds": round(self.paused_seconds, 3),
+        }
+
+
+def connection_metrics() -> Dict[str, Any]:
+    """Return buffered-bytes metrics for every open connection."""
+    connections: List[Dict[str, Any]] = [
+        s.metrics() for s in list(_active_senders.values())
+    ]
+    return {
+        "open_connections": len(connections),
+        "buffered_bytes": sum(c["buffered_bytes"] for c in connections),
+        "connections": connections,
+    }